@@ -0,0 +1,209 @@
+"""
+Per-user admission control for the expensive routes.
+
+Every user (X-MS-CLIENT-PRINCIPAL-ID, else the userId the client sends, else the
+client address) gets a token bucket and a concurrency cap per route class:
+
+  transcribe   /transcribe, /files/<id>/transcribe, /files/batch-transcribe
+               (every file of a batch is admitted on its own, by
+               handlers.batch_transcribe_files; files over the limit get a 429
+               in the batch results)
+  gpt          /ask, /ask/batch, /ask-database, regenerating a summary
+               (a question batch costs one token per distinct question)
+
+A request over the limit is rejected straight away with 429 and Retry-After
+instead of waiting for a worker thread. Limits are read from the environment,
+e.g. ADMISSION_TRANSCRIBE_PER_MINUTE, ADMISSION_TRANSCRIBE_BURST and
+ADMISSION_TRANSCRIBE_CONCURRENCY (0 disables that limit).
+
+State lives in process memory by default. With several app processes or nodes set
+ADMISSION_BACKEND=redis://host:6379/0 (needs the redis package), or install any
+object with take/acquire/release via set_backend().
+"""
+import math
+import os
+import threading
+import time
+from collections import namedtuple
+
+ADMISSION_ENABLED = os.environ.get('ADMISSION_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+ADMISSION_BACKEND = os.environ.get('ADMISSION_BACKEND', '')
+# Suggested wait when a user is at the concurrency cap (we cannot know when a slot frees up)
+BUSY_RETRY_AFTER = int(os.environ.get('ADMISSION_BUSY_RETRY_AFTER', 5))
+# Concurrency slots expire in the shared backend in case a process dies holding one
+SLOT_TTL = 3600
+# How often the in-memory backend forgets buckets that have refilled
+PRUNE_SECONDS = 60
+
+Limit = namedtuple('Limit', ['per_minute', 'burst', 'concurrency'])
+Rejection = namedtuple('Rejection', ['status', 'error', 'retry_after'])
+
+
+def _limit(route_class, per_minute, burst, concurrency):
+    prefix = f'ADMISSION_{route_class.upper()}_'
+    return Limit(
+        per_minute=float(os.environ.get(prefix + 'PER_MINUTE', per_minute)),
+        burst=float(os.environ.get(prefix + 'BURST', burst)),
+        concurrency=int(os.environ.get(prefix + 'CONCURRENCY', concurrency)),
+    )
+
+
+LIMITS = {
+    'transcribe': _limit('transcribe', per_minute=20, burst=50, concurrency=4),
+    'gpt': _limit('gpt', per_minute=30, burst=20, concurrency=4),
+}
+
+# Flask endpoint names; the async routes in asgi.py use the same names. /files/batch-transcribe
+# is not here: handlers.batch_transcribe_files admits each of its files instead
+ROUTE_CLASSES = {
+    'transcribe': 'transcribe',
+    'transcribe_by_id': 'transcribe',
+    'live_transcribe': 'transcribe',
+    'ask': 'gpt',
+    'ask_batch': 'gpt',
+    'ask_database': 'gpt',
+    'regenerate_summary': 'gpt',
+}
+
+
+class MemoryBackend:
+    """Token buckets and concurrency counters for this process only."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buckets = {}  # key -> (tokens, updated, full_at)
+        self._active = {}
+        self._pruned = time.monotonic()
+
+    def take(self, key, rate, burst, cost):
+        """Take cost tokens; returns 0 if granted, else seconds until enough tokens are available."""
+        now = time.monotonic()
+        with self._lock:
+            self._prune(now)
+            tokens, updated, _ = self._buckets.get(key, (burst, now, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            wait = 0.0
+            if tokens >= cost:
+                tokens -= cost
+            else:
+                wait = (cost - tokens) / rate
+            self._buckets[key] = (tokens, now, now + (burst - tokens) / rate)
+            return wait
+
+    def _prune(self, now):
+        """Forget buckets that have refilled to full: a missing bucket starts full anyway."""
+        if now - self._pruned < PRUNE_SECONDS:
+            return
+        self._pruned = now
+        self._buckets = {key: bucket for key, bucket in self._buckets.items() if bucket[2] > now}
+
+    def acquire(self, key, limit):
+        with self._lock:
+            if self._active.get(key, 0) >= limit:
+                return False
+            self._active[key] = self._active.get(key, 0) + 1
+            return True
+
+    def release(self, key):
+        with self._lock:
+            remaining = self._active.get(key, 0) - 1
+            if remaining > 0:
+                self._active[key] = remaining
+            else:
+                self._active.pop(key, None)
+
+
+class RedisBackend:
+    """Shared state for several processes or nodes."""
+
+    TAKE_SCRIPT = """
+    local rate, burst, cost, now = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3]), tonumber(ARGV[4])
+    local tokens = tonumber(redis.call('HGET', KEYS[1], 't'))
+    local updated = tonumber(redis.call('HGET', KEYS[1], 'u'))
+    if tokens == nil then tokens = burst; updated = now end
+    tokens = math.min(burst, tokens + math.max(0, now - updated) * rate)
+    local wait = 0
+    if tokens >= cost then tokens = tokens - cost else wait = (cost - tokens) / rate end
+    redis.call('HSET', KEYS[1], 't', tokens, 'u', now)
+    redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+    return tostring(wait)
+    """
+
+    def __init__(self, url):
+        import redis
+        self._redis = redis.Redis.from_url(url)
+        self._take = self._redis.register_script(self.TAKE_SCRIPT)
+
+    def take(self, key, rate, burst, cost):
+        return float(self._take(keys=[f'admission:bucket:{key}'], args=[rate, burst, cost, time.time()]))
+
+    def acquire(self, key, limit):
+        slot_key = f'admission:active:{key}'
+        pipe = self._redis.pipeline()
+        pipe.incr(slot_key)
+        pipe.expire(slot_key, SLOT_TTL)
+        if pipe.execute()[0] > limit:
+            self._redis.decr(slot_key)
+            return False
+        return True
+
+    def release(self, key):
+        self._redis.decr(f'admission:active:{key}')
+
+
+_backend = RedisBackend(ADMISSION_BACKEND) if ADMISSION_BACKEND.startswith('redis') else MemoryBackend()
+
+
+def set_backend(backend):
+    global _backend
+    _backend = backend
+
+
+def route_class(endpoint):
+    return ROUTE_CLASSES.get(endpoint)
+
+
+def identity(user_id, remote_addr):
+    return f'user:{user_id}' if user_id else f'ip:{remote_addr}'
+
+
+class Ticket:
+    """An admitted request; release() frees its concurrency slot."""
+
+    def __init__(self, key=None):
+        self._key = key
+
+    def release(self):
+        if self._key is not None:
+            _backend.release(self._key)
+            self._key = None
+
+
+def admit(route_class, who, cost=1):
+    """Return (Ticket, None) if the request may run now, else (None, Rejection)."""
+    limit = LIMITS.get(route_class)
+    if not ADMISSION_ENABLED or limit is None:
+        return Ticket(), None
+    key = f'{route_class}:{who}'
+    if limit.per_minute and cost > limit.burst:
+        return None, Rejection(413, f'At most {int(limit.burst)} items can be processed in one request.', None)
+    if limit.concurrency and not _backend.acquire(key, limit.concurrency):
+        return None, Rejection(429, 'Too many requests in progress. Try again shortly.', BUSY_RETRY_AFTER)
+    ticket = Ticket(key if limit.concurrency else None)
+    if limit.per_minute:
+        wait = _backend.take(key, limit.per_minute / 60.0, limit.burst, cost)
+        if wait > 0:
+            ticket.release()
+            return None, Rejection(429, 'Rate limit exceeded. Try again later.', max(1, math.ceil(wait)))
+    return ticket, None
+
+
+def rejection_body(rejection):
+    body = {'error': rejection.error}
+    if rejection.retry_after is not None:
+        body['retry_after'] = rejection.retry_after
+    return body
+
+
+def rejection_headers(rejection):
+    return {'Retry-After': str(rejection.retry_after)} if rejection.retry_after is not None else {}
@@ -0,0 +1,37 @@
+"""
+Add audio_fingerprint and fingerprint_hash tables for near-duplicate detection
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '20261019_add_audio_fingerprint'
+down_revision = '20261019_add_media_storage_columns'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    op.create_table(
+        'audio_fingerprint',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('transcription_id', sa.Integer(), sa.ForeignKey('transcription.id'), nullable=False),
+        sa.Column('duration', sa.Float(), nullable=True),
+        sa.Column('hash_count', sa.Integer(), nullable=False),
+    )
+    op.create_index('ix_audio_fingerprint_transcription_id', 'audio_fingerprint', ['transcription_id'], unique=True)
+    op.create_table(
+        'fingerprint_hash',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('transcription_id', sa.Integer(), sa.ForeignKey('transcription.id'), nullable=False),
+        sa.Column('hash', sa.Integer(), nullable=False),
+        sa.Column('offset', sa.Integer(), nullable=False),
+    )
+    op.create_index('ix_fingerprint_hash_hash', 'fingerprint_hash', ['hash'])
+    op.create_index('ix_fingerprint_hash_transcription_id', 'fingerprint_hash', ['transcription_id'])
+
+def downgrade():
+    op.drop_index('ix_fingerprint_hash_transcription_id', table_name='fingerprint_hash')
+    op.drop_index('ix_fingerprint_hash_hash', table_name='fingerprint_hash')
+    op.drop_table('fingerprint_hash')
+    op.drop_index('ix_audio_fingerprint_transcription_id', table_name='audio_fingerprint')
+    op.drop_table('audio_fingerprint')
@@ -0,0 +1,24 @@
+"""
+Add media storage tiering columns to Transcription table
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '20261019_add_media_storage_columns'
+down_revision = '20261019_add_segment_index'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    op.add_column('transcription', sa.Column('media_state', sa.String(length=16), nullable=False, server_default='original'))
+    op.add_column('transcription', sa.Column('speech_file', sa.String(length=256), nullable=True))
+    op.add_column('transcription', sa.Column('stored_bytes', sa.Integer(), nullable=True))
+    op.add_column('transcription', sa.Column('last_accessed_at', sa.DateTime(), nullable=True))
+
+def downgrade():
+    with op.batch_alter_table('transcription') as batch_op:
+        batch_op.drop_column('last_accessed_at')
+        batch_op.drop_column('stored_bytes')
+        batch_op.drop_column('speech_file')
+        batch_op.drop_column('media_state')
@@ -0,0 +1,25 @@
+"""
+Add segment_index table holding a per-file inverted index over transcript segments
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '20261019_add_segment_index'
+down_revision = '20261019_add_transcription_summary'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    op.create_table(
+        'segment_index',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('transcription_id', sa.Integer(), sa.ForeignKey('transcription.id'), nullable=False),
+        sa.Column('source_hash', sa.String(length=64), nullable=False),
+        sa.Column('data', sa.Text(), nullable=False),
+    )
+    op.create_index('ix_segment_index_transcription_id', 'segment_index', ['transcription_id'], unique=True)
+
+def downgrade():
+    op.drop_index('ix_segment_index_transcription_id', table_name='segment_index')
+    op.drop_table('segment_index')
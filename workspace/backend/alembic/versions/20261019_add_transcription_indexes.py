@@ -0,0 +1,24 @@
+"""
+Add composite indexes for the listing, duplicate detection and status queries on Transcription
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '20261019_add_transcription_indexes'
+down_revision = '20261019_add_transcription_lease'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    op.create_index('ix_transcription_owner_created', 'transcription', ['owner_id', 'created_at'])
+    op.create_index('ix_transcription_created_at', 'transcription', ['created_at'])
+    op.create_index('ix_transcription_hash_size', 'transcription', ['file_hash', 'file_size'])
+    op.create_index('ix_transcription_owner_status', 'transcription', ['owner_id', 'transcription_status'])
+    op.execute('ANALYZE transcription')
+
+def downgrade():
+    op.drop_index('ix_transcription_owner_status', table_name='transcription')
+    op.drop_index('ix_transcription_hash_size', table_name='transcription')
+    op.drop_index('ix_transcription_created_at', table_name='transcription')
+    op.drop_index('ix_transcription_owner_created', table_name='transcription')
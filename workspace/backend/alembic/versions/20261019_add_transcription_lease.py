@@ -0,0 +1,25 @@
+"""
+Add transcription_lease table for coalescing concurrent transcriptions across processes
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '20261019_add_transcription_lease'
+down_revision = '20261019_add_audio_fingerprint'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    op.create_table(
+        'transcription_lease',
+        sa.Column('key', sa.String(length=160), primary_key=True),
+        sa.Column('holder', sa.String(length=64), nullable=False),
+        sa.Column('status', sa.String(length=16), nullable=False),
+        sa.Column('result', sa.Text(), nullable=True),
+        sa.Column('status_code', sa.Integer(), nullable=True),
+        sa.Column('expires_at', sa.DateTime(), nullable=False),
+    )
+
+def downgrade():
+    op.drop_table('transcription_lease')
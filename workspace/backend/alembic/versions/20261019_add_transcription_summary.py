@@ -0,0 +1,28 @@
+"""
+Add transcription_summary table for precomputed per-transcript digests
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '20261019_add_transcription_summary'
+down_revision = '20250716_add_unique_filename_owner'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    op.create_table(
+        'transcription_summary',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('transcription_id', sa.Integer(), sa.ForeignKey('transcription.id'), nullable=False),
+        sa.Column('summary', sa.Text(), nullable=False),
+        sa.Column('keywords', sa.Text(), nullable=True),
+        sa.Column('outline', sa.Text(), nullable=True),
+        sa.Column('source_hash', sa.String(length=64), nullable=False),
+        sa.Column('updated_at', sa.DateTime(), server_default=sa.func.now(), nullable=True),
+    )
+    op.create_index('ix_transcription_summary_transcription_id', 'transcription_summary', ['transcription_id'], unique=True)
+
+def downgrade():
+    op.drop_index('ix_transcription_summary_transcription_id', table_name='transcription_summary')
+    op.drop_table('transcription_summary')
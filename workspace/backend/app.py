@@ -1,13 +1,46 @@
-from flask import Flask, request, jsonify, send_file, send_from_directory
+from flask import Flask, request, jsonify, send_file, send_from_directory, redirect, g
 from flask_cors import CORS
 from flask_sqlalchemy import SQLAlchemy
+import asyncio
 import os
-import requests
 from dotenv import load_dotenv
 from models import db, Transcription
+import azure_openai
+from azure_openai import GPTError, chat_completion, post_whisper
+from summaries import refresh_summary, is_stale
+from segment_index import load_index, parse_query
+from transcript_qa import batch_questions
+import storage_policy
+from storage_policy import check_quota, enforce_quotas, remove_media, media_blob, touch
+import handlers
+from handlers import (
+    TranscriptionFailed,
+    AudioExtractionFailed,
+    authorized_file,
+    claim_transcription,
+    commit_traced,
+    on_transcribed,
+    reuse_near_duplicate,
+    unused_filename,
+)
+import blob_storage
+import fingerprint
+import admission
+import profiling
+import tracing
+import vad
+import response_cache
+import single_flight
+import waveform
+import compression
+import streaming
+import maintenance
+from transcript_segments import build_word_segments
+import transcript_segments
+import partitions
+import static_assets
 from werkzeug.utils import secure_filename
 import hashlib
-import json
 import subprocess
 from sqlalchemy import text
 
@@ -21,47 +54,260 @@ AZURE_OPENAI_ENDPOINT = get_env_var('AZURE_OPENAI_ENDPOINT')
 AZURE_OPENAI_KEY = get_env_var('AZURE_OPENAI_KEY')
 AZURE_OPENAI_DEPLOYMENT = get_env_var('AZURE_OPENAI_DEPLOYMENT')
 
-app = Flask(__name__)
+# The React build is served by serve_react from a manifest (static_assets.py), not Flask's static route
+app = Flask(__name__, static_folder=None)
 app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///transcriptions.db'
 # Remove or comment out the max upload size limit
 # app.config['MAX_CONTENT_LENGTH'] = 500 * 1024 * 1024
 db.init_app(app)
 CORS(app)
-
-print(f"[DEBUG] Using database file: {app.config['SQLALCHEMY_DATABASE_URI']}")
-print('Using database URI:', app.config['SQLALCHEMY_DATABASE_URI'])
+# Registered first so it runs last, after every other hook has finished the response
+compression.init_app(app)
+profiling.init_app(app)
+tracing.init_app(app)
+app.register_blueprint(response_cache.bp)
+static_assets.init_app(app)
+partitions.init_app(app)
 
 UPLOAD_FOLDER = os.path.join(os.path.dirname(__file__), 'uploads')
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 THUMBNAIL_FOLDER = os.path.join(UPLOAD_FOLDER, 'thumbnails')
 os.makedirs(THUMBNAIL_FOLDER, exist_ok=True)
+SPEECH_FOLDER = os.path.join(UPLOAD_FOLDER, 'speech')
+os.makedirs(SPEECH_FOLDER, exist_ok=True)
+app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+app.config['THUMBNAIL_FOLDER'] = THUMBNAIL_FOLDER
+app.config['SPEECH_FOLDER'] = SPEECH_FOLDER
+blob_storage.init_app(app)
 
 with app.app_context():
     db.create_all()
     
-    # Check if segments column exists, if not add it
+    # Check if columns added after the table was first created exist, if not add them
     from sqlalchemy import text
+    added_columns = {
+        'segments': "TEXT",
+        'media_state': "VARCHAR(16) NOT NULL DEFAULT 'original'",
+        'speech_file': "VARCHAR(256)",
+        'stored_bytes': "INTEGER",
+        'last_accessed_at': "DATETIME",
+    }
     try:
         result = db.session.execute(text("PRAGMA table_info(transcription);"))
         columns = [row[1] for row in result.fetchall()]
-        if 'segments' not in columns:
-            db.session.execute(text("ALTER TABLE transcription ADD COLUMN segments TEXT;"))
-            db.session.commit()
-            print("Added segments column to transcription table")
+        for name, ddl in added_columns.items():
+            if name not in columns:
+                db.session.execute(text(f"ALTER TABLE transcription ADD COLUMN {name} {ddl};"))
+                db.session.commit()
+                print(f"Added {name} column to transcription table")
     except Exception as e:
-        print(f"Error checking/adding segments column: {e}")
+        print(f"Error checking/adding columns: {e}")
         db.session.rollback()
+    # Indexes added after the table was first created (create_all skips existing tables)
+    try:
+        for index in Transcription.__table__.indexes:
+            index.create(db.engine, checkfirst=True)
+    except Exception as e:
+        print(f"Error checking/adding indexes: {e}")
 
-def generate_thumbnail(video_path, thumbnail_path):
-    """Generate a thumbnail for a video file using ffmpeg."""
-    cmd = [
+# Storage reconciliation and VACUUM every MAINTENANCE_INTERVAL_HOURS (off by default)
+maintenance.schedule(app)
+
+AUDIO_EXTENSIONS = {'.flac', '.m4a', '.mp3', '.mp4', '.mpeg', '.mpga', '.oga', '.ogg', '.wav', '.webm'}
+VIDEO_EXTENSIONS = ['.mp4', '.mov', '.avi', '.mkv', '.webm', '.flv', '.wmv', '.mpeg', '.mpg']
+
+def thumbnail_command(video_path, thumbnail_path):
+    return [
         'ffmpeg', '-y', '-i', video_path, '-ss', '00:00:01.000', '-vframes', '1', thumbnail_path
     ]
-    result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+def generate_thumbnail(video_path, thumbnail_path):
+    """Generate a thumbnail for a video file using ffmpeg."""
+    cmd = thumbnail_command(video_path, thumbnail_path)
+    with tracing.span('thumbnail') as span:
+        result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        span.set_attribute('process.exit_code', result.returncode)
     return result.returncode == 0
 
+def store_thumbnail(file_path, filename):
+    """Generate and store the thumbnail of a video upload. Returns the thumbnail name, or None."""
+    if os.path.splitext(filename)[1].lower() not in VIDEO_EXTENSIONS:
+        return None
+    thumbnail_filename = f"{os.path.splitext(filename)[0]}.jpg"
+    with blob_storage.staged('thumbnails', thumbnail_filename) as thumbnail_path:
+        if not generate_thumbnail(file_path, thumbnail_path):
+            if os.path.exists(thumbnail_path):
+                os.remove(thumbnail_path)
+            return None
+    return thumbnail_filename
+
+def audio_extraction_command(file_path):
+    """
+    Return (audio_path, ffmpeg_cmd) for sending a file to Whisper.
+    ffmpeg_cmd is None when the file can be uploaded as-is.
+    """
+    ext = os.path.splitext(file_path)[1].lower()
+    if ext in AUDIO_EXTENSIONS:
+        return file_path, None
+    audio_path = file_path + '.mp3'
+    return audio_path, ['ffmpeg', '-y', '-i', file_path, '-vn', '-acodec', 'mp3', audio_path]
+
+def extract_audio(ffmpeg_cmd):
+    """Run an audio extraction command. Returns True on success."""
+    with tracing.span('ffmpeg.extract_audio') as span:
+        result = subprocess.run(ffmpeg_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        span.set_attribute('process.exit_code', result.returncode)
+    return result.returncode == 0
+
+def whisper_request(audio_path):
+    """
+    Send an audio file, with long silences cut out, to the Whisper deployment.
+    Returns (response, timeline); pass the timeline on to build_word_segments.
+    """
+    upload_path, timeline = vad.trim(audio_path)
+    try:
+        with tracing.span('whisper.request', **{'file.size': os.path.getsize(upload_path)}) as span:
+            response = post_whisper(upload_path, os.path.basename(audio_path), vad.trimmed_duration(timeline))
+            span.set_attribute('http.status_code', response.status_code)
+            if not response.ok:
+                span.record_error(f'Whisper returned {response.status_code}')
+    finally:
+        if upload_path != audio_path and os.path.exists(upload_path):
+            os.remove(upload_path)
+    return response, timeline
+
+def transcribe_media(file_path):
+    """
+    Extract the audio of file_path if needed and send it to Whisper.
+    Returns (transcription, word_segments). Raises TranscriptionFailed.
+    """
+    audio_path, ffmpeg_cmd = audio_extraction_command(file_path)
+    temp_audio_created = ffmpeg_cmd is not None
+    if ffmpeg_cmd and not extract_audio(ffmpeg_cmd):
+        raise AudioExtractionFailed('Failed to extract audio from video.', 500)
+    try:
+        response, timeline = whisper_request(audio_path)
+        if not response.ok:
+            raise TranscriptionFailed(response.text, response.status_code)
+        return build_word_segments(response.json(), timeline)
+    finally:
+        if temp_audio_created and os.path.exists(audio_path):
+            os.remove(audio_path)
+
+
+def transcribe_shared(file_hash, file_path, file_id=None):
+    """transcribe_media, run once for concurrent requests with the same content (see single_flight.py)."""
+    return single_flight.run(db.engine, single_flight.content_key(file_hash, file_id),
+                             lambda: transcribe_media(file_path), TranscriptionFailed)
+
+
+def transcribe_record(t, file_path):
+    """
+    Transcribe the media of an existing row (at file_path) into it and commit.
+    Returns the id of the near-duplicate whose transcript was reused, or None.
+    Raises TranscriptionFailed.
+
+    Nothing is written while ffmpeg and Whisper run: the result is saved in its own
+    short transaction, and only if no concurrent request has saved one first.
+    """
+    source_id = reuse_near_duplicate(t, file_path)
+    if source_id or t.transcription_status == 'transcribed':
+        return source_id
+    file_hash, file_id = t.file_hash, t.id
+    db.session.commit()  # No transaction stays open across the external calls
+    transcription, word_segments = transcribe_shared(file_hash, file_path, file_id)
+    if claim_transcription(t):
+        t.transcription = transcription
+        t.segments = transcript_segments.dumps(word_segments)
+        t.transcription_status = 'transcribed'
+        commit_traced()
+        on_transcribed(t.id)
+    return None
+
+
+class FlaskIO:
+    """Runs the route bodies of handlers.py on the request thread (asgi.AsyncIO is the async counterpart)."""
+    batch_concurrency = 1
+
+    async def run(self, fn, *args, **kwargs):
+        # A short app context per step, as in asgi.py, so no session stays open across
+        # ffmpeg, Whisper or GPT calls
+        with app.app_context():
+            return fn(*args, **kwargs)
+
+    async def read(self, file):
+        return file.read()
+
+    def staged(self, area, name):
+        return handlers.entered(blob_storage.staged(area, name))
+
+    def local_path(self, area, name):
+        return handlers.entered(blob_storage.local_path(area, name))
+
+    async def exists(self, area, name):
+        return blob_storage.exists(area, name)
+
+    async def thumbnail(self, file_path, filename):
+        return store_thumbnail(file_path, filename)
+
+    async def transcribe(self, file_hash, file_path, file_id=None):
+        return transcribe_shared(file_hash, file_path, file_id)
+
+    async def complete(self, system_prompt, prompt):
+        # In threads, so the questions of a batch and the groups of a map-reduce run concurrently
+        return await asyncio.to_thread(chat_completion, system_prompt, prompt)
+
+
+def respond(route_body):
+    """Run a handlers.py route body with FlaskIO and turn its (body, status) into a response."""
+    # The steps use sessions of their own; the request's may not stay open across external calls
+    db.session.commit()
+    body, status = asyncio.run(route_body)
+    return jsonify(body), status
+
+def request_scope():
+    """(db_mode, user_id) of a request about one file, from the Azure header or the query string."""
+    user_id = request.headers.get('X-MS-CLIENT-PRINCIPAL-ID') or request.args.get('userId')
+    db_mode = request.args.get('dbMode', 'global')
+    if not db_mode and user_id:
+        db_mode = 'private'
+    return db_mode, user_id
+
+def request_cost(data):
+    """Admission tokens a request uses: one per distinct question of a question batch, else one."""
+    if request.endpoint == 'ask_batch':
+        # One token per distinct question
+        distinct, _ = batch_questions(data.get('questions'))
+        return max(1, len(distinct or []))
+    return 1
+
+
+@app.before_request
+def admission_control():
+    route_class = admission.route_class(request.endpoint)
+    if route_class is None:
+        return None
+    data = request.get_json(silent=True)
+    data = data if isinstance(data, dict) else {}
+    user_id = (request.headers.get('X-MS-CLIENT-PRINCIPAL-ID') or request.args.get('userId')
+               or data.get('userId') or request.form.get('userId'))
+    ticket, rejection = admission.admit(route_class, admission.identity(user_id, request.remote_addr), request_cost(data))
+    if rejection:
+        return jsonify(admission.rejection_body(rejection)), rejection.status, admission.rejection_headers(rejection)
+    g.admission_ticket = ticket
+
+
+@app.teardown_request
+def release_admission(exc):
+    ticket = g.pop('admission_ticket', None)
+    if ticket:
+        ticket.release()
+
 @app.route('/thumbnails/<filename>')
 def get_thumbnail(filename):
+    url = blob_storage.download_url('thumbnails', filename, filename)
+    if url:
+        return redirect(url)
     return send_from_directory(THUMBNAIL_FOLDER, filename)
 
 @app.route('/files', methods=['GET'])
@@ -76,13 +322,20 @@ def list_files():
     # If db_mode is not provided, but user_id is present, default to private
     if not db_mode and user_id:
         db_mode = 'private'
+
     query = Transcription.query
     if db_mode == 'private' and user_id:
         query = query.filter(Transcription.owner_id == user_id)
     elif db_mode == 'global':
         query = query.filter(Transcription.owner_id == None)
-    files = query.order_by(Transcription.created_at.desc()).all()
-    return jsonify({'files': [f.to_dict() for f in files], 'user': user_email or user_id})
+    query = query.order_by(Transcription.created_at.desc())
+    mode = streaming.stream_mode()
+    if mode:
+        return streaming.respond(mode, 'files', query, Transcription.to_dict, {'user': user_email or user_id})
+
+    def build():
+        return {'files': [f.to_dict() for f in query.all()], 'user': user_email or user_id}
+    return response_cache.respond('files', response_cache.scope_for(db_mode, user_id), {'user': user_email or user_id}, build)
 
 @app.route('/files', methods=['POST'])
 def add_file():
@@ -107,41 +360,32 @@ def add_file():
     if ext not in allowed_extensions:
         allowed_list = ', '.join(allowed_extensions)
         return jsonify({'error': f'File type {ext} not supported. Allowed: {allowed_list}'}), 400
-    file_content = file.read()
-    file_hash = hashlib.sha256(file_content).hexdigest()
+    with tracing.span('upload.read') as span:
+        file_content = file.read()
+        span.set_attribute('file.size', len(file_content))
+    with tracing.span('upload.hash'):
+        file_hash = hashlib.sha256(file_content).hexdigest()
     file_size = len(file_content)
     # Check for duplicate only within the selected database (private/public+user)
     if db_mode == 'private' and user_id:
         owner_id = user_id
     else:
         owner_id = None
-    existing = Transcription.query.filter_by(filename=filename, file_hash=file_hash, file_size=file_size, owner_id=owner_id).first()
+    with tracing.span('db.duplicate_lookup'):
+        existing = Transcription.query.filter_by(filename=filename, file_hash=file_hash, file_size=file_size, owner_id=owner_id).first()
     if existing:
         return jsonify({'error': 'File already exists in this database.'}), 409
+    quota_error = check_quota(owner_id, file_size)
+    if quota_error:
+        return jsonify({'error': quota_error}), 507
     # If filename exists in this db, but is not a true duplicate, rename
-    existing_name = Transcription.query.filter_by(filename=filename, owner_id=owner_id).first()
-    if existing_name:
-        base, ext = os.path.splitext(filename)
-        i = 1
-        while True:
-            new_filename = f"{base}_{i}{ext}"
-            if not Transcription.query.filter_by(filename=new_filename, owner_id=owner_id).first():
-                filename = new_filename
-                break
-            i += 1
-    # Save file to uploads directory
-    file_path = os.path.join(UPLOAD_FOLDER, filename)
-    with open(file_path, 'wb') as f_out:
-        f_out.write(file_content)
-    # Generate thumbnail if video
-    ext = os.path.splitext(filename)[1].lower()
-    video_exts = ['.mp4', '.mov', '.avi', '.mkv', '.webm', '.flv', '.wmv', '.mpeg', '.mpg']
-    thumbnail_filename = None
-    if ext in video_exts:
-        thumbnail_filename = f"{os.path.splitext(filename)[0]}.jpg"
-        thumbnail_path = os.path.join(THUMBNAIL_FOLDER, thumbnail_filename)
-        if not generate_thumbnail(file_path, thumbnail_path):
-            thumbnail_filename = None
+    filename = unused_filename(filename, owner_id)
+    # Save file to media storage; thumbnail and fingerprint are made from the local copy
+    with blob_storage.staged('uploads', filename) as file_path:
+        with tracing.span('storage.write'), open(file_path, 'wb') as f_out:
+            f_out.write(file_content)
+        thumbnail_filename = store_thumbnail(file_path, filename)
+        fp = fingerprint.compute(file_path)
     # Save as a new record (no transcription)
     new_transcription = Transcription(
         filename=filename,
@@ -151,31 +395,27 @@ def add_file():
         segments=None,
         thumbnail=thumbnail_filename,
         transcription_status="not_transcribed",
-        owner_id=user_id if db_mode == 'private' and user_id else None
+        owner_id=user_id if db_mode == 'private' and user_id else None,
+        stored_bytes=file_size,
+        last_accessed_at=db.func.now()
     )
     db.session.add(new_transcription)
-    db.session.commit()
+    commit_traced()
+    if fp is not None:
+        fingerprint.store(new_transcription.id, fp)
+        commit_traced()
+    enforce_quotas(owner_id, keep_id=new_transcription.id)
+    waveform.schedule_waveform(app, new_transcription.id)
     return jsonify({'file': new_transcription.to_dict()})
 
 @app.route('/files/<int:file_id>', methods=['DELETE'])
 def delete_file(file_id):
-    user_id = request.headers.get('X-MS-CLIENT-PRINCIPAL-ID')
-    if not user_id:
-        user_id = request.args.get('userId')
-    db_mode = request.args.get('dbMode', 'global')
-    if not db_mode and user_id:
-        db_mode = 'private'
-    t = db.session.get(Transcription, file_id)
-    if not t:
-        return jsonify({'error': 'File not found'}), 404
-    if db_mode == 'private' and user_id and t.owner_id != user_id:
-        return jsonify({'error': 'Unauthorized'}), 403
-    if db_mode == 'global' and t.owner_id is not None:
-        return jsonify({'error': 'Unauthorized'}), 403
-    # Remove file from uploads directory
-    file_path = os.path.join(UPLOAD_FOLDER, t.filename)
-    if os.path.exists(file_path):
-        os.remove(file_path)
+    t, error = authorized_file(file_id, *request_scope())
+    if error:
+        return jsonify(error[0]), error[1]
+    # Remove upload, speech rendition, thumbnail and waveform peaks from disk
+    remove_media(t)
+    waveform.remove(t)
     db.session.delete(t)
     db.session.commit()
     return jsonify({'success': True})
@@ -212,16 +452,9 @@ def batch_delete_files():
                 errors.append(f'Unauthorized to delete file {file_id}')
                 continue
             
-            # Remove file from uploads directory
-            file_path = os.path.join(UPLOAD_FOLDER, t.filename)
-            if os.path.exists(file_path):
-                os.remove(file_path)
-            
-            # Remove thumbnail if exists
-            if t.thumbnail:
-                thumbnail_path = os.path.join(THUMBNAIL_FOLDER, t.thumbnail)
-                if os.path.exists(thumbnail_path):
-                    os.remove(thumbnail_path)
+            # Remove upload, speech rendition, thumbnail and waveform peaks from disk
+            remove_media(t)
+            waveform.remove(t)
             
             db.session.delete(t)
             deleted_count += 1
@@ -254,16 +487,9 @@ def delete_all_files():
         deleted_count = 0
         
         for t in files:
-            # Remove file from uploads directory
-            file_path = os.path.join(UPLOAD_FOLDER, t.filename)
-            if os.path.exists(file_path):
-                os.remove(file_path)
-            
-            # Remove thumbnail if exists
-            if t.thumbnail:
-                thumbnail_path = os.path.join(THUMBNAIL_FOLDER, t.thumbnail)
-                if os.path.exists(thumbnail_path):
-                    os.remove(thumbnail_path)
+            # Remove upload, speech rendition, thumbnail and waveform peaks from disk
+            remove_media(t)
+            waveform.remove(t)
             
             db.session.delete(t)
             deleted_count += 1
@@ -289,480 +515,31 @@ def batch_transcribe_files():
         db_mode = 'private'
     if not data or 'file_ids' not in data:
         return jsonify({'error': 'No file_ids provided'}), 400
-    
-    file_ids = data['file_ids']
-    if not isinstance(file_ids, list):
-        return jsonify({'error': 'file_ids must be an array'}), 400
-    
-    success_count = 0
-    errors = []
-    
-    for file_id in file_ids:
-        try:
-            t = db.session.get(Transcription, file_id)
-            if not t:
-                errors.append(f'File {file_id} not found')
-                continue
-            if db_mode == 'private' and user_id and t.owner_id != user_id:
-                errors.append(f'Unauthorized to transcribe file {file_id}')
-                continue
-            if db_mode == 'global' and t.owner_id is not None:
-                errors.append(f'Unauthorized to transcribe file {file_id}')
-                continue
-            file_path = os.path.join(UPLOAD_FOLDER, t.filename)
-            if not os.path.exists(file_path):
-                errors.append(f'File {file_id} not found on server')
-                continue
-            ext = os.path.splitext(t.filename)[1].lower()
-            audio_extensions = {'.flac', '.m4a', '.mp3', '.mp4', '.mpeg', '.mpga', '.oga', '.ogg', '.wav', '.webm'}
-            audio_path = file_path
-            temp_audio_created = False
-            if ext not in audio_extensions:
-                audio_path = file_path + '.mp3'
-                temp_audio_created = True
-                ffmpeg_cmd = [
-                    'ffmpeg', '-y', '-i', file_path, '-vn', '-acodec', 'mp3', audio_path
-                ]
-                result = subprocess.run(ffmpeg_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-                if result.returncode != 0:
-                    errors.append(f'Failed to extract audio from video for file {file_id}')
-                    continue
-            try:
-                with open(audio_path, 'rb') as audio_file:
-                    headers = {'api-key': AZURE_OPENAI_KEY}
-                    files = {'file': (os.path.basename(audio_path), audio_file, 'audio/mpeg')}
-                    response = requests.post(
-                        AZURE_OPENAI_ENDPOINT,
-                        headers=headers,
-                        files=files,
-                        data={'response_format': 'verbose_json'}
-                    )
-                    if response.ok:
-                        data = response.json()
-                        transcription = data.get('text', '')
-                        segments = data.get('segments', [])
-                        word_segments = []
-                        has_words = False
-                        for seg in segments:
-                            if 'words' in seg and seg['words']:
-                                has_words = True
-                                for word in seg['words']:
-                                    word_segments.append({
-                                        'text': word['word'],
-                                        'start': word['start'],
-                                        'end': word['end']
-                                    })
-                        if not has_words:
-                            chunk_size = 3
-                            for seg in segments:
-                                words = seg.get('text', '').split()
-                                start = seg.get('start', 0)
-                                end = seg.get('end', 0)
-                                if not words:
-                                    continue
-                                duration = (end - start) / max(len(words), 1) if end > start else 0
-                                for i in range(0, len(words), chunk_size):
-                                    chunk_words = words[i:i+chunk_size]
-                                    chunk_start = start + (i * duration)
-                                    chunk_end = chunk_start + (len(chunk_words) * duration)
-                                    word_segments.append({
-                                        'text': ' '.join(chunk_words),
-                                        'start': chunk_start,
-                                        'end': chunk_end
-                                    })
-                        if not word_segments:
-                            word_segments = [{
-                                'text': transcription,
-                                'start': 0,
-                                'end': 0
-                            }]
-                        t.transcription = transcription
-                        t.segments = json.dumps(word_segments)
-                        t.transcription_status = 'transcribed'
-                        success_count += 1
-                    else:
-                        errors.append(f'Failed to transcribe file {file_id}: {response.text}')
-            except Exception as e:
-                errors.append(f'Error transcribing file {file_id}: {str(e)}')
-            finally:
-                if temp_audio_created and os.path.exists(audio_path):
-                    os.remove(audio_path)
-        except Exception as e:
-            errors.append(f'Error processing file {file_id}: {str(e)}')
-    db.session.commit()
-    return jsonify({
-        'success': True,
-        'transcribed_count': success_count,
-        'errors': errors
-    })
+    who = admission.identity(user_id, request.remote_addr)
+    return respond(handlers.batch_transcribe_files(FlaskIO(), data, db_mode, user_id, who))
 
 @app.route('/transcribe', methods=['POST'])
 def transcribe():
-    if 'file' not in request.files:
-        return jsonify({'error': 'No file part'}), 400
-    file = request.files['file']
-    if file.filename == '':
-        return jsonify({'error': 'No selected file'}), 400
-    allowed_extensions = {'.mp4', '.mov', '.avi', '.mkv', '.webm', '.flv', '.wmv', '.mpeg', '.mpg'}
-    audio_extensions = {'.flac', '.m4a', '.mp3', '.mp4', '.mpeg', '.mpga', '.oga', '.ogg', '.wav', '.webm'}
-    _, ext = os.path.splitext(file.filename.lower())
-    if ext not in allowed_extensions:
-        allowed = ', '.join(allowed_extensions)
-        return jsonify({'error': f'File type {ext} not supported. Allowed: {allowed}'}), 400
-    filename = secure_filename(file.filename)
-    file_content = file.read()
-    file_hash = hashlib.sha256(file_content).hexdigest()
-    file_size = len(file_content)
-    # --- DB Mode logic ---
-    db_mode = request.form.get('dbMode', 'private')
     # Prefer Azure header for user ID if present
     user_id = request.headers.get('X-MS-CLIENT-PRINCIPAL-ID') or request.form.get('userId')
-    if db_mode == 'private' and user_id:
-        owner_id = user_id
-    else:
-        owner_id = None
-    # Check for duplicate by filename, file hash, file size, and owner_id
-    existing = Transcription.query.filter_by(filename=filename, file_hash=file_hash, file_size=file_size, owner_id=owner_id).first()
-    if existing and existing.transcription:
-        # Return the existing transcription and saved segments
-        segments_data = []
-        if existing.segments:
-            try:
-                segments_data = json.loads(existing.segments)
-            except (json.JSONDecodeError, TypeError):
-                # Fallback to fake segments if JSON parsing fails
-                words = existing.transcription.split()
-                chunk_size = 3
-                for i in range(0, len(words), chunk_size):
-                    chunk_words = words[i:i+chunk_size]
-                    segments_data.append({
-                        'text': ' '.join(chunk_words),
-                        'start': i,  # fake start
-                        'end': i + len(chunk_words)  # fake end
-                    })
-        if not segments_data:
-            segments_data = [{
-                'text': existing.transcription,
-                'start': 0,
-                'end': 0
-            }]
-        return jsonify({'transcription': existing.transcription, 'segments': segments_data, 'filename': existing.filename}), 200
-    elif existing and not existing.transcription:
-        # If file exists but is not transcribed, run transcription and update the record
-        # Save uploaded file (overwrite)
-        file_path = os.path.join(UPLOAD_FOLDER, filename)
-        with open(file_path, 'wb') as f_out:
-            f_out.write(file_content)
-        ext = os.path.splitext(filename)[1].lower()
-        video_exts = ['.mp4', '.mov', '.avi', '.mkv', '.webm', '.flv', '.wmv', '.mpeg', '.mpg']
-        thumbnail_filename = None
-        if ext in video_exts:
-            thumbnail_filename = f"{os.path.splitext(filename)[0]}.jpg"
-            thumbnail_path = os.path.join(THUMBNAIL_FOLDER, thumbnail_filename)
-            if not generate_thumbnail(file_path, thumbnail_path):
-                thumbnail_filename = None
-        audio_path = file_path
-        temp_audio_created = False
-        if ext not in audio_extensions:
-            audio_path = file_path + '.mp3'
-            temp_audio_created = True
-            import subprocess
-            ffmpeg_cmd = [
-                'ffmpeg', '-y', '-i', file_path, '-vn', '-acodec', 'mp3', audio_path
-            ]
-            result = subprocess.run(ffmpeg_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            if result.returncode != 0:
-                os.remove(file_path)
-                return jsonify({'error': 'Failed to extract audio from video.'}), 500
-        try:
-            with open(audio_path, 'rb') as audio_file:
-                headers = {'api-key': AZURE_OPENAI_KEY}
-                files = {'file': (os.path.basename(audio_path), audio_file, 'audio/mpeg')}
-                response = requests.post(
-                    AZURE_OPENAI_ENDPOINT,
-                    headers=headers,
-                    files=files,
-                    data={'response_format': 'verbose_json'}
-                )
-                if response.ok:
-                    data = response.json()
-                    transcription = data.get('text', '')
-                    segments = data.get('segments', [])
-                    word_segments = []
-                    has_words = False
-                    for seg in segments:
-                        if 'words' in seg and seg['words']:
-                            has_words = True
-                            for word in seg['words']:
-                                word_segments.append({
-                                    'text': word['word'],
-                                    'start': word['start'],
-                                    'end': word['end']
-                                })
-                    if not has_words:
-                        chunk_size = 3
-                        for seg in segments:
-                            words = seg.get('text', '').split()
-                            start = seg.get('start', 0)
-                            end = seg.get('end', 0)
-                            if not words:
-                                continue
-                            duration = (end - start) / max(len(words), 1) if end > start else 0
-                            for i in range(0, len(words), chunk_size):
-                                chunk_words = words[i:i+chunk_size]
-                                chunk_start = start + (i * duration)
-                                chunk_end = chunk_start + (len(chunk_words) * duration)
-                                word_segments.append({
-                                    'text': ' '.join(chunk_words),
-                                    'start': chunk_start,
-                                    'end': chunk_end
-                                })
-                    if not word_segments:
-                        word_segments = [{
-                            'text': transcription,
-                            'start': 0,
-                            'end': 0
-                        }]
-                    # Update the existing record
-                    existing.transcription = transcription
-                    existing.segments = json.dumps(word_segments)
-                    existing.transcription_status = 'transcribed'
-                    existing.thumbnail = thumbnail_filename
-                    db.session.commit()
-                else:
-                    return jsonify({'error': response.text}), response.status_code
-        finally:
-            if temp_audio_created and os.path.exists(audio_path):
-                os.remove(audio_path)
-        return jsonify({'transcription': existing.transcription, 'segments': json.loads(existing.segments), 'filename': existing.filename}), 200
-    elif existing:
-        # Return empty transcription (should not happen, but for safety)
-        return jsonify({'transcription': existing.transcription, 'segments': []}), 200
-    elif existing:
-        # If filename exists but is not a true duplicate, rename
-        base, ext2 = os.path.splitext(filename)
-        i = 1
-        while True:
-            new_filename = f"{base}_{i}{ext2}"
-            if not Transcription.query.filter_by(filename=new_filename).first():
-                filename = new_filename
-                break
-            i += 1
-    # Save file to uploads directory
-    file_path = os.path.join(UPLOAD_FOLDER, filename)
-    with open(file_path, 'wb') as f_out:
-        f_out.write(file_content)
-    # Generate thumbnail if video
-    ext = os.path.splitext(filename)[1].lower()
-    video_exts = ['.mp4', '.mov', '.avi', '.mkv', '.webm', '.flv', '.wmv', '.mpeg', '.mpg']
-    thumbnail_filename = None
-    if ext in video_exts:
-        thumbnail_filename = f"{os.path.splitext(filename)[0]}.jpg"
-        thumbnail_path = os.path.join(THUMBNAIL_FOLDER, thumbnail_filename)
-        if not generate_thumbnail(file_path, thumbnail_path):
-            thumbnail_filename = None
-    audio_path = file_path  # Use uploads path for processing
-    temp_audio_created = False
-    if ext not in audio_extensions:
-        audio_path = file_path + '.mp3'
-        temp_audio_created = True
-        import subprocess
-        ffmpeg_cmd = [
-            'ffmpeg', '-y', '-i', file_path, '-vn', '-acodec', 'mp3', audio_path
-        ]
-        result = subprocess.run(ffmpeg_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        if result.returncode != 0:
-            os.remove(file_path)
-            return jsonify({'error': 'Failed to extract audio from video.'}), 500
-    try:
-        with open(audio_path, 'rb') as audio_file:
-            headers = {
-                'api-key': AZURE_OPENAI_KEY,
-            }
-            files = {
-                'file': (os.path.basename(audio_path), audio_file, 'audio/mpeg')
-            }
-            response = requests.post(
-                AZURE_OPENAI_ENDPOINT,
-                headers=headers,
-                files=files,
-                data={'response_format': 'verbose_json'}
-            )
-            if response.ok:
-                data = response.json()
-                transcription = data.get('text', '')
-                segments = data.get('segments', [])
-                word_segments = []
-                has_words = False
-                for seg in segments:
-                    if 'words' in seg and seg['words']:
-                        has_words = True
-                        for word in seg['words']:
-                            word_segments.append({
-                                'text': word['word'],
-                                'start': word['start'],
-                                'end': word['end']
-                            })
-                # If word-level is not available, split segment text into small chunks (e.g., 3 words) and estimate timings
-                if not has_words:
-                    chunk_size = 3  # You can adjust this for finer or coarser chunks
-                    for seg in segments:
-                        words = seg.get('text', '').split()
-                        start = seg.get('start', 0)
-                        end = seg.get('end', 0)
-                        if not words:
-                            continue
-                        duration = (end - start) / max(len(words), 1) if end > start else 0
-                        for i in range(0, len(words), chunk_size):
-                            chunk_words = words[i:i+chunk_size]
-                            chunk_start = start + (i * duration)
-                            chunk_end = chunk_start + (len(chunk_words) * duration)
-                            word_segments.append({
-                                'text': ' '.join(chunk_words),
-                                'start': chunk_start,
-                                'end': chunk_end
-                            })
-                if not word_segments:
-                    # Fallback: single segment for the whole transcription
-                    word_segments = [{
-                        'text': transcription,
-                        'start': 0,
-                        'end': 0
-                    }]
-                # Save transcription to database with correct owner_id
-                new_transcription = Transcription(
-                    filename=filename,
-                    transcription=transcription,
-                    file_hash=file_hash,
-                    file_size=file_size,
-                    segments=json.dumps(word_segments),
-                    thumbnail=thumbnail_filename,
-                    transcription_status="transcribed",
-                    owner_id=owner_id
-                )
-                db.session.add(new_transcription)
-                db.session.commit()
-            else:
-                return jsonify({'error': response.text}), response.status_code
-    finally:
-        # Do NOT delete the uploaded file from uploads
-        # Only remove temp audio if created
-        if temp_audio_created and os.path.exists(audio_path):
-            os.remove(audio_path)
-    return jsonify({'transcription': transcription, 'segments': word_segments})
+    return respond(handlers.transcribe(FlaskIO(), request.files.get('file'), request.form.get('dbMode', 'private'), user_id))
 
 @app.route('/files/<int:file_id>/transcribe', methods=['POST'])
 def transcribe_by_id(file_id):
-    t = db.session.get(Transcription, file_id)
-    if not t:
-        return jsonify({'error': 'File not found'}), 404
-    if t.transcription_status == 'transcribed':
-        return jsonify({'error': 'Already transcribed', 'file': t.to_dict()}), 400
-    file_path = os.path.join(UPLOAD_FOLDER, t.filename)
-    if not os.path.exists(file_path):
-        return jsonify({'error': 'File not found on server'}), 404
-    # Extract audio if needed
-    ext = os.path.splitext(t.filename)[1].lower()
-    audio_extensions = {'.flac', '.m4a', '.mp3', '.mp4', '.mpeg', '.mpga', '.oga', '.ogg', '.wav', '.webm'}
-    audio_path = file_path
-    temp_audio_created = False
-    if ext not in audio_extensions:
-        audio_path = file_path + '.mp3'
-        temp_audio_created = True
-        ffmpeg_cmd = [
-            'ffmpeg', '-y', '-i', file_path, '-vn', '-acodec', 'mp3', audio_path
-        ]
-        result = subprocess.run(ffmpeg_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        if result.returncode != 0:
-            return jsonify({'error': 'Failed to extract audio from video.'}), 500
-    try:
-        with open(audio_path, 'rb') as audio_file:
-            headers = {'api-key': AZURE_OPENAI_KEY}
-            files = {'file': (os.path.basename(audio_path), audio_file, 'audio/mpeg')}
-            response = requests.post(
-                AZURE_OPENAI_ENDPOINT,
-                headers=headers,
-                files=files,
-                data={'response_format': 'verbose_json'}
-            )
-            if response.ok:
-                data = response.json()
-                transcription = data.get('text', '')
-                segments = data.get('segments', [])
-                word_segments = []
-                has_words = False
-                for seg in segments:
-                    if 'words' in seg and seg['words']:
-                        has_words = True
-                        for word in seg['words']:
-                            word_segments.append({
-                                'text': word['word'],
-                                'start': word['start'],
-                                'end': word['end']
-                            })
-                if not has_words:
-                    chunk_size = 3
-                    for seg in segments:
-                        words = seg.get('text', '').split()
-                        start = seg.get('start', 0)
-                        end = seg.get('end', 0)
-                        if not words:
-                            continue
-                        duration = (end - start) / max(len(words), 1) if end > start else 0
-                        for i in range(0, len(words), chunk_size):
-                            chunk_words = words[i:i+chunk_size]
-                            chunk_start = start + (i * duration)
-                            chunk_end = chunk_start + (len(chunk_words) * duration)
-                            word_segments.append({
-                                'text': ' '.join(chunk_words),
-                                'start': chunk_start,
-                                'end': chunk_end
-                            })
-                if not word_segments:
-                    word_segments = [{
-                        'text': transcription,
-                        'start': 0,
-                        'end': 0
-                    }]
-                t.transcription = transcription
-                t.segments = json.dumps(word_segments)
-                t.transcription_status = 'transcribed'
-                db.session.commit()
-                return jsonify({'file': t.to_dict()})
-            else:
-                return jsonify({'error': response.text}), response.status_code
-    finally:
-        if temp_audio_created and os.path.exists(audio_path):
-            os.remove(audio_path)
+    return respond(handlers.transcribe_by_id(FlaskIO(), file_id))
+
 @app.route('/ask', methods=['POST'])
 def ask():
     data = request.get_json()
-    transcript = data.get('transcript')
-    question = data.get('question')
-    if not transcript or not question:
-        return jsonify({'error': 'Transcript and question are required.'}), 400
-    prompt = f"Transcript:\n{transcript}\n\nQuestion: {question}\nAnswer:"
-    headers = {
-        'api-key': get_env_var('AZURE_GPT_KEY'),
-        'Content-Type': 'application/json'
-    }
-    payload = {
-        'messages': [
-            {"role": "system", "content": "You are a helpful assistant that answers questions based only on the provided transcript."},
-            {"role": "user", "content": prompt}
-        ]
-    }
-    response = requests.post(
-        get_env_var('AZURE_GPT_ENDPOINT'),
-        headers=headers,
-        json=payload
-    )
-    if response.ok:
-        data = response.json()
-        answer = data['choices'][0]['message']['content']
-        return jsonify({'answer': answer})
-    else:
-        return jsonify({'error': response.text}), response.status_code
+    user_id = request.headers.get('X-MS-CLIENT-PRINCIPAL-ID') or data.get('userId')
+    return respond(handlers.ask(FlaskIO(), data, data.get('dbMode', 'global'), user_id))
+
+@app.route('/ask/batch', methods=['POST'])
+def ask_batch():
+    """Several questions about one file or transcript, answered concurrently in one request."""
+    data = request.get_json(silent=True) or {}
+    user_id = request.headers.get('X-MS-CLIENT-PRINCIPAL-ID') or data.get('userId')
+    return respond(handlers.ask_batch(FlaskIO(), data, data.get('dbMode', 'global'), user_id))
 
 @app.route('/search', methods=['GET'])
 def search_transcriptions():
@@ -776,65 +553,130 @@ def search_transcriptions():
         db_mode = 'global'
     if not query:
         return jsonify({'results': []})
+
     trans_query = Transcription.query
     if db_mode == 'private' and user_id:
         trans_query = trans_query.filter(Transcription.owner_id == user_id)
     elif db_mode == 'global':
         trans_query = trans_query.filter(Transcription.owner_id == None)
-    results = trans_query.filter(Transcription.transcription.ilike(f'%{query}%')).all()
-    return jsonify({'results': [t.to_dict() for t in results]})
+    trans_query = trans_query.filter(Transcription.transcription.ilike(f'%{query}%'))
+    mode = streaming.stream_mode()
+    if mode:
+        return streaming.respond(mode, 'results', trans_query, Transcription.to_dict)
+
+    def build():
+        return {'results': [t.to_dict() for t in trans_query.all()]}
+    return response_cache.respond('search', response_cache.scope_for(db_mode, user_id), {'q': query}, build)
 
 @app.route('/ask-database', methods=['POST'])
 def ask_database():
     data = request.get_json()
-    question = data.get('question')
     db_mode = data.get('dbMode', 'global')
     user_id = request.headers.get('X-MS-CLIENT-PRINCIPAL-ID') or data.get('userId')
-    if not question:
-        return jsonify({'error': 'Question is required.'}), 400
-    trans_query = Transcription.query
-    if db_mode == 'private' and user_id:
-        trans_query = trans_query.filter(Transcription.owner_id == user_id)
-    elif db_mode == 'global':
-        trans_query = trans_query.filter(Transcription.owner_id == None)
-    transcriptions = trans_query.all()
-    all_transcripts = '\n\n'.join([t.transcription for t in transcriptions])
-    sources = [
-        {'id': t.id, 'filename': t.filename, 'created_at': t.created_at.isoformat() if t.created_at else None}
-        for t in transcriptions
-    ]
-    prompt = f"Database of transcripts:\n{all_transcripts}\n\nQuestion: {question}\nAnswer:"
-    headers = {
-        'api-key': get_env_var('AZURE_GPT_KEY'),
-        'Content-Type': 'application/json'
-    }
-    payload = {
-        'messages': [
-            {"role": "system", "content": "You are a helpful assistant that answers questions based only on the provided database of transcripts."},
-            {"role": "user", "content": prompt}
-        ]
-    }
-    response = requests.post(
-        get_env_var('AZURE_GPT_ENDPOINT'),
-        headers=headers,
-        json=payload
-    )
-    if response.ok:
-        data = response.json()
-        answer = data['choices'][0]['message']['content']
-        return jsonify({'answer': answer, 'sources': sources})
-    else:
-        return jsonify({'error': response.text}), response.status_code
+    return respond(handlers.ask_database(FlaskIO(), data, db_mode, user_id))
+
+@app.route('/files/<int:file_id>/find', methods=['GET'])
+def find_in_transcript(file_id):
+    query = request.args.get('q', '')
+    terms = parse_query(query)
+    if not terms:
+        return jsonify({'error': 'Query is required.'}), 400
+    try:
+        limit = int(request.args.get('limit', 500))
+    except ValueError:
+        return jsonify({'error': 'limit must be an integer'}), 400
+    # The index holds everything else the search needs
+    _, error = authorized_file(file_id, *request_scope(), owner_only=True)
+    if error:
+        return jsonify(error[0]), error[1]
+    matches = load_index(db.session, file_id).find(terms)
+    return jsonify({'query': query, 'total': len(matches), 'matches': matches[:limit]})
+
+@app.route('/files/<int:file_id>/summary', methods=['GET'])
+def get_summary(file_id):
+    t, error = authorized_file(file_id, *request_scope())
+    if error:
+        return jsonify(error[0]), error[1]
+    if t.summary is None:
+        return jsonify({'error': 'Summary not generated yet'}), 404
+    return jsonify({'summary': t.summary.to_dict(), 'stale': is_stale(t)})
+
+@app.route('/files/<int:file_id>/summary', methods=['POST'])
+def regenerate_summary(file_id):
+    t, error = authorized_file(file_id, *request_scope())
+    if error:
+        return jsonify(error[0]), error[1]
+    if not t.transcription:
+        return jsonify({'error': 'File is not transcribed'}), 400
+    try:
+        summary = refresh_summary(file_id, force=True)
+    except GPTError as e:
+        return jsonify({'error': e.text}), e.status_code
+    return jsonify({'summary': summary, 'stale': False})
+
+@app.route('/files/<int:file_id>/waveform', methods=['GET'])
+def get_waveform(file_id):
+    try:
+        resolution = int(request.args.get('resolution', 1000))
+    except ValueError:
+        return jsonify({'error': 'resolution must be an integer'}), 400
+    t, error = authorized_file(file_id, *request_scope())
+    if error:
+        return jsonify(error[0]), error[1]
+    data = waveform.load(t.file_hash)
+    if data is None:
+        # Files from before waveforms existed get their peaks on first request
+        if waveform.WAVEFORM_ENABLED and t.file_hash and media_blob(t)[0]:
+            waveform.schedule_waveform(app, file_id)
+            return jsonify({'status': 'pending'}), 202
+        return jsonify({'error': 'Waveform not available'}), 404
+    body, samples_per_peak, peaks = waveform.level_for(data, resolution)
+    response = app.response_class(body, mimetype='application/octet-stream')
+    response.headers['X-Waveform-Samples-Per-Peak'] = str(samples_per_peak)
+    response.headers['X-Waveform-Peaks'] = str(peaks)
+    # Peaks are keyed by content, so a level never changes; shared caches would skip the owner check
+    response.headers['Cache-Control'] = 'private, max-age=31536000, immutable'
+    response.set_etag(f'{t.file_hash}-{samples_per_peak}')
+    return response.make_conditional(request)
 
 @app.route('/files/<int:file_id>/download', methods=['GET'])
 def download_file(file_id):
-    t = db.session.get(Transcription, file_id)
-    if not t:
-        return jsonify({'error': 'File not found'}), 404
-    file_path = os.path.join(UPLOAD_FOLDER, t.filename)
-    if not os.path.exists(file_path):
+    t, error = authorized_file(file_id, *request_scope())
+    if error:
+        return jsonify(error[0]), error[1]
+    # Falls back to the speech rendition once the original has been evicted
+    area, name, download_name = media_blob(t)
+    if not area:
         return jsonify({'error': 'File not available on server'}), 404
-    return send_file(file_path, as_attachment=True, download_name=t.filename)
+    touch(t)
+    db.session.commit()
+    # Object storage serves the bytes itself
+    url = blob_storage.download_url(area, name, download_name)
+    if url:
+        return redirect(url)
+    with blob_storage.local_path(area, name) as file_path:
+        return send_file(file_path, as_attachment=True, download_name=download_name)
+
+@app.route('/storage', methods=['GET'])
+def storage_report():
+    user_id = request.headers.get('X-MS-CLIENT-PRINCIPAL-ID') or request.args.get('userId')
+    db_mode = request.args.get('dbMode', 'global')
+    owner_id = user_id if db_mode == 'private' and user_id else None
+    report = storage_policy.report(owner_id)
+    files = (
+        storage_policy.scoped(Transcription.query, owner_id)
+        .with_entities(Transcription.id, Transcription.filename, Transcription.media_state)
+        .all()
+    )
+    report['files'] = [
+        {'id': file_id, 'filename': filename, 'media_state': state, 'fully_retrievable': state in (None, 'original')}
+        for file_id, filename, state in files
+    ]
+    return jsonify(report)
+
+@app.route('/deployments/stats', methods=['GET'])
+def deployment_stats():
+    return jsonify(azure_openai.stats())
 
 @app.route('/files/<int:file_id>/download-txt', methods=['GET'])
 def download_transcription_txt(file_id):
@@ -853,18 +695,11 @@ def download_transcription_txt(file_id):
 
 
 # --- Serve React frontend for all non-API routes ---
-import os
-from flask import send_from_directory
-
 # This must be after all other @app.route definitions
 @app.route('/', defaults={'path': ''})
 @app.route('/<path:path>')
 def serve_react(path):
-    static_folder = os.path.join(os.path.dirname(__file__), 'static')
-    if path != "" and os.path.exists(os.path.join(static_folder, path)):
-        return send_from_directory(static_folder, path)
-    else:
-        return send_from_directory(static_folder, 'index.html')
+    return static_assets.serve(path)
 
 @app.route('/health', methods=['GET'])
 def health_check():
@@ -881,4 +716,9 @@ def health_check():
         return jsonify({'status': 'error', 'details': str(e)}), 500
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5000)
+    if get_env_var('ASYNC_MODE', '').lower() in ('1', 'true', 'yes'):
+        # Async serving mode: I/O-bound routes are handled by asgi.py, the rest by this Flask app
+        import uvicorn
+        uvicorn.run('asgi:application', host='0.0.0.0', port=5000)
+    else:
+        app.run(host='0.0.0.0', port=5000)
@@ -0,0 +1,541 @@
+"""
+ASGI entry point for the async serving mode.
+
+The I/O-bound routes (/transcribe, /files/<id>/transcribe, /files/batch-transcribe,
+/ask, /ask/batch and /ask-database) are served here with an async HTTP client and asyncio
+subprocesses, so a slow Azure or ffmpeg call no longer pins a worker thread. Their route
+bodies are the ones in handlers.py, run with AsyncIO; this module only adds the
+transport. So is the WebSocket /live for live transcription (see live.py), which only
+exists in this mode. Every other route is passed through to the Flask app unchanged.
+
+Run with:  uvicorn asgi:application --host 0.0.0.0 --port 5000
+      or:  ASYNC_MODE=true python app.py
+"""
+import asyncio
+import contextlib
+import datetime
+import functools
+import json
+import os
+import sys
+
+import httpx
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import UploadFile
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.middleware.gzip import GZipMiddleware
+from starlette.responses import JSONResponse
+from starlette.routing import Mount, Route, WebSocketRoute
+from starlette.websockets import WebSocketDisconnect
+from werkzeug.utils import secure_filename
+
+from app import (
+    app as flask_app,
+    db,
+    get_env_var,
+    VIDEO_EXTENSIONS,
+    thumbnail_command,
+    audio_extraction_command,
+)
+from storage_policy import check_quota
+import blob_storage
+import admission
+import azure_openai
+from azure_openai import GPTError, gpt_headers, gpt_payload, whisper_headers
+import handlers
+from handlers import AudioExtractionFailed, TranscriptionFailed, insert_transcription, unused_filename
+import live
+import partitions
+import compression
+import single_flight
+import transcript_qa
+import transcript_segments
+from transcript_segments import build_word_segments
+import tracing
+import vad
+
+ASYNC_MAX_CONNECTIONS = int(get_env_var('ASYNC_MAX_CONNECTIONS', 500))
+ASYNC_UPSTREAM_TIMEOUT = float(get_env_var('ASYNC_UPSTREAM_TIMEOUT', 600))
+ASYNC_FFMPEG_CONCURRENCY = int(get_env_var('ASYNC_FFMPEG_CONCURRENCY', os.cpu_count() or 4))
+ASYNC_BATCH_CONCURRENCY = int(get_env_var('ASYNC_BATCH_CONCURRENCY', 8))
+ASYNC_WSGI_WORKERS = int(get_env_var('ASYNC_WSGI_WORKERS', 10))
+
+# ffmpeg is CPU bound, so only a bounded number of processes run at once;
+# waiting on Azure is not, and is only limited by the connection pool.
+_ffmpeg_slots = asyncio.Semaphore(ASYNC_FFMPEG_CONCURRENCY)
+_client = None
+
+
+def get_client():
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=ASYNC_MAX_CONNECTIONS, max_keepalive_connections=ASYNC_MAX_CONNECTIONS),
+            timeout=httpx.Timeout(ASYNC_UPSTREAM_TIMEOUT),
+            follow_redirects=True,
+        )
+    return _client
+
+
+async def in_app_context(fn, *args, **kwargs):
+    """Run a blocking DB helper in the threadpool inside a Flask app context."""
+    def call():
+        with flask_app.app_context():
+            return fn(*args, **kwargs)
+    return await run_in_threadpool(call)
+
+
+async def run_ffmpeg(cmd):
+    async with _ffmpeg_slots:
+        proc = await asyncio.create_subprocess_exec(
+            *cmd, stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL
+        )
+        return await proc.wait() == 0
+
+
+def blob_store():
+    return flask_app.extensions['blob_store']
+
+
+def db_engine():
+    with flask_app.app_context():
+        return db.engine
+
+
+async def transcribe_shared(file_hash, file_path, file_id=None):
+    """extract_and_transcribe, run once for concurrent requests with the same content (see single_flight.py)."""
+    return await single_flight.run_async(db_engine(), single_flight.content_key(file_hash, file_id),
+                                         lambda: extract_and_transcribe(file_path), TranscriptionFailed)
+
+
+@contextlib.asynccontextmanager
+async def threaded(context):
+    """Use a blocking context manager (e.g. a blob store download or upload) from async code."""
+    value = await run_in_threadpool(context.__enter__)
+    try:
+        yield value
+    except BaseException:
+        if not await run_in_threadpool(context.__exit__, *sys.exc_info()):
+            raise
+    else:
+        await run_in_threadpool(context.__exit__, None, None, None)
+
+
+async def make_thumbnail(file_path, filename):
+    if os.path.splitext(filename)[1].lower() not in VIDEO_EXTENSIONS:
+        return None
+    thumbnail_filename = f"{os.path.splitext(filename)[0]}.jpg"
+    async with threaded(blob_store().staged('thumbnails', thumbnail_filename)) as thumbnail_path:
+        with tracing.span('thumbnail'):
+            made = await run_ffmpeg(thumbnail_command(file_path, thumbnail_path))
+        if not made:
+            if os.path.exists(thumbnail_path):
+                os.remove(thumbnail_path)
+            return None
+    return thumbnail_filename
+
+
+def _present(headers):
+    # requests silently drops None-valued headers (e.g. an unset key); httpx rejects them
+    return {k: v for k, v in headers.items() if v is not None}
+
+
+async def post_whisper(audio_path, duration=None):
+    with tracing.span('whisper.request', **{'file.size': os.path.getsize(audio_path)}) as span:
+        async def send(deployment):
+            with open(audio_path, 'rb') as audio_file:
+                return await get_client().post(
+                    deployment.url,
+                    headers=_present(whisper_headers(deployment)),
+                    files={'file': (os.path.basename(audio_path), audio_file, 'audio/mpeg')},
+                    data={'response_format': 'verbose_json'}
+                )
+        response = await azure_openai.router('whisper').request_async(
+            send, size=os.path.getsize(audio_path), duration=duration, errors=(httpx.TransportError,))
+        span.set_attribute('http.status_code', response.status_code)
+        if response.is_error:
+            span.record_error(f'Whisper returned {response.status_code}')
+    return response
+
+
+async def whisper_window(wav):
+    """The default live engine: one window of WAV audio to a Whisper deployment, as verbose_json."""
+    with tracing.span('whisper.request', **{'file.size': len(wav)}) as span:
+        async def send(deployment):
+            return await get_client().post(
+                deployment.url,
+                headers=_present(whisper_headers(deployment)),
+                files={'file': ('window.wav', wav, 'audio/wav')},
+                data={'response_format': 'verbose_json'}
+            )
+        response = await azure_openai.router('whisper').request_async(
+            send, size=len(wav), duration=live.wav_duration(wav), errors=(httpx.TransportError,))
+        span.set_attribute('http.status_code', response.status_code)
+        if response.is_error:
+            span.record_error(f'Whisper returned {response.status_code}')
+            raise TranscriptionFailed(response.text, response.status_code)
+    return response.json()
+
+
+async def post_gpt(system_prompt, prompt):
+    payload = gpt_payload(system_prompt, prompt)
+    async def send(deployment):
+        return await get_client().post(deployment.url, headers=_present(gpt_headers(deployment)), json=payload)
+    return await azure_openai.router('gpt').request_async(
+        send, size=len(prompt.encode('utf-8')), errors=(httpx.TransportError,))
+
+
+async def gpt_answer(system_prompt, prompt):
+    response = await post_gpt(system_prompt, prompt)
+    if response.is_error:
+        raise GPTError(response.text, response.status_code)
+    return response.json()['choices'][0]['message']['content']
+
+
+async def extract_and_transcribe(file_path):
+    """Extract audio if needed, send it to Whisper and return (transcription, word_segments)."""
+    audio_path, ffmpeg_cmd = audio_extraction_command(file_path)
+    try:
+        if ffmpeg_cmd:
+            with tracing.span('ffmpeg.extract_audio'):
+                extracted = await run_ffmpeg(ffmpeg_cmd)
+            if not extracted:
+                raise AudioExtractionFailed('Failed to extract audio from video.', 500)
+        async with _ffmpeg_slots:
+            upload_path, timeline = await run_in_threadpool(vad.trim, audio_path)
+        try:
+            response = await post_whisper(upload_path, vad.trimmed_duration(timeline))
+        finally:
+            if upload_path != audio_path and os.path.exists(upload_path):
+                os.remove(upload_path)
+    finally:
+        if ffmpeg_cmd and os.path.exists(audio_path):
+            os.remove(audio_path)
+    if response.is_error:
+        raise TranscriptionFailed(response.text, response.status_code)
+    return build_word_segments(response.json(), timeline)
+
+
+class AsyncIO:
+    """Runs the route bodies of handlers.py on the event loop (app.FlaskIO is the Flask counterpart)."""
+    batch_concurrency = ASYNC_BATCH_CONCURRENCY
+
+    async def run(self, fn, *args, **kwargs):
+        return await in_app_context(fn, *args, **kwargs)
+
+    async def read(self, file):
+        return await file.read()
+
+    def staged(self, area, name):
+        return threaded(blob_store().staged(area, name))
+
+    def local_path(self, area, name):
+        return threaded(blob_store().local_path(area, name))
+
+    async def exists(self, area, name):
+        return await run_in_threadpool(blob_store().exists, area, name)
+
+    async def thumbnail(self, file_path, filename):
+        return await make_thumbnail(file_path, filename)
+
+    async def transcribe(self, file_hash, file_path, file_id=None):
+        return await transcribe_shared(file_hash, file_path, file_id)
+
+    async def complete(self, system_prompt, prompt):
+        return await gpt_answer(system_prompt, prompt)
+
+
+def respond(body_and_status):
+    body, status = body_and_status
+    return JSONResponse(body, status_code=status)
+
+
+async def json_body(request):
+    try:
+        data = await request.json()
+    except ValueError:
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+def admitted(handler):
+    """Apply the same per-user admission control as the Flask before_request hook."""
+    route_class = admission.route_class(handler.__name__)
+
+    @functools.wraps(handler)
+    async def wrapper(request):
+        user_id = request.headers.get('X-MS-CLIENT-PRINCIPAL-ID') or request.query_params.get('userId')
+        cost = 1
+        if request.headers.get('content-type', '').startswith('application/json'):
+            data = await json_body(request)
+            user_id = user_id or data.get('userId')
+            if handler.__name__ == 'ask_batch':
+                distinct, _ = transcript_qa.batch_questions(data.get('questions'))
+                cost = max(1, len(distinct or []))
+        elif not user_id:
+            user_id = (await request.form()).get('userId')
+        ticket, rejection = admission.admit(route_class, admission.identity(user_id, request.client.host if request.client else None), cost)
+        if rejection:
+            return JSONResponse(admission.rejection_body(rejection), status_code=rejection.status,
+                                headers=admission.rejection_headers(rejection))
+        try:
+            return await handler(request)
+        finally:
+            ticket.release()
+    return wrapper
+
+
+def partitioned(handler):
+    """Pick the owner's database partition for an async route, as partitions.init_app does for Flask routes."""
+    @functools.wraps(handler)
+    async def wrapper(request):
+        if not partitions.enabled():
+            return await handler(request)
+        if request.headers.get('content-type', '').startswith('application/json'):
+            data = await json_body(request)
+        else:
+            data = await request.form()
+        user_id = request.headers.get('X-MS-CLIENT-PRINCIPAL-ID') or request.query_params.get('userId') or data.get('userId')
+        default = 'private' if handler.__name__ in partitions.PRIVATE_BY_DEFAULT else 'global'
+        db_mode = request.query_params.get('dbMode') or data.get('dbMode') or default
+        with partitions.bound(partitions.owner_for(db_mode, user_id)):
+            return await handler(request)
+    return wrapper
+
+
+def traced(handler):
+    """Give an async route the same root span as the Flask request hook does."""
+    @functools.wraps(handler)
+    async def wrapper(request):
+        with tracing.span(f'{request.method} {request.url.path}', traceparent=request.headers.get('traceparent'),
+                          **{'http.method': request.method, 'http.target': request.url.path}) as span:
+            response = await handler(request)
+            span.set_attribute('http.status_code', response.status_code)
+            return response
+    return wrapper
+
+
+def _save_live_recording(path, filename, file_hash, file_size, owner_id, word_segments):
+    """Store a finished live recording and its stitched transcript as a new row: (file dict, None) or (None, error)."""
+    quota_error = check_quota(owner_id, file_size)
+    if quota_error:
+        return None, quota_error
+    filename = unused_filename(filename, owner_id)
+    blob_storage.put_file('uploads', filename, path)
+    return insert_transcription(
+        filename=filename,
+        transcription=live.transcript_text(word_segments),
+        file_hash=file_hash,
+        file_size=file_size,
+        segments=transcript_segments.dumps(word_segments),
+        transcription_status='transcribed',
+        owner_id=owner_id,
+        stored_bytes=file_size
+    ), None
+
+
+# --- Routes ---
+
+async def transcribe(request):
+    form = await request.form()
+    file = form.get('file')
+    user_id = request.headers.get('X-MS-CLIENT-PRINCIPAL-ID') or form.get('userId')
+    return respond(await handlers.transcribe(AsyncIO(), file if isinstance(file, UploadFile) else None,
+                                             form.get('dbMode', 'private'), user_id))
+
+
+async def transcribe_by_id(request):
+    return respond(await handlers.transcribe_by_id(AsyncIO(), request.path_params['file_id']))
+
+
+async def batch_transcribe_files(request):
+    data = await json_body(request)
+    user_id = request.headers.get('X-MS-CLIENT-PRINCIPAL-ID') or data.get('userId')
+    db_mode = data.get('dbMode', 'global')
+    if not db_mode and user_id:
+        db_mode = 'private'
+    who = admission.identity(user_id, request.client.host if request.client else None)
+    return respond(await handlers.batch_transcribe_files(AsyncIO(), data, db_mode, user_id, who))
+
+
+async def ask(request):
+    data = await json_body(request)
+    user_id = request.headers.get('X-MS-CLIENT-PRINCIPAL-ID') or data.get('userId')
+    return respond(await handlers.ask(AsyncIO(), data, data.get('dbMode', 'global'), user_id))
+
+
+async def ask_batch(request):
+    data = await json_body(request)
+    user_id = request.headers.get('X-MS-CLIENT-PRINCIPAL-ID') or data.get('userId')
+    return respond(await handlers.ask_batch(AsyncIO(), data, data.get('dbMode', 'global'), user_id))
+
+
+async def ask_database(request):
+    data = await json_body(request)
+    user_id = request.headers.get('X-MS-CLIENT-PRINCIPAL-ID') or data.get('userId')
+    return respond(await handlers.ask_database(AsyncIO(), data, data.get('dbMode', 'global'), user_id))
+
+
+_live_engine = None
+
+
+def live_engine():
+    global _live_engine
+    if _live_engine is None:
+        _live_engine = live.load_engine(live.LIVE_ENGINE, whisper_window)
+    return _live_engine
+
+
+async def send_live(websocket, payload):
+    """Send to a live client; the stream is still saved if the client has gone away."""
+    try:
+        await websocket.send_json(payload)
+    except (WebSocketDisconnect, RuntimeError):
+        pass
+
+
+async def transcribe_windows(websocket, session, windows):
+    """Transcribe queued windows in order and push their stitched segments, until None is queued."""
+    while (window := await windows.get()) is not None:
+        with tracing.span('live.window', **{'live.window': window.index, 'live.start_s': window.start}):
+            try:
+                data = await live.call_engine(live_engine(), live.wav_bytes(window.pcm, session.sample_rate),
+                                              run_in_threadpool)
+                _, word_segments = build_word_segments(data)
+                report = session.accept(window, [s for s in word_segments if s['text'].strip()])
+            except Exception as e:
+                # The window's words are lost, but the stream goes on
+                report = session.flush()
+                error = e.message if isinstance(e, TranscriptionFailed) else str(e)
+                await send_live(websocket, {'type': 'error', 'window': window.index, 'error': error,
+                                            'status_code': getattr(e, 'status_code', 500)})
+        await send_live(websocket, {'type': 'segments', 'window': window.index, 'word_segments': report,
+                                    'text': live.transcript_text(report)})
+
+
+def _live_options(message):
+    if message.get('text') is None:
+        return {}
+    try:
+        options = json.loads(message['text'])
+    except ValueError:
+        return {}
+    return options if isinstance(options, dict) and options.get('type') == 'start' else {}
+
+
+def _live_filename(options):
+    base = os.path.splitext(secure_filename(str(options.get('filename') or '')))[0]
+    return f"{base or datetime.datetime.utcnow().strftime('live_%Y%m%d_%H%M%S')}.wav"
+
+
+async def live_transcribe(websocket):
+    await websocket.accept()
+    message = await websocket.receive()
+    if message['type'] == 'websocket.disconnect':
+        return
+    options = _live_options(message)
+    user_id = websocket.headers.get('X-MS-CLIENT-PRINCIPAL-ID') or options.get('userId') or websocket.query_params.get('userId')
+    owner_id = user_id if options.get('dbMode', 'private') == 'private' and user_id else None
+    partitions.select_owner(owner_id)
+    sample_rate = options.get('sampleRate', live.LIVE_SAMPLE_RATE)
+    if not isinstance(sample_rate, int) or sample_rate not in live.SAMPLE_RATES:
+        await websocket.send_json({'type': 'error', 'error': 'sampleRate must be between 8000 and 48000.', 'status_code': 400})
+        await websocket.close(code=1003)
+        return
+    ticket, rejection = admission.admit(admission.route_class('live_transcribe'),
+                                        admission.identity(user_id, websocket.client.host if websocket.client else None))
+    if rejection:
+        await websocket.send_json({'type': 'error', **admission.rejection_body(rejection), 'status_code': rejection.status})
+        await websocket.close(code=1013)
+        return
+
+    session = live.LiveSession(sample_rate)
+    windows = asyncio.Queue()
+    worker = asyncio.create_task(transcribe_windows(websocket, session, windows))
+    await send_live(websocket, {'type': 'ready', 'sampleRate': sample_rate, 'windowSeconds': live.LIVE_WINDOW_SECONDS,
+                                'overlapSeconds': live.LIVE_OVERLAP_SECONDS})
+    connected = True
+    try:
+        if options:
+            message = await websocket.receive()
+        while True:
+            if message['type'] == 'websocket.disconnect':
+                connected = False
+                break
+            if message.get('bytes'):
+                for window in session.feed(message['bytes']):
+                    windows.put_nowait(window)
+                if session.seconds >= live.LIVE_MAX_SECONDS:
+                    await send_live(websocket, {'type': 'error', 'error': 'Maximum stream length reached.', 'status_code': 413})
+                    break
+            elif _live_stop(message.get('text')):
+                break
+            message = await websocket.receive()
+        last = session.finish()
+        if last is not None:
+            windows.put_nowait(last)
+        windows.put_nowait(None)
+        await worker
+        remaining = session.flush()
+        if remaining:
+            await send_live(websocket, {'type': 'segments', 'window': session.windows, 'word_segments': remaining,
+                                        'text': live.transcript_text(remaining)})
+        file_dict, error = None, None
+        if session.received:
+            file_hash, file_size = await run_in_threadpool(session.digest)
+            file_dict, error = await in_app_context(_save_live_recording, session.path, _live_filename(options),
+                                                    file_hash, file_size, owner_id, session.word_segments)
+        if connected:
+            if error:
+                await send_live(websocket, {'type': 'error', 'error': error, 'status_code': 507})
+            await send_live(websocket, {'type': 'final', 'file': file_dict})
+            await websocket.close()
+    finally:
+        if not worker.done():
+            worker.cancel()
+        ticket.release()
+        await run_in_threadpool(session.discard)
+
+
+def _live_stop(text):
+    try:
+        return json.loads(text or '{}').get('type') == 'stop'
+    except (ValueError, AttributeError):
+        return False
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    get_client()
+    try:
+        yield
+    finally:
+        global _client
+        if _client is not None:
+            await _client.aclose()
+            _client = None
+
+
+application = Starlette(
+    routes=[
+        Route('/transcribe', traced(admitted(partitioned(transcribe))), methods=['POST']),
+        Route('/files/batch-transcribe', traced(partitioned(batch_transcribe_files)), methods=['POST']),
+        Route('/files/{file_id:int}/transcribe', traced(admitted(partitioned(transcribe_by_id))), methods=['POST']),
+        Route('/ask', traced(admitted(partitioned(ask))), methods=['POST']),
+        Route('/ask/batch', traced(admitted(partitioned(ask_batch))), methods=['POST']),
+        Route('/ask-database', traced(admitted(partitioned(ask_database))), methods=['POST']),
+        WebSocketRoute('/live', live_transcribe),
+        # Everything else (file management, search, downloads, React frontend) stays on Flask
+        Mount('/', app=WSGIMiddleware(flask_app, workers=ASYNC_WSGI_WORKERS)),
+    ],
+    middleware=[Middleware(CORSMiddleware, allow_origins=['*'], allow_methods=['*'], allow_headers=['*'])] + (
+        # gzip for the native routes; Flask responses arrive already encoded and are passed through
+        [Middleware(GZipMiddleware, minimum_size=compression.COMPRESSION_MIN_BYTES,
+                    compresslevel=compression.COMPRESSION_GZIP_LEVEL)]
+        if compression.COMPRESSION_ENABLED else []
+    ),
+    lifespan=lifespan,
+)
@@ -0,0 +1,295 @@
+"""
+Request helpers for the Azure OpenAI Whisper and GPT deployments.
+
+Requests are routed across one or more deployments of each kind, configured as a
+JSON list in AZURE_WHISPER_DEPLOYMENTS / AZURE_GPT_DEPLOYMENTS:
+
+    [{"name": "sweden", "endpoint": "https://...", "key_env": "AZURE_OPENAI_KEY_SE",
+      "weight": 3, "capacity": 8},
+     {"name": "fast-short-clips", "endpoint": "https://...", "key": "...",
+      "weight": 5, "max_seconds": 120, "max_bytes": 5000000}]
+
+endpoint / endpoint_env and key / key_env give the URL and api-key directly or
+through another environment variable. weight is a preference (e.g. higher for a
+cheaper deployment), capacity caps the requests in flight on it (0 = no cap), and
+max_bytes / max_seconds restrict it to requests up to that upload size or audio
+duration. Without a list, the single AZURE_OPENAI_ENDPOINT / AZURE_GPT_ENDPOINT
+deployment is used as before.
+
+Each request goes to a deployment it fits, picked at random in proportion to
+weight * (1 - recent 429 rate) / recent latency per MB sent, among those with free
+capacity that are not cooling down. A 429 cools a deployment down for its
+Retry-After (else ROUTER_THROTTLE_COOLDOWN seconds), ROUTER_MAX_FAILURES errors in
+a row for ROUTER_ERROR_COOLDOWN seconds. 429s, 5xx responses and connection errors
+fail over to the next deployment; only when every deployment has failed is the
+last response returned. GET /deployments/stats reports the live figures.
+"""
+import json
+import os
+import random
+import threading
+import time
+
+import requests
+
+ASK_SYSTEM_PROMPT = "You are a helpful assistant that answers questions based only on the provided transcript."
+ASK_DATABASE_SYSTEM_PROMPT = "You are a helpful assistant that answers questions based only on the provided database of transcripts."
+
+ROUTER_THROTTLE_COOLDOWN = float(os.environ.get('ROUTER_THROTTLE_COOLDOWN', 10))
+ROUTER_ERROR_COOLDOWN = float(os.environ.get('ROUTER_ERROR_COOLDOWN', 5))
+ROUTER_MAX_FAILURES = int(os.environ.get('ROUTER_MAX_FAILURES', 3))
+ROUTER_SMOOTHING = float(os.environ.get('ROUTER_SMOOTHING', 0.2))  # Weight of the newest sample in the moving averages
+
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+SIZE_UNIT = 1024 * 1024  # Latency is compared per MB sent, so long files do not make a deployment look slow
+DEFAULT_LATENCY = 1.0
+MIN_LATENCY = 0.01
+
+DEFAULTS = {
+    'whisper': {'name': 'default', 'endpoint_env': 'AZURE_OPENAI_ENDPOINT', 'key_env': 'AZURE_OPENAI_KEY'},
+    'gpt': {'name': 'default', 'endpoint_env': 'AZURE_GPT_ENDPOINT', 'key_env': 'AZURE_GPT_KEY'},
+}
+CONFIG_VARS = {'whisper': 'AZURE_WHISPER_DEPLOYMENTS', 'gpt': 'AZURE_GPT_DEPLOYMENTS'}
+
+
+class GPTError(Exception):
+    """A non-2xx response from the GPT deployment."""
+    def __init__(self, text, status_code):
+        super().__init__(text)
+        self.text = text
+        self.status_code = status_code
+
+
+class Deployment:
+    """One deployment and what has been seen of it lately."""
+
+    def __init__(self, name, endpoint=None, endpoint_env=None, key=None, key_env=None, weight=1, capacity=0,
+                 max_bytes=0, max_seconds=0):
+        self.name = name
+        self._endpoint = endpoint
+        self._endpoint_env = endpoint_env
+        self._key = key
+        self._key_env = key_env
+        self.weight = float(weight)
+        self.capacity = int(capacity)
+        self.max_bytes = int(max_bytes)
+        self.max_seconds = float(max_seconds)
+        self.in_flight = 0
+        self.latency = None  # Moving average of seconds per SIZE_UNIT
+        self.throttle_rate = 0.0  # Moving average of 1 for a 429, 0 otherwise
+        self.failures = 0  # Errors in a row
+        self.cooldown_until = 0.0
+        self.requests = 0
+        self.throttled = 0
+        self.errors = 0
+
+    @property
+    def url(self):
+        return self._endpoint or os.environ.get(self._endpoint_env or '')
+
+    @property
+    def key(self):
+        return self._key or os.environ.get(self._key_env or '')
+
+    def fits(self, size, duration):
+        return not ((self.max_bytes and size and size > self.max_bytes)
+                    or (self.max_seconds and duration and duration > self.max_seconds))
+
+    def available(self, now):
+        return self.cooldown_until <= now and (not self.capacity or self.in_flight < self.capacity)
+
+    def score(self, default_latency):
+        latency = max(self.latency if self.latency is not None else default_latency, MIN_LATENCY)
+        return self.weight * max(1.0 - self.throttle_rate, 0.05) / latency
+
+    def to_dict(self, now):
+        return {
+            'name': self.name,
+            'weight': self.weight,
+            'capacity': self.capacity or None,
+            'in_flight': self.in_flight,
+            'latency_s_per_mb': round(self.latency, 4) if self.latency is not None else None,
+            'throttle_rate': round(self.throttle_rate, 4),
+            'cooldown_s': round(max(self.cooldown_until - now, 0), 1),
+            'requests': self.requests,
+            'throttled': self.throttled,
+            'errors': self.errors,
+        }
+
+
+def _average(current, sample):
+    return sample if current is None else current + ROUTER_SMOOTHING * (sample - current)
+
+
+def _retry_after(response):
+    try:
+        return float((getattr(response, 'headers', None) or {}).get('Retry-After'))
+    except (TypeError, ValueError):
+        return ROUTER_THROTTLE_COOLDOWN
+
+
+class Router:
+    """Picks deployments for requests of one kind and keeps their health figures (per process)."""
+
+    def __init__(self, deployments):
+        self.deployments = deployments
+        self._lock = threading.Lock()
+
+    def plan(self, size=None, duration=None):
+        """Deployments to try for a request, in order: a weighted random pick first, then failovers."""
+        now = time.monotonic()
+        with self._lock:
+            fitting = [d for d in self.deployments if d.fits(size, duration)] or list(self.deployments)
+            known = [d.latency for d in fitting if d.latency is not None]
+            default_latency = sum(known) / len(known) if known else DEFAULT_LATENCY
+            ready = [d for d in fitting if d.available(now)]
+            order = []
+            while ready:
+                pick = random.choices(ready, weights=[d.score(default_latency) for d in ready])[0]
+                ready.remove(pick)
+                order.append(pick)
+            # Busy or cooling deployments are still tried last rather than failing outright
+            rest = sorted((d for d in fitting if d not in order), key=lambda d: (d.cooldown_until, d.in_flight))
+            return order + rest
+
+    def _start(self, deployment):
+        with self._lock:
+            deployment.in_flight += 1
+            deployment.requests += 1
+        return time.monotonic()
+
+    def _release(self, deployment):
+        with self._lock:
+            deployment.in_flight -= 1
+
+    def _finish(self, deployment, started, size, response=None):
+        """Record the outcome of a request; returns True if the next deployment should be tried."""
+        now = time.monotonic()
+        status = response.status_code if response is not None else None
+        with self._lock:
+            throttled = status == 429
+            deployment.throttle_rate = _average(deployment.throttle_rate, 1.0 if throttled else 0.0)
+            if throttled:
+                deployment.throttled += 1
+                deployment.cooldown_until = now + _retry_after(response)
+            elif status is None or status >= 500:
+                deployment.errors += 1
+                deployment.failures += 1
+                if deployment.failures >= ROUTER_MAX_FAILURES:
+                    deployment.cooldown_until = now + ROUTER_ERROR_COOLDOWN
+            else:
+                deployment.failures = 0
+                deployment.latency = _average(deployment.latency, (now - started) / max((size or 0) / SIZE_UNIT, 1.0))
+        return status is None or status in RETRYABLE_STATUSES
+
+    def request(self, send, size=None, duration=None, errors=(requests.RequestException,)):
+        """send(deployment) -> response, on the best deployment that answers. Raises the last error if none does."""
+        plan = self.plan(size, duration)
+        for i, deployment in enumerate(plan):
+            started = self._start(deployment)
+            try:
+                response = send(deployment)
+            except errors:
+                self._finish(deployment, started, size)
+                if i == len(plan) - 1:
+                    raise
+                continue
+            else:
+                if not self._finish(deployment, started, size, response) or i == len(plan) - 1:
+                    return response
+            finally:
+                # Also on cancellation and on errors that are not the upstream's fault
+                self._release(deployment)
+
+    async def request_async(self, send, size=None, duration=None, errors=()):
+        """request() for a coroutine function send."""
+        plan = self.plan(size, duration)
+        for i, deployment in enumerate(plan):
+            started = self._start(deployment)
+            try:
+                response = await send(deployment)
+            except errors:
+                self._finish(deployment, started, size)
+                if i == len(plan) - 1:
+                    raise
+                continue
+            else:
+                if not self._finish(deployment, started, size, response) or i == len(plan) - 1:
+                    return response
+            finally:
+                # Also on cancellation and on errors that are not the upstream's fault
+                self._release(deployment)
+
+    def stats(self):
+        now = time.monotonic()
+        with self._lock:
+            return [d.to_dict(now) for d in self.deployments]
+
+
+def load_deployments(kind):
+    raw = os.environ.get(CONFIG_VARS[kind])
+    entries = json.loads(raw) if raw else [DEFAULTS[kind]]
+    return [Deployment(**{'name': f'{kind}-{i}', **entry}) for i, entry in enumerate(entries)]
+
+
+_routers = {}
+_routers_lock = threading.Lock()
+
+
+def router(kind):
+    """The Router for 'whisper' or 'gpt', built from the environment on first use."""
+    with _routers_lock:
+        if kind not in _routers:
+            _routers[kind] = Router(load_deployments(kind))
+        return _routers[kind]
+
+
+def stats():
+    return {kind: router(kind).stats() for kind in CONFIG_VARS}
+
+
+def whisper_headers(deployment=None):
+    return {'api-key': deployment.key if deployment else os.environ.get('AZURE_OPENAI_KEY')}
+
+def gpt_headers(deployment=None):
+    return {
+        'api-key': deployment.key if deployment else os.environ.get('AZURE_GPT_KEY'),
+        'Content-Type': 'application/json'
+    }
+
+def gpt_payload(system_prompt, prompt):
+    return {
+        'messages': [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": prompt}
+        ]
+    }
+
+def gpt_configured():
+    return any(d.url for d in router('gpt').deployments)
+
+def post_whisper(path, filename, duration=None):
+    """Send an audio file to a Whisper deployment (verbose_json) and return the response."""
+    def send(deployment):
+        with open(path, 'rb') as audio_file:
+            return requests.post(
+                deployment.url,
+                headers=whisper_headers(deployment),
+                files={'file': (filename, audio_file, 'audio/mpeg')},
+                data={'response_format': 'verbose_json'}
+            )
+    return router('whisper').request(send, size=os.path.getsize(path), duration=duration)
+
+def post_gpt(system_prompt, prompt):
+    """Send one system/user prompt pair to a GPT deployment and return the response."""
+    payload = gpt_payload(system_prompt, prompt)
+    def send(deployment):
+        return requests.post(deployment.url, headers=gpt_headers(deployment), json=payload)
+    return router('gpt').request(send, size=len(prompt.encode('utf-8')))
+
+def chat_completion(system_prompt, prompt):
+    """Send one system/user prompt pair to the GPT deployment and return the answer text."""
+    response = post_gpt(system_prompt, prompt)
+    if not response.ok:
+        raise GPTError(response.text, response.status_code)
+    return response.json()['choices'][0]['message']['content']
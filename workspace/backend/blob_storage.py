@@ -0,0 +1,241 @@
+"""
+Where uploaded media, thumbnails and speech renditions are kept.
+
+Blobs are addressed by area ('uploads', 'thumbnails', 'speech') and name.
+
+  BLOB_BACKEND=local   (default) the UPLOAD_FOLDER / THUMBNAIL_FOLDER / SPEECH_FOLDER
+                       directories, exactly as before
+  BLOB_BACKEND=s3      an S3-compatible bucket (AWS, MinIO, Azurite-style gateways);
+                       needs boto3 and S3_BUCKET, optionally S3_ENDPOINT_URL and S3_PREFIX
+
+ffmpeg and Whisper need files on disk, so processing goes through local_path()
+(the blob itself for local storage, a streamed temporary copy for S3) and new
+files are written through staged(). Large objects are uploaded in parts
+(S3_MULTIPART_THRESHOLD / S3_MULTIPART_CHUNKSIZE). With S3, download_url() returns
+a presigned URL so downloads are redirected to the bucket instead of passing
+through the app.
+"""
+import contextlib
+import os
+import shutil
+import tempfile
+
+from flask import current_app
+
+BLOB_BACKEND = os.environ.get('BLOB_BACKEND', 'local')
+S3_BUCKET = os.environ.get('S3_BUCKET')
+S3_ENDPOINT_URL = os.environ.get('S3_ENDPOINT_URL')
+S3_REGION = os.environ.get('S3_REGION')
+S3_PREFIX = os.environ.get('S3_PREFIX', '')
+S3_PRESIGN_SECONDS = int(os.environ.get('S3_PRESIGN_SECONDS', 3600))
+S3_MULTIPART_THRESHOLD = int(os.environ.get('S3_MULTIPART_THRESHOLD', 16 * 1024 * 1024))
+S3_MULTIPART_CHUNKSIZE = int(os.environ.get('S3_MULTIPART_CHUNKSIZE', 16 * 1024 * 1024))
+COPY_CHUNK = 1024 * 1024
+
+AREA_FOLDERS = {
+    'uploads': 'UPLOAD_FOLDER',
+    'thumbnails': 'THUMBNAIL_FOLDER',
+    'speech': 'SPEECH_FOLDER',
+}
+
+
+class LocalBlobStore:
+    """Blobs as files in the configured folders."""
+
+    def __init__(self, folders):
+        self.folders = folders
+
+    def path(self, area, name):
+        return os.path.join(self.folders[area], name)
+
+    def write(self, area, name, stream):
+        """Copy a readable stream into a blob in chunks. Returns the number of bytes written."""
+        with open(self.path(area, name), 'wb') as f_out:
+            shutil.copyfileobj(stream, f_out, COPY_CHUNK)
+            return f_out.tell()
+
+    def put_file(self, area, name, path):
+        if os.path.abspath(path) != os.path.abspath(self.path(area, name)):
+            shutil.copyfile(path, self.path(area, name))
+
+    def open(self, area, name):
+        return open(self.path(area, name), 'rb')
+
+    def exists(self, area, name):
+        return bool(name) and os.path.exists(self.path(area, name))
+
+    def size(self, area, name):
+        return os.path.getsize(self.path(area, name)) if self.exists(area, name) else 0
+
+    def delete(self, area, name):
+        if self.exists(area, name):
+            os.remove(self.path(area, name))
+
+    def listing(self, area):
+        """(name, size, modified) of every blob in an area; modified is a POSIX timestamp."""
+        with os.scandir(self.folders[area]) as entries:
+            for entry in entries:
+                # The thumbnail and speech folders live inside the upload folder
+                if entry.is_file(follow_symlinks=False):
+                    stat = entry.stat()
+                    yield entry.name, stat.st_size, stat.st_mtime
+
+    @contextlib.contextmanager
+    def local_path(self, area, name):
+        yield self.path(area, name)
+
+    @contextlib.contextmanager
+    def staged(self, area, name):
+        yield self.path(area, name)
+
+    def download_url(self, area, name, download_name):
+        return None
+
+
+class S3BlobStore:
+    """Blobs as objects in an S3-compatible bucket, under <prefix><area>/<name>."""
+
+    def __init__(self, bucket, client=None, prefix=''):
+        if client is None:
+            import boto3
+            client = boto3.client('s3', endpoint_url=S3_ENDPOINT_URL, region_name=S3_REGION)
+        from boto3.s3.transfer import TransferConfig
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix
+        self.transfer_config = TransferConfig(multipart_threshold=S3_MULTIPART_THRESHOLD, multipart_chunksize=S3_MULTIPART_CHUNKSIZE)
+
+    def key(self, area, name):
+        return f"{self.prefix}{area}/{name}"
+
+    def write(self, area, name, stream):
+        counted = _CountingReader(stream)
+        self.client.upload_fileobj(counted, self.bucket, self.key(area, name), Config=self.transfer_config)
+        return counted.count
+
+    def put_file(self, area, name, path):
+        self.client.upload_file(path, self.bucket, self.key(area, name), Config=self.transfer_config)
+
+    def open(self, area, name):
+        return self.client.get_object(Bucket=self.bucket, Key=self.key(area, name))['Body']
+
+    def _head(self, area, name):
+        from botocore.exceptions import ClientError
+        try:
+            return self.client.head_object(Bucket=self.bucket, Key=self.key(area, name))
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                return None
+            raise
+
+    def exists(self, area, name):
+        return bool(name) and self._head(area, name) is not None
+
+    def size(self, area, name):
+        head = self._head(area, name) if name else None
+        return head['ContentLength'] if head else 0
+
+    def delete(self, area, name):
+        if name:
+            self.client.delete_object(Bucket=self.bucket, Key=self.key(area, name))
+
+    def listing(self, area):
+        prefix = self.key(area, '')
+        for page in self.client.get_paginator('list_objects_v2').paginate(Bucket=self.bucket, Prefix=prefix):
+            for obj in page.get('Contents', []):
+                name = obj['Key'][len(prefix):]
+                if name and '/' not in name:
+                    yield name, obj['Size'], obj['LastModified'].timestamp()
+
+    @contextlib.contextmanager
+    def local_path(self, area, name):
+        """Stream the object to a temporary file that is removed afterwards."""
+        tmp_dir = tempfile.mkdtemp(prefix='blob-')
+        path = os.path.join(tmp_dir, name)
+        try:
+            self.client.download_file(self.bucket, self.key(area, name), path, Config=self.transfer_config)
+            yield path
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    @contextlib.contextmanager
+    def staged(self, area, name):
+        """A temporary local path; whatever is left there when the block ends is uploaded."""
+        tmp_dir = tempfile.mkdtemp(prefix='blob-')
+        path = os.path.join(tmp_dir, name)
+        try:
+            yield path
+            if os.path.exists(path):
+                self.put_file(area, name, path)
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    def download_url(self, area, name, download_name):
+        return self.client.generate_presigned_url(
+            'get_object',
+            Params={
+                'Bucket': self.bucket,
+                'Key': self.key(area, name),
+                'ResponseContentDisposition': f'attachment; filename="{download_name}"',
+            },
+            ExpiresIn=S3_PRESIGN_SECONDS,
+        )
+
+
+class _CountingReader:
+    def __init__(self, stream):
+        self.stream = stream
+        self.count = 0
+
+    def read(self, size=-1):
+        chunk = self.stream.read(size)
+        self.count += len(chunk)
+        return chunk
+
+
+def create_store(app):
+    if BLOB_BACKEND == 's3':
+        return S3BlobStore(S3_BUCKET, prefix=S3_PREFIX)
+    return LocalBlobStore({area: app.config[key] for area, key in AREA_FOLDERS.items()})
+
+
+def init_app(app, store=None):
+    app.extensions['blob_store'] = store or create_store(app)
+
+
+def store():
+    return current_app.extensions['blob_store']
+
+
+# Shortcuts on the store of the current app
+
+def exists(area, name):
+    return store().exists(area, name)
+
+
+def size(area, name):
+    return store().size(area, name)
+
+
+def delete(area, name):
+    store().delete(area, name)
+
+
+def listing(area):
+    return store().listing(area)
+
+
+def local_path(area, name):
+    return store().local_path(area, name)
+
+
+def staged(area, name):
+    return store().staged(area, name)
+
+
+def put_file(area, name, path):
+    store().put_file(area, name, path)
+
+
+def download_url(area, name, download_name):
+    return store().download_url(area, name, download_name)
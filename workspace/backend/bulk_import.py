@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+"""
+Bulk import of an existing media archive.
+
+    python bulk_import.py /archive/recordings [--owner-id USER] [--transcribe]
+
+Walks the directory tree and, batch by batch:
+
+  1. hashes the media files in a thread pool (SHA-256, streamed)
+  2. skips files whose file_hash is already in the target database (private for
+     --owner-id, else global), including duplicates within the archive itself
+  3. copies the files to media storage and makes video thumbnails in a process pool
+  4. inserts the Transcription rows of the batch in one transaction
+
+With --transcribe the new files are also transcribed, --transcribe-workers at a time.
+
+Every finished file is appended to a checkpoint file (by default under
+backend/imports/, one per archive directory). An interrupted import can be run
+again with the same arguments; checkpointed files are not hashed again.
+"""
+import argparse
+import datetime
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+from sqlalchemy import insert
+from werkzeug.utils import secure_filename
+
+from app import (
+    app,
+    db,
+    AUDIO_EXTENSIONS,
+    VIDEO_EXTENSIONS,
+    generate_thumbnail,
+    transcribe_record,
+    TranscriptionFailed,
+)
+from models import Transcription
+from storage_policy import scoped
+import blob_storage
+import partitions
+
+MEDIA_EXTENSIONS = AUDIO_EXTENSIONS | set(VIDEO_EXTENSIONS)
+CHECKPOINT_DIR = os.path.join(os.path.dirname(__file__), 'imports')
+HASH_CHUNK = 1024 * 1024
+
+
+def default_checkpoint(root):
+    digest = hashlib.sha1(os.path.abspath(root).encode()).hexdigest()[:12]
+    return os.path.join(CHECKPOINT_DIR, f'{digest}.jsonl')
+
+
+def walk_media(root):
+    """Relative paths of the media files under root, in a stable order."""
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for name in sorted(filenames):
+            if os.path.splitext(name)[1].lower() in MEDIA_EXTENSIONS:
+                yield os.path.relpath(os.path.join(dirpath, name), root)
+
+
+def hash_file(path):
+    """(sha256 hex digest, size) of a file, read in chunks."""
+    sha = hashlib.sha256()
+    size = 0
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(HASH_CHUNK)
+            if not chunk:
+                break
+            sha.update(chunk)
+            size += len(chunk)
+    return sha.hexdigest(), size
+
+
+def thumbnail_job(src, dst):
+    """Run in a worker process. Returns dst, or None when no thumbnail could be made."""
+    return dst if generate_thumbnail(src, dst) else None
+
+
+def unique_filename(name, taken):
+    """Rename like POST /files does (talk.mp4 -> talk_1.mp4) until the name is free."""
+    filename = secure_filename(name) or 'upload'
+    if filename in taken:
+        base, ext = os.path.splitext(filename)
+        i = 1
+        while f"{base}_{i}{ext}" in taken:
+            i += 1
+        filename = f"{base}_{i}{ext}"
+    taken.add(filename)
+    return filename
+
+
+class Checkpoint:
+    """Append-only record of the files an import has finished with."""
+
+    def __init__(self, path):
+        self.path = path
+        self.done = set()
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    try:
+                        self.done.add(json.loads(line)['path'])
+                    except (ValueError, KeyError):
+                        continue  # Torn last line of an interrupted run
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._file = open(path, 'a')
+
+    def record(self, entries):
+        for entry in entries:
+            self._file.write(json.dumps(entry) + '\n')
+            self.done.add(entry['path'])
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        self._file.close()
+
+
+class Progress:
+    def __init__(self, total):
+        self.total = total
+        self.counts = {'imported': 0, 'duplicate': 0, 'error': 0}
+        self.started = time.monotonic()
+
+    def add(self, entries):
+        for entry in entries:
+            self.counts[entry['status']] += 1
+
+    def report(self):
+        done = sum(self.counts.values())
+        rate = done / max(time.monotonic() - self.started, 1e-6)
+        print(f"[IMPORT] {done}/{self.total} files ({self.counts['imported']} imported, "
+              f"{self.counts['duplicate']} duplicates, {self.counts['error']} errors), {rate:.1f} files/s", flush=True)
+
+
+def import_batch(root, paths, owner_id, known_hashes, taken_names, hash_pool, thumb_pool, tmp_dir):
+    """Import one batch of relative paths. Returns (checkpoint entries, ids of new rows)."""
+    entries = []
+    hashed = {}
+    futures = {hash_pool.submit(hash_file, os.path.join(root, rel)): rel for rel in paths}
+    for future in as_completed(futures):
+        rel = futures[future]
+        try:
+            hashed[rel] = future.result()
+        except OSError as e:
+            entries.append({'path': rel, 'status': 'error', 'error': str(e)})
+
+    # Known hashes are looked up once per batch rather than once per file
+    batch_hashes = {file_hash for file_hash, _ in hashed.values()}
+    rows = scoped(Transcription.query.with_entities(Transcription.file_hash), owner_id).filter(
+        Transcription.file_hash.in_(batch_hashes)).all()
+    known_hashes.update(file_hash for file_hash, in rows)
+
+    new = []
+    for rel in paths:
+        if rel not in hashed:
+            continue
+        file_hash, file_size = hashed[rel]
+        if file_hash in known_hashes:
+            entries.append({'path': rel, 'status': 'duplicate', 'file_hash': file_hash})
+            continue
+        known_hashes.add(file_hash)
+        new.append((rel, unique_filename(os.path.basename(rel), taken_names), file_hash, file_size))
+
+    store = blob_storage.store()  # The pool threads have no app context
+    copies = [hash_pool.submit(store.put_file, 'uploads', filename, os.path.join(root, rel)) for rel, filename, _, _ in new]
+    thumbnail_jobs = {}
+    queued = set()
+    for rel, filename, _, _ in new:
+        thumbnail_filename = f"{os.path.splitext(filename)[0]}.jpg"
+        # Names are unique, but talk.mp4 and talk.mov would share talk.jpg
+        if os.path.splitext(filename)[1].lower() in VIDEO_EXTENSIONS and thumbnail_filename not in queued:
+            queued.add(thumbnail_filename)
+            dst = os.path.join(tmp_dir, thumbnail_filename)
+            thumbnail_jobs[thumb_pool.submit(thumbnail_job, os.path.join(root, rel), dst)] = thumbnail_filename
+    for future in copies:
+        future.result()
+    thumbnails = set()
+    for future in as_completed(thumbnail_jobs):
+        dst = future.result()
+        if dst:
+            store.put_file('thumbnails', thumbnail_jobs[future], dst)
+            os.remove(dst)
+            thumbnails.add(thumbnail_jobs[future])
+
+    now = datetime.datetime.utcnow()
+    values = []
+    for rel, filename, file_hash, file_size in new:
+        thumbnail_filename = f"{os.path.splitext(filename)[0]}.jpg"
+        values.append({
+            'filename': filename,
+            'transcription': '',
+            'file_hash': file_hash,
+            'file_size': file_size,
+            'thumbnail': thumbnail_filename if thumbnail_filename in thumbnails else None,
+            'transcription_status': 'not_transcribed',
+            'owner_id': owner_id,
+            'stored_bytes': file_size,
+            'last_accessed_at': now,
+        })
+    new_ids = []
+    if values:
+        db.session.execute(insert(Transcription), values)
+        db.session.commit()
+        names = [v['filename'] for v in values]
+        ids = dict(scoped(Transcription.query.with_entities(Transcription.filename, Transcription.id), owner_id)
+                   .filter(Transcription.filename.in_(names)).all())
+        for rel, filename, file_hash, _ in new:
+            entries.append({'path': rel, 'status': 'imported', 'id': ids[filename], 'file_hash': file_hash})
+            new_ids.append(ids[filename])
+    return entries, new_ids
+
+
+def transcribe_job(file_id, owner_id=None):
+    """Transcribe one imported file in its own app context. Returns an error message or None."""
+    with app.app_context(), partitions.bound(owner_id):
+        t = db.session.get(Transcription, file_id)
+        if not t or t.transcription_status == 'transcribed':
+            return None
+        try:
+            with blob_storage.local_path('uploads', t.filename) as file_path:
+                transcribe_record(t, file_path)
+        except TranscriptionFailed as e:
+            return f'Failed to transcribe file {file_id}: {e.message}'
+        except Exception as e:
+            db.session.rollback()
+            return f'Error transcribing file {file_id}: {e}'
+    return None
+
+
+def run(root, owner_id=None, transcribe=False, workers=None, transcribe_workers=2, batch_size=1000, checkpoint_path=None):
+    """Import every media file under root. Returns the progress counters."""
+    checkpoint = Checkpoint(checkpoint_path or default_checkpoint(root))
+    pending = [rel for rel in walk_media(root) if rel not in checkpoint.done]
+    progress = Progress(len(pending))
+    print(f"[IMPORT] {len(pending)} files to import from {root} ({len(checkpoint.done)} already done)", flush=True)
+    workers = workers or os.cpu_count() or 4
+    transcriber = ThreadPoolExecutor(max_workers=transcribe_workers) if transcribe else None
+    transcriptions = []
+    try:
+        with app.app_context(), partitions.bound(owner_id), tempfile.TemporaryDirectory(prefix='import-') as tmp_dir, \
+                ThreadPoolExecutor(max_workers=workers) as hash_pool, ProcessPoolExecutor(max_workers=workers) as thumb_pool:
+            taken_names = {name for name, in scoped(Transcription.query.with_entities(Transcription.filename), owner_id)}
+            known_hashes = set()
+            for i in range(0, len(pending), batch_size):
+                entries, new_ids = import_batch(root, pending[i:i + batch_size], owner_id, known_hashes, taken_names,
+                                                hash_pool, thumb_pool, tmp_dir)
+                checkpoint.record(entries)
+                progress.add(entries)
+                progress.report()
+                for entry in entries:
+                    if entry['status'] == 'error':
+                        print(f"[IMPORT] Could not read {entry['path']}: {entry['error']}")
+                if transcriber:
+                    transcriptions += [transcriber.submit(transcribe_job, file_id, owner_id) for file_id in new_ids]
+        if transcriber:
+            print(f"[IMPORT] Waiting for {len(transcriptions)} transcriptions", flush=True)
+            for done, future in enumerate(as_completed(transcriptions), 1):
+                error = future.result()
+                if error:
+                    print(f"[IMPORT] {error}")
+                if done % 50 == 0 or done == len(transcriptions):
+                    print(f"[IMPORT] {done}/{len(transcriptions)} transcriptions finished", flush=True)
+    finally:
+        if transcriber:
+            transcriber.shutdown(wait=True)
+        checkpoint.close()
+    return progress.counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Import a directory of recordings into the transcription database.')
+    parser.add_argument('root', help='directory to import, searched recursively')
+    parser.add_argument('--owner-id', help='import into this user\'s private database (default: global)')
+    parser.add_argument('--transcribe', action='store_true', help='transcribe the imported files')
+    parser.add_argument('--workers', type=int, default=None, help='hashing and thumbnail workers (default: CPU count)')
+    parser.add_argument('--transcribe-workers', type=int, default=2, help='concurrent Whisper requests (default: 2)')
+    parser.add_argument('--batch-size', type=int, default=1000, help='rows inserted per transaction (default: 1000)')
+    parser.add_argument('--checkpoint', help='checkpoint file (default: one per directory under backend/imports/)')
+    args = parser.parse_args(argv)
+    if not os.path.isdir(args.root):
+        parser.error(f'{args.root} is not a directory')
+    counts = run(args.root, owner_id=args.owner_id, transcribe=args.transcribe, workers=args.workers,
+                 transcribe_workers=args.transcribe_workers, batch_size=args.batch_size, checkpoint_path=args.checkpoint)
+    return 1 if counts['error'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
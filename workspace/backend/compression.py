@@ -0,0 +1,133 @@
+"""
+Negotiated response compression.
+
+Transcript-heavy JSON (file listings, search results, database answers) is
+several MB of very compressible text. Responses of a compressible type and at
+least COMPRESSION_MIN_BYTES are encoded with brotli when the client accepts it and
+the brotli package is installed, else with gzip, and carry Vary: Accept-Encoding.
+Streamed responses are compressed chunk by chunk with a sync flush after every
+chunk, so the client still receives rows as they are produced.
+
+Files sent with send_file (media, thumbnails) are left alone, and the frontend
+build comes precompressed from static_assets.py.
+The response cache keeps the encoded variants of its entries, so a cached
+listing is compressed once rather than on every hit.
+"""
+import gzip
+import os
+import zlib
+
+from flask import request
+
+COMPRESSION_ENABLED = os.environ.get('COMPRESSION_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+COMPRESSION_MIN_BYTES = int(os.environ.get('COMPRESSION_MIN_BYTES', 1024))
+COMPRESSION_GZIP_LEVEL = int(os.environ.get('COMPRESSION_GZIP_LEVEL', 6))
+COMPRESSION_BROTLI_QUALITY = int(os.environ.get('COMPRESSION_BROTLI_QUALITY', 5))
+
+COMPRESSIBLE_TYPES = {
+    'application/json', 'application/x-ndjson', 'application/javascript',
+    'image/svg+xml', 'text/css', 'text/html', 'text/plain', 'text/csv',
+}
+
+
+def _brotli():
+    try:
+        import brotli
+    except ImportError:
+        return None
+    return brotli
+
+
+def negotiate(request):
+    """'br', 'gzip' or None for a request's Accept-Encoding."""
+    if not COMPRESSION_ENABLED:
+        return None
+    accepted = request.accept_encodings
+    br, gz = accepted['br'], accepted['gzip']
+    if br and br >= gz and _brotli() is not None:
+        return 'br'
+    if gz:
+        return 'gzip'
+    return None
+
+
+def compress(body, encoding):
+    if encoding == 'br':
+        return _brotli().compress(body, quality=COMPRESSION_BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=COMPRESSION_GZIP_LEVEL, mtime=0)
+
+
+class _GzipStream:
+    def __init__(self):
+        self._compressor = zlib.compressobj(COMPRESSION_GZIP_LEVEL, zlib.DEFLATED, 31)  # 31: gzip container
+
+    def chunk(self, data):
+        return self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self._compressor.flush()
+
+
+class _BrotliStream:
+    def __init__(self):
+        self._compressor = _brotli().Compressor(quality=COMPRESSION_BROTLI_QUALITY)
+
+    def chunk(self, data):
+        return self._compressor.process(data) + self._compressor.flush()
+
+    def finish(self):
+        return self._compressor.finish()
+
+
+def compress_stream(chunks, encoding):
+    """Encode an iterable of str/bytes chunks, flushing after each so none is held back."""
+    stream = _BrotliStream() if encoding == 'br' else _GzipStream()
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode('utf-8')
+        if chunk:
+            yield stream.chunk(chunk)
+    yield stream.finish()
+
+
+def compressible(response):
+    return (
+        200 <= response.status_code < 300 and response.status_code not in (204, 206)
+        and response.mimetype in COMPRESSIBLE_TYPES
+        and 'Content-Encoding' not in response.headers
+        and not response.direct_passthrough
+    )
+
+
+def encoded(response, body, encoding):
+    """Set an already encoded body on a response."""
+    response.set_data(body)
+    response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+def compress_response(response):
+    if not COMPRESSION_ENABLED or not compressible(response):
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = negotiate(request)
+    if encoding is None:
+        return response
+    if response.is_streamed:
+        response.response = compress_stream(response.response, encoding)
+        response.headers.pop('Content-Length', None)
+        response.headers['Content-Encoding'] = encoding
+        return response
+    body = response.get_data()
+    if len(body) < COMPRESSION_MIN_BYTES:
+        return response
+    if response.headers.get('ETag'):
+        # The encoded bytes differ from what a strong ETag was computed for
+        etag, weak = response.get_etag()
+        response.set_etag(etag, weak=True)
+    return encoded(response, compress(body, encoding), encoding)
+
+
+def init_app(app):
+    app.after_request(compress_response)
@@ -0,0 +1,292 @@
+"""
+Acoustic fingerprints for catching re-encoded duplicate recordings.
+
+The SHA-256 file_hash only matches byte-identical uploads. Here FINGERPRINT_WINDOWS
+windows of FINGERPRINT_SECONDS, spread from the head to the tail of the recording,
+are decoded with ffmpeg to mono 8 kHz PCM, and spectral peaks are picked from a
+NumPy STFT. Pairs of nearby peaks are hashed as (anchor frequency, target frequency,
+time delta), which survives re-encoding at a different bitrate or container. Two
+uploads match when their durations agree and, in every window, enough of the hashes
+line up at a consistent time offset; recurring meetings that share an intro differ
+in the later windows.
+
+A near-duplicate of an already transcribed file can reuse its transcription and
+segments instead of being sent to Whisper.
+"""
+import os
+import subprocess
+from collections import defaultdict
+
+import numpy as np
+from sqlalchemy import and_, delete, event, func, insert, or_, select, true
+from sqlalchemy.orm import Session
+
+import tracing
+from models import db, Transcription, AudioFingerprint, FingerprintHash
+from storage_policy import scoped
+
+FINGERPRINT_ENABLED = os.environ.get('FINGERPRINT_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+# Windows of FINGERPRINT_SECONDS each; a recording shorter than all of them is one window
+FINGERPRINT_WINDOWS = int(os.environ.get('FINGERPRINT_WINDOWS', 3))
+FINGERPRINT_SECONDS = int(os.environ.get('FINGERPRINT_SECONDS', 60))
+# Fraction of the hashes of each window that must line up
+FINGERPRINT_MATCH_THRESHOLD = float(os.environ.get('FINGERPRINT_MATCH_THRESHOLD', 0.6))
+# Durations may differ slightly after re-encoding (encoder padding, trimmed tails)
+DURATION_TOLERANCE = 0.02
+
+SAMPLE_RATE = 8000
+N_FFT = 1024
+HOP = 256
+# Frequency bands (in FFT bins) in which one peak per frame is picked
+BAND_EDGES = [8, 20, 40, 80, 160, 320, 512]
+PEAK_NEIGHBOURHOOD = 5  # Frames on each side a peak must dominate
+FAN_OUT = 5
+MAX_DT = 63  # The time delta is the low 6 bits of a hash
+QUERY_CHUNK = 500
+
+
+def decode_pcm(path, seconds=None, start=None):
+    """Decode audio to mono 8 kHz float samples with ffmpeg, or None if it cannot be decoded."""
+    cmd = ['ffmpeg', '-v', 'error']
+    if start:
+        cmd += ['-ss', f'{start:.3f}']
+    cmd += ['-i', path, '-vn', '-ac', '1', '-ar', str(SAMPLE_RATE)]
+    if seconds:
+        cmd += ['-t', str(seconds)]
+    cmd += ['-f', 's16le', '-']
+    try:
+        result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    except FileNotFoundError:
+        return None
+    if result.returncode != 0 or not result.stdout:
+        return None
+    return np.frombuffer(result.stdout, dtype=np.int16).astype(np.float32) / 32768.0
+
+
+def probe_duration(path):
+    cmd = ['ffprobe', '-v', 'error', '-show_entries', 'format=duration', '-of', 'default=noprint_wrappers=1:nokey=1', path]
+    try:
+        result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        return float(result.stdout.strip())
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def spectral_peaks(samples):
+    """Return (frames, bins) arrays of the dominant spectral peaks, ordered by time."""
+    if len(samples) < N_FFT:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    frames = np.lib.stride_tricks.sliding_window_view(samples, N_FFT)[::HOP] * np.hanning(N_FFT)
+    spectrum = np.log1p(np.abs(np.fft.rfft(frames, axis=1)))
+    n_frames = spectrum.shape[0]
+    band_bins = []
+    band_values = []
+    for lo, hi in zip(BAND_EDGES[:-1], BAND_EDGES[1:]):
+        band = spectrum[:, lo:hi]
+        idx = band.argmax(axis=1)
+        band_bins.append(idx + lo)
+        band_values.append(band[np.arange(n_frames), idx])
+    bins = np.stack(band_bins, axis=1)
+    values = np.stack(band_values, axis=1)
+    # A peak must be the maximum of its band over the surrounding frames and stand out from the average
+    padded = np.pad(values, ((PEAK_NEIGHBOURHOOD, PEAK_NEIGHBOURHOOD), (0, 0)), constant_values=-np.inf)
+    local_max = np.lib.stride_tricks.sliding_window_view(padded, 2 * PEAK_NEIGHBOURHOOD + 1, axis=0).max(axis=-1)
+    keep = (values >= local_max) & (values > values.mean() + values.std() * 0.5)
+    frame_idx, band_idx = np.nonzero(keep)
+    return frame_idx, bins[frame_idx, band_idx]
+
+
+def fingerprint_samples(samples):
+    """Hash pairs of spectral peaks. Returns (hashes, anchor_offsets) as int64 arrays."""
+    frames, bins = spectral_peaks(samples)
+    freq = bins // 2  # Coarser frequency resolution tolerates small spectral shifts
+    hashes = []
+    offsets = []
+    for k in range(1, FAN_OUT + 1):
+        if len(frames) <= k:
+            break
+        dt = frames[k:] - frames[:-k]
+        valid = (dt > 0) & (dt <= MAX_DT)
+        hashes.append((freq[:-k][valid] << 14) | (freq[k:][valid] << 6) | dt[valid])
+        offsets.append(frames[:-k][valid])
+    if not hashes:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    return np.concatenate(hashes).astype(np.int64), np.concatenate(offsets).astype(np.int64)
+
+
+def window_starts(duration):
+    """Start times in seconds of the fingerprint windows of a recording of duration seconds (None if unknown)."""
+    if not duration or duration <= FINGERPRINT_WINDOWS * FINGERPRINT_SECONDS:
+        return [0.0]
+    return np.linspace(0.0, duration - FINGERPRINT_SECONDS, FINGERPRINT_WINDOWS).tolist()
+
+
+def window_of(offsets, duration):
+    """Index of the window each anchor offset (in frames from the start of the recording) falls in."""
+    start_frames = [round(start * SAMPLE_RATE / HOP) for start in window_starts(duration)]
+    return np.searchsorted(start_frames, offsets, side='right') - 1
+
+
+def jittered(h):
+    """A hash and the same peak pair one frame closer or further apart: a peak can move a frame when the audio shifts by part of a hop."""
+    dt = h & MAX_DT
+    return [h + d for d in (-1, 0, 1) if 0 < dt + d <= MAX_DT]
+
+
+def match_score(query_hashes, query_offsets, stored):
+    """
+    Fraction of query hashes that line up with a stored fingerprint at one time offset,
+    give or take a frame. stored is an iterable of (hash, offset) pairs.
+    """
+    if len(query_hashes) == 0:
+        return 0.0
+    by_hash = defaultdict(list)
+    for i, (h, offset) in enumerate(zip(query_hashes.tolist(), query_offsets.tolist())):
+        for variant in jittered(h):
+            by_hash[variant].append((i, offset))
+    deltas = defaultdict(set)
+    for h, offset in stored:
+        for i, query_offset in by_hash.get(h, ()):
+            deltas[offset - query_offset].add(i)
+    if not deltas:
+        return 0.0
+    best = max(len(deltas.get(d - 1, set()) | deltas[d] | deltas.get(d + 1, set())) for d in list(deltas))
+    return best / len(query_hashes)
+
+
+def recording_score(fp, stored):
+    """The lowest match_score of the windows of fingerprint fp against stored (hash, offset) pairs."""
+    stored = list(stored)
+    windows = window_of(fp['offsets'], fp['duration'])
+    return min(
+        match_score(fp['hashes'][windows == w], fp['offsets'][windows == w], stored)
+        for w in range(len(window_starts(fp['duration'])))
+    )
+
+
+def compute(path):
+    """Fingerprint a media file: {'hashes', 'offsets', 'duration'} or None if ffmpeg cannot decode it."""
+    if not FINGERPRINT_ENABLED:
+        return None
+    with tracing.span('fingerprint') as span:
+        duration = probe_duration(path)
+        starts = window_starts(duration)
+        seconds = FINGERPRINT_SECONDS if len(starts) > 1 else FINGERPRINT_WINDOWS * FINGERPRINT_SECONDS
+        hashes, offsets = [], []
+        for start in starts:
+            samples = decode_pcm(path, seconds, start)
+            if samples is None:
+                return None
+            window_hashes, window_offsets = fingerprint_samples(samples)
+            hashes.append(window_hashes)
+            # Offsets count frames from the start of the recording, so window_of can tell the windows apart
+            offsets.append(window_offsets + round(start * SAMPLE_RATE / HOP))
+        hashes, offsets = np.concatenate(hashes), np.concatenate(offsets)
+        span.set_attribute('fingerprint.windows', len(starts))
+        span.set_attribute('fingerprint.hashes', len(hashes))
+        if len(hashes) == 0:
+            return None
+        return {'hashes': hashes, 'offsets': offsets, 'duration': duration}
+
+
+def store(file_id, fp):
+    """Persist a fingerprint for a transcription row (does not commit)."""
+    db.session.add(AudioFingerprint(transcription_id=file_id, duration=fp['duration'], hash_count=len(fp['hashes'])))
+    db.session.execute(
+        insert(FingerprintHash),
+        [{'transcription_id': file_id, 'hash': h, 'offset': o} for h, o in zip(fp['hashes'].tolist(), fp['offsets'].tolist())]
+    )
+
+
+def load(file_id):
+    header = AudioFingerprint.query.filter_by(transcription_id=file_id).first()
+    if not header:
+        return None
+    rows = db.session.query(FingerprintHash.hash, FingerprintHash.offset).filter_by(transcription_id=file_id).all()
+    return {
+        'hashes': np.array([r[0] for r in rows], dtype=np.int64),
+        'offsets': np.array([r[1] for r in rows], dtype=np.int64),
+        'duration': header.duration,
+    }
+
+
+def _duration_close_to(duration):
+    """SQL condition: the stored duration is within max(2 s, DURATION_TOLERANCE) of duration (or either is unknown)."""
+    stored = AudioFingerprint.duration
+    if duration is None:
+        return true()
+    return or_(
+        stored.is_(None),
+        func.abs(stored - duration) <= 2.0,
+        and_(stored <= duration, duration - stored <= DURATION_TOLERANCE * duration),
+        and_(stored > duration, stored - duration <= DURATION_TOLERANCE * stored),
+    )
+
+
+def find_near_duplicate(fp, owner_id, exclude_id=None):
+    """Best transcribed row in the same database whose fingerprint matches fp, or None."""
+    candidates = (
+        db.session.query(Transcription.id)
+        .join(AudioFingerprint, AudioFingerprint.transcription_id == Transcription.id)
+        .filter(Transcription.transcription_status == 'transcribed', _duration_close_to(fp['duration']))
+    )
+    candidates = scoped(candidates, owner_id)
+    if exclude_id is not None:
+        candidates = candidates.filter(Transcription.id != exclude_id)
+    candidate_ids = select(candidates.subquery().c.id)
+    stored = defaultdict(list)
+    unique_hashes = list({variant for h in fp['hashes'].tolist() for variant in jittered(h)})
+    for i in range(0, len(unique_hashes), QUERY_CHUNK):
+        rows = (
+            db.session.query(FingerprintHash.transcription_id, FingerprintHash.hash, FingerprintHash.offset)
+            .filter(FingerprintHash.hash.in_(unique_hashes[i:i + QUERY_CHUNK]),
+                    FingerprintHash.transcription_id.in_(candidate_ids))
+            .all()
+        )
+        for file_id, h, offset in rows:
+            stored[file_id].append((h, offset))
+    best_id, best_score = None, 0.0
+    for file_id, pairs in stored.items():
+        score = recording_score(fp, pairs)
+        if score > best_score:
+            best_id, best_score = file_id, score
+    if best_score < FINGERPRINT_MATCH_THRESHOLD:
+        return None
+    print(f"[FINGERPRINT] Near-duplicate of file {best_id} (score {best_score:.2f})")
+    return db.session.get(Transcription, best_id)
+
+
+def fingerprint_file(t, path):
+    """Fingerprint an uploaded row if it has no fingerprint yet. Returns the fingerprint or None."""
+    file_id = t.id
+    existing = load(file_id)
+    if existing is not None:
+        return existing
+    db.session.commit()  # End the read transaction before running ffmpeg
+    fp = compute(path)
+    if fp is not None:
+        store(file_id, fp)
+        db.session.commit()
+    return fp
+
+
+def reusable_transcription(t, path):
+    """A transcribed near-duplicate of row t whose transcription can be copied instead of calling Whisper."""
+    fp = fingerprint_file(t, path)
+    if fp is None:
+        return None
+    return find_near_duplicate(fp, t.owner_id, exclude_id=t.id)
+
+
+def copy_transcription(source, target):
+    target.transcription = source.transcription
+    target.segments = source.segments
+    target.transcription_status = 'transcribed'
+
+
+@event.listens_for(Session, 'before_flush')
+def _drop_hashes_of_deleted_rows(session, flush_context, instances):
+    # Hashes are bulk-deleted rather than cascaded through the ORM, which would load every row first
+    ids = [obj.id for obj in session.deleted if isinstance(obj, Transcription) and obj.id is not None]
+    if ids:
+        session.execute(delete(FingerprintHash).where(FingerprintHash.transcription_id.in_(ids)))
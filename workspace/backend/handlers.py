@@ -0,0 +1,513 @@
+"""
+Route bodies shared by the Flask app (app.py) and the async app (asgi.py).
+
+/transcribe, /files/<id>/transcribe, /files/batch-transcribe, /ask, /ask/batch and
+/ask-database are written once here, as coroutines that take an `io` object for
+everything that differs between the two serving modes and return (body, status):
+
+  io.run(fn, *args, **kwargs)   run a blocking DB step in a short app context of its own
+  io.read(file)                 the bytes of an uploaded file
+  io.staged(area, name)         async context managers over the blob store
+  io.local_path(area, name)
+  io.exists(area, name)
+  io.thumbnail(path, filename)  the stored thumbnail name of a video upload, or None
+  io.transcribe(file_hash, path, file_id=None)
+                                (transcription, word_segments); raises TranscriptionFailed
+  io.complete(system_prompt, prompt)
+                                a GPT answer; raises GPTError
+  io.batch_concurrency          files of a batch transcribed at once
+
+app.FlaskIO runs the steps on the request thread; asgi.AsyncIO uses the threadpool,
+asyncio subprocesses and an async HTTP client. Every DB step returns plain data, so
+no session or transaction is held across ffmpeg, Whisper or GPT calls.
+"""
+import contextlib
+import hashlib
+import os
+
+from flask import current_app
+from sqlalchemy import update
+from sqlalchemy.orm import load_only
+from werkzeug.utils import secure_filename
+
+import admission
+import fingerprint
+import streaming
+import tracing
+import transcript_segments
+import waveform
+from azure_openai import ASK_SYSTEM_PROMPT, ASK_DATABASE_SYSTEM_PROMPT, GPTError
+from models import db, Transcription
+from storage_policy import check_quota, enforce_quotas, schedule_rendition, scoped
+from summaries import answer_map_reduce, digest_records, gather_limited, load_transcripts, schedule_summary
+from transcript_qa import answer_from_passages, answer_question, answer_questions, batch_questions, build_passages, transcript_prompt
+from transcript_segments import stored_segments
+
+TRANSCRIBE_EXTENSIONS = {'.mp4', '.mov', '.avi', '.mkv', '.webm', '.flv', '.wmv', '.mpeg', '.mpg'}
+
+
+class TranscriptionFailed(Exception):
+    def __init__(self, message, status_code):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+
+
+class AudioExtractionFailed(TranscriptionFailed):
+    pass
+
+
+@contextlib.asynccontextmanager
+async def entered(context):
+    """Use a blocking context manager from a route body on the calling thread."""
+    with context as value:
+        yield value
+
+
+def commit_traced():
+    with tracing.span('db.commit'):
+        db.session.commit()
+
+
+def on_transcribed(file_id):
+    """Post-transcription stages: summary generation and storage tiering run in the background."""
+    app = current_app._get_current_object()
+    schedule_summary(app, file_id)
+    schedule_rendition(app, file_id)
+    waveform.schedule_waveform(app, file_id)
+
+
+def claim_transcription(t):
+    """
+    Mark row t as transcribed unless a concurrent request has already done so. The
+    conditional UPDATE holds the write lock until the caller fills in the rest of t and
+    commits, so call it only once the result is ready: no ffmpeg or Whisper call may
+    run inside the transaction. Returns False (with t refreshed) when the other request won.
+    """
+    claimed = db.session.connection().execute(
+        update(Transcription.__table__)
+        .where(Transcription.id == t.id, Transcription.transcription_status != 'transcribed')
+        .values(transcription_status='transcribed')).rowcount == 1
+    if not claimed:
+        db.session.rollback()
+        db.session.refresh(t)
+    return claimed
+
+
+def reuse_near_duplicate(t, file_path):
+    """
+    Copy the transcript of an acoustically matching, already transcribed upload into t
+    instead of sending it to Whisper. Returns the id of the source row, or None
+    (also when a concurrent request transcribed t first).
+    """
+    source = fingerprint.reusable_transcription(t, file_path)
+    if source is None or not claim_transcription(t):
+        return None
+    fingerprint.copy_transcription(source, t)
+    commit_traced()
+    on_transcribed(t.id)
+    return source.id
+
+
+def match_upload(file_path, owner_id):
+    """Fingerprint a new upload before it has a row: (fingerprint or None, matching transcribed row or None)."""
+    fp = fingerprint.compute(file_path)
+    if fp is None:
+        return None, None
+    return fp, fingerprint.find_near_duplicate(fp, owner_id)
+
+
+def unused_filename(filename, owner_id):
+    """
+    filename, or the first free talk_1.mp4, talk_2.mp4, ... in the owner's database.
+    The taken names are read in one index range query instead of one query per suffix.
+    """
+    base, ext = os.path.splitext(filename)
+    prefix = f"{base}_"
+    # Every name starting with 'base_' sorts between prefix and prefix with '_' bumped to '`'
+    taken = {name for name, in scoped(Transcription.query.with_entities(Transcription.filename), owner_id).filter(
+        db.or_(Transcription.filename == filename,
+               db.and_(Transcription.filename >= prefix, Transcription.filename < f"{base}`"))).all()}
+    if filename not in taken:
+        return filename
+    i = 1
+    while f"{base}_{i}{ext}" in taken:
+        i += 1
+    return f"{base}_{i}{ext}"
+
+
+def authorized_file(file_id, db_mode, user_id, owner_only=False):
+    """
+    (row, None) for a file in the caller's database, else (None, (error body, status)):
+    404 when it does not exist, 403 when it belongs to another owner or database.
+    With owner_only just the id and owner_id columns are read.
+    """
+    options = [load_only(Transcription.owner_id)] if owner_only else None
+    t = db.session.get(Transcription, file_id, options=options)
+    if not t:
+        return None, ({'error': 'File not found'}, 404)
+    if db_mode == 'private' and user_id and t.owner_id != user_id:
+        return None, ({'error': 'Unauthorized'}, 403)
+    if db_mode == 'global' and t.owner_id is not None:
+        return None, ({'error': 'Unauthorized'}, 403)
+    return t, None
+
+
+def scoped_transcriptions(db_mode, user_id):
+    trans_query = Transcription.query
+    if db_mode == 'private' and user_id:
+        trans_query = trans_query.filter(Transcription.owner_id == user_id)
+    elif db_mode == 'global':
+        trans_query = trans_query.filter(Transcription.owner_id == None)
+    return trans_query
+
+
+def ask_database_context(db_mode, user_id):
+    """Concatenated transcripts and source list for the database selected by db_mode."""
+    # Only the needed columns, read in batches: segments are often larger than the transcripts
+    rows = (
+        scoped_transcriptions(db_mode, user_id)
+        .with_entities(Transcription.id, Transcription.filename, Transcription.created_at, Transcription.transcription)
+        .yield_per(streaming.STREAM_BATCH_ROWS)
+    )
+    transcripts = []
+    sources = []
+    for file_id, filename, created_at, transcription in rows:
+        transcripts.append(transcription)
+        sources.append({'id': file_id, 'filename': filename, 'created_at': created_at.isoformat() if created_at else None})
+    return '\n\n'.join(transcripts), sources
+
+
+# --- Blocking DB steps, each run through io.run ---
+
+def find_duplicate(filename, file_hash, file_size, owner_id):
+    existing = Transcription.query.filter_by(filename=filename, file_hash=file_hash, file_size=file_size, owner_id=owner_id).first()
+    if not existing:
+        return None
+    return {
+        'id': existing.id,
+        'filename': existing.filename,
+        'file_hash': existing.file_hash,
+        'transcription': existing.transcription,
+        'segments': stored_segments(existing) if existing.transcription else [],
+    }
+
+
+def save_transcription(file_id, transcription, word_segments, thumbnail=False, pending_only=False):
+    t = db.session.get(Transcription, file_id)
+    if not t:
+        return None
+    if pending_only and not claim_transcription(t):
+        return t.to_dict()
+    t.transcription = transcription
+    t.segments = transcript_segments.dumps(word_segments)
+    t.transcription_status = 'transcribed'
+    if thumbnail is not False:
+        t.thumbnail = thumbnail
+    commit_traced()
+    on_transcribed(t.id)
+    return t.to_dict()
+
+
+def insert_transcription(fp=None, **fields):
+    t = Transcription(**fields, last_accessed_at=db.func.now())
+    db.session.add(t)
+    commit_traced()
+    if fp is not None:
+        fingerprint.store(t.id, fp)
+        commit_traced()
+    enforce_quotas(t.owner_id, keep_id=t.id)
+    on_transcribed(t.id)
+    return t.to_dict()
+
+
+def reuse_for_file(file_id, file_path, thumbnail=False):
+    """
+    Fill a row from a transcribed near-duplicate. Returns (its to_dict(), the id of
+    the near-duplicate or None), or None if Whisper is needed.
+    """
+    t = db.session.get(Transcription, file_id)
+    if not t:
+        return None
+    if thumbnail is not False:
+        t.thumbnail = thumbnail
+    source_id = reuse_near_duplicate(t, file_path)
+    # Also done when a concurrent request has transcribed the row in the meantime
+    if not source_id and t.transcription_status != 'transcribed':
+        return None
+    return t.to_dict(), source_id
+
+
+def match_upload_transcript(file_path, owner_id):
+    """(fingerprint or None, (transcription, word_segments) of a matching row or None) for a new upload."""
+    fp, source = match_upload(file_path, owner_id)
+    if source is None:
+        return fp, None
+    return fp, (source.transcription, stored_segments(source))
+
+
+def load_file(file_id):
+    t = db.session.get(Transcription, file_id)
+    return t.to_dict() if t else None
+
+
+def load_segments(file_id, db_mode, user_id):
+    """(segments, (error body, status) or None) for asking about a stored transcript."""
+    t, error = authorized_file(file_id, db_mode, user_id)
+    if error:
+        return None, error
+    if not t.transcription:
+        return None, ({'error': 'File is not transcribed.'}, 400)
+    return stored_segments(t), None
+
+
+def load_batch(file_ids, db_mode, user_id):
+    """{file_id: (filename, file_hash, (status, error message) or None)}, with the same ownership checks as batch delete."""
+    jobs = {}
+    for file_id in file_ids:
+        t = db.session.get(Transcription, file_id)
+        if not t:
+            jobs[file_id] = (None, None, (404, f'File {file_id} not found'))
+        elif db_mode == 'private' and user_id and t.owner_id != user_id:
+            jobs[file_id] = (None, None, (403, f'Unauthorized to transcribe file {file_id}'))
+        elif db_mode == 'global' and t.owner_id is not None:
+            jobs[file_id] = (None, None, (403, f'Unauthorized to transcribe file {file_id}'))
+        else:
+            jobs[file_id] = (t.filename, t.file_hash, None)
+    return jobs
+
+
+def scoped_digests(db_mode, user_id):
+    return digest_records(scoped_transcriptions(db_mode, user_id))
+
+
+def content_hash(content):
+    return hashlib.sha256(content).hexdigest()
+
+
+def write_upload(file_path, content):
+    with open(file_path, 'wb') as f_out:
+        f_out.write(content)
+
+
+# --- Route bodies ---
+
+async def transcribe(io, file, db_mode, user_id):
+    if file is None:
+        return {'error': 'No file part'}, 400
+    if not file.filename:
+        return {'error': 'No selected file'}, 400
+    _, ext = os.path.splitext(file.filename.lower())
+    if ext not in TRANSCRIBE_EXTENSIONS:
+        allowed = ', '.join(TRANSCRIBE_EXTENSIONS)
+        return {'error': f'File type {ext} not supported. Allowed: {allowed}'}, 400
+    filename = secure_filename(file.filename)
+    with tracing.span('upload.read') as span:
+        file_content = await io.read(file)
+        span.set_attribute('file.size', len(file_content))
+    with tracing.span('upload.hash'):
+        file_hash = await io.run(content_hash, file_content)
+    file_size = len(file_content)
+    owner_id = user_id if db_mode == 'private' and user_id else None
+
+    # Check for duplicate by filename, file hash, file size, and owner_id
+    with tracing.span('db.duplicate_lookup'):
+        existing = await io.run(find_duplicate, filename, file_hash, file_size, owner_id)
+    if existing and existing['transcription']:
+        return {'transcription': existing['transcription'], 'segments': existing['segments'], 'filename': existing['filename']}, 200
+
+    if not existing:
+        quota_error = await io.run(check_quota, owner_id, file_size)
+        if quota_error:
+            return {'error': quota_error}, 507
+    # Save file to media storage; everything below works on the local copy
+    async with io.staged('uploads', filename) as file_path:
+        with tracing.span('storage.write'):
+            await io.run(write_upload, file_path, file_content)
+        thumbnail_filename = await io.thumbnail(file_path, filename)
+        fp, reused = None, None
+        if existing:
+            reused = await io.run(reuse_for_file, existing['id'], file_path, thumbnail_filename)
+            if reused:
+                file_dict, _ = reused
+                return {'transcription': file_dict['transcription'], 'segments': file_dict['segments'], 'filename': file_dict['filename']}, 200
+        else:
+            # A re-encoded copy of a recording that is already transcribed reuses its transcript
+            fp, reused = await io.run(match_upload_transcript, file_path, owner_id)
+        try:
+            if reused:
+                transcription, word_segments = reused
+            else:
+                transcription, word_segments = await io.transcribe(file_hash, file_path)
+        except AudioExtractionFailed as e:
+            # Do NOT delete the uploaded file unless its audio cannot be extracted
+            os.remove(file_path)
+            return {'error': e.message}, e.status_code
+        except TranscriptionFailed as e:
+            return {'error': e.message}, e.status_code
+
+    if existing:
+        # File was uploaded before but never transcribed: update that record, unless a concurrent request did
+        file_dict = await io.run(save_transcription, existing['id'], transcription, word_segments,
+                                 thumbnail=thumbnail_filename, pending_only=True)
+        if file_dict:
+            transcription, word_segments = file_dict['transcription'], file_dict['segments']
+        return {'transcription': transcription, 'segments': word_segments, 'filename': existing['filename']}, 200
+    await io.run(
+        insert_transcription,
+        fp=fp,
+        filename=filename,
+        transcription=transcription,
+        file_hash=file_hash,
+        file_size=file_size,
+        segments=transcript_segments.dumps(word_segments),
+        thumbnail=thumbnail_filename,
+        transcription_status="transcribed",
+        owner_id=owner_id,
+        stored_bytes=file_size
+    )
+    return {'transcription': transcription, 'segments': word_segments}, 200
+
+
+async def transcribe_by_id(io, file_id):
+    t = await io.run(load_file, file_id)
+    if not t:
+        return {'error': 'File not found'}, 404
+    if t['transcription_status'] == 'transcribed':
+        return {'error': 'Already transcribed', 'file': t}, 400
+    if not await io.exists('uploads', t['filename']):
+        return {'error': 'File not found on server'}, 404
+    async with io.local_path('uploads', t['filename']) as file_path:
+        reused = await io.run(reuse_for_file, file_id, file_path)
+        if reused:
+            file_dict, source_id = reused
+            return ({'file': file_dict, 'reused_from': source_id} if source_id else {'file': file_dict}), 200
+        try:
+            transcription, word_segments = await io.transcribe(t['file_hash'], file_path, file_id)
+        except TranscriptionFailed as e:
+            return {'error': e.message}, e.status_code
+    file_dict = await io.run(save_transcription, file_id, transcription, word_segments, pending_only=True)
+    if file_dict is None:
+        return {'error': 'File not found'}, 404
+    return {'file': file_dict}, 200
+
+
+async def batch_transcribe_files(io, data, db_mode, user_id, who):
+    """
+    Transcribe the files of a batch. Every file is admitted on its own as the caller `who`
+    (admission.identity), so a batch uses as many tokens and slots as that many single
+    requests; files over the limit get a 429 in the results and are not transcribed.
+    """
+    if 'file_ids' not in data:
+        return {'error': 'No file_ids provided'}, 400
+    file_ids = data['file_ids']
+    if not isinstance(file_ids, list):
+        return {'error': 'file_ids must be an array'}, 400
+
+    jobs = await io.run(load_batch, file_ids, db_mode, user_id)
+
+    async def transcribe_one(file_id, filename, file_hash):
+        if not await io.exists('uploads', filename):
+            return 404, f'File {file_id} not found on server'
+        async with io.local_path('uploads', filename) as file_path:
+            if await io.run(reuse_for_file, file_id, file_path):
+                return 200, None
+            try:
+                transcription, word_segments = await io.transcribe(file_hash, file_path, file_id)
+            except AudioExtractionFailed:
+                return 500, f'Failed to extract audio from video for file {file_id}'
+            except TranscriptionFailed as e:
+                return e.status_code, f'Failed to transcribe file {file_id}: {e.message}'
+            except Exception as e:
+                return 500, f'Error transcribing file {file_id}: {str(e)}'
+        # Each file is committed as soon as it is done, unless a concurrent request saved it first
+        await io.run(save_transcription, file_id, transcription, word_segments, pending_only=True)
+        return 200, None
+
+    async def run_one(file_id):
+        filename, file_hash, error = jobs[file_id]
+        if error:
+            return {'file_id': file_id, 'status': error[0], 'error': error[1]}
+        ticket, rejection = admission.admit('transcribe', who)
+        if rejection:
+            result = {'file_id': file_id, 'status': rejection.status, 'error': f'File {file_id} not transcribed: {rejection.error}'}
+            if rejection.retry_after is not None:
+                result['retry_after'] = rejection.retry_after
+            return result
+        try:
+            status, error = await transcribe_one(file_id, filename, file_hash)
+        finally:
+            ticket.release()
+        return {'file_id': file_id, 'status': status, 'error': error} if error else {'file_id': file_id, 'status': status}
+
+    # No more files at once than the caller has concurrency slots, or the extra ones would be refused
+    workers = io.batch_concurrency
+    if admission.ADMISSION_ENABLED and admission.LIMITS['transcribe'].concurrency:
+        workers = min(workers, admission.LIMITS['transcribe'].concurrency)
+    results = await gather_limited((run_one(file_id) for file_id in file_ids), workers)
+    errors = [r['error'] for r in results if 'error' in r]
+    return {
+        'success': True,
+        'transcribed_count': len(results) - len(errors),
+        'errors': errors,
+        'results': results
+    }, 200
+
+
+async def ask(io, data, db_mode, user_id):
+    transcript = data.get('transcript')
+    question = data.get('question')
+    try:
+        if data.get('file_id') is not None and question:
+            # Let the server pick the relevant segments of a stored transcript
+            segments, error = await io.run(load_segments, data['file_id'], db_mode, user_id)
+            if error:
+                return error
+            return await answer_question(question, segments, data.get('mode'), io.complete), 200
+        if not transcript or not question:
+            return {'error': 'Transcript and question are required.'}, 400
+        return {'answer': await io.complete(ASK_SYSTEM_PROMPT, transcript_prompt(transcript, question))}, 200
+    except GPTError as e:
+        return {'error': e.text}, e.status_code
+
+
+async def ask_batch(io, data, db_mode, user_id):
+    """Several questions about one file or transcript, answered concurrently in one request."""
+    questions = data.get('questions')
+    _, error = batch_questions(questions)
+    if error:
+        return {'error': error}, 400
+    if data.get('file_id') is not None:
+        segments, error = await io.run(load_segments, data['file_id'], db_mode, user_id)
+        if error:
+            return error
+        # The passages are built once and shared by every question
+        passages = build_passages(segments)
+        answers = await answer_questions(questions, lambda q: answer_from_passages(q, passages, data.get('mode'), io.complete))
+    elif data.get('transcript'):
+        transcript = data['transcript']
+
+        async def ask_transcript(question):
+            return {'answer': await io.complete(ASK_SYSTEM_PROMPT, transcript_prompt(transcript, question))}
+        answers = await answer_questions(questions, ask_transcript)
+    else:
+        return {'error': 'A file_id or transcript is required.'}, 400
+    return {'answers': answers}, 200
+
+
+async def ask_database(io, data, db_mode, user_id):
+    question = data.get('question')
+    if not question:
+        return {'error': 'Question is required.'}, 400
+    try:
+        if data.get('mode') == 'map-reduce':
+            # Pick relevant meetings from their precomputed summaries, then read only those transcripts
+            records = await io.run(scoped_digests, db_mode, user_id)
+            answer, sources = await answer_map_reduce(question, records, io.complete,
+                                                      lambda ids: io.run(load_transcripts, ids))
+            return {'answer': answer, 'sources': sources}, 200
+        all_transcripts, sources = await io.run(ask_database_context, db_mode, user_id)
+        prompt = f"Database of transcripts:\n{all_transcripts}\n\nQuestion: {question}\nAnswer:"
+        return {'answer': await io.complete(ASK_DATABASE_SYSTEM_PROMPT, prompt), 'sources': sources}, 200
+    except GPTError as e:
+        return {'error': e.text}, e.status_code
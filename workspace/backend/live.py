@@ -0,0 +1,207 @@
+"""
+Live transcription of an audio stream, for meetings that are still going on.
+
+A client opens the WebSocket /live (asgi.py) and sends:
+
+    {"type": "start", "sampleRate": 16000, "filename": "standup.wav",
+     "dbMode": "private", "userId": "..."}          optional, first message
+    binary frames                                   mono 16-bit little-endian PCM
+    {"type": "stop"}                                end of the stream
+
+Audio is cut into rolling windows of LIVE_WINDOW_SECONDS that overlap by
+LIVE_OVERLAP_SECONDS. Each window is transcribed as soon as it is full, and its
+word_segments, shifted to the time since the stream started, are pushed back as
+
+    {"type": "segments", "window": n, "word_segments": [...], "text": "..."}
+
+Windows are stitched at the middle of their overlap: a window only reports the
+words whose midpoint lies between the middles of its overlaps with the previous
+and the next window, so a word cut off at the edge of one window is taken from
+the window that heard all of it, and no word is reported twice. After "stop" the
+remaining audio is transcribed, the whole recording is saved as a WAV upload and
+a normal, transcribed Transcription row is created from the stitched segments:
+
+    {"type": "final", "file": {...}}
+
+Windows go to the Azure Whisper deployment by default. LIVE_ENGINE=module:function
+plugs in another engine (e.g. a local Whisper model): it is called with the WAV
+bytes of one window and returns a dict shaped like Whisper's verbose_json (text,
+segments, optionally words). It may be a coroutine function; a plain function
+runs in the threadpool.
+"""
+import hashlib
+import importlib
+import inspect
+import io
+import os
+import tempfile
+import wave
+
+LIVE_ENGINE = os.environ.get('LIVE_ENGINE', 'azure')
+LIVE_WINDOW_SECONDS = float(os.environ.get('LIVE_WINDOW_SECONDS', 10))
+LIVE_OVERLAP_SECONDS = float(os.environ.get('LIVE_OVERLAP_SECONDS', 2))
+LIVE_SAMPLE_RATE = int(os.environ.get('LIVE_SAMPLE_RATE', 16000))
+LIVE_MAX_SECONDS = int(os.environ.get('LIVE_MAX_SECONDS', 4 * 3600))
+
+SAMPLE_WIDTH = 2  # 16-bit PCM
+SAMPLE_RATES = range(8000, 48001)
+
+
+def load_engine(spec, default):
+    """The engine named by spec ('azure' for default, else 'module:function')."""
+    if not spec or spec == 'azure':
+        return default
+    module_name, _, attr = spec.partition(':')
+    return getattr(importlib.import_module(module_name), attr or 'transcribe')
+
+
+async def call_engine(engine, wav_bytes, run_in_threadpool):
+    if inspect.iscoroutinefunction(engine):
+        return await engine(wav_bytes)
+    return await run_in_threadpool(engine, wav_bytes)
+
+
+def wav_bytes(pcm, sample_rate):
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as w:
+        w.setnchannels(1)
+        w.setsampwidth(SAMPLE_WIDTH)
+        w.setframerate(sample_rate)
+        w.writeframes(pcm)
+    return buffer.getvalue()
+
+
+def wav_duration(data):
+    """Seconds of audio in WAV bytes, or None if they cannot be read."""
+    try:
+        with wave.open(io.BytesIO(data), 'rb') as w:
+            return w.getnframes() / w.getframerate()
+    except (wave.Error, EOFError):
+        return None
+
+
+def stitch(word_segments, start, end, first, last, overlap):
+    """
+    Split the segments of the window [start, end) (in stream time) into the ones to
+    report now and the ones left to the next window, by their midpoints.
+    """
+    low = float('-inf') if first else start + overlap / 2
+    high = float('inf') if last else end - overlap / 2
+    report, deferred = [], []
+    for segment in word_segments:
+        middle = (segment['start'] + segment['end']) / 2
+        if middle >= high:
+            deferred.append(segment)
+        elif middle >= low:
+            report.append(segment)
+    return report, deferred
+
+
+def shifted(word_segments, offset):
+    return [{**segment, 'start': segment['start'] + offset, 'end': segment['end'] + offset} for segment in word_segments]
+
+
+def transcript_text(word_segments):
+    return ' '.join(text for text in (segment['text'].strip() for segment in word_segments) if text)
+
+
+class Window:
+    def __init__(self, index, start, pcm, last):
+        self.index = index
+        self.start = start  # Seconds since the stream started
+        self.pcm = pcm
+        self.last = last
+
+
+class LiveSession:
+    """
+    The audio of one stream: cuts it into overlapping windows, stitches their
+    segments, and keeps the whole recording in a temporary WAV file.
+    """
+
+    def __init__(self, sample_rate=None, window_seconds=None, overlap_seconds=None):
+        sample_rate = sample_rate or LIVE_SAMPLE_RATE
+        window_seconds = window_seconds or LIVE_WINDOW_SECONDS
+        overlap_seconds = LIVE_OVERLAP_SECONDS if overlap_seconds is None else overlap_seconds
+        self.sample_rate = sample_rate
+        self.overlap = overlap_seconds
+        self.window_bytes = int(window_seconds * sample_rate) * SAMPLE_WIDTH
+        self.step_bytes = self.window_bytes - int(overlap_seconds * sample_rate) * SAMPLE_WIDTH
+        self.buffer = bytearray()
+        self.buffer_start = 0  # Byte offset of the buffer in the stream
+        self.received = 0
+        self.windows = 0
+        self.word_segments = []
+        self.deferred = []
+        self._pending_byte = b''
+        fd, self.path = tempfile.mkstemp(prefix='live-', suffix='.wav')
+        os.close(fd)
+        self._wav = wave.open(self.path, 'wb')
+        self._wav.setnchannels(1)
+        self._wav.setsampwidth(SAMPLE_WIDTH)
+        self._wav.setframerate(sample_rate)
+
+    @property
+    def seconds(self):
+        return self.received / SAMPLE_WIDTH / self.sample_rate
+
+    def _window(self, pcm, last):
+        window = Window(self.windows, self.buffer_start / SAMPLE_WIDTH / self.sample_rate, pcm, last)
+        self.windows += 1
+        return window
+
+    def feed(self, frame):
+        """Add a frame of PCM; returns the windows it completed."""
+        data = self._pending_byte + bytes(frame)
+        # Frames may split a sample; the odd byte waits for the next frame
+        usable = len(data) // SAMPLE_WIDTH * SAMPLE_WIDTH
+        data, self._pending_byte = data[:usable], data[usable:]
+        self._wav.writeframes(data)
+        self.received += len(data)
+        self.buffer += data
+        windows = []
+        while len(self.buffer) >= self.window_bytes:
+            windows.append(self._window(bytes(self.buffer[:self.window_bytes]), last=False))
+            del self.buffer[:self.step_bytes]
+            self.buffer_start += self.step_bytes
+        return windows
+
+    def finish(self):
+        """The last, partial window, or None when its audio was already covered by the previous one."""
+        self._close_recording()
+        covered = self.window_bytes - self.step_bytes if self.windows else 0
+        if len(self.buffer) <= covered:
+            return None
+        return self._window(bytes(self.buffer), last=True)
+
+    def accept(self, window, word_segments):
+        """Stitch a transcribed window in; returns the segments to report for it."""
+        end = window.start + len(window.pcm) / SAMPLE_WIDTH / self.sample_rate
+        report, self.deferred = stitch(shifted(word_segments, window.start), window.start, end,
+                                       window.index == 0, window.last, self.overlap)
+        self.word_segments += report
+        return report
+
+    def flush(self):
+        """Report the segments held back for the next window, when it never comes or could not be transcribed."""
+        report, self.deferred = self.deferred, []
+        self.word_segments += report
+        return report
+
+    def digest(self):
+        """(sha256, size) of the recording file once finish() has closed it."""
+        sha = hashlib.sha256()
+        with open(self.path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                sha.update(chunk)
+        return sha.hexdigest(), os.path.getsize(self.path)
+
+    def _close_recording(self):
+        if self._wav is not None:
+            self._wav.close()
+            self._wav = None
+
+    def discard(self):
+        self._close_recording()
+        if os.path.exists(self.path):
+            os.remove(self.path)
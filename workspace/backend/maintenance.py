@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+"""
+Storage reconciliation and database maintenance.
+
+    python maintenance.py [--dry-run] [--json] [--skip-storage] [--skip-database]
+
+Media storage and the transcription table drift apart over time: a crash between
+writing a blob and committing its row leaves an orphan, failed ffmpeg runs leave
+<upload>.mp3 extraction files behind, and SQLite keeps the pages of deleted rows
+until it is vacuumed. One run:
+
+  1. lists the uploads, thumbnails and speech areas and compares them with the
+     blobs the rows refer to (uploads, speech renditions, thumbnails, waveform peaks)
+  2. deletes blobs no row refers to, including stale extraction files, once they
+     are older than MAINTENANCE_GRACE_SECONDS (younger ones may belong to an upload
+     or transcription in progress)
+  3. flags rows whose media is gone: media_state falls back to 'speech' when the
+     rendition is still there, else becomes 'missing'; lost thumbnails are cleared
+  4. runs ANALYZE, VACUUM and wal_checkpoint(TRUNCATE) on SQLite (VACUUM ANALYZE on
+     PostgreSQL), including each owner partition file (partitions.py)
+
+--dry-run reports what would be done and changes nothing. With
+MAINTENANCE_INTERVAL_HOURS set, the app also runs it in a background thread every
+so many hours; a row in transcription_lease makes sure only one process of a
+deployment does so per interval.
+"""
+import argparse
+import datetime
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+
+from sqlalchemy import insert, text, update
+from sqlalchemy.exc import IntegrityError
+
+import blob_storage
+import partitions
+import waveform
+from models import db, Transcription, TranscriptionLease
+
+MAINTENANCE_INTERVAL_HOURS = float(os.environ.get('MAINTENANCE_INTERVAL_HOURS', 0))
+MAINTENANCE_GRACE_SECONDS = int(os.environ.get('MAINTENANCE_GRACE_SECONDS', 3600))
+
+LEASE_KEY = 'maintenance'
+FLAG_BATCH_ROWS = 500
+
+DATABASE_STATEMENTS = {
+    'sqlite': ['ANALYZE', 'VACUUM', 'PRAGMA wal_checkpoint(TRUNCATE)'],
+    'postgresql': ['VACUUM ANALYZE'],
+}
+
+
+def is_extraction_file(name):
+    """Whether a blob name looks like the <upload>.mp3 that audio extraction writes next to an upload."""
+    base, ext = os.path.splitext(name)
+    return ext.lower() == '.mp3' and os.path.splitext(base)[1] != ''
+
+
+def referenced_blobs():
+    """(rows, {area: names the rows refer to}); rows are (id, filename, thumbnail, speech_file, media_state)."""
+    names = {area: set() for area in blob_storage.AREA_FOLDERS}
+    rows = []
+    query = db.session.query(Transcription.id, Transcription.filename, Transcription.thumbnail,
+                             Transcription.speech_file, Transcription.media_state, Transcription.file_hash)
+    for file_id, filename, thumbnail, speech_file, media_state, file_hash in query.yield_per(1000):
+        rows.append((file_id, filename, thumbnail, speech_file, media_state))
+        names['uploads'].add(filename)
+        if thumbnail:
+            names['thumbnails'].add(thumbnail)
+        if speech_file:
+            names['speech'].add(speech_file)
+        if file_hash:
+            names['thumbnails'].add(waveform.blob_name(file_hash))
+    db.session.commit()
+    return rows, names
+
+
+def find_unreferenced(stored, referenced, grace_seconds):
+    """(orphans, extraction files, count too recent to judge) among the stored blobs."""
+    orphans, extraction_files, recent = [], [], 0
+    cutoff = time.time() - grace_seconds
+    for area, blobs in stored.items():
+        for name, size in blobs.items():
+            if name in referenced[area] or name.startswith('.'):
+                continue
+            if blobs.modified[name] > cutoff:
+                recent += 1
+                continue
+            entry = {'area': area, 'name': name, 'bytes': size}
+            (extraction_files if area == 'uploads' and is_extraction_file(name) else orphans).append(entry)
+    return orphans, extraction_files, recent
+
+
+def find_missing_media(rows, stored):
+    """{file id: what the row should become} for rows that refer to blobs that are not stored."""
+    changes = {}
+    for file_id, filename, thumbnail, speech_file, media_state in rows:
+        change = {}
+        has_speech = bool(speech_file) and speech_file in stored['speech']
+        if media_state in (None, 'original') and filename not in stored['uploads']:
+            change['media_state'] = 'speech' if has_speech else 'missing'
+        elif media_state == 'speech' and not has_speech:
+            change['media_state'] = 'missing'
+        if thumbnail and thumbnail not in stored['thumbnails']:
+            change['thumbnail'] = None
+        if change:
+            changes[file_id] = change
+    return changes
+
+
+def flag_missing_media(changes, stored):
+    """Apply find_missing_media's changes to rows that have not changed since they were read."""
+    applied = 0
+    for i, file_id in enumerate(changes, 1):
+        t = db.session.get(Transcription, file_id)
+        if t is None:
+            continue
+        change = changes[file_id]
+        if 'media_state' in change and t.media_state != 'missing':
+            if change['media_state'] == 'speech':
+                t.media_state = 'speech'
+                t.stored_bytes = stored['speech'].get(t.speech_file, 0)
+            else:
+                t.media_state = 'missing'
+                t.speech_file = None
+                t.stored_bytes = 0
+            applied += 1
+        if 'thumbnail' in change and t.thumbnail and t.thumbnail not in stored['thumbnails']:
+            t.thumbnail = None
+        if i % FLAG_BATCH_ROWS == 0:
+            db.session.commit()
+    db.session.commit()
+    return applied
+
+
+class _Listing(dict):
+    """name -> size of the blobs in one area, with their modification times in .modified."""
+
+    def __init__(self, area):
+        super().__init__()
+        self.modified = {}
+        for name, size, modified in blob_storage.listing(area):
+            self[name] = size
+            self.modified[name] = modified
+
+
+def reconcile_storage(dry_run=False, grace_seconds=MAINTENANCE_GRACE_SECONDS):
+    # Blobs are shared by all owners, so every partition's references count (partitions.py)
+    rows = {}
+    referenced = {area: set() for area in blob_storage.AREA_FOLDERS}
+    for partition in partitions.each(db.engine):
+        rows[partition], names = referenced_blobs()
+        for area in referenced:
+            referenced[area] |= names[area]
+        db.session.close()
+    # Listed after the rows were read: a blob whose row is committed in between is still recent
+    stored = {area: _Listing(area) for area in blob_storage.AREA_FOLDERS}
+    orphans, extraction_files, recent = find_unreferenced(stored, referenced, grace_seconds)
+    changes = {}
+    for partition in partitions.each(db.engine):
+        partition_changes = find_missing_media(rows[partition], stored)
+        if not dry_run:
+            flag_missing_media(partition_changes, stored)
+            db.session.close()
+        changes.update(partition_changes)
+    if not dry_run:
+        for entry in orphans + extraction_files:
+            blob_storage.delete(entry['area'], entry['name'])
+    return {
+        'orphans': orphans,
+        'extraction_files': extraction_files,
+        'recent_unreferenced': recent,
+        'freed_bytes': sum(entry['bytes'] for entry in orphans + extraction_files),
+        'missing_media': sorted(i for i, change in changes.items() if change.get('media_state') == 'missing'),
+        'speech_only': sorted(i for i, change in changes.items() if change.get('media_state') == 'speech'),
+        'missing_thumbnails': sorted(i for i, change in changes.items() if 'thumbnail' in change),
+    }
+
+
+def _sqlite_bytes(conn):
+    page_size = conn.execute(text('PRAGMA page_size')).scalar()
+    pages = conn.execute(text('PRAGMA page_count')).scalar()
+    free = conn.execute(text('PRAGMA freelist_count')).scalar()
+    return pages * page_size, free * page_size
+
+
+def maintain_database(engine, dry_run=False):
+    """Refresh planner statistics and give the space of deleted rows back to the file system."""
+    dialect = engine.dialect.name
+    statements = DATABASE_STATEMENTS.get(dialect, [])
+    report = {'dialect': dialect, 'statements': statements}
+    # VACUUM cannot run inside a transaction
+    with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+        if dialect == 'sqlite':
+            report['bytes_before'], report['reclaimable_bytes'] = _sqlite_bytes(conn)
+        if dry_run:
+            return report
+        for statement in statements:
+            conn.execute(text(statement))
+        if dialect == 'sqlite':
+            report['bytes_after'], _ = _sqlite_bytes(conn)
+    return report
+
+
+def run(dry_run=False, storage=True, database=True, grace_seconds=MAINTENANCE_GRACE_SECONDS):
+    """One maintenance pass in the current app context. Returns the report."""
+    report = {'dry_run': dry_run}
+    if storage:
+        report['storage'] = reconcile_storage(dry_run, grace_seconds)
+    if database:
+        report['database'] = maintain_database(db.engine, dry_run)
+        if db.engine.dialect.name == 'sqlite' and partitions.enabled():
+            # Each owner partition is a database file of its own
+            report['partitions'] = [maintain_database(partitions.partition_engine(db.engine, name), dry_run)
+                                    for name in partitions.names(db.engine)]
+    return report
+
+
+def summary(report):
+    verb = 'Would delete' if report['dry_run'] else 'Deleted'
+    lines = []
+    storage = report.get('storage')
+    if storage:
+        lines.append(f"[MAINTENANCE] {verb} {len(storage['orphans'])} orphaned blobs and "
+                     f"{len(storage['extraction_files'])} stale extraction files ({storage['freed_bytes']} bytes); "
+                     f"{storage['recent_unreferenced']} recent unreferenced blobs left alone")
+        lines.append(f"[MAINTENANCE] Media missing for {len(storage['missing_media'])} files, original missing for "
+                     f"{len(storage['speech_only'])} more, thumbnail missing for {len(storage['missing_thumbnails'])}")
+    database = report.get('database')
+    if database:
+        verb = 'Would run' if report['dry_run'] else 'Ran'
+        lines.append(f"[MAINTENANCE] {verb} {', '.join(database['statements']) or 'nothing'} on {database['dialect']}")
+        if 'bytes_before' in database:
+            after = database.get('bytes_after', database['bytes_before'] - database['reclaimable_bytes'])
+            lines.append(f"[MAINTENANCE] Database file {database['bytes_before']} -> {after} bytes")
+        if report.get('partitions'):
+            lines.append(f"[MAINTENANCE] {verb} the same on {len(report['partitions'])} owner partitions")
+    return '\n'.join(lines)
+
+
+# --- Scheduled runs ---
+
+def claim_scheduled_run(engine, holder):
+    """True if this process runs the maintenance that is due; the claim lasts most of one interval."""
+    now = datetime.datetime.utcnow()
+    expires = now + datetime.timedelta(hours=MAINTENANCE_INTERVAL_HOURS * 0.9)
+    table = TranscriptionLease.__table__
+    try:
+        with engine.begin() as conn:
+            conn.execute(insert(table).values(key=LEASE_KEY, holder=holder, status='running', expires_at=expires))
+        return True
+    except IntegrityError:
+        pass
+    with engine.begin() as conn:
+        claimed = conn.execute(update(table).where(table.c.key == LEASE_KEY, table.c.expires_at < now)
+                               .values(holder=holder, expires_at=expires))
+        return claimed.rowcount == 1
+
+
+def _scheduled_runs(app, stop):
+    holder = uuid.uuid4().hex
+    while not stop.wait(MAINTENANCE_INTERVAL_HOURS * 3600):
+        with app.app_context():
+            try:
+                if claim_scheduled_run(db.engine, holder):
+                    print(summary(run()), flush=True)
+            except Exception as e:
+                db.session.rollback()
+                print(f"[MAINTENANCE] Error during scheduled maintenance: {e}")
+
+
+def schedule(app):
+    """Run maintenance every MAINTENANCE_INTERVAL_HOURS in a daemon thread (no-op when unset). Returns a stop event."""
+    stop = threading.Event()
+    if MAINTENANCE_INTERVAL_HOURS > 0:
+        threading.Thread(target=_scheduled_runs, args=(app, stop), daemon=True, name='maintenance').start()
+    return stop
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Reconcile media storage with the database and compact the database.')
+    parser.add_argument('--dry-run', action='store_true', help='report what would be done without changing anything')
+    parser.add_argument('--skip-storage', action='store_true', help='do not reconcile media storage')
+    parser.add_argument('--skip-database', action='store_true', help='do not run ANALYZE / VACUUM')
+    parser.add_argument('--grace-seconds', type=int, default=MAINTENANCE_GRACE_SECONDS,
+                        help=f'leave unreferenced blobs younger than this alone (default: {MAINTENANCE_GRACE_SECONDS})')
+    parser.add_argument('--json', action='store_true', help='print the full report as JSON')
+    args = parser.parse_args(argv)
+    from app import app
+    with app.app_context():
+        report = run(dry_run=args.dry_run, storage=not args.skip_storage, database=not args.skip_database,
+                     grace_seconds=args.grace_seconds)
+    print(json.dumps(report, indent=2) if args.json else summary(report))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,14 +1,23 @@
 from flask_sqlalchemy import SQLAlchemy
 import hashlib
 import json
+from partitions import PartitionedSession
+import transcript_segments
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': PartitionedSession})
 
 class Transcription(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     filename = db.Column(db.String(256), nullable=False)
     __table_args__ = (
         db.UniqueConstraint('filename', 'owner_id', name='uix_filename_owner'),
+        # Listings per database, newest first
+        db.Index('ix_transcription_owner_created', 'owner_id', 'created_at'),
+        db.Index('ix_transcription_created_at', 'created_at'),
+        # Duplicate detection by content
+        db.Index('ix_transcription_hash_size', 'file_hash', 'file_size'),
+        # Transcribed rows of one database (near-duplicate candidates, eviction)
+        db.Index('ix_transcription_owner_status', 'owner_id', 'transcription_status'),
     )
     transcription = db.Column(db.Text, nullable=False)
     created_at = db.Column(db.DateTime, server_default=db.func.now())
@@ -18,12 +27,19 @@ class Transcription(db.Model):
     thumbnail = db.Column(db.String(256), nullable=True)
     transcription_status = db.Column(db.String(32), nullable=False, default='not_transcribed')
     owner_id = db.Column(db.String(128), nullable=True, index=True)  # Azure AD user id or None for global
+    media_state = db.Column(db.String(16), nullable=False, default='original')  # original, speech (original evicted) or missing
+    speech_file = db.Column(db.String(256), nullable=True)  # Compact speech rendition kept after transcription
+    stored_bytes = db.Column(db.Integer, nullable=True)  # Bytes of media currently kept on disk for this row
+    last_accessed_at = db.Column(db.DateTime, nullable=True)
+    summary = db.relationship('TranscriptionSummary', backref='transcription', uselist=False, cascade='all, delete-orphan')
+    segment_index = db.relationship('SegmentIndex', backref='transcription', uselist=False, cascade='all, delete-orphan')
+    fingerprint = db.relationship('AudioFingerprint', backref='transcription', uselist=False, cascade='all, delete-orphan')
 
     def to_dict(self):
         segments_data = []
         if self.segments:
             try:
-                segments_data = json.loads(self.segments)
+                segments_data = transcript_segments.loads(self.segments)
             except (json.JSONDecodeError, TypeError):
                 segments_data = []
         
@@ -37,5 +53,69 @@ class Transcription(db.Model):
             'segments': segments_data,
             'thumbnail': self.thumbnail,
             'transcription_status': self.transcription_status,
-            'owner_id': self.owner_id
+            'owner_id': self.owner_id,
+            'media_state': self.media_state,
+            'fully_retrievable': self.media_state in (None, 'original'),
+            'last_accessed_at': self.last_accessed_at.isoformat() if self.last_accessed_at else None
         }
+
+
+class TranscriptionSummary(db.Model):
+    """Compact digest of a transcript, used to pick relevant meetings without re-reading every transcript."""
+    id = db.Column(db.Integer, primary_key=True)
+    transcription_id = db.Column(db.Integer, db.ForeignKey('transcription.id'), nullable=False, unique=True, index=True)
+    summary = db.Column(db.Text, nullable=False, default='')
+    keywords = db.Column(db.Text, nullable=True)  # JSON list of keywords
+    outline = db.Column(db.Text, nullable=True)  # JSON list of topic headings
+    source_hash = db.Column(db.String(64), nullable=False)  # SHA256 of the transcript text the digest was built from
+    updated_at = db.Column(db.DateTime, server_default=db.func.now(), onupdate=db.func.now())
+
+    def to_dict(self):
+        def load(value):
+            try:
+                return json.loads(value) if value else []
+            except (json.JSONDecodeError, TypeError):
+                return []
+
+        return {
+            'transcription_id': self.transcription_id,
+            'summary': self.summary,
+            'keywords': load(self.keywords),
+            'outline': load(self.outline),
+            'source_hash': self.source_hash,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None
+        }
+
+
+class SegmentIndex(db.Model):
+    """Inverted index over a transcription's segments, used by /files/<id>/find."""
+    id = db.Column(db.Integer, primary_key=True)
+    transcription_id = db.Column(db.Integer, db.ForeignKey('transcription.id'), nullable=False, unique=True, index=True)
+    source_hash = db.Column(db.String(64), nullable=False)  # SHA256 of the segments JSON the index was built from
+    data = db.Column(db.Text, nullable=False)  # JSON: postings, token -> segment map and segment timings
+
+
+class AudioFingerprint(db.Model):
+    """Acoustic fingerprint header for an upload; the hashes live in FingerprintHash."""
+    id = db.Column(db.Integer, primary_key=True)
+    transcription_id = db.Column(db.Integer, db.ForeignKey('transcription.id'), nullable=False, unique=True, index=True)
+    duration = db.Column(db.Float, nullable=True)  # Audio duration in seconds as reported by ffmpeg
+    hash_count = db.Column(db.Integer, nullable=False, default=0)
+
+
+class FingerprintHash(db.Model):
+    """One spectral-peak pair hash of an upload, with the frame offset of its anchor peak."""
+    id = db.Column(db.Integer, primary_key=True)
+    transcription_id = db.Column(db.Integer, db.ForeignKey('transcription.id'), nullable=False, index=True)
+    hash = db.Column(db.Integer, nullable=False, index=True)
+    offset = db.Column(db.Integer, nullable=False)
+
+
+class TranscriptionLease(db.Model):
+    """Cross-process single-flight lease: one worker transcribes a given content, the others wait for its result."""
+    key = db.Column(db.String(160), primary_key=True)  # 'hash:<file_hash>' or 'file:<id>'
+    holder = db.Column(db.String(64), nullable=False)
+    status = db.Column(db.String(16), nullable=False, default='running')  # running, done or failed
+    result = db.Column(db.Text, nullable=True)  # JSON result, or the error message when failed
+    status_code = db.Column(db.Integer, nullable=True)
+    expires_at = db.Column(db.DateTime, nullable=False)
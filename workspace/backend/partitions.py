@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+"""
+Per-owner database partitions.
+
+    python partitions.py list                   partitions with their owner, rows and size
+    python partitions.py migrate [OWNER ...]    move private rows from the main database into partitions
+
+With DB_PARTITIONING=owner, each owner's private data (transcriptions and their
+summaries, segment indexes and fingerprints) lives in a partition of its own
+rather than in the shared tables. On SQLite that is a separate database file
+under DB_PARTITION_FOLDER (default: partitions/ next to the main database); on
+PostgreSQL it is a schema of the same name. The global database and
+transcription_lease stay in the main database.
+
+A partition is picked with the same dbMode / userId logic the queries filter
+by, through a before_request hook here and a wrapper on the async routes in
+asgi.py. The session's get_bind then sends every statement on a partitioned
+table there. The choice is a context variable, so work handed to a thread pool
+through tracing.in_current_context or run_in_threadpool stays in the partition
+of its request. Ids are only unique within a partition, so routes that take a
+file id need dbMode / userId for private files (the frontend sends them).
+
+One tenant's writes then only lock their own file, their listings only read
+their own indexes, and a large tenant can be moved or archived as one file or
+schema. Rows written before partitioning was turned on stay in the main
+database until `migrate` moves them.
+"""
+import argparse
+import contextlib
+import contextvars
+import hashlib
+import os
+import re
+import sys
+import threading
+
+from flask import g, request
+from flask_sqlalchemy.session import Session
+from sqlalchemy import create_engine, delete, func, insert, select, text
+
+DB_PARTITIONING = os.environ.get('DB_PARTITIONING', 'off').lower()
+DB_PARTITION_FOLDER = os.environ.get('DB_PARTITION_FOLDER', '')
+
+PREFIX = 'owner_'
+SHARED_TABLES = {'transcription_lease'}
+# Routes whose handlers default dbMode to private
+PRIVATE_BY_DEFAULT = {'transcribe', 'live_transcribe'}
+
+_partition = contextvars.ContextVar('db_partition', default=None)
+_engines = {}
+_engines_lock = threading.Lock()
+
+
+def enabled():
+    return DB_PARTITIONING == 'owner'
+
+
+def partition_name(owner_id):
+    """A file and schema name for an owner: readable where the id allows, unique through its hash."""
+    slug = re.sub(r'[^a-z0-9]+', '_', owner_id.lower()).strip('_')[:32]
+    digest = hashlib.sha256(owner_id.encode('utf-8')).hexdigest()[:12]
+    return f'{PREFIX}{slug}_{digest}' if slug else f'{PREFIX}{digest}'
+
+
+def owner_for(db_mode, user_id):
+    return user_id if db_mode == 'private' and user_id else None
+
+
+def current():
+    """Name of the partition statements go to in this context, or None for the main database."""
+    return _partition.get()
+
+
+def select_owner(owner_id):
+    """Send this context's statements to owner_id's partition (None: the main database). Returns a token for reset()."""
+    return _partition.set(partition_name(owner_id) if owner_id is not None and enabled() else None)
+
+
+def reset(token):
+    _partition.reset(token)
+
+
+@contextlib.contextmanager
+def bound(owner_id):
+    token = select_owner(owner_id)
+    try:
+        yield
+    finally:
+        reset(token)
+
+
+def partitioned_tables(metadata):
+    return [table for table in metadata.sorted_tables if table.name not in SHARED_TABLES]
+
+
+def _folder(main):
+    return DB_PARTITION_FOLDER or os.path.join(os.path.dirname(os.path.abspath(main.url.database)), 'partitions')
+
+
+def _create(main, name):
+    from models import db
+    if main.dialect.name == 'sqlite':
+        folder = _folder(main)
+        os.makedirs(folder, exist_ok=True)
+        engine = create_engine(f'sqlite:///{os.path.join(folder, name)}.db')
+    else:
+        with main.begin() as conn:
+            conn.execute(text(f'CREATE SCHEMA IF NOT EXISTS "{name}"'))
+        engine = main.execution_options(schema_translate_map={None: name})
+    db.metadata.create_all(engine, tables=partitioned_tables(db.metadata))
+    return engine
+
+
+def partition_engine(main, name):
+    """The engine of partition name, created with its tables on first use."""
+    key = (str(main.url), name)
+    with _engines_lock:
+        if key not in _engines:
+            _engines[key] = _create(main, name)
+        return _engines[key]
+
+
+def engine_for(main, owner_id):
+    return main if owner_id is None or not enabled() else partition_engine(main, partition_name(owner_id))
+
+
+def names(main):
+    """Names of the partitions that exist."""
+    if main.dialect.name == 'sqlite':
+        folder = _folder(main)
+        if not os.path.isdir(folder):
+            return []
+        return sorted(f[:-len('.db')] for f in os.listdir(folder) if f.startswith(PREFIX) and f.endswith('.db'))
+    with main.connect() as conn:
+        rows = conn.execute(text('SELECT schema_name FROM information_schema.schemata WHERE schema_name LIKE :prefix'),
+                            {'prefix': PREFIX + '%'})
+        return sorted(name for name, in rows)
+
+
+def each(main):
+    """Bind the main database, then each partition in turn, for work across all owners. Yields the partition name."""
+    for name in [None] + (names(main) if enabled() else []):
+        token = _partition.set(name)
+        try:
+            yield name
+        finally:
+            _partition.reset(token)
+
+
+class PartitionedSession(Session):
+    """Sends statements on partitioned tables to the partition picked for the current context."""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        engine = super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+        name = _partition.get()
+        if name is None or bind is not None:
+            return engine
+        table = getattr(mapper, 'local_table', None) if mapper is not None else getattr(clause, 'table', None)
+        if getattr(table, 'name', None) in SHARED_TABLES:
+            return engine
+        return partition_engine(engine, name)
+
+
+def request_owner():
+    """The owner whose data a Flask request works on, read like the route handlers read it."""
+    data = request.get_json(silent=True)
+    data = data if isinstance(data, dict) else {}
+    user_id = (request.headers.get('X-MS-CLIENT-PRINCIPAL-ID') or request.args.get('userId')
+               or data.get('userId') or request.form.get('userId'))
+    db_mode = (request.args.get('dbMode') or data.get('dbMode') or request.form.get('dbMode')
+               or ('private' if request.endpoint in PRIVATE_BY_DEFAULT else 'global'))
+    return owner_for(db_mode, user_id)
+
+
+def init_app(app):
+    def select_partition():
+        if enabled():
+            g.partition_token = select_owner(request_owner())
+
+    def reset_partition(exc):
+        token = g.pop('partition_token', None)
+        if token is not None:
+            reset(token)
+
+    app.before_request(select_partition)
+    app.teardown_request(reset_partition)
+
+
+# --- Administration ---
+
+def migrate(main, owner_id):
+    """
+    Move owner_id's rows from the main database into their partition, keeping
+    each id unless the partition already uses it. Returns the number of files moved.
+    """
+    from models import db, Transcription
+    transcription = Transcription.__table__
+    children = [t for t in partitioned_tables(db.metadata) if 'transcription_id' in t.c]
+    target = engine_for(main, owner_id)
+    # The partition commits first: an interrupted run leaves copies behind rather than losing rows
+    with main.begin() as src, target.begin() as dst:
+        rows = src.execute(select(transcription).where(transcription.c.owner_id == owner_id)).mappings().all()
+        taken = set(dst.execute(select(transcription.c.id)).scalars())
+        for row in rows:
+            values = dict(row)
+            if values['id'] in taken:
+                del values['id']
+            new_id = dst.execute(insert(transcription).values(**values)).inserted_primary_key[0]
+            for child in children:
+                child_rows = src.execute(select(child).where(child.c.transcription_id == row['id'])).mappings().all()
+                if child_rows:
+                    dst.execute(insert(child), [{**{k: v for k, v in r.items() if k != 'id'}, 'transcription_id': new_id}
+                                                for r in child_rows])
+                    src.execute(delete(child).where(child.c.transcription_id == row['id']))
+            src.execute(delete(transcription).where(transcription.c.id == row['id']))
+    return len(rows)
+
+
+def unmigrated_owners(main):
+    from models import Transcription
+    column = Transcription.__table__.c.owner_id
+    with main.connect() as conn:
+        return sorted(conn.execute(select(column).where(column != None).distinct()).scalars())
+
+
+def describe(main):
+    """[{name, owner_id, files, bytes}] for each partition."""
+    from models import Transcription
+    table = Transcription.__table__
+    found = []
+    for name in names(main):
+        engine = partition_engine(main, name)
+        with engine.connect() as conn:
+            owner_id = conn.execute(select(table.c.owner_id).limit(1)).scalar()
+            files = conn.execute(select(func.count()).select_from(table)).scalar()
+        size = os.path.getsize(engine.url.database) if engine.dialect.name == 'sqlite' else None
+        found.append({'name': name, 'owner_id': owner_id, 'files': files, 'bytes': size})
+    return found
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Manage per-owner database partitions (DB_PARTITIONING=owner).')
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('list', help='show the partitions')
+    migrate_parser = commands.add_parser('migrate', help='move private rows from the main database into partitions')
+    migrate_parser.add_argument('owners', nargs='*', help='owner ids (default: every owner with rows in the main database)')
+    args = parser.parse_args(argv)
+    if not enabled():
+        parser.error('set DB_PARTITIONING=owner first')
+    from app import app
+    from models import db
+    with app.app_context():
+        main_engine = db.engine
+        if args.command == 'list':
+            for p in describe(main_engine):
+                print(f"{p['name']}  owner={p['owner_id']}  files={p['files']}" + (f"  bytes={p['bytes']}" if p['bytes'] is not None else ''))
+            return 0
+        for owner_id in args.owners or unmigrated_owners(main_engine):
+            moved = migrate(main_engine, owner_id)
+            print(f"[PARTITIONS] Moved {moved} files of {owner_id} to {partition_name(owner_id)}", flush=True)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
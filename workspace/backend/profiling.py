@@ -0,0 +1,197 @@
+"""
+On-demand profiling of Flask requests.
+
+A request is profiled when it carries X-Profile-Token equal to PROFILE_ADMIN_TOKEN,
+or at random with probability PROFILE_SAMPLE_RATE. Both are off by default, and
+then the only cost per request is one header lookup.
+
+A profiled request writes, under PROFILE_DIR (at most PROFILE_MAX_FILES profiles,
+oldest removed first):
+
+  <id>.pstats   cProfile output, for `python -m pstats` or snakeviz
+  <id>.folded   sampled call stacks in collapsed format, for flamegraph.pl or speedscope
+  <id>.json     route, status and duration
+
+The response carries X-Profile-Id. GET /admin/profiles lists the stored profiles and
+GET /admin/profiles/<id>.<pstats|folded|json> downloads one; both need the admin token.
+"""
+import cProfile
+import datetime
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+
+from flask import Blueprint, g, jsonify, request, send_from_directory
+
+PROFILE_ADMIN_TOKEN = os.environ.get('PROFILE_ADMIN_TOKEN')
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+PROFILE_DIR = os.environ.get('PROFILE_DIR', os.path.join(os.path.dirname(__file__), 'profiles'))
+PROFILE_MAX_FILES = int(os.environ.get('PROFILE_MAX_FILES', 50))
+# Seconds between stack samples for the .folded output
+PROFILE_SAMPLE_INTERVAL = float(os.environ.get('PROFILE_SAMPLE_INTERVAL', 0.005))
+
+TOKEN_HEADER = 'X-Profile-Token'
+KINDS = ('pstats', 'folded', 'json')
+PROFILE_ID_RE = re.compile(r'^[0-9]{8}T[0-9]{12}-[0-9a-f]{8}$')
+
+bp = Blueprint('profiling', __name__)
+
+# Since Python 3.12 only one cProfile can be active per interpreter; overlapping requests are not profiled
+_profiler_lock = threading.Lock()
+
+
+class StackSampler(threading.Thread):
+    """Samples the call stack of one thread at a fixed interval and counts collapsed stacks."""
+
+    def __init__(self, thread_id, interval):
+        super().__init__(daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            names = []
+            while frame is not None:
+                code = frame.f_code
+                names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            self.stacks[';'.join(reversed(names))] += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+    def folded(self):
+        return ''.join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+def is_admin(req):
+    return bool(PROFILE_ADMIN_TOKEN) and req.headers.get(TOKEN_HEADER) == PROFILE_ADMIN_TOKEN
+
+
+def should_profile(req):
+    if PROFILE_SAMPLE_RATE and random.random() < PROFILE_SAMPLE_RATE:
+        return True
+    return is_admin(req)
+
+
+def start_profile():
+    if request.blueprint == bp.name or not should_profile(request):
+        return
+    if not _profiler_lock.acquire(blocking=False):
+        return
+    sampler = StackSampler(threading.get_ident(), PROFILE_SAMPLE_INTERVAL)
+    profiler = cProfile.Profile()
+    sampler.start()
+    g.profile = (profiler, sampler, time.perf_counter())
+    profiler.enable()
+
+
+def finish_profile(response):
+    active = g.pop('profile', None)
+    if active is None:
+        return response
+    profiler, sampler, started = active
+    stop(profiler, sampler)
+    duration_ms = (time.perf_counter() - started) * 1000
+    profile_id = f"{datetime.datetime.utcnow().strftime('%Y%m%dT%H%M%S%f')}-{uuid.uuid4().hex[:8]}"
+    try:
+        save_profile(profile_id, profiler, sampler, {
+            'id': profile_id,
+            'method': request.method,
+            'path': request.path,
+            'endpoint': request.endpoint,
+            'status': response.status_code,
+            'duration_ms': round(duration_ms, 1),
+            'created_at': time.time(),
+        })
+        response.headers['X-Profile-Id'] = profile_id
+    except OSError as e:
+        print(f"[PROFILE] Could not save profile: {e}")
+    return response
+
+
+def stop(profiler, sampler):
+    profiler.disable()
+    sampler.stop()
+    _profiler_lock.release()
+
+
+def abandon_profile(exc):
+    # after_request does not run when the request failed before producing a response
+    active = g.pop('profile', None)
+    if active is not None:
+        stop(active[0], active[1])
+
+
+def save_profile(profile_id, profiler, sampler, meta):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    profiler.dump_stats(os.path.join(PROFILE_DIR, f'{profile_id}.pstats'))
+    with open(os.path.join(PROFILE_DIR, f'{profile_id}.folded'), 'w') as f:
+        f.write(sampler.folded())
+    with open(os.path.join(PROFILE_DIR, f'{profile_id}.json'), 'w') as f:
+        json.dump(meta, f)
+    prune()
+
+
+def stored_ids():
+    if not os.path.isdir(PROFILE_DIR):
+        return []
+    # Ids start with a UTC timestamp, so sorting them sorts by age
+    return sorted({name.rsplit('.', 1)[0] for name in os.listdir(PROFILE_DIR) if PROFILE_ID_RE.match(name.rsplit('.', 1)[0])})
+
+
+def prune():
+    ids = stored_ids()
+    for profile_id in ids[:max(0, len(ids) - PROFILE_MAX_FILES)]:
+        for kind in KINDS:
+            path = os.path.join(PROFILE_DIR, f'{profile_id}.{kind}')
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def load_meta(profile_id):
+    try:
+        with open(os.path.join(PROFILE_DIR, f'{profile_id}.json')) as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return {'id': profile_id}
+
+
+@bp.before_request
+def require_admin():
+    if not is_admin(request):
+        return jsonify({'error': 'Not found'}), 404
+
+
+@bp.route('/admin/profiles', methods=['GET'])
+def list_profiles():
+    return jsonify({'profiles': [load_meta(profile_id) for profile_id in reversed(stored_ids())]})
+
+
+@bp.route('/admin/profiles/<profile_id>.<kind>', methods=['GET'])
+def download_profile(profile_id, kind):
+    if kind not in KINDS or not PROFILE_ID_RE.match(profile_id):
+        return jsonify({'error': 'Not found'}), 404
+    if not os.path.exists(os.path.join(PROFILE_DIR, f'{profile_id}.{kind}')):
+        return jsonify({'error': 'Not found'}), 404
+    return send_from_directory(PROFILE_DIR, f'{profile_id}.{kind}', as_attachment=True)
+
+
+def init_app(app):
+    """Register the hooks first so a profile covers the other before_request hooks too."""
+    app.before_request(start_profile)
+    app.after_request(finish_profile)
+    app.teardown_request(abandon_profile)
+    app.register_blueprint(bp)
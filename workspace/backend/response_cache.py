@@ -0,0 +1,299 @@
+"""
+Cache for the JSON responses of GET /files and GET /search.
+
+Entries are keyed by (route, owner scope, query parameters, data version). Every
+owner scope ('owner:<id>', 'global', and 'all' for unscoped listings) has its own
+version number. It is bumped after a commit that adds, changes or deletes a
+Transcription row in that scope, which makes the older entries unreachable, so
+invalidation is exact and writes in one user's database leave the others cached.
+ORM bulk updates and deletes of Transcription rows bump every scope.
+
+Tiers:
+  local    in-process LRU bounded by RESPONSE_CACHE_MAX_BYTES; single responses
+           above RESPONSE_CACHE_MAX_ENTRY_BYTES are not cached
+  shared   RESPONSE_CACHE_SHARED=redis://host:6379/0 (needs the redis package)
+           keeps versions and entries in Redis, so several app processes share
+           them and see each other's writes
+
+The local tier also keeps the gzip/brotli encoding of an entry once a client has
+asked for it (see compression.py), so hits are not compressed again.
+
+Entries also expire after RESPONSE_CACHE_TTL seconds, which bounds staleness after
+writes from outside the app process (e.g. bulk_import.py without a shared tier).
+Responses carry X-Cache: HIT or MISS; GET /cache/stats reports the counters.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from flask import Blueprint, Response, jsonify, request
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+import compression
+from models import Transcription
+
+RESPONSE_CACHE_ENABLED = os.environ.get('RESPONSE_CACHE_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+RESPONSE_CACHE_MAX_BYTES = int(os.environ.get('RESPONSE_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+RESPONSE_CACHE_MAX_ENTRY_BYTES = int(os.environ.get('RESPONSE_CACHE_MAX_ENTRY_BYTES', 8 * 1024 * 1024))
+RESPONSE_CACHE_TTL = int(os.environ.get('RESPONSE_CACHE_TTL', 300))
+RESPONSE_CACHE_SHARED = os.environ.get('RESPONSE_CACHE_SHARED', '')
+
+ALL_SCOPES = 'all'
+EPOCH = 'epoch'  # Bumped by bulk statements, whose rows are not known
+
+bp = Blueprint('response_cache', __name__)
+
+
+def scope_for(db_mode, user_id):
+    """The owner scope a listing filtered like list_files / search_transcriptions reads from."""
+    if db_mode == 'private' and user_id:
+        return f'owner:{user_id}'
+    if db_mode == 'global':
+        return 'global'
+    return ALL_SCOPES
+
+
+def owner_scope(owner_id):
+    return 'global' if owner_id is None else f'owner:{owner_id}'
+
+
+class LocalTier:
+    """LRU of encoded responses, bounded by their total size in bytes."""
+
+    def __init__(self, max_bytes, max_entry_bytes, ttl):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self.ttl = ttl
+        self.bytes = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            body, expires = entry
+            if expires < time.monotonic():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return body
+
+    def set(self, key, body):
+        if len(body) > self.max_entry_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (body, time.monotonic() + self.ttl)
+            self.bytes += len(body)
+            while self.bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _remove(self, key):
+        body, _ = self._entries.pop(key)
+        self.bytes -= len(body)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class MemoryVersions:
+    def __init__(self):
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    def get(self, scope):
+        with self._lock:
+            return self._versions.get(EPOCH, 0), self._versions.get(scope, 0)
+
+    def bump(self, scopes):
+        with self._lock:
+            for scope in scopes:
+                self._versions[scope] = self._versions.get(scope, 0) + 1
+
+
+class RedisTier:
+    """Versions and entries shared by all app processes."""
+
+    def __init__(self, url, ttl):
+        import redis
+        self._redis = redis.Redis.from_url(url)
+        self.ttl = ttl
+
+    def get(self, key):
+        return self._redis.get(f'respcache:entry:{key}')
+
+    def set(self, key, body):
+        self._redis.set(f'respcache:entry:{key}', body, ex=self.ttl)
+
+    def versions(self, scope):
+        epoch, version = self._redis.mget(f'respcache:version:{EPOCH}', f'respcache:version:{scope}')
+        return int(epoch or 0), int(version or 0)
+
+    def bump(self, scopes):
+        pipe = self._redis.pipeline()
+        for scope in scopes:
+            pipe.incr(f'respcache:version:{scope}')
+        pipe.execute()
+
+
+class ResponseCache:
+    def __init__(self, local, shared=None):
+        self.local = local
+        self.shared = shared
+        self.memory_versions = MemoryVersions()
+        self.counts = {'hits': 0, 'shared_hits': 0, 'misses': 0, 'uncacheable': 0}
+        self._lock = threading.Lock()
+
+    def _count(self, name):
+        with self._lock:
+            self.counts[name] += 1
+
+    def versions(self, scope):
+        return self.shared.versions(scope) if self.shared else self.memory_versions.get(scope)
+
+    def bump(self, scopes):
+        # Every write also changes the unscoped listing
+        scopes = set(scopes) | {ALL_SCOPES}
+        if self.shared:
+            self.shared.bump(scopes)
+        else:
+            self.memory_versions.bump(scopes)
+
+    def key(self, route, scope, params):
+        # The version is read before the response is built: a write committed meanwhile
+        # bumps it, so a response built from older data is never stored under the newer key
+        epoch, version = self.versions(scope)
+        raw = json.dumps([route, scope, params, epoch, version], sort_keys=True, default=str)
+        return hashlib.sha256(raw.encode()).hexdigest()
+
+    def lookup(self, key):
+        body = self.local.get(key)
+        if body is not None:
+            self._count('hits')
+            return body
+        if self.shared:
+            body = self.shared.get(key)
+            if body is not None:
+                self._count('shared_hits')
+                self.local.set(key, body)
+                return body
+        self._count('misses')
+        return None
+
+    def store(self, key, body):
+        if len(body) > self.local.max_entry_bytes:
+            self._count('uncacheable')
+            return
+        self.local.set(key, body)
+        if self.shared:
+            self.shared.set(key, body)
+
+    def stats(self):
+        with self._lock:
+            counts = dict(self.counts)
+        lookups = counts['hits'] + counts['shared_hits'] + counts['misses']
+        counts.update({
+            'hit_ratio': round((counts['hits'] + counts['shared_hits']) / lookups, 3) if lookups else None,
+            'entries': len(self.local),
+            'bytes': self.local.bytes,
+            'max_bytes': self.local.max_bytes,
+            'evictions': self.local.evictions,
+            'shared': bool(self.shared),
+        })
+        return counts
+
+
+def _create_cache():
+    shared = RedisTier(RESPONSE_CACHE_SHARED, RESPONSE_CACHE_TTL) if RESPONSE_CACHE_SHARED.startswith('redis') else None
+    return ResponseCache(LocalTier(RESPONSE_CACHE_MAX_BYTES, RESPONSE_CACHE_MAX_ENTRY_BYTES, RESPONSE_CACHE_TTL), shared)
+
+
+_cache = _create_cache()
+
+
+def set_cache(cache):
+    global _cache
+    _cache = cache
+
+
+def respond(route, scope, params, build):
+    """A JSON response for build() (which returns a JSON-able dict), served from the cache when possible."""
+    if not RESPONSE_CACHE_ENABLED:
+        return jsonify(build())
+    key = _cache.key(route, scope, params)
+    body = _cache.lookup(key)
+    state = 'HIT'
+    if body is None:
+        state = 'MISS'
+        body = json.dumps(build(), separators=(',', ':')).encode()
+        _cache.store(key, body)
+    response = Response(body, mimetype='application/json')
+    response.headers['X-Cache'] = state
+    encoding = compression.negotiate(request) if len(body) >= compression.COMPRESSION_MIN_BYTES else None
+    if encoding:
+        encoded = _cache.local.get(f'{key}:{encoding}')
+        if encoded is None:
+            encoded = compression.compress(body, encoding)
+            _cache.local.set(f'{key}:{encoding}', encoded)
+        compression.encoded(response, encoded, encoding)
+    return response
+
+
+# --- Invalidation ---
+
+def _pending(session):
+    return session.info.setdefault('response_cache_scopes', set())
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_changed_scopes(session, flush_context):
+    changed = [obj for obj in list(session.new) + list(session.dirty) + list(session.deleted) if isinstance(obj, Transcription)]
+    if not changed:
+        return
+    pending = _pending(session)
+    for t in changed:
+        pending.add(owner_scope(t.owner_id))
+        # A row moved to another owner changes both listings
+        pending.update(owner_scope(owner_id) for owner_id in inspect(t).attrs.owner_id.history.deleted or ())
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def _collect_bulk_statements(orm_execute_state):
+    if not (orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete):
+        return
+    table = getattr(orm_execute_state.statement, 'table', None)
+    if table is None or table.name != Transcription.__tablename__:
+        return
+    pending = _pending(orm_execute_state.session)
+    params = orm_execute_state.parameters
+    if orm_execute_state.is_insert and params:
+        rows = params if isinstance(params, list) else [params]
+        pending.update(owner_scope(row.get('owner_id')) for row in rows)
+    else:
+        pending.add(EPOCH)
+
+
+@event.listens_for(Session, 'after_commit')
+def _bump_versions(session):
+    scopes = session.info.pop('response_cache_scopes', None)
+    if scopes:
+        _cache.bump(scopes)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_scopes(session):
+    session.info.pop('response_cache_scopes', None)
+
+
+@bp.route('/cache/stats', methods=['GET'])
+def cache_stats():
+    return jsonify(_cache.stats())
@@ -0,0 +1,182 @@
+"""
+Per-file inverted index over transcript segments for in-transcript search.
+
+The index is (re)built whenever a Transcription's segments are written, from a
+before_flush hook, so every code path that saves a transcription keeps it current.
+It stores, for each normalised token, the list of token positions it occurs at,
+plus the segment each position belongs to and the segment start/end times, so a
+search never needs to parse the full segments JSON.
+
+Query syntax for /files/<id>/find?q=:
+  budget            every occurrence of the word
+  budg*             every word starting with "budg"
+  next quarter      the phrase "next quarter" (quotes are optional)
+  "next quart*"     a phrase whose last word is a prefix
+"""
+import bisect
+import hashlib
+import json
+import re
+import threading
+from collections import OrderedDict
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+from models import Transcription, SegmentIndex
+import transcript_segments
+
+TOKEN_RE = re.compile(r"\w+(?:'\w+)*")
+INDEX_VERSION = 1
+# Parsed indexes kept in memory, keyed by (transcription_id, source_hash)
+CACHE_SIZE = 64
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def tokenize(text):
+    return TOKEN_RE.findall((text or '').lower())
+
+
+def segments_hash(segments_json):
+    return hashlib.sha256((segments_json or '').encode('utf-8')).hexdigest()
+
+
+def build_index(segments):
+    """Build the index payload for a list of {'text', 'start', 'end'} segments."""
+    postings = {}
+    token_segments = []
+    starts = []
+    ends = []
+    for seg_idx, seg in enumerate(segments):
+        starts.append(seg.get('start', 0))
+        ends.append(seg.get('end', 0))
+        for token in tokenize(seg.get('text', '')):
+            postings.setdefault(token, []).append(len(token_segments))
+            token_segments.append(seg_idx)
+    return {
+        'version': INDEX_VERSION,
+        'postings': postings,
+        'token_segments': token_segments,
+        'starts': starts,
+        'ends': ends,
+    }
+
+
+def index_transcription(t):
+    """Attach a freshly built SegmentIndex to a Transcription (does not commit)."""
+    try:
+        segments = transcript_segments.loads(t.segments) if t.segments else []
+    except (json.JSONDecodeError, TypeError):
+        segments = []
+    data = json.dumps(build_index(segments), separators=(',', ':'))
+    source_hash = segments_hash(t.segments)
+    if t.segment_index is None:
+        t.segment_index = SegmentIndex(source_hash=source_hash, data=data)
+    else:
+        t.segment_index.source_hash = source_hash
+        t.segment_index.data = data
+    return t.segment_index
+
+
+@event.listens_for(Session, 'before_flush')
+def _reindex_changed_segments(session, flush_context, instances):
+    for obj in list(session.new) + list(session.dirty):
+        if not isinstance(obj, Transcription):
+            continue
+        if obj in session.new:
+            changed = bool(obj.segments)
+        else:
+            changed = inspect(obj).attrs.segments.history.has_changes()
+        if changed:
+            index_transcription(obj)
+
+
+class LoadedIndex:
+    def __init__(self, data):
+        self.postings = data['postings']
+        self.vocabulary = sorted(self.postings)
+        self.token_segments = data['token_segments']
+        self.starts = data['starts']
+        self.ends = data['ends']
+
+    def positions(self, term, prefix=False):
+        """{position: matched word} for an exact term or a prefix."""
+        if not prefix:
+            return {p: term for p in self.postings.get(term, [])}
+        found = {}
+        i = bisect.bisect_left(self.vocabulary, term)
+        while i < len(self.vocabulary) and self.vocabulary[i].startswith(term):
+            word = self.vocabulary[i]
+            for p in self.postings[word]:
+                found[p] = word
+            i += 1
+        return found
+
+    def find(self, terms):
+        """Match a phrase given as [(term, is_prefix), ...]; returns matches in transcript order."""
+        if not terms:
+            return []
+        candidates = [self.positions(term, prefix) for term, prefix in terms]
+        matches = []
+        for start_pos in sorted(candidates[0]):
+            words = [candidates[0][start_pos]]
+            for offset, positions in enumerate(candidates[1:], start=1):
+                word = positions.get(start_pos + offset)
+                if word is None:
+                    break
+                words.append(word)
+            else:
+                first_seg = self.token_segments[start_pos]
+                last_seg = self.token_segments[start_pos + len(terms) - 1]
+                matches.append({
+                    'segment_start': first_seg,
+                    'segment_end': last_seg,
+                    'start': self.starts[first_seg],
+                    'end': self.ends[last_seg],
+                    'words': words,
+                })
+        return matches
+
+
+def parse_query(query):
+    """Turn a query string into [(term, is_prefix), ...]."""
+    terms = []
+    for piece in query.replace('"', ' ').split():
+        tokens = tokenize(piece)
+        if not tokens:
+            continue
+        terms.extend((token, False) for token in tokens[:-1])
+        terms.append((tokens[-1], piece.endswith('*')))
+    return terms
+
+
+def load_index(session, file_id):
+    """
+    Return a LoadedIndex for a transcription. The index is kept current by the
+    before_flush hook; rows saved before it existed, or whose segments were written
+    with Core statements (bulk_import, partitions.migrate), are indexed on first search.
+    """
+    segments, source_hash = (
+        session.query(Transcription.segments, SegmentIndex.source_hash)
+        .outerjoin(SegmentIndex, SegmentIndex.transcription_id == Transcription.id)
+        .filter(Transcription.id == file_id)
+        .one()
+    )
+    if source_hash != segments_hash(segments):
+        row = index_transcription(session.get(Transcription, file_id))
+        session.commit()
+        source_hash = row.source_hash
+    key = (file_id, source_hash)
+    with _cache_lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            return _cache[key]
+    data = session.query(SegmentIndex.data).filter_by(transcription_id=file_id).scalar()
+    loaded = LoadedIndex(json.loads(data))
+    with _cache_lock:
+        _cache[key] = loaded
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+    return loaded
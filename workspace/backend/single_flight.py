@@ -0,0 +1,227 @@
+"""
+Single-flight transcription: concurrent requests for the same content share one run.
+
+Two tabs submitting the same file, two users uploading the same recording, or a
+double-click on "transcribe" would otherwise each run ffmpeg and pay for Whisper.
+Work is keyed by content ('hash:<file_hash>', or 'file:<id>' for rows without a
+hash). The first caller runs it and the others wait and get the same result, or
+the same error:
+
+  - callers in one process wait on the running flight directly (threads, or
+    tasks of the asyncio event loop for asgi.py)
+  - across processes, the runner holds a row in transcription_lease. Others poll
+    it until it holds a result (kept for SINGLE_FLIGHT_RESULT_SECONDS), and take
+    over if it expires because its holder died (SINGLE_FLIGHT_LEASE_SECONDS).
+
+Results must be JSON-serialisable. Errors of the given error_type (constructed as
+error_type(message, status_code)) are shared too; other errors release the lease
+so a waiting caller retries the work itself.
+
+The lease rows are written on their own connection, so callers must not hold a
+SQLite write transaction on the session while they wait.
+"""
+import asyncio
+import datetime
+import json
+import os
+import threading
+import time
+import uuid
+
+from sqlalchemy import delete, insert, select, update
+from sqlalchemy.exc import IntegrityError
+
+import partitions
+import tracing
+from models import TranscriptionLease
+
+SINGLE_FLIGHT_LEASE_SECONDS = int(os.environ.get('SINGLE_FLIGHT_LEASE_SECONDS', 900))
+SINGLE_FLIGHT_RESULT_SECONDS = int(os.environ.get('SINGLE_FLIGHT_RESULT_SECONDS', 60))
+SINGLE_FLIGHT_POLL_SECONDS = float(os.environ.get('SINGLE_FLIGHT_POLL_SECONDS', 0.5))
+
+lease_table = TranscriptionLease.__table__
+
+ACQUIRED, BUSY, DONE, FAILED = 'acquired', 'busy', 'done', 'failed'
+
+
+def content_key(file_hash, file_id=None):
+    if file_hash:
+        return f'hash:{file_hash}'
+    # Ids are per partition; the same content may be shared across them
+    partition = partitions.current()
+    return f'file:{partition}:{file_id}' if partition else f'file:{file_id}'
+
+
+def _now():
+    return datetime.datetime.utcnow()
+
+
+# --- DB lease ---
+
+def try_acquire(engine, key, holder, waited=False):
+    """
+    (state, row): ACQUIRED, BUSY, or DONE / FAILED with the finished lease row.
+    A failure is only handed to callers that were waiting for it; a later caller retries.
+    """
+    now = _now()
+    try:
+        with engine.begin() as conn:
+            conn.execute(insert(lease_table).values(
+                key=key, holder=holder, status='running',
+                expires_at=now + datetime.timedelta(seconds=SINGLE_FLIGHT_LEASE_SECONDS)))
+        return ACQUIRED, None
+    except IntegrityError:
+        pass
+    with engine.begin() as conn:
+        row = conn.execute(select(lease_table).where(lease_table.c.key == key)).first()
+        if row is None:
+            return BUSY, None  # Finished and cleaned up in between; the next poll inserts
+        if row.expires_at > now and (waited or row.status != 'failed'):
+            if row.status == 'done':
+                return DONE, row
+            if row.status == 'failed':
+                return FAILED, row
+            return BUSY, None
+        # Expired (a finished result that is too old, or a holder that died) or an old
+        # failure: take it over, unless someone else did first.
+        taken = conn.execute(
+            update(lease_table)
+            .where(lease_table.c.key == key, lease_table.c.holder == row.holder, lease_table.c.expires_at == row.expires_at)
+            .values(holder=holder, status='running', result=None, status_code=None,
+                    expires_at=now + datetime.timedelta(seconds=SINGLE_FLIGHT_LEASE_SECONDS)))
+        return (ACQUIRED, None) if taken.rowcount == 1 else (BUSY, None)
+
+
+def finish(engine, key, holder, status, result, status_code=None):
+    """Publish the outcome for waiting processes and drop results nobody needs any more."""
+    now = _now()
+    with engine.begin() as conn:
+        conn.execute(
+            update(lease_table)
+            .where(lease_table.c.key == key, lease_table.c.holder == holder)
+            .values(status=status, result=result, status_code=status_code,
+                    expires_at=now + datetime.timedelta(seconds=SINGLE_FLIGHT_RESULT_SECONDS)))
+        conn.execute(delete(lease_table).where(lease_table.c.status != 'running', lease_table.c.expires_at < now))
+
+
+def release(engine, key, holder):
+    with engine.begin() as conn:
+        conn.execute(delete(lease_table).where(lease_table.c.key == key, lease_table.c.holder == holder))
+
+
+def _outcome(state, row, error_type):
+    if state == DONE:
+        return json.loads(row.result)
+    raise error_type(row.result, row.status_code)
+
+
+def _publish(engine, key, holder, error, result, error_type):
+    if error is None:
+        finish(engine, key, holder, 'done', json.dumps(result))
+    elif isinstance(error, error_type):
+        finish(engine, key, holder, 'failed', str(error.args[0]) if error.args else '', getattr(error, 'status_code', None))
+    else:
+        release(engine, key, holder)
+
+
+# --- In-process flights ---
+
+class Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+_flights = {}
+_flights_lock = threading.Lock()
+
+
+def run(engine, key, work, error_type):
+    """Run work() once for all concurrent callers with this key, in any process, and return its result."""
+    with _flights_lock:
+        flight = _flights.get(key)
+        leader = flight is None
+        if leader:
+            flight = _flights[key] = Flight()
+    if not leader:
+        with tracing.span('single_flight.wait', **{'single_flight.key': key}):
+            flight.done.wait()
+        if flight.error is not None:
+            raise flight.error
+        return flight.result
+    try:
+        flight.result = _run_leased(engine, key, work, error_type)
+        return flight.result
+    except BaseException as e:
+        flight.error = e
+        raise
+    finally:
+        with _flights_lock:
+            del _flights[key]
+        flight.done.set()
+
+
+def _run_leased(engine, key, work, error_type):
+    holder = f'{os.getpid()}-{uuid.uuid4().hex[:8]}'
+    waited = False
+    while True:
+        state, row = try_acquire(engine, key, holder, waited)
+        if state == ACQUIRED:
+            break
+        if state != BUSY:
+            return _outcome(state, row, error_type)
+        time.sleep(SINGLE_FLIGHT_POLL_SECONDS)
+        waited = True
+    try:
+        result = work()
+    except BaseException as e:
+        _publish(engine, key, holder, e, None, error_type)
+        raise
+    _publish(engine, key, holder, None, result, error_type)
+    return result
+
+
+# --- asyncio flights (asgi.py) ---
+
+_async_flights = {}
+
+
+async def run_async(engine, key, work, error_type):
+    """run() for coroutines: work is an async callable, lease queries run in a thread."""
+    flight = _async_flights.get(key)
+    if flight is not None:
+        return await asyncio.shield(flight)
+    flight = asyncio.get_running_loop().create_future()
+    # Mark the error as retrieved when no other caller was waiting for it
+    flight.add_done_callback(lambda f: f.cancelled() or f.exception())
+    _async_flights[key] = flight
+    try:
+        result = await _run_leased_async(engine, key, work, error_type)
+        flight.set_result(result)
+        return result
+    except BaseException as e:
+        flight.set_exception(e)
+        raise
+    finally:
+        del _async_flights[key]
+
+
+async def _run_leased_async(engine, key, work, error_type):
+    holder = f'{os.getpid()}-{uuid.uuid4().hex[:8]}'
+    waited = False
+    while True:
+        state, row = await asyncio.to_thread(try_acquire, engine, key, holder, waited)
+        if state == ACQUIRED:
+            break
+        if state != BUSY:
+            return _outcome(state, row, error_type)
+        await asyncio.sleep(SINGLE_FLIGHT_POLL_SECONDS)
+        waited = True
+    try:
+        result = await work()
+    except BaseException as e:
+        await asyncio.to_thread(_publish, engine, key, holder, e, None, error_type)
+        raise
+    await asyncio.to_thread(_publish, engine, key, holder, None, result, error_type)
+    return result
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""
+Serving the React build from static/.
+
+    python static_assets.py [folder]     write .gz (and .br, with brotli) next to each asset
+
+The folder is read once at startup into a manifest of its files: content type,
+an ETag from the content hash, and the encoded variants on offer. Variants are
+the .br / .gz files written next to an asset at build time (the Dockerfile runs
+this module's CLI), else gzip/brotli bodies compressed in memory at startup for
+compressible files of at least COMPRESSION_MIN_BYTES. A request gets the best
+variant its Accept-Encoding allows, without compressing anything per request.
+
+Assets whose names carry a content hash (main.3f2a1b4c.js, logo.6ce24c58023cc2f8.svg)
+never change under the same URL and are sent with
+Cache-Control: public, max-age=31536000, immutable. index.html and the other
+unhashed files are sent with Cache-Control: no-cache and an ETag, so browsers
+revalidate them and get a 304 while the build is unchanged. Paths not in the
+manifest fall back to index.html for client-side routing. Files added to static/
+after startup are not seen until the next start.
+"""
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+import sys
+
+from flask import Response, current_app, request, send_file
+from werkzeug.exceptions import NotFound
+
+from compression import COMPRESSIBLE_TYPES, COMPRESSION_MIN_BYTES, _brotli
+
+STATIC_FOLDER = os.environ.get('STATIC_FOLDER') or os.path.join(os.path.dirname(__file__), 'static')
+STATIC_COMPRESS_AT_STARTUP = os.environ.get('STATIC_COMPRESS_AT_STARTUP', 'true').lower() in ('1', 'true', 'yes')
+
+IMMUTABLE = 'public, max-age=31536000, immutable'
+REVALIDATE = 'no-cache'
+# Create React App puts an 8+ hex digit content hash before the extension(s)
+FINGERPRINT = re.compile(r'\.[0-9a-f]{8,}\.')
+VARIANT_SUFFIXES = {'br': '.br', 'gzip': '.gz'}
+ENCODING_PREFERENCE = ('br', 'gzip')
+EXTRA_TYPES = {'.map': 'application/json', '.webmanifest': 'application/manifest+json'}
+
+
+def is_fingerprinted(name):
+    return FINGERPRINT.search(os.path.basename(name)) is not None
+
+
+def guess_type(name):
+    ext = os.path.splitext(name)[1].lower()
+    return EXTRA_TYPES.get(ext) or mimetypes.guess_type(name)[0] or 'application/octet-stream'
+
+
+def is_compressible(mimetype):
+    return mimetype.startswith('text/') or mimetype in COMPRESSIBLE_TYPES or mimetype.endswith('+json')
+
+
+def encode(data, encoding):
+    """Compress at the highest level; this runs once per asset, not per request."""
+    if encoding == 'br':
+        return _brotli().compress(data, quality=11)
+    return gzip.compress(data, compresslevel=9, mtime=0)
+
+
+def available_encodings():
+    return [e for e in ENCODING_PREFERENCE if e != 'br' or _brotli() is not None]
+
+
+class Asset:
+    def __init__(self, path, mimetype, etag, immutable):
+        self.path = path
+        self.mimetype = mimetype
+        self.etag = etag
+        self.immutable = immutable
+        self.variants = {}  # encoding -> path of a precompressed file, or the compressed bytes
+
+
+def load_asset(path, name, compress):
+    with open(path, 'rb') as f:
+        data = f.read()
+    mimetype = guess_type(name)
+    asset = Asset(path, mimetype, hashlib.sha256(data).hexdigest()[:32], is_fingerprinted(name))
+    if not is_compressible(mimetype):
+        return asset
+    for encoding, suffix in VARIANT_SUFFIXES.items():
+        if os.path.isfile(path + suffix):
+            asset.variants[encoding] = path + suffix
+        elif compress and len(data) >= COMPRESSION_MIN_BYTES and encoding in available_encodings():
+            body = encode(data, encoding)
+            if len(body) < len(data):
+                asset.variants[encoding] = body
+    return asset
+
+
+def build_manifest(folder=STATIC_FOLDER, compress=STATIC_COMPRESS_AT_STARTUP):
+    """{URL path relative to folder: Asset} for the files under folder (empty if it does not exist)."""
+    manifest = {}
+    for root, _, files in os.walk(folder):
+        for filename in files:
+            path = os.path.join(root, filename)
+            name = os.path.relpath(path, folder).replace(os.sep, '/')
+            if any(name.endswith(suffix) for suffix in VARIANT_SUFFIXES.values()) \
+                    and os.path.isfile(path.rsplit('.', 1)[0]):
+                continue
+            manifest[name] = load_asset(path, name, compress)
+    return manifest
+
+
+def init_app(app, manifest=None):
+    app.extensions['static_manifest'] = build_manifest() if manifest is None else manifest
+
+
+def lookup(path):
+    """The Asset for a request path, or None."""
+    manifest = current_app.extensions['static_manifest']
+    asset = manifest.get(path)
+    if asset is None and path.startswith('static/'):
+        # The Dockerfile flattens build/static/ into static/, while index.html still links /static/js/...
+        asset = manifest.get(path[len('static/'):])
+    return asset
+
+
+def negotiate(asset):
+    if not asset.variants:
+        return None
+    accepted = request.accept_encodings
+    for encoding in ENCODING_PREFERENCE:
+        if encoding in asset.variants and accepted[encoding]:
+            return encoding
+    return None
+
+
+def respond(asset):
+    encoding = negotiate(asset)
+    body = asset.variants[encoding] if encoding else asset.path
+    if isinstance(body, bytes):
+        response = Response(body, mimetype=asset.mimetype)
+    else:
+        response = send_file(body, mimetype=asset.mimetype, conditional=False, etag=False, max_age=None)
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    if asset.variants:
+        response.vary.add('Accept-Encoding')
+    # Each encoding is a different byte sequence, so it gets its own strong ETag
+    response.set_etag(f'{asset.etag}-{encoding}' if encoding else asset.etag)
+    response.headers['Cache-Control'] = IMMUTABLE if asset.immutable else REVALIDATE
+    return response.make_conditional(request)
+
+
+def serve(path):
+    """The asset at path, else index.html for client-side routes."""
+    asset = lookup(path) if path else None
+    if asset is None:
+        asset = lookup('index.html')
+        if asset is None:
+            raise NotFound()
+    return respond(asset)
+
+
+def precompress(folder=STATIC_FOLDER):
+    """Write .gz (and .br) variants next to the compressible assets in folder. Returns how many were written."""
+    written = 0
+    for name, asset in build_manifest(folder, compress=False).items():
+        if not is_compressible(asset.mimetype) or os.path.getsize(asset.path) < COMPRESSION_MIN_BYTES:
+            continue
+        with open(asset.path, 'rb') as f:
+            data = f.read()
+        for encoding in available_encodings():
+            body = encode(data, encoding)
+            if len(body) < len(data):
+                with open(asset.path + VARIANT_SUFFIXES[encoding], 'wb') as f:
+                    f.write(body)
+                written += 1
+    return written
+
+
+if __name__ == '__main__':
+    folder = sys.argv[1] if len(sys.argv) > 1 else STATIC_FOLDER
+    print(f'[STATIC] Wrote {precompress(folder)} precompressed variants in {folder}')
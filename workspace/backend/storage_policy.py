@@ -0,0 +1,215 @@
+"""
+Storage tiering for uploaded media.
+
+Policies (STORAGE_POLICY):
+  keep         keep every original upload (default)
+  speech       after transcription also keep a compact speech rendition (mono 16 kHz Opus);
+               the original is only evicted when a quota needs the space
+  speech-only  make the rendition and evict the original straight away
+
+Quotas in bytes (0 = unlimited): STORAGE_QUOTA_BYTES for all media and
+STORAGE_OWNER_QUOTA_BYTES per owner (the global database counts as one owner).
+When a quota is exceeded, media of the least recently accessed transcribed files
+is evicted: first originals that already have a speech rendition, then whatever
+media is left. Transcripts and segments are always kept. With per-owner
+partitions, usage for STORAGE_QUOTA_BYTES is summed over all partitions, while
+eviction happens in the partition of the upload that went over the quota.
+"""
+import os
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+import blob_storage
+import partitions
+import tracing
+from models import db, Transcription
+
+STORAGE_POLICY = os.environ.get('STORAGE_POLICY', 'keep')
+STORAGE_QUOTA_BYTES = int(os.environ.get('STORAGE_QUOTA_BYTES', 0))
+STORAGE_OWNER_QUOTA_BYTES = int(os.environ.get('STORAGE_OWNER_QUOTA_BYTES', 0))
+SPEECH_BITRATE = os.environ.get('STORAGE_SPEECH_BITRATE', '24k')
+
+ALL_OWNERS = object()
+
+_executor = ThreadPoolExecutor(max_workers=int(os.environ.get('STORAGE_WORKERS', 2)))
+
+# Bytes a row currently keeps on disk; rows from before tiering only have file_size
+_used_bytes = db.func.coalesce(Transcription.stored_bytes, Transcription.file_size, 0)
+_last_used = db.func.coalesce(Transcription.last_accessed_at, Transcription.created_at)
+
+
+def remove_media(t):
+    """Delete everything kept for a row: original upload, speech rendition and thumbnail."""
+    blob_storage.delete('uploads', t.filename)
+    blob_storage.delete('speech', t.speech_file)
+    blob_storage.delete('thumbnails', t.thumbnail)
+
+
+def media_blob(t):
+    """Best available media for a row as (area, name, download_name), or (None, None, None) if nothing is left."""
+    if t.media_state in (None, 'original') and blob_storage.exists('uploads', t.filename):
+        return 'uploads', t.filename, t.filename
+    if t.speech_file and blob_storage.exists('speech', t.speech_file):
+        return 'speech', t.speech_file, os.path.splitext(t.filename)[0] + '.ogg'
+    return None, None, None
+
+
+def touch(t):
+    t.last_accessed_at = db.func.now()
+
+
+def scoped(query, owner_id):
+    if owner_id is ALL_OWNERS:
+        return query
+    if owner_id is None:
+        return query.filter(Transcription.owner_id == None)
+    return query.filter(Transcription.owner_id == owner_id)
+
+
+def _total(query, owner_id):
+    if owner_id is ALL_OWNERS:
+        # With per-owner partitions (partitions.py) all owners' rows are spread over several databases
+        return sum(query.scalar() or 0 for _ in partitions.each(db.engine))
+    return scoped(query, owner_id).scalar() or 0
+
+
+def usage(owner_id=ALL_OWNERS):
+    query = db.session.query(db.func.sum(_used_bytes)).filter(Transcription.media_state != 'missing')
+    return _total(query, owner_id)
+
+
+def _quota_scopes(owner_id):
+    scopes = []
+    if STORAGE_OWNER_QUOTA_BYTES:
+        scopes.append((STORAGE_OWNER_QUOTA_BYTES, owner_id))
+    if STORAGE_QUOTA_BYTES:
+        scopes.append((STORAGE_QUOTA_BYTES, ALL_OWNERS))
+    return scopes
+
+
+def _eviction_candidates(owner_id, originals_only):
+    query = Transcription.query.filter(Transcription.transcription_status == 'transcribed')
+    if originals_only:
+        query = query.filter(Transcription.media_state == 'original', Transcription.speech_file != None)
+    else:
+        query = query.filter(Transcription.media_state != 'missing')
+    return scoped(query, owner_id).order_by(_last_used.asc(), Transcription.id.asc())
+
+
+def evictable_bytes(owner_id):
+    query = db.session.query(db.func.sum(_used_bytes)).filter(
+        Transcription.transcription_status == 'transcribed', Transcription.media_state != 'missing'
+    )
+    return _total(query, owner_id)
+
+
+def check_quota(owner_id, incoming_bytes):
+    """Error message if storing incoming_bytes more would exceed a quota even after eviction, else None."""
+    for quota, scope in _quota_scopes(owner_id):
+        if usage(scope) - evictable_bytes(scope) + incoming_bytes > quota:
+            return 'Storage quota exceeded.' if scope is ALL_OWNERS else 'Storage quota for this database exceeded.'
+    return None
+
+
+def evict_original(t):
+    """Drop the original upload and keep only the speech rendition. Returns bytes freed."""
+    kept = blob_storage.size('speech', t.speech_file) if t.speech_file else 0
+    freed = (t.stored_bytes if t.stored_bytes is not None else t.file_size or 0) - kept
+    blob_storage.delete('uploads', t.filename)
+    t.media_state = 'speech'
+    t.stored_bytes = kept
+    return freed
+
+
+def evict_all(t):
+    """Drop all media for a row; the transcript stays. Returns bytes freed."""
+    freed = t.stored_bytes if t.stored_bytes is not None else t.file_size or 0
+    blob_storage.delete('uploads', t.filename)
+    blob_storage.delete('speech', t.speech_file)
+    t.media_state = 'missing'
+    t.speech_file = None
+    t.stored_bytes = 0
+    return freed
+
+
+def enforce_quotas(owner_id, keep_id=None):
+    """Evict least recently accessed media until usage is back under every quota that applies to owner_id."""
+    evicted = []
+    for quota, scope in _quota_scopes(owner_id):
+        over = usage(scope) - quota
+        for originals_only, evict in ((True, evict_original), (False, evict_all)):
+            if over <= 0:
+                break
+            for t in _eviction_candidates(scope, originals_only):
+                if t.id == keep_id:
+                    continue
+                over -= evict(t)
+                evicted.append(t.id)
+                if over <= 0:
+                    break
+        db.session.commit()
+    if evicted:
+        print(f"[STORAGE] Evicted media for files {evicted}")
+    return evicted
+
+
+def speech_rendition_command(src, dst):
+    return ['ffmpeg', '-y', '-i', src, '-vn', '-ac', '1', '-ar', '16000', '-c:a', 'libopus', '-b:a', SPEECH_BITRATE, dst]
+
+
+def make_speech_rendition(file_id):
+    """Encode the compact speech rendition for a transcribed file and apply the storage policy."""
+    t = db.session.get(Transcription, file_id)
+    if not t or t.media_state != 'original' or t.speech_file:
+        return
+    if not blob_storage.exists('uploads', t.filename):
+        return
+    filename = t.filename
+    speech_file = f"{t.id}_{os.path.splitext(filename)[0]}.ogg"
+    if partitions.current():
+        # Ids repeat across partitions, the shared speech area must not
+        speech_file = f"{partitions.current()}_{speech_file}"
+    db.session.commit()
+    with blob_storage.local_path('uploads', filename) as src, blob_storage.staged('speech', speech_file) as dst:
+        result = subprocess.run(speech_rendition_command(src, dst), stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        if result.returncode != 0 and os.path.exists(dst):
+            os.remove(dst)
+        speech_bytes = os.path.getsize(dst) if os.path.exists(dst) else 0
+    if result.returncode != 0:
+        print(f"[STORAGE] Failed to create speech rendition for file {file_id}")
+        return
+    t = db.session.get(Transcription, file_id)
+    if not t:
+        blob_storage.delete('speech', speech_file)
+        return
+    t.speech_file = speech_file
+    t.stored_bytes = (t.stored_bytes if t.stored_bytes is not None else t.file_size or 0) + speech_bytes
+    if STORAGE_POLICY == 'speech-only':
+        evict_original(t)
+    db.session.commit()
+    enforce_quotas(t.owner_id)
+
+
+def _rendition_in_background(app, file_id):
+    with app.app_context(), tracing.span('storage.rendition', **{'file.id': file_id}):
+        try:
+            make_speech_rendition(file_id)
+        except Exception as e:
+            db.session.rollback()
+            print(f"[STORAGE] Error while tiering file {file_id}: {e}")
+
+
+def schedule_rendition(app, file_id):
+    """Queue the speech rendition for a freshly transcribed file (no-op with the keep policy)."""
+    if STORAGE_POLICY in ('speech', 'speech-only'):
+        _executor.submit(tracing.in_current_context(_rendition_in_background), app, file_id)
+
+
+def report(owner_id):
+    return {
+        'policy': STORAGE_POLICY,
+        'usage_bytes': usage(owner_id),
+        'quota_bytes': STORAGE_OWNER_QUOTA_BYTES or None,
+        'global_usage_bytes': usage(),
+        'global_quota_bytes': STORAGE_QUOTA_BYTES or None,
+    }
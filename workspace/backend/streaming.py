@@ -0,0 +1,62 @@
+"""
+Streamed JSON for listings that can be large.
+
+GET /files and GET /search normally build the whole response in memory. With
+?stream=ndjson (or Accept: application/x-ndjson) every row is sent as one JSON
+line; with ?stream=json the usual {"files": [...]} / {"results": [...]} document is
+sent in chunks. Either way rows are read from the database cursor
+STREAM_BATCH_ROWS at a time and serialised as they arrive, so server memory stays
+flat however many rows match. Streamed responses bypass the response cache.
+"""
+import json
+import os
+
+from flask import Response, request, stream_with_context
+
+STREAM_BATCH_ROWS = int(os.environ.get('STREAM_BATCH_ROWS', 200))
+
+NDJSON = 'application/x-ndjson'
+
+
+def stream_mode():
+    """'ndjson', 'json' or None for the current request."""
+    mode = request.args.get('stream', '').lower()
+    if mode == 'ndjson' or (not mode and request.accept_mimetypes.best == NDJSON):
+        return 'ndjson'
+    if mode in ('json', '1', 'true'):
+        return 'json'
+    return None
+
+
+def _dumps(value):
+    return json.dumps(value, separators=(',', ':'))
+
+
+def _rows(query, serialize):
+    for row in query.yield_per(STREAM_BATCH_ROWS):
+        yield serialize(row)
+
+
+def respond(mode, field, query, serialize, extra=None):
+    """
+    Stream serialize(row) for every row of query: as NDJSON lines, or as the
+    document {field: [...], **extra} for mode 'json'.
+    """
+    def ndjson():
+        for item in _rows(query, serialize):
+            yield _dumps(item) + '\n'
+
+    def document():
+        yield '{' + _dumps(field) + ':['
+        first = True
+        for item in _rows(query, serialize):
+            yield ('' if first else ',') + _dumps(item)
+            first = False
+        yield ']'
+        for key, value in (extra or {}).items():
+            yield ',' + _dumps(key) + ':' + _dumps(value)
+        yield '}'
+
+    if mode == 'ndjson':
+        return Response(stream_with_context(ndjson()), mimetype=NDJSON)
+    return Response(stream_with_context(document()), mimetype='application/json')
@@ -0,0 +1,238 @@
+"""
+Per-transcript summaries, keywords and topic outlines, and map-reduce answering over them.
+
+With SUMMARIES_ENABLED=true a digest is generated in the background after a file is
+transcribed; otherwise POST /files/<id>/summary builds one on demand. Digests are
+stored in TranscriptionSummary with the hash of the transcript they were built from,
+so a stale one is regenerated whenever the transcript changes.
+
+/ask-database with mode "map-reduce" sends the digests (not the transcripts) to GPT in
+parallel batches, asks which meetings are relevant, and only expands the selected
+meetings into the final prompt.
+"""
+import asyncio
+import hashlib
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import tracing
+from models import db, Transcription, TranscriptionSummary
+from azure_openai import ASK_DATABASE_SYSTEM_PROMPT, chat_completion, gpt_configured
+
+SUMMARIES_ENABLED = os.environ.get('SUMMARIES_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+SUMMARY_CHUNK_CHARS = int(os.environ.get('SUMMARY_CHUNK_CHARS', 12000))
+SUMMARY_WORKERS = int(os.environ.get('SUMMARY_WORKERS', 4))
+MAP_REDUCE_BATCH_SIZE = int(os.environ.get('MAP_REDUCE_BATCH_SIZE', 8))
+MAP_REDUCE_MAX_WORKERS = int(os.environ.get('MAP_REDUCE_MAX_WORKERS', 8))
+MAP_REDUCE_MAX_EXPAND = int(os.environ.get('MAP_REDUCE_MAX_EXPAND', 5))
+# Used in place of a digest for transcripts that have not been summarised yet
+FALLBACK_EXCERPT_CHARS = 1500
+
+SUMMARY_SYSTEM_PROMPT = "You summarise meeting transcripts. Reply only with JSON."
+CHUNK_SYSTEM_PROMPT = "You summarise part of a meeting transcript in a short paragraph, keeping names, decisions and numbers."
+RELEVANCE_SYSTEM_PROMPT = "You decide which meetings are relevant to a question. Reply only with a JSON array of meeting ids."
+
+_executor = ThreadPoolExecutor(max_workers=SUMMARY_WORKERS)
+
+
+def summaries_enabled():
+    return SUMMARIES_ENABLED and gpt_configured()
+
+
+def transcript_hash(text):
+    return hashlib.sha256((text or '').encode('utf-8')).hexdigest()
+
+
+def _parse_json(text, opening, closing):
+    """Pull the first JSON object/array out of a model reply (which may be wrapped in prose or fences)."""
+    start, end = text.find(opening), text.rfind(closing)
+    if start == -1 or end <= start:
+        return None
+    try:
+        return json.loads(text[start:end + 1])
+    except json.JSONDecodeError:
+        return None
+
+
+def summary_prompt(text):
+    return (
+        "Summarise the meeting transcript below. Reply with a JSON object with keys "
+        "\"summary\" (at most 5 sentences), \"keywords\" (up to 15 short keywords or names) "
+        "and \"outline\" (ordered list of the topics discussed, one short heading each).\n\n"
+        f"Transcript:\n{text}"
+    )
+
+
+def generate_digest(text, complete=chat_completion):
+    """Return {'summary', 'keywords', 'outline'} for a transcript, summarising long ones chunk by chunk."""
+    if len(text) > SUMMARY_CHUNK_CHARS:
+        chunks = [text[i:i + SUMMARY_CHUNK_CHARS] for i in range(0, len(text), SUMMARY_CHUNK_CHARS)]
+        with ThreadPoolExecutor(max_workers=MAP_REDUCE_MAX_WORKERS) as pool:
+            partials = list(pool.map(lambda chunk: complete(CHUNK_SYSTEM_PROMPT, chunk), chunks))
+        text = '\n\n'.join(partials)
+    answer = complete(SUMMARY_SYSTEM_PROMPT, summary_prompt(text))
+    data = _parse_json(answer, '{', '}')
+    if not isinstance(data, dict):
+        # Keep the plain reply rather than losing the call
+        return {'summary': answer.strip(), 'keywords': [], 'outline': []}
+    return {
+        'summary': str(data.get('summary', '')).strip(),
+        'keywords': [str(k) for k in data.get('keywords') or []],
+        'outline': [str(o) for o in data.get('outline') or []],
+    }
+
+
+def is_stale(t):
+    return t.summary is None or t.summary.source_hash != transcript_hash(t.transcription)
+
+
+def refresh_summary(file_id, force=False):
+    """(Re)generate the digest for one transcription if missing or stale. Returns the summary dict or None."""
+    t = db.session.get(Transcription, file_id)
+    if not t or not t.transcription:
+        return None
+    if not force and not is_stale(t):
+        return t.summary.to_dict()
+    source_hash = transcript_hash(t.transcription)
+    text = t.transcription
+    # Do not hold the session open across the GPT calls
+    db.session.commit()
+    digest = generate_digest(text)
+    t = db.session.get(Transcription, file_id)
+    if not t:
+        return None
+    summary = t.summary or TranscriptionSummary(transcription_id=t.id)
+    summary.summary = digest['summary']
+    summary.keywords = json.dumps(digest['keywords'])
+    summary.outline = json.dumps(digest['outline'])
+    summary.source_hash = source_hash
+    t.summary = summary
+    db.session.commit()
+    return summary.to_dict()
+
+
+def _refresh_in_background(app, file_id):
+    with app.app_context(), tracing.span('summary.generate', **{'file.id': file_id}):
+        try:
+            refresh_summary(file_id)
+        except Exception as e:
+            db.session.rollback()
+            print(f"[SUMMARY] Failed to summarise file {file_id}: {e}")
+
+
+def schedule_summary(app, file_id):
+    """Queue digest generation for a freshly transcribed file (no-op when summaries are disabled)."""
+    if summaries_enabled():
+        _executor.submit(tracing.in_current_context(_refresh_in_background), app, file_id)
+
+
+# --- Map-reduce answering ---
+
+def digest_records(trans_query):
+    """[{'id', 'filename', 'created_at', 'digest'}] for the transcribed rows of trans_query."""
+    rows = (
+        trans_query
+        .outerjoin(TranscriptionSummary, TranscriptionSummary.transcription_id == Transcription.id)
+        .filter(Transcription.transcription != '')
+        .with_entities(
+            Transcription.id, Transcription.filename, Transcription.created_at,
+            TranscriptionSummary.summary, TranscriptionSummary.keywords, TranscriptionSummary.outline,
+            db.func.substr(Transcription.transcription, 1, FALLBACK_EXCERPT_CHARS)
+        )
+        .all()
+    )
+    records = []
+    for file_id, filename, created_at, summary, keywords, outline, excerpt in rows:
+        if summary is not None:
+            digest = f"Summary: {summary}\nKeywords: {', '.join(json.loads(keywords or '[]'))}\nTopics: {'; '.join(json.loads(outline or '[]'))}"
+        else:
+            digest = f"Excerpt: {excerpt}"
+        records.append({
+            'id': file_id,
+            'filename': filename,
+            'created_at': created_at.isoformat() if created_at else None,
+            'digest': digest,
+        })
+    return records
+
+
+def relevance_prompt(question, batch):
+    meetings = '\n\n'.join(f"[id={r['id']}] {r['filename']}\n{r['digest']}" for r in batch)
+    return (
+        f"Question: {question}\n\nMeetings:\n{meetings}\n\n"
+        "Reply with a JSON array of the ids of the meetings needed to answer the question, e.g. [3, 7]. "
+        "Reply [] if none are relevant."
+    )
+
+
+def parse_relevant_ids(answer, batch):
+    ids = _parse_json(answer, '[', ']')
+    allowed = {r['id'] for r in batch}
+    if not isinstance(ids, list):
+        return set()
+    selected = set()
+    for value in ids:
+        try:
+            value = int(value)
+        except (TypeError, ValueError):
+            continue
+        if value in allowed:
+            selected.add(value)
+    return selected
+
+
+def batches(records, size=None):
+    size = size or MAP_REDUCE_BATCH_SIZE
+    return [records[i:i + size] for i in range(0, len(records), size)]
+
+
+def pick_selected(records, selected_ids):
+    """Selected records in their original order, capped at MAP_REDUCE_MAX_EXPAND."""
+    return [r for r in records if r['id'] in selected_ids][:MAP_REDUCE_MAX_EXPAND]
+
+
+def reduce_prompt(question, records, transcripts):
+    """Final prompt: full transcripts of the selected meetings, or every digest if none was selected."""
+    if transcripts:
+        body = '\n\n'.join(f"--- {r['filename']} ---\n{transcripts[r['id']]}" for r in records)
+    else:
+        body = '\n\n'.join(f"--- {r['filename']} ---\n{r['digest']}" for r in records)
+    return f"Database of transcripts:\n{body}\n\nQuestion: {question}\nAnswer:"
+
+
+def load_transcripts(ids):
+    rows = db.session.query(Transcription.id, Transcription.transcription).filter(Transcription.id.in_(ids)).all()
+    return dict(rows)
+
+
+async def gather_limited(aws, limit):
+    """asyncio.gather over the awaitables aws, running at most limit of them at a time."""
+    slots = asyncio.Semaphore(max(1, limit))
+
+    async def one(aw):
+        async with slots:
+            return await aw
+    return await asyncio.gather(*(one(aw) for aw in aws))
+
+
+async def answer_map_reduce(question, records, complete, load):
+    """
+    Answer a question over the digest_records of a set of transcriptions by selecting
+    meetings from their digests first. complete(system_prompt, prompt) and load(ids)
+    (-> {id: transcript}, e.g. load_transcripts) are coroutines.
+    """
+    groups = batches(records)
+    answers = await gather_limited(
+        (complete(RELEVANCE_SYSTEM_PROMPT, relevance_prompt(question, batch)) for batch in groups), MAP_REDUCE_MAX_WORKERS)
+    selected_ids = set()
+    for batch, answer in zip(groups, answers):
+        selected_ids |= parse_relevant_ids(answer, batch)
+    selected = pick_selected(records, selected_ids)
+    if selected:
+        transcripts = await load([r['id'] for r in selected])
+        prompt = reduce_prompt(question, selected, transcripts)
+    else:
+        prompt = reduce_prompt(question, records, {})
+    sources = [{'id': r['id'], 'filename': r['filename'], 'created_at': r['created_at']} for r in (selected or records)]
+    return await complete(ASK_DATABASE_SYSTEM_PROMPT, prompt), sources
@@ -0,0 +1,123 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import pytest
+import uuid
+import asyncio
+from sqlalchemy import delete
+from starlette.testclient import TestClient
+from app import app, db, FlaskIO
+from asgi import application, AsyncIO
+from models import Transcription
+import admission
+
+@pytest.fixture
+def client():
+    app.config['TESTING'] = True
+    with app.test_client() as client:
+        yield client
+
+@pytest.fixture
+def tight_limits(monkeypatch):
+    monkeypatch.setattr(admission, 'LIMITS', {
+        'transcribe': admission.Limit(per_minute=6, burst=3, concurrency=1),
+        'gpt': admission.Limit(per_minute=60, burst=2, concurrency=0),
+    })
+    monkeypatch.setattr(admission, '_backend', admission.MemoryBackend())
+
+def test_token_bucket_refills_over_time(monkeypatch):
+    backend = admission.MemoryBackend()
+    now = [1000.0]
+    monkeypatch.setattr(admission.time, 'monotonic', lambda: now[0])
+    assert backend.take('k', rate=1.0, burst=2, cost=2) == 0
+    assert backend.take('k', rate=1.0, burst=2, cost=1) == pytest.approx(1.0)
+    now[0] += 1.5
+    assert backend.take('k', rate=1.0, burst=2, cost=1) == 0
+    assert backend.take('k', rate=1.0, burst=2, cost=1) == pytest.approx(0.5)
+
+def test_refilled_buckets_are_forgotten(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(admission.time, 'monotonic', lambda: now[0])
+    backend = admission.MemoryBackend()
+    for i in range(100):
+        backend.take(f'user:{i}', rate=1.0, burst=5, cost=1)
+    backend.take('user:busy', rate=1.0, burst=500, cost=500)
+    now[0] += admission.PRUNE_SECONDS
+    backend.take('user:new', rate=1.0, burst=5, cost=1)
+    assert sorted(backend._buckets) == ['user:busy', 'user:new']
+    assert backend.take('user:busy', rate=1.0, burst=500, cost=1) == 0
+
+def test_concurrency_cap_releases_slots(tight_limits):
+    ticket, rejection = admission.admit('transcribe', 'user:a')
+    assert rejection is None
+    _, rejection = admission.admit('transcribe', 'user:a')
+    assert rejection.status == 429 and rejection.retry_after == admission.BUSY_RETRY_AFTER
+    # Other users are not affected
+    other, rejection = admission.admit('transcribe', 'user:b')
+    assert rejection is None
+    other.release()
+    ticket.release()
+    ticket, rejection = admission.admit('transcribe', 'user:a')
+    assert rejection is None
+    ticket.release()
+
+def test_rate_limited_route_returns_429_with_retry_after(client, tight_limits):
+    user_id = f'test-admission-{uuid.uuid4()}'
+    for _ in range(2):
+        rv = client.post('/ask', json={'question': 'q', 'userId': user_id})
+        assert rv.status_code == 400  # Admitted, then rejected for the missing transcript
+    rv = client.post('/ask', json={'question': 'q', 'userId': user_id})
+    assert rv.status_code == 429
+    assert int(rv.headers['Retry-After']) >= 1
+    assert rv.get_json()['retry_after'] >= 1
+    # The header identity takes precedence and has its own bucket
+    rv = client.post('/ask', json={'question': 'q'}, headers={'X-MS-CLIENT-PRINCIPAL-ID': f'{user_id}-other'})
+    assert rv.status_code == 400
+
+@pytest.fixture
+def batch_owner(monkeypatch):
+    """200 private files whose uploads are missing, so an admitted file fails fast with a 404."""
+    user_id = f'test-admission-{uuid.uuid4()}'
+    monkeypatch.setattr(FlaskIO, 'exists', lambda self, area, name: asyncio.sleep(0, False))
+    monkeypatch.setattr(AsyncIO, 'exists', lambda self, area, name: asyncio.sleep(0, False))
+    with app.app_context():
+        rows = [Transcription(filename=f'batch_{i}.mp3', transcription='', owner_id=user_id) for i in range(200)]
+        db.session.add_all(rows)
+        db.session.commit()
+        ids = [t.id for t in rows]
+    yield user_id, ids
+    with app.app_context():
+        db.session.execute(delete(Transcription).where(Transcription.owner_id == user_id))
+        db.session.commit()
+
+@pytest.mark.parametrize('serving', ['flask', 'asgi'])
+def test_a_batch_is_admitted_per_file(client, tight_limits, batch_owner, serving):
+    user_id, ids = batch_owner
+    body = {'file_ids': ids, 'userId': user_id, 'dbMode': 'private'}
+    if serving == 'flask':
+        rv = client.post('/files/batch-transcribe', json=body)
+    else:
+        with TestClient(application) as async_client:
+            rv = async_client.post('/files/batch-transcribe', json=body)
+    assert rv.status_code == 200
+    results = rv.get_json()['results'] if serving == 'flask' else rv.json()['results']
+    # Only the burst of 3 files was run; the other 197 were throttled instead of running unmetered
+    assert [r['status'] for r in results[:3]] == [404, 404, 404]
+    throttled = results[3:]
+    assert len(throttled) == 197
+    assert all(r['status'] == 429 and r['retry_after'] >= 1 for r in throttled)
+    # The batch used up the bucket for single requests too
+    assert client.post(f'/files/{ids[0]}/transcribe', json={'userId': user_id}).status_code == 429
+
+def test_unlimited_routes_are_not_admitted(client, tight_limits):
+    for _ in range(5):
+        assert client.get('/health').status_code == 200
+
+def test_async_routes_share_the_limits(tight_limits):
+    user_id = f'test-admission-{uuid.uuid4()}'
+    with TestClient(application) as async_client:
+        for _ in range(2):
+            assert async_client.post('/ask', json={'question': 'q', 'userId': user_id}).status_code == 400
+        rv = async_client.post('/ask', json={'question': 'q', 'userId': user_id})
+        assert rv.status_code == 429
+        assert 'retry-after' in rv.headers
@@ -5,6 +5,8 @@ import pytest
 from app import app, db
 from models import Transcription
 import tempfile
+import json
+from sqlalchemy import update
 
 @pytest.fixture
 def client():
@@ -127,3 +129,59 @@ def test_batch_transcribe_invalid_data(client):
     
     rv = client.post('/files/batch-transcribe', json={'file_ids': 'not_an_array'})
     assert rv.status_code == 400
+
+# Test in-transcript search over the segment index
+def test_find_in_transcript(client):
+    segments = [
+        {'text': ' Next', 'start': 0.0, 'end': 0.4},
+        {'text': ' quarter', 'start': 0.4, 'end': 0.9},
+        {'text': ' budget.', 'start': 0.9, 'end': 1.5},
+        {'text': ' Budgets', 'start': 5.0, 'end': 5.6},
+        {'text': ' next', 'start': 6.0, 'end': 6.3},
+        {'text': ' quarterly', 'start': 6.3, 'end': 7.0},
+    ]
+    with app.app_context():
+        t = Transcription(filename='find_test.mp3', transcription='Next quarter budget. Budgets next quarterly',
+                          segments=json.dumps(segments), transcription_status='transcribed', owner_id='test-find')
+        db.session.add(t)
+        db.session.commit()
+        file_id = t.id
+    def find(q):
+        return client.get(f'/files/{file_id}/find', query_string={'q': q, 'dbMode': 'private', 'userId': 'test-find'})
+    try:
+        rv = find('budget')
+        assert rv.status_code == 200
+        assert [(m['segment_start'], m['start']) for m in rv.get_json()['matches']] == [(2, 0.9)]
+
+        rv = find('budg*')
+        assert [m['words'] for m in rv.get_json()['matches']] == [['budget'], ['budgets']]
+
+        rv = find('"next quarter"')
+        match, = rv.get_json()['matches']
+        assert (match['segment_start'], match['segment_end'], match['start'], match['end']) == (0, 1, 0.0, 0.9)
+
+        rv = find('next quart*')
+        assert rv.get_json()['total'] == 2
+
+        assert find('').status_code == 400
+
+        # Another user's private file, or asking for it from the global database, is refused
+        assert client.get(f'/files/{file_id}/find', query_string={'q': 'budget', 'dbMode': 'private', 'userId': 'someone-else'}).status_code == 403
+        assert client.get(f'/files/{file_id}/find?q=budget').status_code == 403
+
+        # Segments written without the ORM (as bulk_import does) are reindexed on the next search
+        with app.app_context():
+            db.session.execute(update(Transcription).where(Transcription.id == file_id)
+                               .values(segments=json.dumps([{'text': ' Forecast', 'start': 9.0, 'end': 9.5}])))
+            db.session.commit()
+        rv = find('forecast')
+        assert [m['start'] for m in rv.get_json()['matches']] == [9.0]
+        assert find('budget').get_json()['total'] == 0
+    finally:
+        with app.app_context():
+            db.session.delete(db.session.get(Transcription, file_id))
+            db.session.commit()
+
+def test_find_in_transcript_not_found(client):
+    rv = client.get('/files/999999/find?q=budget')
+    assert rv.status_code == 404
@@ -0,0 +1,99 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import pytest
+import io
+import uuid
+from starlette.testclient import TestClient
+from app import app, db, build_word_segments
+from models import Transcription
+from asgi import application
+import asgi
+import blob_storage
+import fingerprint
+
+@pytest.fixture
+def client():
+    with TestClient(application) as client:
+        yield client
+
+# Routes not served natively are passed through to Flask
+def test_flask_routes_pass_through(client):
+    rv = client.get('/health')
+    assert rv.status_code == 200
+    assert rv.json()['status'] == 'ok'
+    rv = client.get('/files')
+    assert rv.status_code == 200
+    assert isinstance(rv.json()['files'], list)
+
+def test_transcribe_no_file(client):
+    rv = client.post('/transcribe', data={})
+    assert rv.status_code == 400
+    assert rv.json()['error'] == 'No file part'
+
+def test_transcribe_unsupported_type(client):
+    rv = client.post('/transcribe', files={'file': ('notes.txt', io.BytesIO(b'text'))})
+    assert rv.status_code == 400
+    assert 'not supported' in rv.json()['error']
+
+def test_transcribe_by_id_not_found(client):
+    rv = client.post('/files/9999/transcribe')
+    assert rv.status_code == 404
+
+def test_batch_transcribe_invalid_data(client):
+    rv = client.post('/files/batch-transcribe', json={})
+    assert rv.status_code == 400
+    rv = client.post('/files/batch-transcribe', json={'file_ids': 'not_an_array'})
+    assert rv.status_code == 400
+
+def test_batch_transcribe_missing_file(client):
+    rv = client.post('/files/batch-transcribe', json={'file_ids': [999999]})
+    assert rv.status_code == 200
+    data = rv.json()
+    assert data['transcribed_count'] == 0
+    assert data['errors'] == ['File 999999 not found']
+
+def test_ask_no_data(client):
+    rv = client.post('/ask', json={})
+    assert rv.status_code == 400
+
+def test_ask_batch_invalid_data(client):
+    assert client.post('/ask/batch', json={'transcript': 'x'}).status_code == 400
+    assert client.post('/ask/batch', json={'questions': ['What was decided?']}).status_code == 400
+
+def test_ask_database_no_question(client):
+    rv = client.post('/ask-database', json={})
+    assert rv.status_code == 400
+
+def test_build_word_segments_estimates_chunks():
+    data = {'text': 'one two three four', 'segments': [{'text': 'one two three four', 'start': 0.0, 'end': 4.0}]}
+    transcription, segments = build_word_segments(data)
+    assert transcription == 'one two three four'
+    assert segments == [
+        {'text': 'one two three', 'start': 0.0, 'end': 3.0},
+        {'text': 'four', 'start': 3.0, 'end': 4.0},
+    ]
+
+def test_transcribe_stores_a_new_upload(client, tmp_path, monkeypatch):
+    folders = {area: str(tmp_path / area) for area in blob_storage.AREA_FOLDERS}
+    for folder in folders.values():
+        os.makedirs(folder)
+    monkeypatch.setitem(app.extensions, 'blob_store', blob_storage.LocalBlobStore(folders))
+    monkeypatch.setattr(fingerprint, 'FINGERPRINT_ENABLED', False)
+    segments = [{'text': 'hello there', 'start': 0.0, 'end': 1.0}]
+    async def transcribe_shared(*args):
+        return 'hello there', segments
+    async def make_thumbnail(*args):
+        return None
+    monkeypatch.setattr(asgi, 'transcribe_shared', transcribe_shared)
+    monkeypatch.setattr(asgi, 'make_thumbnail', make_thumbnail)
+    owner = f'test-asgi-{uuid.uuid4()}'
+    rv = client.post('/transcribe', files={'file': ('standup.mp4', io.BytesIO(uuid.uuid4().bytes))},
+                     data={'dbMode': 'private', 'userId': owner})
+    assert rv.status_code == 200
+    assert rv.json() == {'transcription': 'hello there', 'segments': segments}
+    with app.app_context():
+        t = Transcription.query.filter_by(owner_id=owner).one()
+        assert t.transcription_status == 'transcribed'
+        db.session.delete(t)
+        db.session.commit()
@@ -0,0 +1,111 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import asyncio
+import json
+import time
+import pytest
+import requests
+import azure_openai
+from azure_openai import Deployment, Router
+
+class Response:
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.ok = status_code < 400
+        self.headers = headers or {}
+        self.text = f'status {status_code}'
+
+def router(*deployments):
+    return Router([Deployment(**d) for d in deployments])
+
+def test_a_throttled_deployment_fails_over_and_cools_down():
+    r = router({'name': 'a', 'endpoint': 'https://a', 'weight': 1000}, {'name': 'b', 'endpoint': 'https://b'})
+    calls = []
+    def send(d):
+        calls.append(d.name)
+        return Response(429, {'Retry-After': '30'}) if d.name == 'a' else Response(200)
+    assert r.request(send).status_code == 200
+    assert calls == ['a', 'b']
+    a, b = r.deployments
+    assert a.cooldown_until > time.monotonic() + 25 and a.throttled == 1
+    # While a cools down, b is tried first
+    calls.clear()
+    r.request(send)
+    assert calls == ['b']
+
+def test_connection_errors_fail_over_and_the_last_one_is_raised():
+    r = router({'name': 'a', 'endpoint': 'https://a'}, {'name': 'b', 'endpoint': 'https://b'})
+    def send(d):
+        raise requests.ConnectionError(d.name)
+    with pytest.raises(requests.ConnectionError):
+        r.request(send)
+    assert [d.errors for d in r.deployments] == [1, 1]
+
+def test_client_errors_are_returned_without_failover():
+    r = router({'name': 'a', 'endpoint': 'https://a'}, {'name': 'b', 'endpoint': 'https://b'})
+    calls = []
+    assert r.request(lambda d: calls.append(d) or Response(400)).status_code == 400
+    assert len(calls) == 1
+
+def test_large_or_long_requests_skip_deployments_they_do_not_fit():
+    r = router({'name': 'short', 'endpoint': 'https://s', 'weight': 1000, 'max_seconds': 120, 'max_bytes': 5_000_000},
+               {'name': 'long', 'endpoint': 'https://l'})
+    assert [d.name for d in r.plan(size=1_000_000, duration=60)][0] == 'short'
+    assert [d.name for d in r.plan(size=1_000_000, duration=3600)] == ['long']
+    assert [d.name for d in r.plan(size=20_000_000)] == ['long']
+
+def test_weights_latency_and_capacity_shape_the_choice():
+    r = router({'name': 'a', 'endpoint': 'https://a', 'weight': 3}, {'name': 'b', 'endpoint': 'https://b'})
+    picks = [r.plan()[0].name for _ in range(4000)]
+    assert 0.7 < picks.count('a') / len(picks) < 0.8
+    # b answers ten times faster per MB, which outweighs a's weight
+    a, b = r.deployments
+    a.latency, b.latency = 1.0, 0.1
+    picks = [r.plan()[0].name for _ in range(1000)]
+    assert picks.count('b') > picks.count('a')
+    # A full deployment is only tried after the others
+    b.capacity, b.in_flight = 2, 2
+    assert [d.name for d in r.plan()] == ['a', 'b']
+
+def test_async_requests_fail_over_too():
+    r = router({'name': 'a', 'endpoint': 'https://a', 'weight': 1000}, {'name': 'b', 'endpoint': 'https://b'})
+    async def send(d):
+        return Response(503 if d.name == 'a' else 200)
+    assert asyncio.run(r.request_async(send)).status_code == 200
+    assert r.deployments[0].errors == 1 and r.deployments[1].failures == 0
+
+def test_cancelled_or_failed_sends_release_their_slot():
+    r = router({'name': 'a', 'endpoint': 'https://a', 'capacity': 1})
+    [a] = r.deployments
+    async def hang(d):
+        await asyncio.sleep(10)
+    async def cancelled():
+        task = asyncio.create_task(r.request_async(hang))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+    asyncio.run(cancelled())
+    def broken(d):
+        raise ValueError('not an upstream error')
+    with pytest.raises(ValueError):
+        r.request(broken)
+    # Neither counted as a deployment error, and the deployment is free again
+    assert a.in_flight == 0 and a.errors == 0
+    assert a.available(time.monotonic())
+
+def test_deployments_come_from_the_environment(monkeypatch):
+    monkeypatch.setenv('AZURE_OPENAI_ENDPOINT', 'https://single')
+    monkeypatch.setenv('AZURE_OPENAI_KEY', 'single-key')
+    monkeypatch.delenv('AZURE_WHISPER_DEPLOYMENTS', raising=False)
+    [default] = azure_openai.load_deployments('whisper')
+    assert (default.url, default.key) == ('https://single', 'single-key')
+    monkeypatch.setenv('SECOND_KEY', 'second-key')
+    monkeypatch.setenv('AZURE_WHISPER_DEPLOYMENTS', json.dumps([
+        {'endpoint': 'https://first', 'key': 'first-key', 'weight': 2},
+        {'name': 'second', 'endpoint': 'https://second', 'key_env': 'SECOND_KEY', 'capacity': 4},
+    ]))
+    first, second = azure_openai.load_deployments('whisper')
+    assert (first.name, first.key, first.weight) == ('whisper-0', 'first-key', 2.0)
+    assert (second.name, second.key, second.capacity) == ('second', 'second-key', 4)
@@ -0,0 +1,120 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import pytest
+import io
+import uuid
+import requests
+from app import app, db
+from models import Transcription
+import blob_storage
+
+@pytest.fixture
+def local_store(tmp_path):
+    folders = {area: str(tmp_path / area) for area in blob_storage.AREA_FOLDERS}
+    for folder in folders.values():
+        os.makedirs(folder)
+    return blob_storage.LocalBlobStore(folders)
+
+@pytest.fixture(scope='module')
+def s3_endpoint():
+    """An in-process S3-compatible server, standing in for MinIO."""
+    pytest.importorskip('boto3')
+    moto_server = pytest.importorskip('moto.server')
+    server = moto_server.ThreadedMotoServer(port=0)
+    server.start()
+    host, port = server.get_host_and_port()
+    yield f'http://{host}:{port}'
+    server.stop()
+
+@pytest.fixture
+def s3_store(s3_endpoint, monkeypatch):
+    import boto3
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'testing')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'testing')
+    client = boto3.client('s3', endpoint_url=s3_endpoint, region_name='us-east-1')
+    bucket = f'media-{uuid.uuid4().hex[:12]}'
+    client.create_bucket(Bucket=bucket)
+    monkeypatch.setattr(blob_storage, 'S3_MULTIPART_THRESHOLD', 5 * 1024 * 1024)
+    monkeypatch.setattr(blob_storage, 'S3_MULTIPART_CHUNKSIZE', 5 * 1024 * 1024)
+    return blob_storage.S3BlobStore(bucket, client=client, prefix='test/')
+
+def test_local_store_round_trip(local_store):
+    assert local_store.write('uploads', 'a.mp3', io.BytesIO(b'audio')) == 5
+    assert local_store.exists('uploads', 'a.mp3')
+    assert local_store.size('uploads', 'a.mp3') == 5
+    with local_store.open('uploads', 'a.mp3') as f:
+        assert f.read() == b'audio'
+    with local_store.local_path('uploads', 'a.mp3') as path:
+        assert path == local_store.path('uploads', 'a.mp3')
+    assert local_store.download_url('uploads', 'a.mp3', 'a.mp3') is None
+    local_store.delete('uploads', 'a.mp3')
+    assert not local_store.exists('uploads', 'a.mp3')
+    assert not local_store.exists('uploads', None)
+
+def test_s3_multipart_write_and_streaming_read(s3_store):
+    payload = os.urandom(11 * 1024 * 1024)
+    assert s3_store.write('uploads', 'long.mp4', io.BytesIO(payload)) == len(payload)
+    head = s3_store.client.head_object(Bucket=s3_store.bucket, Key='test/uploads/long.mp4')
+    assert head['ETag'].strip('"').endswith('-3')  # Uploaded in three parts
+    body = s3_store.open('uploads', 'long.mp4')
+    assert b''.join(body.iter_chunks(1024 * 1024)) == payload
+    assert s3_store.size('uploads', 'long.mp4') == len(payload)
+
+def test_s3_staged_and_local_path(s3_store):
+    with s3_store.staged('thumbnails', 'x.jpg') as path:
+        with open(path, 'wb') as f:
+            f.write(b'jpeg')
+    assert s3_store.exists('thumbnails', 'x.jpg')
+    with s3_store.local_path('thumbnails', 'x.jpg') as path:
+        with open(path, 'rb') as f:
+            assert f.read() == b'jpeg'
+    assert not os.path.exists(path)
+    # Nothing left in the staging path means nothing is uploaded
+    with s3_store.staged('thumbnails', 'failed.jpg'):
+        pass
+    assert not s3_store.exists('thumbnails', 'failed.jpg')
+    s3_store.delete('thumbnails', 'x.jpg')
+    assert not s3_store.exists('thumbnails', 'x.jpg')
+
+def test_s3_presigned_download(s3_store):
+    s3_store.write('uploads', 'talk.mp3', io.BytesIO(b'talk'))
+    url = s3_store.download_url('uploads', 'talk.mp3', 'Talk.mp3')
+    response = requests.get(url)
+    assert response.status_code == 200
+    assert response.content == b'talk'
+    assert 'Talk.mp3' in response.headers['Content-Disposition']
+
+def test_download_route_redirects_to_object_storage(s3_store, monkeypatch):
+    app.config['TESTING'] = True
+    monkeypatch.setitem(app.extensions, 'blob_store', s3_store)
+    name = f'remote_{uuid.uuid4().hex}.mp3'
+    s3_store.write('uploads', name, io.BytesIO(b'remote audio'))
+    with app.app_context():
+        db.create_all()
+        t = Transcription(filename=name, transcription='', transcription_status='not_transcribed')
+        db.session.add(t)
+        db.session.commit()
+        file_id = t.id
+    try:
+        with app.test_client() as client:
+            rv = client.get(f'/files/{file_id}/download')
+            assert rv.status_code == 302
+            assert requests.get(rv.headers['Location']).content == b'remote audio'
+            assert client.delete(f'/files/{file_id}').status_code == 200
+        assert not s3_store.exists('uploads', name)
+    finally:
+        with app.app_context():
+            t = db.session.get(Transcription, file_id)
+            if t:
+                db.session.delete(t)
+                db.session.commit()
+
+def test_listing_skips_nested_folders(local_store, s3_store):
+    for store in (local_store, s3_store):
+        store.write('uploads', 'a.mp3', io.BytesIO(b'audio'))
+        store.write('thumbnails', 'a.jpg', io.BytesIO(b'jpeg'))
+    os.makedirs(local_store.path('uploads', 'nested'))
+    s3_store.client.put_object(Bucket=s3_store.bucket, Key='test/uploads/nested/b.mp3', Body=b'audio')
+    for store in (local_store, s3_store):
+        assert [(name, size) for name, size, _ in store.listing('uploads')] == [('a.mp3', 5)]
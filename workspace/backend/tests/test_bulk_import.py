@@ -0,0 +1,94 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import pytest
+import json
+import uuid
+from app import app, db
+from models import Transcription
+import blob_storage
+import bulk_import
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    folders = {area: str(tmp_path / 'media' / area) for area in blob_storage.AREA_FOLDERS}
+    for folder in folders.values():
+        os.makedirs(folder)
+    store = blob_storage.LocalBlobStore(folders)
+    monkeypatch.setitem(app.extensions, 'blob_store', store)
+    return store
+
+@pytest.fixture
+def owner_id():
+    owner_id = f'test-import-{uuid.uuid4()}'
+    yield owner_id
+    with app.app_context():
+        Transcription.query.filter_by(owner_id=owner_id).delete()
+        db.session.commit()
+
+@pytest.fixture
+def archive(tmp_path):
+    root = tmp_path / 'archive'
+    (root / '2023' / 'q1').mkdir(parents=True)
+    (root / '2024').mkdir()
+    (root / '2023' / 'q1' / 'standup.mp3').write_bytes(b'standup audio')
+    (root / '2023' / 'retro.wav').write_bytes(b'retro audio')
+    (root / '2024' / 'standup.mp3').write_bytes(b'another standup')
+    (root / '2024' / 'copy of retro.wav').write_bytes(b'retro audio')
+    (root / '2024' / 'notes.txt').write_text('not media')
+    return root
+
+def rows(owner_id):
+    with app.app_context():
+        return {t.filename: t.file_hash for t in Transcription.query.filter_by(owner_id=owner_id)}
+
+def test_import_skips_duplicates_and_renames(store, owner_id, archive, tmp_path):
+    counts = bulk_import.run(str(archive), owner_id=owner_id, workers=2, batch_size=2,
+                             checkpoint_path=str(tmp_path / 'checkpoint.jsonl'))
+    assert counts == {'imported': 3, 'duplicate': 1, 'error': 0}
+    imported = rows(owner_id)
+    assert set(imported) == {'retro.wav', 'standup.mp3', 'standup_1.mp3'}
+    assert store.exists('uploads', 'standup_1.mp3')
+    with open(store.path('uploads', 'retro.wav'), 'rb') as f:
+        assert f.read() == b'retro audio'
+
+def test_interrupted_import_resumes_from_checkpoint(store, owner_id, archive, tmp_path, monkeypatch):
+    checkpoint = tmp_path / 'checkpoint.jsonl'
+    real_batch = bulk_import.import_batch
+    calls = []
+    def failing_batch(*args):
+        calls.append(args[1])
+        if len(calls) == 2:
+            raise KeyboardInterrupt
+        return real_batch(*args)
+    monkeypatch.setattr(bulk_import, 'import_batch', failing_batch)
+    with pytest.raises(KeyboardInterrupt):
+        bulk_import.run(str(archive), owner_id=owner_id, workers=2, batch_size=2, checkpoint_path=str(checkpoint))
+    done = [json.loads(line)['path'] for line in checkpoint.read_text().splitlines()]
+    assert done == calls[0]
+
+    hashed = []
+    real_hash = bulk_import.hash_file
+    monkeypatch.setattr(bulk_import, 'import_batch', real_batch)
+    monkeypatch.setattr(bulk_import, 'hash_file', lambda path: hashed.append(path) or real_hash(path))
+    counts = bulk_import.run(str(archive), owner_id=owner_id, workers=2, batch_size=2, checkpoint_path=str(checkpoint))
+    # Only the files after the checkpoint are hashed again
+    assert len(hashed) == 2
+    assert counts['imported'] + counts['duplicate'] == 2
+    assert len(rows(owner_id)) == 3
+
+def test_known_hashes_are_skipped(store, owner_id, archive, tmp_path):
+    bulk_import.run(str(archive), owner_id=owner_id, checkpoint_path=str(tmp_path / 'first.jsonl'))
+    counts = bulk_import.run(str(archive), owner_id=owner_id, checkpoint_path=str(tmp_path / 'second.jsonl'))
+    assert counts == {'imported': 0, 'duplicate': 4, 'error': 0}
+
+def test_transcribe_flag_transcribes_new_rows(store, owner_id, archive, tmp_path, monkeypatch):
+    transcribed = []
+    def fake_transcribe(t, file_path):
+        assert os.path.exists(file_path)
+        transcribed.append(t.filename)
+        t.transcription_status = 'transcribed'
+        db.session.commit()
+    monkeypatch.setattr(bulk_import, 'transcribe_record', fake_transcribe)
+    bulk_import.run(str(archive), owner_id=owner_id, transcribe=True, checkpoint_path=str(tmp_path / 'c.jsonl'))
+    assert sorted(transcribed) == ['retro.wav', 'standup.mp3', 'standup_1.mp3']
@@ -0,0 +1,93 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import pytest
+import gzip
+import json
+import uuid
+import zlib
+from app import app, db
+from models import Transcription
+import compression
+import response_cache
+
+ROWS = 30
+
+@pytest.fixture
+def client(monkeypatch):
+    app.config['TESTING'] = True
+    monkeypatch.setattr(response_cache, 'RESPONSE_CACHE_ENABLED', True)
+    monkeypatch.setattr(response_cache, '_cache', response_cache._create_cache())
+    with app.test_client() as client:
+        with app.app_context():
+            db.create_all()
+        yield client
+
+@pytest.fixture
+def owner():
+    owner = f'test-compression-{uuid.uuid4()}'
+    with app.app_context():
+        for i in range(ROWS):
+            db.session.add(Transcription(filename=f'standup_{i}.mp3', owner_id=owner, transcription_status='transcribed',
+                                         transcription=f'Notes {i}: the quarterly budget review was moved to Friday. ' * 5))
+        db.session.commit()
+    yield owner
+    with app.app_context():
+        Transcription.query.filter_by(owner_id=owner).delete()
+        db.session.commit()
+
+def test_listing_is_gzipped_when_accepted(client, owner):
+    url = f'/files?dbMode=private&userId={owner}'
+    plain = client.get(url)
+    assert 'Content-Encoding' not in plain.headers
+    rv = client.get(url, headers={'Accept-Encoding': 'gzip, deflate'})
+    assert rv.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in rv.headers['Vary']
+    assert len(rv.data) < len(plain.data) / 4
+    assert json.loads(gzip.decompress(rv.data)) == plain.get_json()
+
+def test_cached_listing_reuses_its_encoded_variant(client, owner, monkeypatch):
+    url = f'/files?dbMode=private&userId={owner}'
+    calls = []
+    real = compression.compress
+    monkeypatch.setattr(compression, 'compress', lambda body, encoding: calls.append(encoding) or real(body, encoding))
+    first = client.get(url, headers={'Accept-Encoding': 'gzip'})
+    second = client.get(url, headers={'Accept-Encoding': 'gzip'})
+    assert (first.headers['X-Cache'], second.headers['X-Cache']) == ('MISS', 'HIT')
+    assert second.data == first.data and calls == ['gzip']
+
+def test_small_responses_are_not_encoded(client):
+    rv = client.get('/files/999999999/download', headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in rv.headers
+
+def test_streamed_listings_match_the_plain_ones(client, owner, monkeypatch):
+    monkeypatch.setattr(response_cache, 'RESPONSE_CACHE_ENABLED', False)
+    base = f'/files?dbMode=private&userId={owner}'
+    plain = client.get(base).get_json()
+    rv = client.get(base + '&stream=ndjson')
+    assert rv.is_streamed and rv.mimetype == 'application/x-ndjson'
+    assert [json.loads(line) for line in rv.data.decode().splitlines()] == plain['files']
+    rv = client.get(base, headers={'Accept': 'application/x-ndjson'})
+    assert len(rv.data.decode().splitlines()) == ROWS
+    assert client.get(base + '&stream=json').get_json() == plain
+
+    search = f'/search?q=budget&dbMode=private&userId={owner}'
+    assert client.get(search + '&stream=json').get_json() == client.get(search).get_json()
+
+def test_streamed_listing_is_gzipped_chunk_by_chunk(client, owner):
+    rv = client.get(f'/files?dbMode=private&userId={owner}&stream=ndjson', headers={'Accept-Encoding': 'gzip'})
+    assert rv.headers['Content-Encoding'] == 'gzip' and 'Content-Length' not in rv.headers
+    lines = gzip.decompress(rv.data).decode().splitlines()
+    assert len(lines) == ROWS
+    # Every chunk is flushed, so a client can decode rows before the stream ends
+    stream = compression.compress_stream(['{"a":1}\n', '{"a":2}\n'], 'gzip')
+    decoder = zlib.decompressobj(31)
+    assert decoder.decompress(next(stream)) == b'{"a":1}\n'
+
+@pytest.mark.skipif(compression._brotli() is None, reason='brotli not installed')
+def test_brotli_is_preferred_when_available(client, owner):
+    brotli = compression._brotli()
+    url = f'/files?dbMode=private&userId={owner}'
+    rv = client.get(url, headers={'Accept-Encoding': 'gzip, br'})
+    assert rv.headers['Content-Encoding'] == 'br'
+    assert json.loads(brotli.decompress(rv.data)) == client.get(url).get_json()
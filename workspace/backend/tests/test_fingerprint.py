@@ -0,0 +1,145 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import pytest
+import io
+import json
+import uuid
+import numpy as np
+from starlette.testclient import TestClient
+from app import app, db
+from asgi import application
+from models import Transcription, FingerprintHash
+import fingerprint
+import storage_policy
+
+@pytest.fixture
+def client():
+    app.config['TESTING'] = True
+    with app.test_client() as client:
+        with app.app_context():
+            db.create_all()
+        yield client
+
+@pytest.fixture
+def owner():
+    owner_id = f'test-fingerprint-{uuid.uuid4()}'
+    yield owner_id
+    with app.app_context():
+        for t in Transcription.query.filter_by(owner_id=owner_id).all():
+            storage_policy.remove_media(t)
+            db.session.delete(t)
+        db.session.commit()
+
+def speech_like(seed, seconds=20):
+    """Random syllable-like tone bursts at 8 kHz: a stand-in for a recording with distinct spectral peaks."""
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(0.25 * fingerprint.SAMPLE_RATE)) / fingerprint.SAMPLE_RATE
+    envelope = np.hanning(len(t))
+    notes = []
+    for _ in range(seconds * 4):
+        freqs = rng.uniform(100, 3500, size=3)
+        notes.append(envelope * sum(np.sin(2 * np.pi * f * t) for f in freqs) / 3)
+    return np.concatenate(notes).astype(np.float32)
+
+def score(a, b):
+    hashes_a, offsets_a = fingerprint.fingerprint_samples(a)
+    hashes_b, offsets_b = fingerprint.fingerprint_samples(b)
+    return fingerprint.match_score(hashes_a, offsets_a, zip(hashes_b.tolist(), offsets_b.tolist()))
+
+def test_reencoded_copy_matches():
+    original = speech_like(1)
+    rng = np.random.default_rng(7)
+    # Quieter, with added noise, as after a lossy re-encode
+    copy = (0.6 * original + rng.normal(0, 0.05, len(original))).astype(np.float32)
+    assert score(copy, original) >= fingerprint.FINGERPRINT_MATCH_THRESHOLD
+
+def test_trimmed_copy_matches_at_offset():
+    original = speech_like(2)
+    # Cut at a point that is not a multiple of the STFT hop
+    trimmed = original[fingerprint.HOP * 40 + 77:]
+    assert score(trimmed, original) >= fingerprint.FINGERPRINT_MATCH_THRESHOLD
+
+def test_different_recording_does_not_match():
+    assert score(speech_like(3), speech_like(4)) < fingerprint.FINGERPRINT_MATCH_THRESHOLD
+
+def test_too_short_input_has_no_hashes():
+    hashes, offsets = fingerprint.fingerprint_samples(np.zeros(100, dtype=np.float32))
+    assert len(hashes) == 0 and len(offsets) == 0
+
+def fake_media(monkeypatch, samples_by_name):
+    """Let fingerprint.compute decode in-memory samples instead of running ffmpeg on the uploads."""
+    def decode_pcm(path, seconds=None, start=None):
+        samples = samples_by_name[os.path.basename(path)]
+        first = int((start or 0) * fingerprint.SAMPLE_RATE)
+        return samples[first:first + int(seconds * fingerprint.SAMPLE_RATE)] if seconds else samples[first:]
+    monkeypatch.setattr(fingerprint, 'decode_pcm', decode_pcm)
+    monkeypatch.setattr(fingerprint, 'probe_duration',
+                        lambda path: len(samples_by_name[os.path.basename(path)]) / fingerprint.SAMPLE_RATE)
+
+@pytest.mark.parametrize('native', [False, True], ids=['flask', 'asgi'])
+def test_near_duplicate_reuses_transcription(client, owner, monkeypatch, native):
+    original = speech_like(5)
+    first, second = f'meeting_{uuid.uuid4().hex}.mp3', f'meeting_{uuid.uuid4().hex}.m4a'
+    fake_media(monkeypatch, {first: original, second: 0.5 * original})
+    segments = [{'text': 'hello there', 'start': 0.0, 'end': 1.0}]
+    rv = client.post('/files', data={'file': (io.BytesIO(b'first'), first), 'userId': owner, 'dbMode': 'private'},
+                     content_type='multipart/form-data')
+    first_id = rv.get_json()['file']['id']
+    with app.app_context():
+        t = db.session.get(Transcription, first_id)
+        t.transcription = 'hello there'
+        t.segments = json.dumps(segments)
+        t.transcription_status = 'transcribed'
+        db.session.commit()
+    rv = client.post('/files', data={'file': (io.BytesIO(b'second'), second), 'userId': owner, 'dbMode': 'private'},
+                     content_type='multipart/form-data')
+    second_id = rv.get_json()['file']['id']
+    # Whisper must not be called: the endpoint is unset in tests, so a request would fail
+    if native:
+        with TestClient(application) as asgi_client:
+            rv = asgi_client.post(f'/files/{second_id}/transcribe')
+        data = rv.json()
+    else:
+        rv = client.post(f'/files/{second_id}/transcribe')
+        data = rv.get_json()
+    assert rv.status_code == 200
+    assert data['reused_from'] == first_id
+    assert data['file']['transcription'] == 'hello there'
+    assert data['file']['segments'] == segments
+    assert data['file']['transcription_status'] == 'transcribed'
+
+def test_no_match_across_databases(client, owner):
+    original = speech_like(6)
+    with app.app_context():
+        t = Transcription(filename=f'global_{uuid.uuid4().hex}.mp3', transcription='text', transcription_status='transcribed', owner_id=owner)
+        db.session.add(t)
+        db.session.commit()
+        hashes, offsets = fingerprint.fingerprint_samples(original)
+        fp = {'hashes': hashes, 'offsets': offsets, 'duration': 20.0}
+        fingerprint.store(t.id, fp)
+        db.session.commit()
+        assert fingerprint.find_near_duplicate(fp, owner).id == t.id
+        assert fingerprint.find_near_duplicate(fp, f'{owner}-other') is None
+        # Candidates are narrowed by duration before their hashes are read
+        assert fingerprint.find_near_duplicate({**fp, 'duration': 21.5}, owner).id == t.id
+        assert fingerprint.find_near_duplicate({**fp, 'duration': None}, owner).id == t.id
+        assert fingerprint.find_near_duplicate({**fp, 'duration': 40.0}, owner) is None
+        assert fingerprint.find_near_duplicate(fp, owner, exclude_id=t.id) is None
+        db.session.delete(t)
+        db.session.commit()
+        assert FingerprintHash.query.filter_by(transcription_id=t.id).count() == 0
+
+def test_shared_intro_does_not_match(client, owner, monkeypatch):
+    # Two recurring meetings: the same first 180 s, then a different discussion
+    intro = speech_like(7, seconds=180)
+    meeting, next_meeting = np.concatenate([intro, speech_like(8, seconds=120)]), np.concatenate([intro, speech_like(9, seconds=120)])
+    fake_media(monkeypatch, {'meeting.mp3': meeting, 'next_meeting.mp3': next_meeting, 'meeting.m4a': 0.5 * meeting})
+    with app.app_context():
+        t = Transcription(filename=f'meeting_{uuid.uuid4().hex}.mp3', transcription='text', transcription_status='transcribed', owner_id=owner)
+        db.session.add(t)
+        db.session.commit()
+        fingerprint.store(t.id, fingerprint.compute('meeting.mp3'))
+        db.session.commit()
+        assert fingerprint.find_near_duplicate(fingerprint.compute('next_meeting.mp3'), owner) is None
+        assert fingerprint.find_near_duplicate(fingerprint.compute('meeting.m4a'), owner).id == t.id
@@ -0,0 +1,94 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import pytest
+import asyncio
+import io
+import uuid
+import wave
+import numpy as np
+from starlette.testclient import TestClient
+from app import app, db
+from models import Transcription
+import asgi
+import blob_storage
+import live
+
+SAMPLE_RATE = 8000
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    folders = {area: str(tmp_path / 'media' / area) for area in blob_storage.AREA_FOLDERS}
+    for folder in folders.values():
+        os.makedirs(folder)
+    store = blob_storage.LocalBlobStore(folders)
+    monkeypatch.setitem(app.extensions, 'blob_store', store)
+    return store
+
+def spoken(seconds):
+    """PCM in which every sample of second n has the value n, so the fake engine can tell where it is."""
+    return np.repeat(np.arange(seconds, dtype=np.int16), SAMPLE_RATE).tobytes()
+
+async def fake_engine(wav):
+    """A word 'w<n>' from 0.1 s to 0.6 s into every second n that the window holds."""
+    with wave.open(io.BytesIO(wav)) as w:
+        samples = np.frombuffer(w.readframes(w.getnframes()), dtype=np.int16)
+    words = [{'word': f'w{samples[i]}', 'start': i // SAMPLE_RATE + 0.1, 'end': i // SAMPLE_RATE + 0.6}
+             for i in range(0, len(samples), SAMPLE_RATE)]
+    return {'text': ' '.join(w['word'] for w in words), 'segments': [{'text': '', 'start': 0, 'end': 0, 'words': words}]}
+
+def test_session_stitches_overlapping_windows():
+    session = live.LiveSession(SAMPLE_RATE, window_seconds=10, overlap_seconds=2)
+    try:
+        windows = []
+        pcm = spoken(25)
+        for i in range(0, len(pcm), 3001):  # Frames that split samples
+            windows += session.feed(pcm[i:i + 3001])
+        assert [w.start for w in windows] == [0, 8]
+        last = session.finish()
+        assert (last.start, last.last) == (16, True)
+        for window in windows + [last]:
+            data = asyncio.run(fake_engine(live.wav_bytes(window.pcm, SAMPLE_RATE)))
+            session.accept(window, [{'text': w['word'], 'start': w['start'], 'end': w['end']} for w in data['segments'][0]['words']])
+        assert [s['text'] for s in session.word_segments] == [f'w{n}' for n in range(25)]
+        assert session.word_segments[9] == {'text': 'w9', 'start': 9.1, 'end': 9.6}
+        assert session.digest()[1] == 44 + len(pcm)
+    finally:
+        session.discard()
+    assert not os.path.exists(session.path)
+
+def test_live_stream_is_pushed_and_saved(store, monkeypatch):
+    monkeypatch.setattr(asgi, '_live_engine', fake_engine)
+    monkeypatch.setattr(live, 'LIVE_WINDOW_SECONDS', 10)
+    monkeypatch.setattr(live, 'LIVE_OVERLAP_SECONDS', 2)
+    owner = f'test-live-{uuid.uuid4()}'
+    pcm = spoken(25)
+    try:
+        with TestClient(asgi.application) as client, client.websocket_connect('/live') as ws:
+            ws.send_json({'type': 'start', 'sampleRate': SAMPLE_RATE, 'filename': 'standup.webm', 'dbMode': 'private', 'userId': owner})
+            assert ws.receive_json()['type'] == 'ready'
+            for i in range(0, len(pcm), SAMPLE_RATE):
+                ws.send_bytes(pcm[i:i + SAMPLE_RATE])
+            first = ws.receive_json()  # Pushed while the stream is still open
+            assert first['type'] == 'segments' and first['text'] == ' '.join(f'w{n}' for n in range(9))
+            ws.send_json({'type': 'stop'})
+            messages = []
+            while not messages or messages[-1]['type'] != 'final':
+                messages.append(ws.receive_json())
+        words = first['word_segments'] + [s for m in messages if m['type'] == 'segments' for s in m['word_segments']]
+        assert [s['text'] for s in words] == [f'w{n}' for n in range(25)]
+        saved = messages[-1]['file']
+        assert saved['filename'] == 'standup.wav' and saved['owner_id'] == owner
+        assert saved['transcription_status'] == 'transcribed'
+        assert saved['segments'] == words
+        with wave.open(store.path('uploads', 'standup.wav')) as w:
+            assert w.readframes(w.getnframes()) == pcm
+    finally:
+        with app.app_context():
+            Transcription.query.filter_by(owner_id=owner).delete()
+            db.session.commit()
+
+def test_live_rejects_a_bad_sample_rate():
+    with TestClient(asgi.application) as client, client.websocket_connect('/live') as ws:
+        ws.send_json({'type': 'start', 'sampleRate': 3})
+        assert ws.receive_json()['status_code'] == 400
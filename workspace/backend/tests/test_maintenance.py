@@ -0,0 +1,124 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import pytest
+import datetime
+import time
+import uuid
+from sqlalchemy import create_engine, text
+from app import app, db
+from models import Transcription, TranscriptionLease
+import blob_storage
+import maintenance
+import waveform
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    folders = {area: str(tmp_path / 'media' / area) for area in blob_storage.AREA_FOLDERS}
+    for folder in folders.values():
+        os.makedirs(folder)
+    store = blob_storage.LocalBlobStore(folders)
+    monkeypatch.setitem(app.extensions, 'blob_store', store)
+    return store
+
+def put(store, area, name, age=0):
+    path = store.path(area, name)
+    with open(path, 'wb') as f:
+        f.write(b'x' * 100)
+    if age:
+        stamp = time.time() - age
+        os.utime(path, (stamp, stamp))
+
+@pytest.fixture
+def rows(store, monkeypatch):
+    """Rows with all media, with only the speech rendition left, and with nothing left."""
+    tag = uuid.uuid4().hex
+    with app.app_context():
+        kept = Transcription(filename=f'kept_{tag}.mp4', transcription='', file_hash=f'{tag}a', thumbnail=f'kept_{tag}.jpg')
+        speech = Transcription(filename=f'speech_{tag}.mp4', transcription='', speech_file=f'speech_{tag}.ogg',
+                               thumbnail=f'speech_{tag}.jpg', stored_bytes=5000)
+        gone = Transcription(filename=f'gone_{tag}.mp3', transcription='', media_state='speech',
+                             speech_file=f'gone_{tag}.ogg', stored_bytes=5000)
+        db.session.add_all([kept, speech, gone])
+        db.session.commit()
+        ids = [kept.id, speech.id, gone.id]
+    put(store, 'uploads', f'kept_{tag}.mp4', age=7200)
+    put(store, 'thumbnails', f'kept_{tag}.jpg', age=7200)
+    put(store, 'thumbnails', waveform.blob_name(f'{tag}a'), age=7200)
+    put(store, 'speech', f'speech_{tag}.ogg', age=7200)
+    # Only reconcile these rows; the test database may hold others whose media is elsewhere
+    real = maintenance.referenced_blobs
+    def own_rows():
+        found, names = real()
+        return [row for row in found if row[0] in ids], names
+    monkeypatch.setattr(maintenance, 'referenced_blobs', own_rows)
+    yield tag, ids
+    with app.app_context():
+        Transcription.query.filter(Transcription.id.in_(ids)).delete()
+        db.session.commit()
+
+def test_dry_run_reports_and_changes_nothing(store, rows):
+    tag, (kept, speech, gone) = rows
+    put(store, 'uploads', 'lost.mov', age=7200)
+    put(store, 'uploads', f'kept_{tag}.mp4.mp3', age=7200)
+    put(store, 'uploads', 'uploading.mp4')
+    with app.app_context():
+        report = maintenance.reconcile_storage(dry_run=True)
+    assert [e['name'] for e in report['orphans']] == ['lost.mov']
+    assert [e['name'] for e in report['extraction_files']] == [f'kept_{tag}.mp4.mp3']
+    assert report['recent_unreferenced'] == 1 and report['freed_bytes'] == 200
+    assert report['missing_media'] == [gone] and report['speech_only'] == [speech]
+    assert report['missing_thumbnails'] == [speech]
+    assert store.exists('uploads', 'lost.mov')
+    with app.app_context():
+        assert db.session.get(Transcription, gone).media_state == 'speech'
+
+def test_reconcile_deletes_orphans_and_flags_missing_media(store, rows):
+    tag, (kept, speech, gone) = rows
+    put(store, 'uploads', 'lost.mov', age=7200)
+    put(store, 'thumbnails', 'lost.jpg', age=7200)
+    put(store, 'uploads', f'kept_{tag}.mp4.mp3', age=7200)
+    put(store, 'uploads', 'uploading.mp4')
+    with app.app_context():
+        maintenance.reconcile_storage()
+        assert not store.exists('uploads', 'lost.mov') and not store.exists('thumbnails', 'lost.jpg')
+        assert not store.exists('uploads', f'kept_{tag}.mp4.mp3')
+        assert store.exists('uploads', 'uploading.mp4')
+        assert store.exists('thumbnails', waveform.blob_name(f'{tag}a'))
+        t = db.session.get(Transcription, kept)
+        assert (t.media_state, t.thumbnail) == ('original', f'kept_{tag}.jpg')
+        t = db.session.get(Transcription, speech)
+        assert (t.media_state, t.stored_bytes, t.thumbnail) == ('speech', 100, None)
+        t = db.session.get(Transcription, gone)
+        assert (t.media_state, t.speech_file, t.stored_bytes) == ('missing', None, 0)
+
+def test_vacuum_gives_deleted_pages_back(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'vacuum.db'}")
+    with engine.begin() as conn:
+        conn.execute(text('CREATE TABLE t (id INTEGER PRIMARY KEY, body TEXT)'))
+        conn.execute(text('INSERT INTO t (body) VALUES (:body)'), [{'body': 'x' * 1000}] * 2000)
+        conn.execute(text('DELETE FROM t WHERE id > 100'))
+    planned = maintenance.maintain_database(engine, dry_run=True)
+    assert planned['reclaimable_bytes'] > 1_000_000
+    report = maintenance.maintain_database(engine)
+    assert report['statements'] == ['ANALYZE', 'VACUUM', 'PRAGMA wal_checkpoint(TRUNCATE)']
+    assert report['bytes_after'] < report['bytes_before'] - 1_000_000
+    with engine.connect() as conn:
+        assert conn.execute(text("SELECT count(*) FROM sqlite_master WHERE name = 'sqlite_stat1'")).scalar() == 1
+
+def test_one_process_claims_each_scheduled_run(monkeypatch):
+    monkeypatch.setattr(maintenance, 'MAINTENANCE_INTERVAL_HOURS', 1)
+    with app.app_context():
+        TranscriptionLease.query.filter_by(key=maintenance.LEASE_KEY).delete()
+        db.session.commit()
+        try:
+            assert maintenance.claim_scheduled_run(db.engine, 'first')
+            assert not maintenance.claim_scheduled_run(db.engine, 'second')
+            # The first claim has run out
+            TranscriptionLease.query.filter_by(key=maintenance.LEASE_KEY).update(
+                {'expires_at': datetime.datetime.utcnow() - datetime.timedelta(minutes=1)})
+            db.session.commit()
+            assert maintenance.claim_scheduled_run(db.engine, 'second')
+        finally:
+            TranscriptionLease.query.filter_by(key=maintenance.LEASE_KEY).delete()
+            db.session.commit()
@@ -0,0 +1,121 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import pytest
+import io
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from app import app, db
+from models import Transcription, TranscriptionSummary
+import app as backend
+import blob_storage
+import maintenance
+import partitions
+import single_flight
+import tracing
+import waveform
+
+@pytest.fixture
+def owner(tmp_path, monkeypatch):
+    monkeypatch.setattr(partitions, 'DB_PARTITIONING', 'owner')
+    monkeypatch.setattr(partitions, 'DB_PARTITION_FOLDER', str(tmp_path / 'partitions'))
+    monkeypatch.setattr(backend.fingerprint, 'FINGERPRINT_ENABLED', False)
+    folders = {area: str(tmp_path / 'media' / area) for area in blob_storage.AREA_FOLDERS}
+    for folder in folders.values():
+        os.makedirs(folder)
+    monkeypatch.setitem(app.extensions, 'blob_store', blob_storage.LocalBlobStore(folders))
+    app.config['TESTING'] = True
+    owner = f'test-partitions-{uuid.uuid4()}'
+    yield owner
+    with app.app_context():
+        Transcription.query.filter_by(owner_id=owner).delete()
+        db.session.commit()
+
+def upload(client, owner, name):
+    data = {'file': (io.BytesIO(b'ID3' + uuid.uuid4().bytes * 64), name), 'dbMode': 'private', 'userId': owner}
+    return client.post('/files', data=data, content_type='multipart/form-data')
+
+def test_private_files_live_in_the_owners_partition(owner, tmp_path):
+    client = app.test_client()
+    rv = upload(client, owner, 'standup.mp3')
+    assert rv.status_code == 200
+    file_id = rv.get_json()['file']['id']
+    private = f'dbMode=private&userId={owner}'
+    assert (tmp_path / 'partitions' / f'{partitions.partition_name(owner)}.db').is_file()
+    with app.app_context():
+        assert Transcription.query.filter_by(owner_id=owner).count() == 0
+    assert [f['filename'] for f in client.get(f'/files?{private}').get_json()['files']] == ['standup.mp3']
+    assert all(f['filename'] != 'standup.mp3' or f['owner_id'] != owner
+               for f in client.get('/files?dbMode=global').get_json()['files'])
+    assert client.get(f'/files/{file_id}/download-txt?{private}').status_code == 200
+    assert client.get(f'/files/{file_id}/download?{private}').status_code == 200
+    assert client.delete(f'/files/{file_id}?{private}').status_code == 200
+    assert client.get(f'/files?{private}').get_json()['files'] == []
+
+def test_background_work_stays_in_the_partition(owner):
+    with app.app_context(), partitions.bound(owner):
+        db.session.add(Transcription(filename='retro.mp3', transcription='', owner_id=owner))
+        db.session.commit()
+        def count():
+            with app.app_context():
+                return Transcription.query.filter_by(filename='retro.mp3', owner_id=owner).count()
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            assert pool.submit(tracing.in_current_context(count)).result() == 1
+        assert single_flight.content_key(None, 7) == f'file:{partitions.partition_name(owner)}:7'
+    assert single_flight.content_key(None, 7) == 'file:7'
+
+def test_migrate_moves_rows_with_their_ids(owner):
+    with app.app_context():
+        t = Transcription(filename='planning.mp3', transcription='Plans', owner_id=owner, transcription_status='transcribed')
+        db.session.add(t)
+        db.session.flush()
+        db.session.add(TranscriptionSummary(transcription_id=t.id, summary='Plans', source_hash='x'))
+        db.session.commit()
+        file_id = t.id
+        assert partitions.unmigrated_owners(db.engine).count(owner) == 1
+        assert partitions.migrate(db.engine, owner) == 1
+        assert Transcription.query.filter_by(owner_id=owner).count() == 0
+        assert TranscriptionSummary.query.filter_by(transcription_id=file_id).count() == 0
+        db.session.close()
+        with partitions.bound(owner):
+            moved = db.session.get(Transcription, file_id)
+            assert moved.filename == 'planning.mp3' and moved.summary.summary == 'Plans'
+            db.session.close()
+        [described] = [p for p in partitions.describe(db.engine) if p['owner_id'] == owner]
+        assert described['files'] == 1
+
+def test_maintenance_counts_blobs_referenced_from_partitions(owner):
+    store = app.extensions['blob_store']
+    for name in ('kept.mp3', 'lost.mp3'):
+        with open(store.path('uploads', name), 'wb') as f:
+            f.write(b'x' * 10)
+        stamp = time.time() - 7200
+        os.utime(store.path('uploads', name), (stamp, stamp))
+    with app.app_context():
+        with partitions.bound(owner):
+            db.session.add(Transcription(filename='kept.mp3', transcription='', owner_id=owner))
+            db.session.commit()
+        report = maintenance.reconcile_storage(dry_run=True)
+    assert [e['name'] for e in report['orphans']] == ['lost.mp3']
+
+def test_peaks_shared_with_another_partition_are_kept(owner):
+    store = app.extensions['blob_store']
+    file_hash = uuid.uuid4().hex
+    with open(store.path('thumbnails', waveform.blob_name(file_hash)), 'wb') as f:
+        f.write(b'WFPK')
+    with app.app_context():
+        shared = Transcription(filename='all-hands.mp3', transcription='', file_hash=file_hash)
+        db.session.add(shared)
+        db.session.commit()
+        try:
+            with partitions.bound(owner):
+                db.session.add(Transcription(filename='all-hands.mp3', transcription='', owner_id=owner, file_hash=file_hash))
+                db.session.commit()
+                file_id = Transcription.query.filter_by(owner_id=owner).one().id
+            rv = app.test_client().delete(f'/files/{file_id}?dbMode=private&userId={owner}')
+            assert rv.status_code == 200
+            assert os.path.exists(store.path('thumbnails', waveform.blob_name(file_hash)))
+        finally:
+            db.session.delete(shared)
+            db.session.commit()
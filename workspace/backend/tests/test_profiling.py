@@ -0,0 +1,52 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import pytest
+import pstats
+from app import app
+import profiling
+
+TOKEN = 'test-profile-token'
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.setattr(profiling, 'PROFILE_DIR', str(tmp_path / 'profiles'))
+    monkeypatch.setattr(profiling, 'PROFILE_ADMIN_TOKEN', TOKEN)
+    monkeypatch.setattr(profiling, 'PROFILE_SAMPLE_RATE', 0.0)
+    app.config['TESTING'] = True
+    with app.test_client() as client:
+        yield client
+
+def test_requests_are_not_profiled_by_default(client):
+    rv = client.get('/health')
+    assert 'X-Profile-Id' not in rv.headers
+    assert profiling.stored_ids() == []
+
+def test_admin_header_profiles_request(client):
+    rv = client.get('/files', headers={profiling.TOKEN_HEADER: TOKEN})
+    profile_id = rv.headers['X-Profile-Id']
+    stats = pstats.Stats(os.path.join(profiling.PROFILE_DIR, f'{profile_id}.pstats'))
+    assert any(func[2] == 'list_files' for func in stats.stats)
+    listing = client.get('/admin/profiles', headers={profiling.TOKEN_HEADER: TOKEN}).get_json()['profiles']
+    assert listing[0]['id'] == profile_id
+    assert listing[0]['endpoint'] == 'list_files'
+    rv = client.get(f'/admin/profiles/{profile_id}.folded', headers={profiling.TOKEN_HEADER: TOKEN})
+    assert rv.status_code == 200
+
+def test_wrong_token_is_ignored_and_listing_is_admin_only(client):
+    rv = client.get('/health', headers={profiling.TOKEN_HEADER: 'wrong'})
+    assert 'X-Profile-Id' not in rv.headers
+    assert client.get('/admin/profiles').status_code == 404
+    assert client.get('/admin/profiles', headers={profiling.TOKEN_HEADER: 'wrong'}).status_code == 404
+
+def test_sampling_and_bounded_directory(client, monkeypatch):
+    monkeypatch.setattr(profiling, 'PROFILE_SAMPLE_RATE', 1.0)
+    monkeypatch.setattr(profiling, 'PROFILE_MAX_FILES', 3)
+    ids = [client.get('/health').headers['X-Profile-Id'] for _ in range(5)]
+    assert profiling.stored_ids() == ids[-3:]
+    assert len(os.listdir(profiling.PROFILE_DIR)) == 3 * len(profiling.KINDS)
+
+def test_folded_output_format():
+    sampler = profiling.StackSampler(0, 0.01)
+    sampler.stacks['main (app.py:1);handler (app.py:10)'] = 3
+    assert sampler.folded() == 'main (app.py:1);handler (app.py:10) 3\n'
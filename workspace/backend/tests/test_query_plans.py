@@ -0,0 +1,144 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import pytest
+import datetime
+import io
+import sqlite3
+import tempfile
+import time
+import uuid
+from sqlalchemy import create_engine, event
+from app import app, db, unused_filename
+from models import Transcription
+import blob_storage
+import response_cache
+import storage_policy
+import waveform
+
+SEED_ROWS = 100_000
+OWNERS = 1000
+# Generous enough for a slow CI box; a full scan plus sort of 100k rows is far slower
+QUERY_SECONDS = 0.05
+
+@pytest.fixture(scope='module')
+def seeded(tmp_path_factory):
+    """A database with the app's schema and SEED_ROWS transcriptions spread over the global database and OWNERS owners."""
+    path = str(tmp_path_factory.mktemp('plans') / 'seeded.db')
+    engine = create_engine(f'sqlite:///{path}')
+    db.metadata.create_all(engine)
+    engine.dispose()
+    conn = sqlite3.connect(path)
+    start = datetime.datetime(2024, 1, 1)
+    rows = []
+    for i in range(SEED_ROWS):
+        owner = None if i % 100 == 0 else f'owner-{i % OWNERS}'
+        rows.append((
+            f'meeting_{i}.mp4', f'transcript {i} about the quarterly budget' if i % 3 else '',
+            start + datetime.timedelta(minutes=i), f'{i:064x}', 1000 + i,
+            'transcribed' if i % 3 else 'not_transcribed', owner, 'original', 1000 + i,
+        ))
+    conn.executemany(
+        'INSERT INTO transcription (filename, transcription, created_at, file_hash, file_size, transcription_status,'
+        ' owner_id, media_state, stored_bytes) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+    conn.commit()
+    conn.execute('ANALYZE')
+    yield conn
+    conn.close()
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    folders = {area: str(tmp_path / 'media' / area) for area in blob_storage.AREA_FOLDERS}
+    for folder in folders.values():
+        os.makedirs(folder)
+    store = blob_storage.LocalBlobStore(folders)
+    monkeypatch.setitem(app.extensions, 'blob_store', store)
+    return store
+
+@pytest.fixture
+def captured(monkeypatch):
+    """The SELECTs on transcription the app sends while the test runs, with their parameters."""
+    monkeypatch.setattr(response_cache, 'RESPONSE_CACHE_ENABLED', False)
+    monkeypatch.setattr(waveform, 'WAVEFORM_ENABLED', False)
+    db_fd, db_path = tempfile.mkstemp()
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + db_path
+    statements = []
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith('SELECT') and 'FROM transcription' in statement:
+            statements.append((statement, parameters))
+    with app.app_context():
+        db.create_all()
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', capture)
+    yield statements
+    event.remove(engine, 'before_cursor_execute', capture)
+    os.close(db_fd)
+    os.unlink(db_path)
+
+def plan(conn, statement, parameters):
+    return [row[3] for row in conn.execute('EXPLAIN QUERY PLAN ' + statement, parameters)]
+
+def whole_table_total(statement):
+    # The storage report's usage over every database has to read every row
+    return statement.lstrip().startswith('SELECT sum(') and 'owner_id' not in statement
+
+def timed(conn, statement, parameters):
+    started = time.perf_counter()
+    conn.execute(statement, parameters).fetchall()
+    return time.perf_counter() - started
+
+def assert_indexed(conn, statements):
+    assert statements
+    for statement, parameters in statements:
+        steps = plan(conn, statement, parameters)
+        detail = f'{statement}\n{steps}'
+        if not whole_table_total(statement):
+            assert not any(step.startswith('SCAN transcription') for step in steps), detail
+        assert not any('TEMP B-TREE FOR ORDER BY' in step for step in steps), detail
+        assert min(timed(conn, statement, parameters) for _ in range(3)) < QUERY_SECONDS, detail
+
+def test_file_routes_use_indexes(seeded, store, captured):
+    owner = f'test-plans-{uuid.uuid4()}'
+    app.config['TESTING'] = True
+    client = app.test_client()
+    try:
+        for content in (b'first', b'second'):
+            data = {'file': (io.BytesIO(content + owner.encode()), 'standup.mp3'), 'dbMode': 'private', 'userId': owner}
+            assert client.post('/files', data=data, content_type='multipart/form-data').status_code == 200
+        assert client.get(f'/files?dbMode=private&userId={owner}').status_code == 200
+        assert client.get('/files?dbMode=global').status_code == 200
+        assert client.get(f'/search?q=budget&dbMode=private&userId={owner}').status_code == 200
+        assert client.get(f'/storage?dbMode=private&userId={owner}').status_code == 200
+        file_id = client.get(f'/files?dbMode=private&userId={owner}').get_json()['files'][0]['id']
+        assert client.delete(f'/files/{file_id}?dbMode=private&userId={owner}').status_code == 200
+    finally:
+        client.delete(f'/files/all?dbMode=private&userId={owner}')
+    assert_indexed(seeded, captured)
+
+def test_background_queries_use_indexes(seeded, captured):
+    with app.app_context():
+        storage_policy._eviction_candidates('owner-7', originals_only=False).limit(10).all()
+        storage_policy.scoped(Transcription.query.with_entities(Transcription.file_hash), 'owner-7').filter(
+            Transcription.file_hash.in_(['a' * 64, 'b' * 64])).all()
+    statements = [(s, p) for s, p in captured if 'ORDER BY' not in s]
+    assert_indexed(seeded, statements)
+    # Eviction sorts the owner's transcribed rows by last use; it must not scan the table to find them
+    ordered = [(s, p) for s, p in captured if 'ORDER BY' in s]
+    for statement, parameters in ordered:
+        assert not any(step.startswith('SCAN transcription') for step in plan(seeded, statement, parameters))
+
+def test_rename_probes_names_in_one_query(store, captured):
+    owner = f'test-plans-{uuid.uuid4()}'
+    app.config['TESTING'] = True
+    client = app.test_client()
+    try:
+        for i in range(4):
+            data = {'file': (io.BytesIO(f'{i}{owner}'.encode()), 'talk.mp3'), 'dbMode': 'private', 'userId': owner}
+            rv = client.post('/files', data=data, content_type='multipart/form-data')
+        assert rv.get_json()['file']['filename'] == 'talk_3.mp3'
+        with app.app_context():
+            captured.clear()
+            assert unused_filename('talk.mp3', owner) == 'talk_4.mp3'
+        assert len(captured) == 1
+    finally:
+        client.delete(f'/files/all?dbMode=private&userId={owner}')
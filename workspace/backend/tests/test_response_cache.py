@@ -0,0 +1,108 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import pytest
+import uuid
+from app import app, db
+from models import Transcription
+import response_cache
+
+@pytest.fixture
+def client(monkeypatch):
+    app.config['TESTING'] = True
+    monkeypatch.setattr(response_cache, 'RESPONSE_CACHE_ENABLED', True)
+    monkeypatch.setattr(response_cache, '_cache', response_cache._create_cache())
+    with app.test_client() as client:
+        with app.app_context():
+            db.create_all()
+        yield client
+
+@pytest.fixture
+def owners():
+    owners = [f'test-cache-{uuid.uuid4()}' for _ in range(2)]
+    yield owners
+    with app.app_context():
+        Transcription.query.filter(Transcription.owner_id.in_(owners)).delete()
+        db.session.commit()
+
+def add_row(owner_id, text=''):
+    with app.app_context():
+        t = Transcription(filename=f'{uuid.uuid4().hex}.mp3', transcription=text, owner_id=owner_id,
+                          transcription_status='transcribed' if text else 'not_transcribed')
+        db.session.add(t)
+        db.session.commit()
+        return t.id
+
+def list_files(client, owner_id):
+    rv = client.get(f'/files?dbMode=private&userId={owner_id}')
+    return rv.headers['X-Cache'], [f['id'] for f in rv.get_json()['files']]
+
+def test_listing_is_cached_until_its_scope_changes(client, owners):
+    mine, other = owners
+    first = add_row(mine)
+    assert list_files(client, mine) == ('MISS', [first])
+    assert list_files(client, mine) == ('HIT', [first])
+    # Writes in another user's database leave this entry alone
+    add_row(other)
+    assert list_files(client, mine)[0] == 'HIT'
+    second = add_row(mine)
+    state, ids = list_files(client, mine)
+    assert state == 'MISS' and set(ids) == {first, second}
+
+def test_transcription_and_delete_invalidate(client, owners):
+    mine = owners[0]
+    file_id = add_row(mine)
+    list_files(client, mine)
+    with app.app_context():
+        t = db.session.get(Transcription, file_id)
+        t.transcription = 'now transcribed'
+        t.transcription_status = 'transcribed'
+        db.session.commit()
+    rv = client.get(f'/files?dbMode=private&userId={mine}')
+    assert rv.headers['X-Cache'] == 'MISS'
+    assert rv.get_json()['files'][0]['transcription_status'] == 'transcribed'
+    assert client.delete(f'/files/{file_id}?dbMode=private&userId={mine}').status_code == 200
+    assert list_files(client, mine) == ('MISS', [])
+
+def test_rolled_back_writes_keep_the_cache(client, owners):
+    mine = owners[0]
+    add_row(mine)
+    list_files(client, mine)
+    with app.app_context():
+        db.session.add(Transcription(filename='never.mp3', transcription='', owner_id=mine))
+        db.session.flush()
+        db.session.rollback()
+    assert list_files(client, mine)[0] == 'HIT'
+
+def test_bulk_delete_invalidates_every_scope(client, owners):
+    mine, other = owners
+    add_row(mine)
+    list_files(client, mine)
+    with app.app_context():
+        Transcription.query.filter(Transcription.owner_id == other).delete()
+        db.session.commit()
+    assert list_files(client, mine)[0] == 'MISS'
+
+def test_search_is_keyed_by_query(client, owners):
+    mine = owners[0]
+    add_row(mine, 'quarterly budget review')
+    url = f'/search?dbMode=private&userId={mine}&q='
+    assert client.get(url + 'budget').headers['X-Cache'] == 'MISS'
+    assert client.get(url + 'budget').headers['X-Cache'] == 'HIT'
+    rv = client.get(url + 'review')
+    assert rv.headers['X-Cache'] == 'MISS'
+    assert len(rv.get_json()['results']) == 1
+    stats = client.get('/cache/stats').get_json()
+    assert stats['hits'] == 1 and stats['misses'] == 2 and stats['entries'] == 2
+
+def test_local_tier_evicts_least_recently_used_by_size():
+    tier = response_cache.LocalTier(max_bytes=10, max_entry_bytes=6, ttl=60)
+    tier.set('a', b'aaaa')
+    tier.set('b', b'bbbb')
+    assert tier.get('a') == b'aaaa'
+    tier.set('c', b'cccc')
+    assert tier.get('b') is None
+    assert tier.get('a') == b'aaaa' and tier.get('c') == b'cccc'
+    assert tier.bytes == 8 and tier.evictions == 1
+    tier.set('big', b'x' * 7)
+    assert tier.get('big') is None
@@ -0,0 +1,203 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import pytest
+import asyncio
+import datetime
+import io
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import insert, update
+from app import app, db, TranscriptionFailed
+import app as backend
+import azure_openai
+from models import TranscriptionLease
+import single_flight
+import summaries
+import waveform
+
+@pytest.fixture
+def engine(monkeypatch):
+    monkeypatch.setattr(single_flight, 'SINGLE_FLIGHT_POLL_SECONDS', 0.01)
+    with app.app_context():
+        db.create_all()
+        yield db.engine
+
+@pytest.fixture
+def quiet(monkeypatch):
+    """Only Whisper posts: no background summary or waveform after a transcription."""
+    monkeypatch.setattr(summaries, 'SUMMARIES_ENABLED', False)
+    monkeypatch.setattr(waveform, 'WAVEFORM_ENABLED', False)
+    monkeypatch.setattr(backend.fingerprint, 'FINGERPRINT_ENABLED', False)
+
+@pytest.fixture
+def key():
+    key = f'hash:test-{uuid.uuid4().hex}'
+    yield key
+    with app.app_context():
+        TranscriptionLease.query.filter_by(key=key).delete()
+        db.session.commit()
+
+def add_lease(engine, key, status, result=None, status_code=None, seconds=60):
+    with engine.begin() as conn:
+        conn.execute(insert(TranscriptionLease.__table__).values(
+            key=key, holder='other-process', status=status, result=result, status_code=status_code,
+            expires_at=datetime.datetime.utcnow() + datetime.timedelta(seconds=seconds)))
+
+def test_concurrent_callers_share_one_run(engine, key):
+    calls = []
+    started = threading.Event()
+    def work():
+        calls.append(1)
+        started.set()
+        time.sleep(0.2)
+        return ['hello', [{'text': 'hello', 'start': 0, 'end': 1}]]
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        first = pool.submit(single_flight.run, engine, key, work, TranscriptionFailed)
+        started.wait(2)
+        others = [pool.submit(single_flight.run, engine, key, work, TranscriptionFailed) for _ in range(3)]
+        results = [f.result() for f in [first] + others]
+    assert len(calls) == 1
+    assert all(r == results[0] for r in results)
+
+def test_errors_are_shared_then_retried(engine, key):
+    started = threading.Event()
+    def failing():
+        started.set()
+        time.sleep(0.2)
+        raise TranscriptionFailed('throttled', 429)
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        first = pool.submit(single_flight.run, engine, key, failing, TranscriptionFailed)
+        started.wait(2)
+        second = pool.submit(single_flight.run, engine, key, lambda: pytest.fail('should wait'), TranscriptionFailed)
+        for future in (first, second):
+            with pytest.raises(TranscriptionFailed) as e:
+                future.result()
+            assert e.value.status_code == 429
+    # A caller arriving after the failure runs the work again
+    assert single_flight.run(engine, key, lambda: 'ok', TranscriptionFailed) == 'ok'
+
+def test_result_of_another_process_is_reused(engine, key):
+    add_lease(engine, key, 'done', '["from the other process", []]')
+    assert single_flight.run(engine, key, lambda: pytest.fail('should reuse'), TranscriptionFailed) == ['from the other process', []]
+
+def test_waits_for_another_process_and_takes_over_expired_leases(engine, key):
+    add_lease(engine, key, 'running')
+    def finish_elsewhere():
+        time.sleep(0.1)
+        single_flight.finish(engine, key, 'other-process', 'failed', 'bad audio', 400)
+    threading.Thread(target=finish_elsewhere).start()
+    with pytest.raises(TranscriptionFailed) as e:
+        single_flight.run(engine, key, lambda: pytest.fail('should wait'), TranscriptionFailed)
+    assert (e.value.message, e.value.status_code) == ('bad audio', 400)
+
+    with app.app_context():
+        TranscriptionLease.query.filter_by(key=key).delete()
+        db.session.commit()
+    # The holder died: its lease expired and the next caller runs the work
+    add_lease(engine, key, 'running', seconds=-1)
+    assert single_flight.run(engine, key, lambda: 'mine', TranscriptionFailed) == 'mine'
+
+def test_async_callers_share_one_run(engine, key):
+    calls = []
+    async def work():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return 'result'
+    async def main():
+        return await asyncio.gather(*(single_flight.run_async(engine, key, work, TranscriptionFailed) for _ in range(3)))
+    assert asyncio.run(main()) == ['result'] * 3
+    assert len(calls) == 1
+
+def test_double_click_on_transcribe_calls_whisper_once(engine, quiet, monkeypatch):
+    entered, release = threading.Event(), threading.Event()
+    calls = []
+    class Response:
+        ok = True
+        status_code = 200
+        def json(self):
+            return {'text': 'hello there', 'segments': [{'text': 'hello there', 'start': 0.0, 'end': 2.0}]}
+    def post(*args, **kwargs):
+        if 'files' in kwargs:  # The audio upload, not a GPT call
+            calls.append(1)
+        entered.set()
+        release.wait(5)
+        return Response()
+    monkeypatch.setattr(azure_openai.requests, 'post', post)
+    app.config['TESTING'] = True
+    client = app.test_client()
+    data = {'file': (io.BytesIO(uuid.uuid4().bytes), f'flight_{uuid.uuid4().hex}.mp3'), 'dbMode': 'global'}
+    file_id = client.post('/files', data=data, content_type='multipart/form-data').get_json()['file']['id']
+    try:
+        def click():
+            return app.test_client().post(f'/files/{file_id}/transcribe')
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            first = pool.submit(click)
+            entered.wait(5)
+            second = pool.submit(click)
+            time.sleep(0.3)
+            release.set()
+            responses = [first.result(), second.result()]
+        assert [rv.status_code for rv in responses] == [200, 200]
+        assert all(rv.get_json()['file']['transcription'] == 'hello there' for rv in responses)
+        assert len(calls) == 1
+    finally:
+        client.delete(f'/files/{file_id}')
+
+def upload(client, name):
+    data = {'file': (io.BytesIO(uuid.uuid4().bytes), name), 'dbMode': 'global'}
+    return client.post('/files', data=data, content_type='multipart/form-data').get_json()['file']['id']
+
+def test_batch_commits_each_file_without_holding_a_transaction(engine, quiet, monkeypatch):
+    class Response:
+        def __init__(self, ok):
+            self.ok = ok
+            self.status_code = 200 if ok else 500
+            self.text = '' if ok else 'Whisper is down'
+        def json(self):
+            return {'text': 'hello there', 'segments': [{'text': 'hello there', 'start': 0.0, 'end': 2.0}]}
+    calls = []
+    def post(*args, **kwargs):
+        assert not db.session().in_transaction()
+        calls.append(1)
+        return Response(len(calls) == 1)
+    monkeypatch.setattr(azure_openai.requests, 'post', post)
+    app.config['TESTING'] = True
+    client = app.test_client()
+    ids = [upload(client, f'batch_{uuid.uuid4().hex}.mp3') for _ in range(2)]
+    try:
+        rv = client.post('/files/batch-transcribe', json={'file_ids': ids, 'dbMode': 'global'})
+        assert rv.get_json()['transcribed_count'] == 1
+        assert rv.get_json()['errors'] == [f'Failed to transcribe file {ids[1]}: Whisper is down']
+        with app.app_context():
+            statuses = [db.session.get(backend.Transcription, i).transcription_status for i in ids]
+        assert statuses == ['transcribed', 'not_transcribed']
+    finally:
+        for file_id in ids:
+            client.delete(f'/files/{file_id}')
+
+def test_batch_keeps_a_result_saved_concurrently(engine, monkeypatch):
+    app.config['TESTING'] = True
+    client = app.test_client()
+    file_id = upload(client, f'batch_{uuid.uuid4().hex}.mp3')
+    class Response:
+        ok = True
+        status_code = 200
+        def json(self):
+            return {'text': 'late result', 'segments': [{'text': 'late result', 'start': 0.0, 'end': 2.0}]}
+    def post(*args, **kwargs):
+        # Another worker saves its transcript while this request waits for Whisper
+        with engine.begin() as conn:
+            conn.execute(update(backend.Transcription.__table__).where(backend.Transcription.id == file_id)
+                         .values(transcription='first result', transcription_status='transcribed'))
+        return Response()
+    monkeypatch.setattr(azure_openai.requests, 'post', post)
+    try:
+        rv = client.post('/files/batch-transcribe', json={'file_ids': [file_id], 'dbMode': 'global'})
+        assert rv.get_json()['errors'] == []
+        with app.app_context():
+            assert db.session.get(backend.Transcription, file_id).transcription == 'first result'
+    finally:
+        client.delete(f'/files/{file_id}')
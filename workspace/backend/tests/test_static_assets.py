@@ -0,0 +1,61 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import pytest
+import gzip
+from app import app
+import static_assets
+
+BUNDLE = b'function render(){return "transcript";}\n' * 200
+INDEX = b'<!doctype html><html><body><div id="root"></div><script src="/static/js/main.3f2a1b4c.js"></script></body></html>'
+
+@pytest.fixture
+def folder(tmp_path):
+    (tmp_path / 'js').mkdir()
+    (tmp_path / 'js' / 'main.3f2a1b4c.js').write_bytes(BUNDLE)
+    (tmp_path / 'index.html').write_bytes(INDEX)
+    (tmp_path / 'favicon.ico').write_bytes(b'\x00' * 64)
+    return tmp_path
+
+@pytest.fixture
+def client(folder, monkeypatch):
+    app.config['TESTING'] = True
+    monkeypatch.setitem(app.extensions, 'static_manifest', static_assets.build_manifest(str(folder)))
+    with app.test_client() as client:
+        yield client
+
+def test_fingerprinted_bundles_are_immutable_and_precompressed(client, monkeypatch):
+    calls = []
+    monkeypatch.setattr(static_assets, 'encode', lambda *args: calls.append(args))
+    rv = client.get('/static/js/main.3f2a1b4c.js', headers={'Accept-Encoding': 'gzip'})
+    assert rv.status_code == 200 and rv.headers['Content-Encoding'] == 'gzip'
+    assert rv.headers['Cache-Control'] == static_assets.IMMUTABLE
+    assert 'Accept-Encoding' in rv.headers['Vary']
+    assert gzip.decompress(rv.data) == BUNDLE and calls == []
+    plain = client.get('/js/main.3f2a1b4c.js')
+    assert plain.data == BUNDLE and 'Content-Encoding' not in plain.headers
+    assert plain.headers['ETag'] != rv.headers['ETag']
+
+def test_index_is_revalidated_with_its_etag(client):
+    rv = client.get('/')
+    assert rv.data == INDEX and rv.headers['Cache-Control'] == 'no-cache'
+    etag = rv.headers['ETag']
+    again = client.get('/', headers={'If-None-Match': etag})
+    assert again.status_code == 304 and not again.data
+    # Client-side routes get the same index.html
+    assert client.get('/files/42/view').headers['ETag'] == etag
+    icon = client.get('/favicon.ico')
+    assert icon.headers['Cache-Control'] == 'no-cache' and 'Content-Encoding' not in icon.headers
+
+def test_build_time_variants_are_used_and_not_listed(folder, tmp_path):
+    static_assets.precompress(str(folder))
+    assert (folder / 'js' / 'main.3f2a1b4c.js.gz').is_file()
+    assert not (folder / 'index.html.gz').exists()  # Too small to be worth it
+    manifest = static_assets.build_manifest(str(folder), compress=False)
+    assert sorted(manifest) == ['favicon.ico', 'index.html', 'js/main.3f2a1b4c.js']
+    assert manifest['js/main.3f2a1b4c.js'].variants['gzip'] == str(folder / 'js' / 'main.3f2a1b4c.js.gz')
+
+def test_missing_build_is_a_404(monkeypatch, tmp_path):
+    monkeypatch.setitem(app.extensions, 'static_manifest', static_assets.build_manifest(str(tmp_path / 'none')))
+    with app.test_client() as client:
+        assert client.get('/').status_code == 404
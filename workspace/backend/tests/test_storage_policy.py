@@ -0,0 +1,82 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import pytest
+import io
+import uuid
+import datetime
+from app import app, db, UPLOAD_FOLDER, THUMBNAIL_FOLDER, SPEECH_FOLDER
+from models import Transcription
+import storage_policy
+
+@pytest.fixture
+def client():
+    app.config['TESTING'] = True
+    with app.test_client() as client:
+        with app.app_context():
+            db.create_all()
+        yield client
+
+@pytest.fixture
+def owner():
+    owner_id = f'test-storage-{uuid.uuid4()}'
+    yield owner_id
+    with app.app_context():
+        for t in Transcription.query.filter_by(owner_id=owner_id).all():
+            storage_policy.remove_media(t)
+            db.session.delete(t)
+        db.session.commit()
+
+def add_media(owner_id, name, size, accessed_minutes_ago, speech_size=None):
+    with open(os.path.join(UPLOAD_FOLDER, name), 'wb') as f:
+        f.write(b'x' * size)
+    t = Transcription(filename=name, transcription='text', transcription_status='transcribed', owner_id=owner_id,
+                      file_size=size, stored_bytes=size + (speech_size or 0),
+                      last_accessed_at=datetime.datetime.utcnow() - datetime.timedelta(minutes=accessed_minutes_ago))
+    db.session.add(t)
+    db.session.commit()
+    if speech_size:
+        t.speech_file = f'{t.id}_{os.path.splitext(name)[0]}.ogg'
+        with open(os.path.join(SPEECH_FOLDER, t.speech_file), 'wb') as f:
+            f.write(b's' * speech_size)
+        db.session.commit()
+    return t.id
+
+def test_delete_file_removes_thumbnail(client):
+    name = f'thumb_{uuid.uuid4().hex}.mp3'
+    rv = client.post('/files', data={'file': (io.BytesIO(b'audio'), name)}, content_type='multipart/form-data')
+    file_id = rv.get_json()['file']['id']
+    thumbnail_path = os.path.join(THUMBNAIL_FOLDER, f'{file_id}.jpg')
+    with open(thumbnail_path, 'wb') as f:
+        f.write(b'jpg')
+    with app.app_context():
+        db.session.get(Transcription, file_id).thumbnail = f'{file_id}.jpg'
+        db.session.commit()
+    assert client.delete(f'/files/{file_id}').status_code == 200
+    assert not os.path.exists(thumbnail_path)
+
+def test_quota_evicts_least_recently_accessed_original(client, owner, monkeypatch):
+    monkeypatch.setattr(storage_policy, 'STORAGE_OWNER_QUOTA_BYTES', 1500)
+    with app.app_context():
+        old_id = add_media(owner, f'old_{uuid.uuid4().hex}.mp3', 1000, accessed_minutes_ago=60, speech_size=100)
+        new_id = add_media(owner, f'new_{uuid.uuid4().hex}.mp3', 1000, accessed_minutes_ago=1, speech_size=100)
+        assert storage_policy.enforce_quotas(owner) == [old_id]
+        old = db.session.get(Transcription, old_id)
+        assert old.media_state == 'speech'
+        assert not os.path.exists(os.path.join(UPLOAD_FOLDER, old.filename))
+        assert db.session.get(Transcription, new_id).media_state == 'original'
+    files = {f['id']: f for f in client.get(f'/files?userId={owner}&dbMode=private').get_json()['files']}
+    assert files[old_id]['fully_retrievable'] is False
+    assert files[new_id]['fully_retrievable'] is True
+    # The speech rendition is served once the original is gone
+    rv = client.get(f'/files/{old_id}/download?userId={owner}&dbMode=private')
+    assert rv.status_code == 200
+    assert rv.data == b's' * 100
+    report = client.get(f'/storage?userId={owner}&dbMode=private').get_json()
+    assert report['usage_bytes'] == 1200
+
+def test_upload_rejected_when_quota_cannot_be_met(client, owner, monkeypatch):
+    monkeypatch.setattr(storage_policy, 'STORAGE_OWNER_QUOTA_BYTES', 10)
+    data = {'file': (io.BytesIO(b'x' * 100), 'too_big.mp3'), 'userId': owner, 'dbMode': 'private'}
+    rv = client.post('/files', data=data, content_type='multipart/form-data')
+    assert rv.status_code == 507
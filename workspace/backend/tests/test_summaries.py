@@ -0,0 +1,94 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import pytest
+import asyncio
+import json
+import uuid
+from app import app, db
+from handlers import scoped_transcriptions
+from models import Transcription, TranscriptionSummary
+import summaries
+
+@pytest.fixture
+def owner():
+    owner_id = f'test-summaries-{uuid.uuid4()}'
+    with app.app_context():
+        db.create_all()
+    yield owner_id
+    with app.app_context():
+        for t in Transcription.query.filter_by(owner_id=owner_id).all():
+            db.session.delete(t)
+        db.session.commit()
+
+def add_transcription(owner_id, filename, text, summary=None):
+    t = Transcription(filename=filename, transcription=text, segments='[]', transcription_status='transcribed', owner_id=owner_id)
+    if summary is not None:
+        t.summary = TranscriptionSummary(summary=summary, keywords=json.dumps(['budget']), outline=json.dumps(['Q3 budget']),
+                                         source_hash=summaries.transcript_hash(text))
+    db.session.add(t)
+    db.session.commit()
+    return t.id
+
+def test_generate_digest_parses_fenced_json():
+    reply = '```json\n{"summary": "Budget review.", "keywords": ["budget", "Q3"], "outline": ["Numbers", "Next steps"]}\n```'
+    digest = summaries.generate_digest('short transcript', complete=lambda system, prompt: reply)
+    assert digest == {'summary': 'Budget review.', 'keywords': ['budget', 'Q3'], 'outline': ['Numbers', 'Next steps']}
+
+def test_generate_digest_summarises_long_transcripts_in_chunks(monkeypatch):
+    monkeypatch.setattr(summaries, 'SUMMARY_CHUNK_CHARS', 10)
+    calls = []
+    def complete(system, prompt):
+        calls.append(system)
+        if system == summaries.CHUNK_SYSTEM_PROMPT:
+            return 'part'
+        return '{"summary": "whole", "keywords": [], "outline": []}'
+    digest = summaries.generate_digest('x' * 35, complete=complete)
+    assert calls.count(summaries.CHUNK_SYSTEM_PROMPT) == 4
+    assert digest['summary'] == 'whole'
+
+def test_summary_is_stale_after_transcript_changes(owner):
+    with app.app_context():
+        file_id = add_transcription(owner, 'stale.mp3', 'original text', summary='Original.')
+        t = db.session.get(Transcription, file_id)
+        assert not summaries.is_stale(t)
+        t.transcription = 'edited text'
+        db.session.commit()
+        assert summaries.is_stale(t)
+
+def test_map_reduce_expands_only_selected_meetings(owner):
+    with app.app_context():
+        budget_id = add_transcription(owner, 'budget.mp3', 'We agreed the Q3 budget is 10k.', summary='Q3 budget meeting.')
+        add_transcription(owner, 'standup.mp3', 'Daily standup, nothing about money.')
+        prompts = []
+        async def complete(system, prompt):
+            prompts.append(prompt)
+            if system == summaries.RELEVANCE_SYSTEM_PROMPT:
+                return f'[{budget_id}]'
+            return 'The budget is 10k.'
+        async def load(ids):
+            return summaries.load_transcripts(ids)
+        records = summaries.digest_records(scoped_transcriptions('private', owner))
+        answer, sources = asyncio.run(summaries.answer_map_reduce('What is the budget?', records, complete, load))
+    assert answer == 'The budget is 10k.'
+    assert [s['id'] for s in sources] == [budget_id]
+    # Unsummarised transcripts still take part in the map step via an excerpt
+    assert 'Excerpt: Daily standup' in prompts[0]
+    assert 'We agreed the Q3 budget is 10k.' in prompts[-1]
+    assert 'Daily standup' not in prompts[-1]
+
+def test_summary_endpoint_not_found():
+    with app.test_client() as client:
+        assert client.get('/files/999999/summary').status_code == 404
+        assert client.post('/files/999999/summary').status_code == 404
+
+def test_summary_endpoints_check_the_owner(owner):
+    with app.app_context():
+        file_id = add_transcription(owner, 'private.mp3', 'Private meeting.', summary='Private.')
+    with app.test_client() as client:
+        rv = client.get(f'/files/{file_id}/summary', query_string={'dbMode': 'private', 'userId': owner})
+        assert rv.status_code == 200
+        assert rv.get_json()['summary']['summary'] == 'Private.'
+        assert client.get(f'/files/{file_id}/summary', query_string={'dbMode': 'private', 'userId': 'someone-else'}).status_code == 403
+        assert client.get(f'/files/{file_id}/summary').status_code == 403
+        assert client.post(f'/files/{file_id}/summary').status_code == 403
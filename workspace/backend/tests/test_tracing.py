@@ -0,0 +1,111 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import pytest
+import io
+import json
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from app import app
+import app as backend
+import azure_openai
+import tracing
+
+class ListExporter:
+    def __init__(self):
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def export(self, span):
+        with self._lock:
+            self.spans.append(span)
+
+    def named(self, name):
+        return [s for s in self.spans if s.name == name]
+
+@pytest.fixture
+def exporter(monkeypatch):
+    exporter = ListExporter()
+    monkeypatch.setattr(tracing, '_exporter', exporter)
+    return exporter
+
+@pytest.fixture
+def client():
+    app.config['TESTING'] = True
+    with app.test_client() as client:
+        yield client
+
+def test_disabled_tracing_is_a_no_op(monkeypatch):
+    monkeypatch.setattr(tracing, '_exporter', None)
+    with tracing.span('anything', size=1) as span:
+        span.set_attribute('ignored', True)
+        assert tracing.current_span() is None
+    assert span is tracing.NOOP_SPAN
+
+def test_nested_spans_share_the_trace(exporter):
+    with tracing.span('parent') as parent:
+        with tracing.span('child', **{'file.size': 10}) as child:
+            pass
+    assert child.trace_id == parent.trace_id
+    assert child.parent_id == parent.span_id
+    assert parent.parent_id is None
+    assert child.attributes == {'file.size': 10}
+    assert [s.name for s in exporter.spans] == ['child', 'parent']
+
+def test_errors_mark_the_span(exporter):
+    with pytest.raises(ValueError):
+        with tracing.span('failing'):
+            raise ValueError('boom')
+    assert 'boom' in exporter.spans[0].error
+    assert exporter.spans[0].to_otlp()['status']['code'] == 2
+
+def test_background_work_stays_in_the_trace(exporter):
+    def work():
+        with tracing.span('background'):
+            pass
+    with ThreadPoolExecutor(max_workers=1) as pool, tracing.span('request') as root:
+        pool.submit(tracing.in_current_context(work)).result()
+        pool.submit(work).result()
+    traced, untraced = exporter.named('background')
+    assert traced.parent_id == root.span_id
+    assert untraced.trace_id != root.trace_id
+
+def test_file_exporter_writes_otlp_json(tmp_path, monkeypatch):
+    path = tmp_path / 'traces.jsonl'
+    monkeypatch.setattr(tracing, '_exporter', tracing.FileExporter(str(path)))
+    traceparent = '00-' + 'a' * 32 + '-' + 'b' * 16 + '-01'
+    with tracing.span('upload', traceparent=traceparent, **{'file.size': 5, 'audio.duration_s': 1.5}):
+        pass
+    request = json.loads(path.read_text().splitlines()[0])
+    span = request['resourceSpans'][0]['scopeSpans'][0]['spans'][0]
+    assert span['traceId'] == 'a' * 32
+    assert span['parentSpanId'] == 'b' * 16
+    assert {'key': 'file.size', 'value': {'intValue': '5'}} in span['attributes']
+    assert {'key': 'audio.duration_s', 'value': {'doubleValue': 1.5}} in span['attributes']
+
+def test_transcribe_by_id_records_pipeline_stages(client, exporter, monkeypatch):
+    class Response:
+        ok = True
+        status_code = 200
+        def json(self):
+            return {'text': 'hello there', 'duration': 2.0, 'segments': [{'text': 'hello there', 'start': 0.0, 'end': 2.0}]}
+    monkeypatch.setattr(azure_openai.requests, 'post', lambda *args, **kwargs: Response())
+    monkeypatch.setattr(backend.fingerprint, 'FINGERPRINT_ENABLED', False)
+    data = {'file': (io.BytesIO(uuid.uuid4().bytes), f'trace_{uuid.uuid4().hex}.mp3'), 'dbMode': 'global'}
+    rv = client.post('/files', data=data, content_type='multipart/form-data')
+    file_id = rv.get_json()['file']['id']
+    try:
+        exporter.spans.clear()
+        rv = client.post(f'/files/{file_id}/transcribe', headers={'traceparent': '00-' + 'c' * 32 + '-' + 'd' * 16 + '-01'})
+        assert rv.status_code == 200
+        root = exporter.named('POST /files/<int:file_id>/transcribe')[0]
+        assert root.trace_id == 'c' * 32 and root.parent_id == 'd' * 16
+        assert root.attributes['http.status_code'] == 200
+        whisper = exporter.named('whisper.request')[0]
+        assert whisper.parent_id == root.span_id
+        assert whisper.attributes['http.status_code'] == 200
+        assert exporter.named('segments.postprocess')[0].attributes['audio.duration_s'] == 2.0
+        assert exporter.named('db.commit')
+    finally:
+        client.delete(f'/files/{file_id}')
@@ -0,0 +1,205 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import pytest
+import asyncio
+import json
+import threading
+import time
+import uuid
+import app as backend
+from app import app, db
+from models import Transcription
+from starlette.testclient import TestClient
+import asgi
+import handlers
+import transcript_qa
+
+def meeting_segments(minutes=180):
+    """One 10-second segment per slot; the budget discussion happens at 95:00."""
+    segments = []
+    for i in range(minutes * 6):
+        text = 'we went over the usual status updates and action items'
+        if i == 95 * 6:
+            text = 'the marketing budget for next quarter is two hundred thousand'
+        segments.append({'text': text, 'start': i * 10.0, 'end': i * 10.0 + 10})
+    return segments
+
+@pytest.fixture
+def client():
+    app.config['TESTING'] = True
+    with app.test_client() as client:
+        with app.app_context():
+            db.create_all()
+        yield client
+
+def test_build_passages_groups_segments_by_time():
+    passages = transcript_qa.build_passages(meeting_segments(2), seconds=30)
+    assert len(passages) == 4
+    assert passages[0]['start'] == 0 and passages[0]['end'] == 30
+    assert passages[1]['line'].startswith('[00:30] ')
+
+def test_select_passages_keeps_relevant_passage_within_budget():
+    passages = transcript_qa.build_passages(meeting_segments())
+    selected = transcript_qa.select_passages(passages, 'What is the marketing budget?', budget=200)
+    assert sum(p['tokens'] for p in selected) <= 200
+    assert any('marketing budget' in p['text'] for p in selected)
+    assert [p['start'] for p in selected] == sorted(p['start'] for p in selected)
+
+def test_short_transcript_is_sent_whole():
+    passages = transcript_qa.build_passages(meeting_segments(1))
+    assert transcript_qa.select_passages(passages, 'anything', budget=10000) == passages
+
+def test_citations_map_timestamps_to_passages():
+    passages = transcript_qa.build_passages(meeting_segments())
+    cited = transcript_qa.citations('It is 200k [1:35:00], see also [95:10] and [00:10, 00:20].', passages)
+    assert [c['start'] for c in cited] == [5700.0, 0.0]
+    assert 'marketing budget' in cited[0]['text']
+
+def test_map_reduce_queries_every_group_and_merges():
+    calls = []
+    async def complete(system, prompt):
+        calls.append(system)
+        if system == transcript_qa.MERGE_SYSTEM_PROMPT:
+            return 'Two hundred thousand [1:35:00].'
+        if 'marketing budget' in prompt:
+            return 'The budget is 200k [1:35:00].'
+        if '[00:00]' in prompt:
+            return 'Budget was mentioned without numbers [00:00].'
+        return transcript_qa.NOT_FOUND
+    result = asyncio.run(transcript_qa.answer_question('What is the marketing budget?', meeting_segments(), 'map-reduce', complete))
+    groups = transcript_qa.passage_groups(transcript_qa.build_passages(meeting_segments()))
+    assert len(groups) > 1
+    assert calls.count(transcript_qa.GROUP_ASK_SYSTEM_PROMPT) == len(groups)
+    assert calls.count(transcript_qa.MERGE_SYSTEM_PROMPT) == 1
+    assert result['answer'] == 'Two hundred thousand [1:35:00].'
+    assert result['citations'][0]['start'] == 5700.0
+
+def test_ask_by_file_id(client, monkeypatch):
+    monkeypatch.setattr(transcript_qa, 'ASK_CONTEXT_TOKENS', 300)
+    prompts = []
+    def fake_chat_completion(system, prompt):
+        prompts.append(prompt)
+        return 'Two hundred thousand [1:35:00].'
+    monkeypatch.setattr(backend, 'chat_completion', fake_chat_completion)
+    with app.app_context():
+        t = Transcription(filename=f'qa_{uuid.uuid4().hex}.mp3', transcription='long meeting', segments=json.dumps(meeting_segments()),
+                          transcription_status='transcribed')
+        db.session.add(t)
+        db.session.commit()
+        file_id = t.id
+    try:
+        rv = client.post('/ask', json={'file_id': file_id, 'question': 'What is the marketing budget?'})
+        assert rv.status_code == 200
+        data = rv.get_json()
+        assert data['mode'] == 'select'
+        assert data['citations'][0]['start'] == 5700.0
+        assert len(prompts) == 1 and 'marketing budget' in prompts[0]
+        assert transcript_qa.estimate_tokens(prompts[0]) < 400
+    finally:
+        with app.app_context():
+            db.session.delete(db.session.get(Transcription, file_id))
+            db.session.commit()
+
+@pytest.fixture
+def private_file():
+    owner = f'test-qa-{uuid.uuid4()}'
+    with app.app_context():
+        t = Transcription(filename=f'qa_{uuid.uuid4().hex}.mp3', transcription='long meeting', segments=json.dumps(meeting_segments(1)),
+                          transcription_status='transcribed', owner_id=owner)
+        db.session.add(t)
+        db.session.commit()
+        file_id = t.id
+    yield file_id, owner
+    with app.app_context():
+        db.session.delete(db.session.get(Transcription, file_id))
+        db.session.commit()
+
+@pytest.mark.parametrize('native', [False, True], ids=['flask', 'asgi'])
+def test_ask_by_file_id_checks_the_owner(client, private_file, monkeypatch, native):
+    file_id, owner = private_file
+    monkeypatch.setattr(backend, 'chat_completion', lambda system, prompt: 'Nothing about money.')
+    async def gpt_answer(system, prompt):
+        return 'Nothing about money.'
+    monkeypatch.setattr(asgi, 'gpt_answer', gpt_answer)
+    with TestClient(asgi.application) as asgi_client:
+        post = asgi_client.post if native else client.post
+        question = {'file_id': file_id, 'question': 'What is the budget?'}
+        assert post('/ask', json={**question, 'dbMode': 'private', 'userId': owner}).status_code == 200
+        assert post('/ask', json={**question, 'dbMode': 'private', 'userId': 'someone-else'}).status_code == 403
+        assert post('/ask', json=question).status_code == 403
+
+@pytest.mark.parametrize('native', [False, True], ids=['flask', 'asgi'])
+def test_ask_batch_by_file_id_checks_the_owner(client, private_file, monkeypatch, native):
+    file_id, owner = private_file
+    monkeypatch.setattr(backend, 'chat_completion', lambda system, prompt: 'Nothing about money.')
+    async def gpt_answer(system, prompt):
+        return 'Nothing about money.'
+    monkeypatch.setattr(asgi, 'gpt_answer', gpt_answer)
+    with TestClient(asgi.application) as asgi_client:
+        post = asgi_client.post if native else client.post
+        batch = {'file_id': file_id, 'questions': ['What is the budget?', 'Who owns it?']}
+        assert post('/ask/batch', json={**batch, 'dbMode': 'private', 'userId': owner}).status_code == 200
+        assert post('/ask/batch', json={**batch, 'dbMode': 'private', 'userId': 'someone-else'}).status_code == 403
+        assert post('/ask/batch', json=batch).status_code == 403
+
+def test_ask_by_unknown_file_id(client):
+    rv = client.post('/ask', json={'file_id': 999999999, 'question': 'Anything?'})
+    assert rv.status_code == 404
+
+def test_ask_batch_asks_each_distinct_question_once_in_parallel(client, monkeypatch):
+    running, peak, calls = [0], [0], []
+    lock = threading.Lock()
+    def fake_chat_completion(system, prompt):
+        with lock:
+            calls.append(prompt)
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+        time.sleep(0.1)
+        with lock:
+            running[0] -= 1
+        if 'Risks' in prompt:
+            raise backend.GPTError('throttled', 429)
+        return 'answer to ' + prompt.rsplit('Question: ', 1)[1].split('\n')[0]
+    monkeypatch.setattr(backend, 'chat_completion', fake_chat_completion)
+    questions = ['Summary?', 'Decisions?', ' Summary? ', 'Action items?', 'Risks?']
+    rv = client.post('/ask/batch', json={'transcript': 'we decided to ship', 'questions': questions})
+    assert rv.status_code == 200
+    answers = rv.get_json()['answers']
+    assert [a['question'] for a in answers] == questions
+    assert answers[0]['answer'] == answers[2]['answer'] == 'answer to Summary?'
+    assert answers[4] == {'question': 'Risks?', 'error': 'throttled', 'status_code': 429}
+    assert len(calls) == 4
+    assert peak[0] > 1
+    assert all('we decided to ship' in prompt for prompt in calls)
+
+def test_ask_batch_by_file_id_shares_passages(client, monkeypatch):
+    monkeypatch.setattr(transcript_qa, 'ASK_CONTEXT_TOKENS', 300)
+    built = []
+    real_build = handlers.build_passages
+    monkeypatch.setattr(handlers, 'build_passages', lambda segments: built.append(1) or real_build(segments))
+    monkeypatch.setattr(backend, 'chat_completion', lambda system, prompt: 'Two hundred thousand [1:35:00].')
+    with app.app_context():
+        t = Transcription(filename=f'qa_{uuid.uuid4().hex}.mp3', transcription='long meeting', segments=json.dumps(meeting_segments()),
+                          transcription_status='transcribed')
+        db.session.add(t)
+        db.session.commit()
+        file_id = t.id
+    try:
+        rv = client.post('/ask/batch', json={'file_id': file_id, 'questions': ['What is the marketing budget?', 'Who owns it?']})
+        assert rv.status_code == 200
+        answers = rv.get_json()['answers']
+        assert len(answers) == 2 and all(a['citations'][0]['start'] == 5700.0 for a in answers)
+        assert built == [1]
+    finally:
+        with app.app_context():
+            db.session.delete(db.session.get(Transcription, file_id))
+            db.session.commit()
+
+def test_ask_batch_validation(client, monkeypatch):
+    monkeypatch.setattr(transcript_qa, 'ASK_BATCH_MAX_QUESTIONS', 2)
+    assert client.post('/ask/batch', json={'transcript': 'x', 'questions': []}).status_code == 400
+    assert client.post('/ask/batch', json={'transcript': 'x', 'questions': ['ok', '']}).status_code == 400
+    assert client.post('/ask/batch', json={'transcript': 'x', 'questions': ['a', 'b', 'c']}).status_code == 400
+    assert client.post('/ask/batch', json={'questions': ['a']}).status_code == 400
+    assert client.post('/ask/batch', json={'file_id': 999999999, 'questions': ['a']}).status_code == 404
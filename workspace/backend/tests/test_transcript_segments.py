@@ -0,0 +1,106 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import json
+import pytest
+import random
+import time
+import transcript_segments
+
+THREE_HOURS = 3 * 3600
+
+def legacy_word_segments(data):
+    """The per-chunk loop build_word_segments used before, kept as the reference output."""
+    transcription = data.get('text', '')
+    segments = data.get('segments', [])
+    word_segments = []
+    has_words = False
+    for seg in segments:
+        if 'words' in seg and seg['words']:
+            has_words = True
+            for word in seg['words']:
+                word_segments.append({'text': word['word'], 'start': word['start'], 'end': word['end']})
+    if not has_words:
+        chunk_size = 3
+        for seg in segments:
+            words = seg.get('text', '').split()
+            start = seg.get('start', 0)
+            end = seg.get('end', 0)
+            if not words:
+                continue
+            duration = (end - start) / max(len(words), 1) if end > start else 0
+            for i in range(0, len(words), chunk_size):
+                chunk_words = words[i:i+chunk_size]
+                chunk_start = start + (i * duration)
+                chunk_end = chunk_start + (len(chunk_words) * duration)
+                word_segments.append({'text': ' '.join(chunk_words), 'start': chunk_start, 'end': chunk_end})
+    if not word_segments:
+        word_segments = [{'text': transcription, 'start': 0, 'end': 0}]
+    return transcription, word_segments
+
+def verbose_json(seconds, seed=1, words=False):
+    """A Whisper response of about seconds of speech, in segments of a few seconds."""
+    rng = random.Random(seed)
+    vocabulary = ['budget', 'review', 'moved', 'to', 'Friday', 'the', 'team', 'agreed', 'zażółć', 'next', 'sprint']
+    segments, position = [], 0.0
+    while position < seconds:
+        length = rng.uniform(2, 8)
+        text = ' '.join(rng.choice(vocabulary) for _ in range(rng.randint(1, 20)))
+        segment = {'id': len(segments), 'start': position, 'end': position + length, 'text': ' ' + text}
+        if words:
+            step = length / len(text.split())
+            segment['words'] = [{'word': w, 'start': position + i * step, 'end': position + (i + 1) * step}
+                                for i, w in enumerate(text.split())]
+        segments.append(segment)
+        position += length
+    return {'text': ''.join(s['text'] for s in segments), 'duration': seconds, 'segments': segments}
+
+def test_output_matches_the_loop_it_replaces():
+    cases = [
+        verbose_json(600),
+        verbose_json(600, words=True),
+        {'text': 'a b c d', 'segments': [{'text': 'a b c d', 'start': 0, 'end': 0},
+                                         {'text': 'e f', 'start': 5, 'end': 7},
+                                         {'text': '   ', 'start': 7, 'end': 9},
+                                         {'text': 'g h i j k l m', 'start': 9.5, 'end': 9.5}]},
+        {'text': 'no segments'},
+        {'text': '', 'segments': []},
+    ]
+    for data in cases:
+        transcription, segments = transcript_segments.word_segments(data)
+        expected = legacy_word_segments(data)
+        assert (transcription, segments) == expected
+        # Same types too: an int start stays an int in the stored JSON
+        assert json.dumps(segments) == json.dumps(expected[1])
+        assert transcript_segments.loads(transcript_segments.dumps(segments)) == json.loads(json.dumps(segments))
+
+def test_unreadable_segments_get_placeholders():
+    class Row:
+        transcription = 'one two three four'
+        segments = '{not json'
+    assert transcript_segments.stored_segments(Row()) == [
+        {'text': 'one two three', 'start': 0, 'end': 3},
+        {'text': 'four', 'start': 3, 'end': 4},
+    ]
+
+def best_of_three(fn):
+    timings = []
+    for _ in range(3):
+        started = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+@pytest.mark.skipif(os.environ.get('RUN_BENCHMARKS') != 'true', reason='Benchmark; set RUN_BENCHMARKS=true to run it')
+def test_three_hour_transcript_benchmark():
+    """Micro-benchmark: response -> stored JSON -> served segments for a 3-hour meeting without word timings."""
+    data = verbose_json(THREE_HOURS)
+    def before():
+        _, segments = legacy_word_segments(data)
+        json.loads(json.dumps(segments))
+    def after():
+        _, segments = transcript_segments.word_segments(data)
+        transcript_segments.loads(transcript_segments.dumps(segments))
+    legacy, current = best_of_three(before), best_of_three(after)
+    print(f'\n[BENCHMARK] {len(data["segments"])} segments: loop + json {legacy * 1000:.1f} ms, '
+          f'transcript_segments {current * 1000:.1f} ms ({legacy / current:.1f}x)')
@@ -0,0 +1,90 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import pytest
+import shutil
+import subprocess
+import numpy as np
+import app as backend
+import azure_openai
+import vad
+
+def levels_for(pattern):
+    """Frame levels for a list of (seconds, is_speech) stretches."""
+    rng = np.random.default_rng(0)
+    samples = []
+    for seconds, is_speech in pattern:
+        n = int(seconds * vad.SAMPLE_RATE)
+        noise = rng.normal(0, 0.002, n)
+        if is_speech:
+            t = np.arange(n) / vad.SAMPLE_RATE
+            noise += 0.3 * np.sin(2 * np.pi * 220 * t)
+        samples.append(noise)
+    return vad.frame_levels(np.concatenate(samples))
+
+def test_speech_spans_cut_long_silences_only():
+    levels = levels_for([(30, False), (5, True), (1, False), (4, True), (20, False), (3, True), (10, False)])
+    spans = vad.speech_spans(levels)
+    # The one second pause is bridged, the twenty second one is cut
+    assert len(spans) == 2
+    (a_start, a_end), (b_start, b_end) = spans
+    assert a_start == pytest.approx(30 - vad.VAD_PADDING_SECONDS, abs=0.05)
+    assert a_end == pytest.approx(40 + vad.VAD_PADDING_SECONDS, abs=0.05)
+    assert b_start == pytest.approx(60 - vad.VAD_PADDING_SECONDS, abs=0.05)
+    assert b_end == pytest.approx(63 + vad.VAD_PADDING_SECONDS, abs=0.05)
+
+def test_remap_segments_restores_original_timeline():
+    timeline = vad.build_timeline([(30.0, 40.0), (60.0, 63.0)])
+    assert timeline == [(0.0, 30.0, 40.0), (10.0, 60.0, 63.0)]
+    segments = [
+        {'text': 'hello', 'start': 0.5, 'end': 1.0},
+        {'text': 'straddles', 'start': 9.8, 'end': 10.2},
+        {'text': 'later', 'start': 10.0, 'end': 12.5},
+        {'text': 'at the cut', 'start': 9.0, 'end': 10.0},
+    ]
+    remapped = vad.remap_segments(segments, timeline)
+    assert [(s['start'], s['end']) for s in remapped] == [(30.5, 31.0), (39.8, 60.2), (60.0, 62.5), (39.0, 40.0)]
+    assert remapped[0]['text'] == 'hello'
+    assert vad.remap_segments(segments, None) is segments
+
+def test_trim_is_skipped_when_little_silence(monkeypatch):
+    monkeypatch.setattr(vad, 'VAD_ENABLED', True)
+    monkeypatch.setattr(vad, 'decode_levels', lambda path: levels_for([(2, False), (20, True), (3, False)]))
+    monkeypatch.setattr(vad.subprocess, 'run', lambda *a, **k: pytest.fail('should not cut'))
+    assert vad.trim('talk.mp3') == ('talk.mp3', None)
+
+def test_whisper_timestamps_are_remapped(monkeypatch, tmp_path):
+    audio = tmp_path / 'talk.mp3'
+    trimmed = tmp_path / 'talk.mp3.vad.mp3'
+    audio.write_bytes(b'original')
+    trimmed.write_bytes(b'trimmed')
+    monkeypatch.setattr(vad, 'trim', lambda path: (str(trimmed), vad.build_timeline([(120.0, 125.0)])))
+    uploaded = []
+    class Response:
+        ok = True
+        status_code = 200
+        def json(self):
+            return {'text': 'hi', 'segments': [{'text': 'hi', 'start': 0.0, 'end': 1.0, 'words': [{'word': 'hi', 'start': 0.2, 'end': 0.6}]}]}
+    def post(url, headers=None, files=None, data=None):
+        uploaded.append(files['file'][1].read())
+        return Response()
+    monkeypatch.setattr(azure_openai.requests, 'post', post)
+    response, timeline = backend.whisper_request(str(audio))
+    assert uploaded == [b'trimmed']
+    assert not trimmed.exists()
+    _, segments = backend.build_word_segments(response.json(), timeline)
+    assert segments == [{'text': 'hi', 'start': 120.2, 'end': 120.6}]
+
+@pytest.mark.skipif(shutil.which('ffmpeg') is None, reason='ffmpeg not installed')
+def test_trim_cuts_silence_from_a_real_file(monkeypatch, tmp_path):
+    monkeypatch.setattr(vad, 'VAD_ENABLED', True)
+    path = str(tmp_path / 'meeting.wav')
+    subprocess.run([
+        'ffmpeg', '-y', '-v', 'error',
+        '-f', 'lavfi', '-i', 'anullsrc=r=16000:cl=mono:d=20',
+        '-f', 'lavfi', '-i', 'sine=frequency=300:sample_rate=16000:duration=5',
+        '-filter_complex', '[0][1]concat=n=2:v=0:a=1', path,
+    ], check=True)
+    trimmed_path, timeline = vad.trim(path)
+    assert trimmed_path != path and os.path.exists(trimmed_path)
+    assert timeline[0][1] == pytest.approx(20 - vad.VAD_PADDING_SECONDS, abs=0.1)
@@ -0,0 +1,125 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import pytest
+import io
+import shutil
+import subprocess
+import uuid
+import numpy as np
+from app import app, db
+from models import Transcription
+import blob_storage
+import waveform
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    folders = {area: str(tmp_path / 'media' / area) for area in blob_storage.AREA_FOLDERS}
+    for folder in folders.values():
+        os.makedirs(folder)
+    store = blob_storage.LocalBlobStore(folders)
+    monkeypatch.setitem(app.extensions, 'blob_store', store)
+    return store
+
+@pytest.fixture
+def client():
+    app.config['TESTING'] = True
+    with app.test_client() as client:
+        with app.app_context():
+            db.create_all()
+        yield client
+
+@pytest.fixture
+def row():
+    with app.app_context():
+        t = Transcription(filename=f'wave_{uuid.uuid4().hex}.mp3', transcription='', file_hash=uuid.uuid4().hex)
+        db.session.add(t)
+        db.session.commit()
+        file_id, file_hash = t.id, t.file_hash
+    yield file_id, file_hash
+    with app.app_context():
+        Transcription.query.filter_by(id=file_id).delete()
+        db.session.commit()
+
+def tone(seconds, amplitude=0.5):
+    t = np.arange(int(seconds * waveform.SAMPLE_RATE)) / waveform.SAMPLE_RATE
+    return (np.sin(2 * np.pi * 50 * t) * amplitude * 32767).astype(np.int16)
+
+class FakeProc:
+    def __init__(self, data):
+        self.stdout = io.BytesIO(data)
+        self.returncode = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+def test_decode_peaks_keeps_buckets_aligned_across_reads(monkeypatch):
+    samples = np.concatenate([tone(3), np.zeros(1000, dtype=np.int16), tone(0.5, amplitude=0.1)])
+    monkeypatch.setattr(waveform, 'READ_BYTES', 1001)  # Reads end mid-sample and mid-bucket
+    monkeypatch.setattr(waveform.subprocess, 'Popen', lambda *a, **k: FakeProc(samples.tobytes()))
+    mins, maxs = waveform.decode_peaks('talk.mp3')
+    expected_mins, expected_maxs = waveform.bucket_peaks(samples, waveform.samples_per_peak())
+    assert np.array_equal(mins, expected_mins) and np.array_equal(maxs, expected_maxs)
+    assert len(mins) == -(-len(samples) // waveform.samples_per_peak())
+
+def test_levels_encode_and_serve_by_resolution():
+    samples = np.concatenate([tone(60), np.zeros(60 * waveform.SAMPLE_RATE, dtype=np.int16)])
+    data = waveform.encode(waveform.build_levels(*waveform.bucket_peaks(samples, waveform.samples_per_peak())))
+    sample_rate, levels = waveform.decode(data)
+    assert sample_rate == 8000
+    assert [peaks for _, peaks, _ in levels] == [12000, 3000, 750]
+    assert len(data) < 32 * 1024
+
+    body, samples_per_peak, peaks = waveform.level_for(data, 1000)
+    assert (samples_per_peak, peaks) == (320, 3000)
+    header = waveform.SERVED_HEADER.unpack_from(body)
+    assert header == (8000, 320, 3000)
+    pairs = np.frombuffer(body[waveform.SERVED_HEADER.size:], dtype=np.int8).reshape(-1, 2)
+    assert len(pairs) == 3000
+    assert pairs[:1500, 0].min() <= -63 and pairs[:1500, 1].max() >= 63
+    assert not pairs[1500:].any()  # The silent minute is flat
+    assert waveform.level_for(data, 100)[2] == 750
+    assert waveform.level_for(data, 50000)[2] == 12000
+
+def test_waveform_route(client, store, row, monkeypatch):
+    file_id, file_hash = row
+    scheduled = []
+    monkeypatch.setattr(waveform, 'schedule_waveform', lambda app, file_id: scheduled.append(file_id))
+    # Neither peaks nor media
+    assert client.get(f'/files/{file_id}/waveform').status_code == 404
+    with app.app_context():
+        filename = db.session.get(Transcription, file_id).filename
+    with open(store.path('uploads', filename), 'wb') as f:
+        f.write(b'media')
+    rv = client.get(f'/files/{file_id}/waveform')
+    assert rv.status_code == 202 and scheduled == [file_id]
+
+    data = waveform.encode(waveform.build_levels(*waveform.bucket_peaks(tone(30), waveform.samples_per_peak())))
+    with open(store.path('thumbnails', waveform.blob_name(file_hash)), 'wb') as f:
+        f.write(data)
+    rv = client.get(f'/files/{file_id}/waveform?resolution=500')
+    assert rv.status_code == 200
+    assert rv.headers['X-Waveform-Peaks'] == '750'
+    assert waveform.SERVED_HEADER.unpack_from(rv.data) == (8000, 320, 750)
+    assert client.get(f'/files/{file_id}/waveform?resolution=500', headers={'If-None-Match': rv.headers['ETag']}).status_code == 304
+    assert client.get(f'/files/{file_id}/waveform?resolution=x').status_code == 400
+    # A global file is not served as part of a private database
+    assert client.get(f'/files/{file_id}/waveform', query_string={'dbMode': 'private', 'userId': 'someone'}).status_code == 403
+
+    assert client.delete(f'/files/{file_id}').status_code == 200
+    assert not store.exists('thumbnails', waveform.blob_name(file_hash))
+
+@pytest.mark.skipif(shutil.which('ffmpeg') is None, reason='ffmpeg not installed')
+def test_make_waveform_from_a_real_file(store, row):
+    file_id, file_hash = row
+    with app.app_context():
+        filename = db.session.get(Transcription, file_id).filename
+    subprocess.run(['ffmpeg', '-y', '-v', 'error', '-f', 'lavfi', '-i', 'sine=frequency=300:sample_rate=16000:duration=10',
+                    store.path('uploads', filename)], check=True)
+    with app.app_context():
+        waveform.make_waveform(file_id)
+        _, levels = waveform.decode(waveform.load(file_hash))
+    assert levels[0][1] == pytest.approx(1000, abs=5)
@@ -0,0 +1,242 @@
+"""
+Lightweight tracing for the upload-to-transcript pipeline.
+
+Every request gets a root span and each pipeline stage (upload, hashing, duplicate
+lookup, thumbnail, ffmpeg extraction, Whisper call, segment post-processing, DB
+commit, background summary and rendition) a child span with attributes such as
+file size, audio duration and upstream status. The current span is kept in a
+contextvar, and work handed to a thread pool through in_current_context() stays
+in the same trace. An incoming W3C traceparent header continues the caller's trace.
+
+Spans are exported in the OTLP/JSON format:
+
+  TRACE_EXPORT=file   one ExportTraceServiceRequest per line in TRACE_FILE
+  TRACE_EXPORT=otlp   batched POSTs to OTEL_EXPORTER_OTLP_ENDPOINT + /v1/traces
+                      (an OpenTelemetry collector, Jaeger, Tempo, ...)
+
+With TRACE_EXPORT unset (default) span() hands out a shared no-op span.
+"""
+import contextlib
+import contextvars
+import json
+import os
+import queue
+import re
+import secrets
+import threading
+import time
+
+import requests
+
+TRACE_EXPORT = os.environ.get('TRACE_EXPORT', '')
+TRACE_FILE = os.environ.get('TRACE_FILE', os.path.join(os.path.dirname(__file__), 'traces.jsonl'))
+OTLP_ENDPOINT = os.environ.get('OTEL_EXPORTER_OTLP_ENDPOINT', 'http://localhost:4318')
+SERVICE_NAME = os.environ.get('OTEL_SERVICE_NAME', 'meeting-transcriber')
+OTLP_BATCH_SIZE = 256
+OTLP_FLUSH_SECONDS = 2.0
+
+TRACEPARENT_RE = re.compile(r'^00-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}$')
+
+_current = contextvars.ContextVar('current_span', default=None)
+
+
+class Span:
+    def __init__(self, name, trace_id, parent_id=None, attributes=None):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.attributes = dict(attributes or {})
+        self.error = None
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+
+    def set_attribute(self, key, value):
+        if value is not None:
+            self.attributes[key] = value
+
+    def set_attributes(self, attributes):
+        for key, value in attributes.items():
+            self.set_attribute(key, value)
+
+    def record_error(self, message):
+        self.error = str(message)
+
+    def traceparent(self):
+        return f'00-{self.trace_id}-{self.span_id}-01'
+
+    def to_otlp(self):
+        span = {
+            'traceId': self.trace_id,
+            'spanId': self.span_id,
+            'name': self.name,
+            'kind': 1,
+            'startTimeUnixNano': str(self.start_ns),
+            'endTimeUnixNano': str(self.end_ns or time.time_ns()),
+            'attributes': [_otlp_attribute(k, v) for k, v in self.attributes.items()],
+            'status': {'code': 2, 'message': self.error} if self.error else {'code': 1},
+        }
+        if self.parent_id:
+            span['parentSpanId'] = self.parent_id
+        return span
+
+
+class _NoopSpan:
+    def set_attribute(self, key, value):
+        pass
+
+    def set_attributes(self, attributes):
+        pass
+
+    def record_error(self, message):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+def _otlp_attribute(key, value):
+    if isinstance(value, bool):
+        typed = {'boolValue': value}
+    elif isinstance(value, int):
+        typed = {'intValue': str(value)}
+    elif isinstance(value, float):
+        typed = {'doubleValue': value}
+    else:
+        typed = {'stringValue': str(value)}
+    return {'key': key, 'value': typed}
+
+
+def export_request(spans):
+    """Wrap spans in an OTLP ExportTraceServiceRequest."""
+    return {
+        'resourceSpans': [{
+            'resource': {'attributes': [_otlp_attribute('service.name', SERVICE_NAME)]},
+            'scopeSpans': [{'scope': {'name': 'tracing'}, 'spans': [s.to_otlp() for s in spans]}],
+        }]
+    }
+
+
+class FileExporter:
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def export(self, span):
+        line = json.dumps(export_request([span]), separators=(',', ':'))
+        with self._lock, open(self.path, 'a') as f:
+            f.write(line + '\n')
+
+
+class OTLPExporter:
+    """Queues finished spans and posts them in batches from a background thread."""
+
+    def __init__(self, endpoint):
+        self.url = endpoint.rstrip('/') + '/v1/traces'
+        self._queue = queue.Queue(maxsize=OTLP_BATCH_SIZE * 16)
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def export(self, span):
+        try:
+            self._queue.put_nowait(span)
+        except queue.Full:
+            pass  # Dropping spans is better than slowing requests down
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + OTLP_FLUSH_SECONDS
+            while len(batch) < OTLP_BATCH_SIZE and time.monotonic() < deadline:
+                try:
+                    batch.append(self._queue.get(timeout=max(0.0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+            try:
+                requests.post(self.url, json=export_request(batch), timeout=10)
+            except requests.RequestException as e:
+                print(f"[TRACE] Failed to export {len(batch)} spans: {e}")
+
+
+def _create_exporter():
+    if TRACE_EXPORT == 'file':
+        return FileExporter(TRACE_FILE)
+    if TRACE_EXPORT == 'otlp':
+        return OTLPExporter(OTLP_ENDPOINT)
+    return None
+
+
+_exporter = _create_exporter()
+
+
+def set_exporter(exporter):
+    global _exporter
+    _exporter = exporter
+
+
+def enabled():
+    return _exporter is not None
+
+
+def current_span():
+    return _current.get()
+
+
+@contextlib.contextmanager
+def span(name, traceparent=None, **attributes):
+    """Run a block as a child of the current span (or a new trace). Yields the span."""
+    if _exporter is None:
+        yield NOOP_SPAN
+        return
+    parent = _current.get()
+    if parent is not None:
+        trace_id, parent_id = parent.trace_id, parent.span_id
+    else:
+        match = TRACEPARENT_RE.match(traceparent or '')
+        trace_id, parent_id = (match.group(1), match.group(2)) if match else (secrets.token_hex(16), None)
+    current = Span(name, trace_id, parent_id, attributes)
+    token = _current.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.record_error(repr(e))
+        raise
+    finally:
+        current.end_ns = time.time_ns()
+        _current.reset(token)
+        _exporter.export(current)
+
+
+def in_current_context(fn):
+    """Bind fn to the current trace context, for handing work to a thread pool."""
+    context = contextvars.copy_context()
+    return lambda *args, **kwargs: context.run(fn, *args, **kwargs)
+
+
+def init_app(app):
+    """Give every Flask request a root span that the stage spans hang off."""
+    from flask import g, request
+
+    def start_request_span():
+        if _exporter is None:
+            return
+        g.trace_span = span(f'{request.method} {request.url_rule.rule if request.url_rule else request.path}',
+                            traceparent=request.headers.get('traceparent'), **{'http.method': request.method})
+        g.trace_span.__enter__().set_attribute('http.target', request.path)
+
+    def end_request_span(exc):
+        context = g.pop('trace_span', None)
+        if context is not None:
+            current = _current.get()
+            if exc is not None:
+                current.record_error(repr(exc))
+            context.__exit__(None, None, None)
+
+    def add_status(response):
+        current = _current.get() if 'trace_span' in g else None
+        if current is not None:
+            current.set_attribute('http.status_code', response.status_code)
+        return response
+
+    app.before_request(start_request_span)
+    app.after_request(add_status)
+    app.teardown_request(end_request_span)
@@ -0,0 +1,243 @@
+"""
+Answering questions about one stored transcript without sending all of it to GPT.
+
+/ask with a file_id lets the server pick the context. The word segments are grouped
+into short time-stamped passages (ASK_PASSAGE_SECONDS), ranked against the question
+with BM25 and the best ones are packed, in transcript order, into ASK_CONTEXT_TOKENS.
+A transcript that fits the budget is sent whole.
+
+Mode "map-reduce" covers every passage instead: the passages are split into
+consecutive groups that each fit the budget, every group is asked in parallel and
+the partial answers are merged in a final call.
+
+The model cites passages by their start timestamp, e.g. [12:05]; those citations
+are returned with start/end seconds so the player can jump to them.
+
+/ask/batch answers several questions about one transcript at once: the passages
+are built once, identical questions are asked once, and the distinct questions
+run concurrently (ASK_BATCH_CONCURRENCY at a time).
+"""
+import math
+import os
+import re
+from collections import Counter
+
+from azure_openai import ASK_SYSTEM_PROMPT, GPTError
+from segment_index import tokenize
+from summaries import MAP_REDUCE_MAX_WORKERS, gather_limited
+
+ASK_CONTEXT_TOKENS = int(os.environ.get('ASK_CONTEXT_TOKENS', 6000))
+ASK_PASSAGE_SECONDS = float(os.environ.get('ASK_PASSAGE_SECONDS', 30))
+ASK_BATCH_MAX_QUESTIONS = int(os.environ.get('ASK_BATCH_MAX_QUESTIONS', 20))
+ASK_BATCH_CONCURRENCY = int(os.environ.get('ASK_BATCH_CONCURRENCY', 4))
+# Rough token estimate; good enough for budgeting without a tokenizer dependency
+CHARS_PER_TOKEN = 4
+BM25_K1 = 1.5
+BM25_B = 0.75
+NOT_FOUND = 'NOT_FOUND'
+
+CITE_INSTRUCTION = " Cite the excerpts you rely on by their start timestamp in square brackets, e.g. [12:05]."
+SEGMENT_ASK_SYSTEM_PROMPT = ASK_SYSTEM_PROMPT + CITE_INSTRUCTION
+GROUP_ASK_SYSTEM_PROMPT = (
+    "You answer a question from part of a meeting transcript." + CITE_INSTRUCTION +
+    f" If this part does not help answer the question, reply exactly {NOT_FOUND}."
+)
+MERGE_SYSTEM_PROMPT = (
+    "You merge partial answers from different parts of one meeting into a single answer."
+    " Keep the timestamp citations in square brackets."
+)
+NOT_FOUND_ANSWER = "The transcript does not seem to cover this question."
+
+TIMESTAMP_RE = re.compile(r'\b(?:(\d+):)?(\d{1,2}):(\d{2})\b')
+CITATION_RE = re.compile(r'\[([^\]]*\d:\d{2}[^\]]*)\]')
+
+
+def estimate_tokens(text):
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def format_timestamp(seconds):
+    seconds = int(seconds or 0)
+    hours, rest = divmod(seconds, 3600)
+    minutes, secs = divmod(rest, 60)
+    return f"{hours}:{minutes:02d}:{secs:02d}" if hours else f"{minutes:02d}:{secs:02d}"
+
+
+def build_passages(segments, seconds=None):
+    """Group consecutive {'text', 'start', 'end'} segments into passages of about `seconds` each."""
+    seconds = seconds or ASK_PASSAGE_SECONDS
+    passages = []
+    current = None
+    for seg in segments:
+        text = (seg.get('text') or '').strip()
+        if not text:
+            continue
+        start, end = seg.get('start') or 0, seg.get('end') or 0
+        if current is None or start - current['start'] >= seconds:
+            current = {'start': start, 'end': end, 'text': text}
+            passages.append(current)
+        else:
+            current['end'] = max(current['end'], end)
+            current['text'] += ' ' + text
+    for passage in passages:
+        passage['line'] = f"[{format_timestamp(passage['start'])}] {passage['text']}"
+        passage['tokens'] = estimate_tokens(passage['line'])
+    return passages
+
+
+def rank_passages(passages, question):
+    """BM25 score of every passage for the question, in passage order."""
+    terms = set(tokenize(question))
+    docs = [Counter(tokenize(p['text'])) for p in passages]
+    if not docs or not terms:
+        return [0.0] * len(passages)
+    avg_len = sum(sum(d.values()) for d in docs) / len(docs) or 1
+    doc_freq = {term: sum(1 for d in docs if term in d) for term in terms}
+    scores = []
+    for doc in docs:
+        length = sum(doc.values())
+        score = 0.0
+        for term in terms:
+            tf = doc.get(term, 0)
+            if not tf:
+                continue
+            idf = math.log(1 + (len(docs) - doc_freq[term] + 0.5) / (doc_freq[term] + 0.5))
+            score += idf * tf * (BM25_K1 + 1) / (tf + BM25_K1 * (1 - BM25_B + BM25_B * length / avg_len))
+        scores.append(score)
+    return scores
+
+
+def select_passages(passages, question, budget=None):
+    """The highest ranked passages that fit in the token budget, in transcript order."""
+    budget = budget or ASK_CONTEXT_TOKENS
+    if sum(p['tokens'] for p in passages) <= budget:
+        return list(passages)
+    scores = rank_passages(passages, question)
+    # Ties (e.g. nothing matches) fall back to the earliest passages
+    order = sorted(range(len(passages)), key=lambda i: (-scores[i], i))
+    chosen = set()
+    used = 0
+    for i in order:
+        if used + passages[i]['tokens'] > budget:
+            continue
+        chosen.add(i)
+        used += passages[i]['tokens']
+    return [passages[i] for i in sorted(chosen)]
+
+
+def passage_groups(passages, budget=None):
+    """Split passages into consecutive groups that each fit in the token budget."""
+    budget = budget or ASK_CONTEXT_TOKENS
+    groups = []
+    used = 0
+    for passage in passages:
+        if not groups or used + passage['tokens'] > budget:
+            groups.append([])
+            used = 0
+        groups[-1].append(passage)
+        used += passage['tokens']
+    return groups
+
+
+def excerpt_prompt(question, passages):
+    excerpts = '\n'.join(p['line'] for p in passages)
+    return f"Transcript excerpts, each starting with its timestamp:\n{excerpts}\n\nQuestion: {question}\nAnswer:"
+
+
+def found_partials(partials):
+    return [p for p in partials if p and NOT_FOUND not in p]
+
+
+def merge_prompt(question, partials):
+    body = '\n\n'.join(f"- {p.strip()}" for p in partials)
+    return f"Partial answers:\n{body}\n\nQuestion: {question}\nAnswer:"
+
+
+def _seconds(match):
+    hours, minutes, secs = match.groups()
+    return int(hours or 0) * 3600 + int(minutes) * 60 + int(secs)
+
+
+def citations(answer, passages):
+    """[{'start', 'end', 'text'}] for every passage cited in the answer, in order of first citation."""
+    cited = []
+    for bracket in CITATION_RE.findall(answer or ''):
+        for match in TIMESTAMP_RE.finditer(bracket):
+            at = _seconds(match)
+            passage = None
+            for p in passages:
+                if int(p['start']) <= at:
+                    passage = p
+                else:
+                    break
+            if passage is not None and passage not in cited and at <= int(passage['end']) + 1:
+                cited.append(passage)
+    return [{'start': p['start'], 'end': p['end'], 'text': p['text']} for p in cited]
+
+
+def transcript_prompt(transcript, question):
+    return f"Transcript:\n{transcript}\n\nQuestion: {question}\nAnswer:"
+
+
+def normalize_question(question):
+    return ' '.join(question.split())
+
+
+def batch_questions(questions):
+    """(distinct questions in order of first appearance, error message or None) for an /ask/batch body."""
+    if not isinstance(questions, list) or not questions:
+        return None, 'Questions must be a non-empty array.'
+    if not all(isinstance(q, str) and q.strip() for q in questions):
+        return None, 'Every question must be a non-empty string.'
+    distinct = list(dict.fromkeys(normalize_question(q) for q in questions))
+    if len(distinct) > ASK_BATCH_MAX_QUESTIONS:
+        return None, f'At most {ASK_BATCH_MAX_QUESTIONS} different questions per batch.'
+    return distinct, None
+
+
+def batch_answers(questions, results):
+    """One entry per asked question (duplicates included) from {distinct question: result}."""
+    return [{'question': q, **results[normalize_question(q)]} for q in questions]
+
+
+async def answer_questions(questions, ask):
+    """
+    Await ask(question) -> dict once per distinct question, ASK_BATCH_CONCURRENCY at a time.
+    A failed question gets {'error', 'status_code'} instead of failing the batch.
+    """
+    distinct, _ = batch_questions(questions)
+
+    async def one(question):
+        try:
+            return await ask(question)
+        except GPTError as e:
+            return {'error': e.text, 'status_code': e.status_code}
+
+    results = await gather_limited((one(q) for q in distinct), ASK_BATCH_CONCURRENCY)
+    return batch_answers(questions, dict(zip(distinct, results)))
+
+
+async def answer_question(question, segments, mode, complete):
+    """
+    Answer a question about one transcript: {'answer', 'citations', 'mode'}.
+    complete(system_prompt, prompt) is a coroutine returning the GPT answer.
+    """
+    return await answer_from_passages(question, build_passages(segments), mode, complete)
+
+
+async def answer_from_passages(question, passages, mode, complete):
+    if mode == 'map-reduce':
+        groups = passage_groups(passages)
+        partials = await gather_limited(
+            (complete(GROUP_ASK_SYSTEM_PROMPT, excerpt_prompt(question, group)) for group in groups), MAP_REDUCE_MAX_WORKERS)
+        found = found_partials(partials)
+        if not found:
+            answer = NOT_FOUND_ANSWER
+        elif len(found) == 1:
+            answer = found[0]
+        else:
+            answer = await complete(MERGE_SYSTEM_PROMPT, merge_prompt(question, found))
+    else:
+        mode = 'select'
+        answer = await complete(SEGMENT_ASK_SYSTEM_PROMPT, excerpt_prompt(question, select_passages(passages, question)))
+    return {'answer': answer, 'citations': citations(answer, passages), 'mode': mode}
@@ -0,0 +1,122 @@
+"""
+Word segments: from Whisper's verbose_json to what is stored and served.
+
+Every Whisper response goes through build_word_segments: word-level timings when
+Whisper returns them, else each segment's text cut into CHUNK_WORDS-word chunks
+with the segment's time spread evenly over its words. The chunk timings of a
+whole transcript are computed in one pass of array arithmetic (the same IEEE
+operations, in the same order, as the per-chunk loop they replace, so the values
+are identical), then mapped back through the VAD timeline (vad.py).
+
+Segments are stored as a JSON string in Transcription.segments. dumps / loads use
+orjson when it is installed and fall back to the json module; both read what the
+other wrote. A 3-hour transcript is ~30k segments, so this is on the path of every
+transcription, listing and download.
+"""
+import json
+
+import numpy as np
+
+import tracing
+import vad
+
+CHUNK_WORDS = 3
+
+
+def _orjson():
+    try:
+        import orjson
+    except ImportError:
+        return None
+    return orjson
+
+
+def dumps(value):
+    orjson = _orjson()
+    if orjson is None:
+        return json.dumps(value)
+    return orjson.dumps(value).decode('utf-8')
+
+
+def loads(text):
+    """Parse stored segments; raises json.JSONDecodeError (or TypeError) like json.loads."""
+    orjson = _orjson()
+    if orjson is None:
+        return json.loads(text)
+    return orjson.loads(text)
+
+
+def word_level_segments(segments):
+    return [{'text': word['word'], 'start': word['start'], 'end': word['end']}
+            for seg in segments for word in seg.get('words') or ()]
+
+
+def estimated_segments(segments, chunk_words=CHUNK_WORDS):
+    """CHUNK_WORDS-word chunks of each segment's text, with the segment's time spread evenly over its words."""
+    words, starts, ends = [], [], []
+    for seg in segments:
+        seg_words = seg.get('text', '').split()
+        if seg_words:
+            words.append(seg_words)
+            starts.append(seg.get('start', 0))
+            ends.append(seg.get('end', 0))
+    if not words:
+        return []
+    counts = np.array([len(w) for w in words])
+    start = np.array(starts, dtype=float)
+    end = np.array(ends, dtype=float)
+    timed = end > start
+    per_word = np.where(timed, (end - start) / counts, 0.0)
+    chunks = -(-counts // chunk_words)
+    owner = np.repeat(np.arange(len(words)), chunks)
+    first_word = (np.arange(chunks.sum()) - np.repeat(np.cumsum(chunks) - chunks, chunks)) * chunk_words
+    size = np.minimum(chunk_words, counts[owner] - first_word)
+    chunk_start = start[owner] + first_word * per_word[owner]
+    chunk_end = chunk_start + size * per_word[owner]
+    chunk_start, chunk_end = chunk_start.tolist(), chunk_end.tolist()
+    # Untimed segments keep their start as given (an int stays an int) for both ends of every chunk
+    for i in np.flatnonzero(~timed[owner]).tolist():
+        chunk_start[i] = chunk_end[i] = starts[owner[i]]
+    texts = [' '.join(seg_words[i:i + chunk_words]) for seg_words in words for i in range(0, len(seg_words), chunk_words)]
+    return [{'text': text, 'start': s, 'end': e} for text, s, e in zip(texts, chunk_start, chunk_end)]
+
+
+def word_segments(data):
+    """(transcription, word_segments) of a verbose_json response, before VAD remapping."""
+    transcription = data.get('text', '')
+    segments = data.get('segments', [])
+    found = word_level_segments(segments) or estimated_segments(segments)
+    # Fallback: single segment for the whole transcription
+    return transcription, found or [{'text': transcription, 'start': 0, 'end': 0}]
+
+
+def build_word_segments(data, timeline=None):
+    """
+    Turn a Whisper verbose_json response into (transcription, word_segments).
+    timeline maps the timestamps of silence-trimmed audio back to the original (see vad.py).
+    """
+    with tracing.span('segments.postprocess') as span:
+        transcription, segments = word_segments(data)
+        segments = vad.remap_segments(segments, timeline)
+        span.set_attributes({'audio.duration_s': data.get('duration'), 'segments.count': len(segments)})
+    return transcription, segments
+
+
+def placeholder_segments(transcription, chunk_words=CHUNK_WORDS):
+    """Chunks of a transcript whose stored segments cannot be read, timed by word index."""
+    words = transcription.split()
+    return [{'text': ' '.join(words[i:i + chunk_words]), 'start': i, 'end': i + len(words[i:i + chunk_words])}
+            for i in range(0, len(words), chunk_words)]
+
+
+def stored_segments(t):
+    """Segments saved for an already transcribed record, with fake timings if they cannot be parsed."""
+    segments_data = []
+    if t.segments:
+        try:
+            segments_data = loads(t.segments)
+        except (json.JSONDecodeError, TypeError):
+            segments_data = placeholder_segments(t.transcription)
+    if not segments_data:
+        segments_data = [{'text': t.transcription, 'start': 0, 'end': 0}]
+    return segments_data
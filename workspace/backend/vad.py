@@ -0,0 +1,166 @@
+"""
+Silence trimming before audio is sent to Whisper.
+
+Meeting recordings often start with minutes of people waiting to join, and we pay
+Whisper for every second uploaded. With VAD_ENABLED the audio is decoded with
+ffmpeg to mono 8 kHz PCM and streamed through a NumPy energy-based voice
+activity detector: 30 ms frames louder than the recording's noise floor by
+VAD_MARGIN_DB count as speech, gaps shorter than VAD_MIN_SILENCE_SECONDS are
+kept, and every kept span is padded by VAD_PADDING_SECONDS. ffmpeg then cuts the
+speech spans into a shorter file for Whisper.
+
+The trimmed file comes with a timeline of (trimmed start, original start, original
+end) spans. remap_segments() moves Whisper's timestamps back onto the original
+recording, so the player in the UI stays in sync with the transcript.
+
+Energy detection removes silence and near-silence; quiet hold music usually goes,
+loud music is kept as speech.
+"""
+import os
+import subprocess
+
+import numpy as np
+
+import tracing
+
+VAD_ENABLED = os.environ.get('VAD_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+VAD_MARGIN_DB = float(os.environ.get('VAD_MARGIN_DB', 15))
+VAD_MIN_SILENCE_SECONDS = float(os.environ.get('VAD_MIN_SILENCE_SECONDS', 2.0))
+VAD_PADDING_SECONDS = float(os.environ.get('VAD_PADDING_SECONDS', 0.3))
+# Not worth a second ffmpeg pass (and the risk of clipping words) for less than this
+VAD_MIN_SAVED_SECONDS = float(os.environ.get('VAD_MIN_SAVED_SECONDS', 10))
+
+SAMPLE_RATE = 8000
+FRAME = 240  # 30 ms at 8 kHz
+FLOOR_PERCENTILE = 10
+ABSOLUTE_FLOOR_DB = -60.0  # Digital silence would otherwise make any hiss count as speech
+READ_FRAMES = 4096
+
+
+def frame_levels(samples):
+    """Loudness in dBFS of each complete FRAME of float samples."""
+    usable = len(samples) // FRAME * FRAME
+    frames = np.asarray(samples[:usable], dtype=np.float64).reshape(-1, FRAME)
+    return 10 * np.log10(np.mean(frames ** 2, axis=1) + 1e-10)
+
+
+def decode_levels(path):
+    """Stream a file through ffmpeg and return its frame levels, or None if it cannot be decoded."""
+    cmd = ['ffmpeg', '-v', 'error', '-i', path, '-vn', '-ac', '1', '-ar', str(SAMPLE_RATE), '-f', 's16le', '-']
+    try:
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    except FileNotFoundError:
+        return None
+    levels = []
+    frame_bytes = FRAME * 2
+    pending = b''
+    with proc:
+        while True:
+            chunk = proc.stdout.read(READ_FRAMES * frame_bytes)
+            if not chunk:
+                break
+            # Pipe reads can end mid-frame; carry the remainder so frames stay aligned with time
+            pending += chunk
+            usable = len(pending) // frame_bytes * frame_bytes
+            samples = np.frombuffer(pending[:usable], dtype=np.int16).astype(np.float32) / 32768.0
+            pending = pending[usable:]
+            levels.append(frame_levels(samples))
+    if proc.returncode != 0 or not levels:
+        return None
+    return np.concatenate(levels)
+
+
+def speech_spans(levels):
+    """[(start, end)] seconds of speech, padded and with short pauses bridged."""
+    if len(levels) == 0:
+        return []
+    threshold = max(np.percentile(levels, FLOOR_PERCENTILE), ABSOLUTE_FLOOR_DB) + VAD_MARGIN_DB
+    speech = np.concatenate(([False], levels > threshold, [False]))
+    edges = np.flatnonzero(np.diff(speech.astype(np.int8)))
+    frame_seconds = FRAME / SAMPLE_RATE
+    duration = len(levels) * frame_seconds
+    spans = []
+    for start, end in zip(edges[::2] * frame_seconds, edges[1::2] * frame_seconds):
+        start, end = max(0.0, start - VAD_PADDING_SECONDS), min(duration, end + VAD_PADDING_SECONDS)
+        if spans and start - spans[-1][1] < VAD_MIN_SILENCE_SECONDS:
+            spans[-1] = (spans[-1][0], end)
+        else:
+            spans.append((start, end))
+    return spans
+
+
+def build_timeline(spans):
+    """[(trimmed_start, original_start, original_end)] for spans laid end to end."""
+    timeline = []
+    position = 0.0
+    for start, end in spans:
+        timeline.append((position, start, end))
+        position += end - start
+    return timeline
+
+
+def trimmed_duration(timeline):
+    """Seconds of audio in the trimmed file, or None without a timeline."""
+    if not timeline:
+        return None
+    position, start, end = timeline[-1]
+    return position + end - start
+
+
+def trim_command(audio_path, spans, trimmed_path):
+    selected = '+'.join(f'between(t,{start:.3f},{end:.3f})' for start, end in spans)
+    return ['ffmpeg', '-y', '-v', 'error', '-i', audio_path, '-vn',
+            '-af', f"aselect='{selected}',asetpts=N/SR/TB", '-acodec', 'mp3', trimmed_path]
+
+
+def trim(audio_path):
+    """
+    Return (path to upload, timeline). When there is little silence to remove, or
+    VAD is disabled or fails, that is (audio_path, None); otherwise the caller
+    removes the trimmed file when done.
+    """
+    if not VAD_ENABLED:
+        return audio_path, None
+    with tracing.span('vad.trim') as span:
+        levels = decode_levels(audio_path)
+        if levels is None:
+            return audio_path, None
+        duration = len(levels) * FRAME / SAMPLE_RATE
+        spans = speech_spans(levels)
+        kept = sum(end - start for start, end in spans)
+        span.set_attributes({'audio.duration_s': duration, 'vad.speech_s': kept, 'vad.spans': len(spans)})
+        if not spans or duration - kept < VAD_MIN_SAVED_SECONDS:
+            return audio_path, None
+        trimmed_path = audio_path + '.vad.mp3'
+        result = subprocess.run(trim_command(audio_path, spans, trimmed_path), stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        if result.returncode != 0:
+            if os.path.exists(trimmed_path):
+                os.remove(trimmed_path)
+            span.record_error('ffmpeg could not cut the speech spans')
+            return audio_path, None
+        span.set_attribute('vad.removed_s', duration - kept)
+    return trimmed_path, build_timeline(spans)
+
+
+def remap_segments(word_segments, timeline):
+    """Move {'start', 'end'} timestamps of the trimmed audio back onto the original recording."""
+    if not timeline or not word_segments:
+        return word_segments
+    trimmed_starts = np.array([t for t, _, _ in timeline])
+    original_starts = np.array([s for _, s, _ in timeline])
+    original_ends = np.array([e for _, _, e in timeline])
+
+    def remap(times, side):
+        # On a cut, starts belong to the span that begins there and ends to the one that ends there
+        times = np.asarray(times, dtype=np.float64)
+        index = np.clip(np.searchsorted(trimmed_starts, times, side=side) - 1, 0, len(timeline) - 1)
+        return np.minimum(original_starts[index] + times - trimmed_starts[index], original_ends[index])
+
+    starts = remap([seg['start'] for seg in word_segments], 'right')
+    ends = remap([seg['end'] for seg in word_segments], 'left')
+    # A word that straddles a cut ends in the next span, never before it starts
+    ends = np.maximum(ends, starts)
+    return [
+        {**seg, 'start': round(float(start), 3), 'end': round(float(end), 3)}
+        for seg, start, end in zip(word_segments, starts, ends)
+    ]
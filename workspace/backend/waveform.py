@@ -0,0 +1,227 @@
+"""
+Precomputed waveform peaks for the timeline of the transcript player.
+
+Drawing a timeline in the browser would otherwise mean fetching and decoding the
+whole recording. Instead the media is decoded once with ffmpeg (mono 8 kHz PCM,
+streamed) and NumPy reduces it to min/max peak pairs at several resolutions: the
+finest level has WAVEFORM_PEAKS_PER_SECOND peaks per second, and every further
+level merges WAVEFORM_LEVEL_FACTOR peaks of the previous one, down to a few hundred
+peaks for the whole file.
+
+Peaks are stored as 8-bit values in one small blob next to the thumbnails, keyed
+by file_hash, so rows sharing the same content share the blob:
+
+    header      '<4sBBHI'   b'WFPK', version, level count, reserved, sample rate
+    level table '<II'       samples per peak, peak count (finest level first)
+    data        int8        min, max, min, max, ... of each level in table order
+
+GET /files/<id>/waveform?resolution=N serves the coarsest level with at least N
+peaks (the finest if none has that many), as a '<III' header (sample rate,
+samples per peak, peak count) followed by its int8 min/max pairs. Peaks are made
+in the background after upload and transcription, or on the first request.
+"""
+import os
+import struct
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+import blob_storage
+import partitions
+import tracing
+from models import db, Transcription
+from storage_policy import media_blob
+
+WAVEFORM_ENABLED = os.environ.get('WAVEFORM_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+WAVEFORM_PEAKS_PER_SECOND = int(os.environ.get('WAVEFORM_PEAKS_PER_SECOND', 100))
+WAVEFORM_LEVEL_FACTOR = int(os.environ.get('WAVEFORM_LEVEL_FACTOR', 4))
+
+SAMPLE_RATE = 8000
+MIN_PEAKS = 256  # No coarser level once a level has fewer peaks than this
+READ_BYTES = 1024 * 1024
+MAGIC = b'WFPK'
+VERSION = 1
+HEADER = struct.Struct('<4sBBHI')
+LEVEL = struct.Struct('<II')
+SERVED_HEADER = struct.Struct('<III')
+
+_executor = ThreadPoolExecutor(max_workers=int(os.environ.get('WAVEFORM_WORKERS', 2)))
+# (partition, file id): ids are only unique within a partition (partitions.py)
+_scheduled = set()
+
+
+def blob_name(file_hash):
+    return f"{file_hash}.peaks"
+
+
+def samples_per_peak():
+    return max(1, SAMPLE_RATE // WAVEFORM_PEAKS_PER_SECOND)
+
+
+def bucket_peaks(samples, size):
+    """(mins, maxs) of consecutive buckets of `size` samples; the last bucket may be partial."""
+    starts = np.arange(0, len(samples), size)
+    return np.minimum.reduceat(samples, starts), np.maximum.reduceat(samples, starts)
+
+
+def decode_peaks(path):
+    """Stream a file through ffmpeg into finest-level int16 (mins, maxs), or None if it cannot be decoded."""
+    cmd = ['ffmpeg', '-v', 'error', '-i', path, '-vn', '-ac', '1', '-ar', str(SAMPLE_RATE), '-f', 's16le', '-']
+    try:
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    except FileNotFoundError:
+        return None
+    size = samples_per_peak()
+    bucket_bytes = size * 2
+    mins, maxs = [], []
+    pending = b''
+    with proc:
+        while True:
+            chunk = proc.stdout.read(READ_BYTES)
+            if not chunk:
+                break
+            # Only whole buckets are reduced; the remainder waits for the next read
+            pending += chunk
+            usable = len(pending) // bucket_bytes * bucket_bytes
+            if usable:
+                lo, hi = bucket_peaks(np.frombuffer(pending[:usable], dtype=np.int16), size)
+                mins.append(lo)
+                maxs.append(hi)
+                pending = pending[usable:]
+    if proc.returncode != 0:
+        return None
+    usable = len(pending) // 2 * 2
+    if usable:
+        lo, hi = bucket_peaks(np.frombuffer(pending[:usable], dtype=np.int16), size)
+        mins.append(lo)
+        maxs.append(hi)
+    if not mins:
+        return None
+    return np.concatenate(mins), np.concatenate(maxs)
+
+
+def build_levels(mins, maxs):
+    """[(samples per peak, int8 interleaved min/max)] from the finest level down."""
+    spp = samples_per_peak()
+    levels = []
+    while True:
+        pairs = np.empty(len(mins) * 2, dtype=np.int8)
+        # int16 -> int8 keeps the high byte; the shift floors, so min and max stay ordered
+        pairs[0::2] = (mins >> 8).astype(np.int8)
+        pairs[1::2] = (maxs >> 8).astype(np.int8)
+        levels.append((spp, pairs))
+        if len(mins) < MIN_PEAKS * WAVEFORM_LEVEL_FACTOR or WAVEFORM_LEVEL_FACTOR < 2:
+            return levels
+        starts = np.arange(0, len(mins), WAVEFORM_LEVEL_FACTOR)
+        mins, maxs = np.minimum.reduceat(mins, starts), np.maximum.reduceat(maxs, starts)
+        spp *= WAVEFORM_LEVEL_FACTOR
+
+
+def encode(levels):
+    parts = [HEADER.pack(MAGIC, VERSION, len(levels), 0, SAMPLE_RATE)]
+    parts += [LEVEL.pack(spp, len(pairs) // 2) for spp, pairs in levels]
+    parts += [pairs.tobytes() for _, pairs in levels]
+    return b''.join(parts)
+
+
+def decode(data):
+    """(sample rate, [(samples per peak, peak count, offset into data)])."""
+    magic, version, count, _, sample_rate = HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError('Not a waveform peaks blob')
+    offset = HEADER.size + count * LEVEL.size
+    levels = []
+    for i in range(count):
+        spp, peaks = LEVEL.unpack_from(data, HEADER.size + i * LEVEL.size)
+        levels.append((spp, peaks, offset))
+        offset += peaks * 2
+    return sample_rate, levels
+
+
+def level_for(data, resolution):
+    """The served body for the coarsest level with at least `resolution` peaks: (body, samples per peak, peaks)."""
+    sample_rate, levels = decode(data)
+    spp, peaks, offset = levels[0]
+    for candidate in levels[1:]:
+        if candidate[1] < resolution:
+            break
+        spp, peaks, offset = candidate
+    return SERVED_HEADER.pack(sample_rate, spp, peaks) + data[offset:offset + peaks * 2], spp, peaks
+
+
+def compute(path):
+    """The encoded peaks blob for a media file, or None if it cannot be decoded."""
+    with tracing.span('waveform.decode') as span:
+        decoded = decode_peaks(path)
+        if decoded is None:
+            return None
+        span.set_attribute('waveform.peaks', len(decoded[0]))
+    return encode(build_levels(*decoded))
+
+
+def exists(file_hash):
+    return bool(file_hash) and blob_storage.exists('thumbnails', blob_name(file_hash))
+
+
+def load(file_hash):
+    """The stored peaks blob of some content, or None."""
+    if not exists(file_hash):
+        return None
+    with blob_storage.store().open('thumbnails', blob_name(file_hash)) as f:
+        return f.read()
+
+
+def make_waveform(file_id):
+    """Decode a row's media and store its peaks, unless its content already has them."""
+    t = db.session.get(Transcription, file_id)
+    if not t or not t.file_hash or exists(t.file_hash):
+        return
+    area, name, _ = media_blob(t)
+    if not area:
+        return
+    file_hash = t.file_hash
+    db.session.commit()
+    with blob_storage.local_path(area, name) as src:
+        data = compute(src)
+    if data is None:
+        print(f"[WAVEFORM] Could not decode media of file {file_id}")
+        return
+    with blob_storage.staged('thumbnails', blob_name(file_hash)) as dst, open(dst, 'wb') as f:
+        f.write(data)
+
+
+def _waveform_in_background(app, file_id, key):
+    with app.app_context(), tracing.span('waveform', **{'file.id': file_id}):
+        try:
+            make_waveform(file_id)
+        except Exception as e:
+            db.session.rollback()
+            print(f"[WAVEFORM] Error while computing peaks for file {file_id}: {e}")
+        finally:
+            _scheduled.discard(key)
+
+
+def schedule_waveform(app, file_id):
+    """Queue peak computation for a new or freshly transcribed file (no-op when disabled or already queued)."""
+    key = (partitions.current(), file_id)
+    if WAVEFORM_ENABLED and key not in _scheduled:
+        _scheduled.add(key)
+        _executor.submit(tracing.in_current_context(_waveform_in_background), app, file_id, key)
+
+
+def remove(t):
+    """Delete the peaks of a row that is being deleted, unless other rows have the same content."""
+    if not t.file_hash:
+        return
+    # The blob is shared by all owners, so rows in every partition count
+    here = partitions.current()
+    shared = False
+    for partition in partitions.each(db.engine):
+        if not shared:
+            query = db.session.query(Transcription.id).filter(Transcription.file_hash == t.file_hash)
+            if partition == here:
+                query = query.filter(Transcription.id != t.id)
+            shared = query.first() is not None
+    if not shared:
+        blob_storage.delete('thumbnails', blob_name(t.file_hash))
@@ -12,6 +12,7 @@ function App() {
   const [error, setError] = useState('');
   const [question, setQuestion] = useState('');
   const [answer, setAnswer] = useState('');
+  const [citations, setCitations] = useState([]);
   const [qaLoading, setQaLoading] = useState(false);
   const [videoUrl, setVideoUrl] = useState(null);
   const [activeSegment, setActiveSegment] = useState(null);
@@ -51,6 +52,7 @@ function App() {
     setTranscription('');
     setError('');
     setAnswer('');
+    setCitations([]);
     setQuestion('');
     setVideoUrl(file ? URL.createObjectURL(file) : null);
     setSegments([]);
@@ -79,6 +81,7 @@ function App() {
     setError('');
     setTranscription('');
     setAnswer('');
+    setCitations([]);
     setQuestion('');
     if (fileInputRef.current) fileInputRef.current.blur();
     const formData = new FormData();
@@ -117,16 +120,20 @@ function App() {
     setQaLoading(true);
     setError('');
     setAnswer('');
+    setCitations([]);
     if (questionInputRef.current) questionInputRef.current.blur();
     try {
+      // Stored files let the server pick the relevant segments; otherwise send the transcript
+      const body = fileId ? { file_id: fileId, question, dbMode, userId } : { transcript: transcription, question };
       const response = await fetch('/ask', {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({ transcript: transcription, question }),
+        body: JSON.stringify(body),
       });
       const data = await response.json();
       if (response.ok) {
         setAnswer(data.answer);
+        setCitations(data.citations || []);
       } else {
         setError(data.error || 'Q&A failed.');
       }
@@ -176,6 +183,7 @@ function App() {
       setError('');
       setTranscription('');
       setAnswer('');
+      setCitations([]);
       setQuestion('');
       setSegments([]);
       setActiveSegment(null);
@@ -185,7 +193,7 @@ function App() {
       setPage('transcribe');
       setHighlightInfo(null); // Reset highlight
       try {
-        setVideoUrl(`/files/${fileObj.id}/download`);
+        setVideoUrl(`/files/${fileObj.id}/download?userId=${encodeURIComponent(userId)}&dbMode=${encodeURIComponent(dbMode)}`);
         setTranscription(fileObj.transcription || '');
         let segs = [];
         setFileId(fileObj.id || null); // Set fileId for download
@@ -296,7 +304,7 @@ function App() {
       return;
     }
     try {
-      const res = await fetch(`/files/${fileId}/download-txt`);
+      const res = await fetch(`/files/${fileId}/download-txt?userId=${encodeURIComponent(userId)}&dbMode=${encodeURIComponent(dbMode)}`);
       if (!res.ok) throw new Error('Failed to download TXT');
       const blob = await res.blob();
       // Try to get filename from Content-Disposition
@@ -318,7 +326,11 @@ function App() {
     setLoading(true);
     setError('');
     try {
-      const res = await fetch(`/files/${selectedDbFile.id}/transcribe`, { method: 'POST' });
+      const res = await fetch(`/files/${selectedDbFile.id}/transcribe`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ userId, dbMode })
+      });
       const data = await res.json();
       if (!res.ok) throw new Error(data.error || 'Transcription failed');
       // Update UI with new transcription
@@ -343,6 +355,7 @@ function App() {
       setVideoUrl(null);
       setError('');
       setAnswer('');
+      setCitations([]);
       setQuestion('');
     }
   };
@@ -852,6 +865,27 @@ function App() {
               }}>
                 <div className="m-0" style={{whiteSpace: 'pre-wrap', wordBreak: 'break-word', fontFamily: 'inherit', fontSize: '1.15rem'}}>{answer}</div>
               </div>
+              {citations.length > 0 && (
+                <div style={{ marginTop: 8, display: 'flex', flexWrap: 'wrap', gap: 6 }}>
+                  {citations.map((cite, idx) => (
+                    <Button
+                      key={idx}
+                      size="sm"
+                      variant="outline-light"
+                      title={cite.text}
+                      onClick={() => {
+                        const video = document.querySelector('video');
+                        if (video) {
+                          video.currentTime = cite.start;
+                          video.play();
+                        }
+                      }}
+                    >
+                      {new Date(cite.start * 1000).toISOString().substr(cite.start >= 3600 ? 11 : 14, cite.start >= 3600 ? 8 : 5)}
+                    </Button>
+                  ))}
+                </div>
+              )}
             </>
           )}
         </>
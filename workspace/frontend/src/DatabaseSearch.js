@@ -145,7 +145,7 @@ function DatabaseSearch({ onTranscribeFile, dbMode, userId }) {
                     if (!onTranscribeFile) return;
                     try {
                       // Load the file list as in DatabaseGallery, then find the file by id
-                      const res = await fetch('/files');
+                      const res = await fetch(`/files?userId=${encodeURIComponent(userId || '')}&dbMode=${encodeURIComponent(dbMode || 'global')}`);
                       const data = await res.json();
                       if (res.ok && Array.isArray(data.files)) {
                         const file = data.files.find(f => f.id === s.id);